@@ -109,6 +109,7 @@ void taskSensor(void *pvParameters) {
 
 // --- 6. TASK MQTT: KẾT NỐI & GỬI DỮ LIỆU (Core 0) ---
 void taskMQTT(void *pvParameters) {
+  uint32_t seq = 0; // Số thứ tự gói tin, Server dùng để bỏ gói bị gửi lại
   for (;;) {
     if (!client.connected()) {
       Serial.print("Connecting to MQTT...");
@@ -135,6 +136,7 @@ void taskMQTT(void *pvParameters) {
       outDoc["pump_state"]  = farmData.st_pump;
       outDoc["light_state"] = farmData.st_light;
       outDoc["mist_state"]  = farmData.st_mist;
+      outDoc["seq"]         = seq++;
       // ----------------------------------------------------------------------
       
       xSemaphoreGive(xMutex);
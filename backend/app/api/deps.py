@@ -1,10 +1,13 @@
-from typing import Generator, Optional
+import asyncio
+from typing import AsyncGenerator, Generator, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from db.session import SessionLocal
+from db.replicas import replica_set
+from db.session import AsyncSessionLocal, SessionLocal, async_read_session, read_session
 from core.config import settings
 from crud import user as crud_user
 from models.models import User
@@ -20,6 +23,25 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Session bất đồng bộ cho endpoint `async def`: chờ DB không chặn event loop (MQTT, hẹn giờ bơm)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# --- API CHỈ ĐỌC (lịch sử, biểu đồ, nhật ký, danh sách thiết bị): đọc ở read replica nếu có (db/replicas.py) ---
+def get_read_db() -> Generator:
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db() -> AsyncGenerator[AsyncSession, None]:
+    if replica_set.due:
+        await asyncio.to_thread(replica_set.refresh)  # Đo trễ là I/O đồng bộ -> không chạy trên event loop
+    async with async_read_session() as db:
+        yield db
+
 # --- 1. HÀM HELPER: CHUẨN HÓA ROLE ---
 # Giúp xử lý mọi trường hợp Enum, String, viết hoa/thường
 def _normalize_role(role_data) -> str:
@@ -0,0 +1,63 @@
+"""
+Phân trang theo con trỏ (keyset) cho các danh sách mới -> cũ: /logs, /reports/logs, /devices/{id}/history.
+
+Con trỏ = (timestamp, id) của bản ghi cuối trang trước, gửi cho client dưới dạng chuỗi mờ (base64).
+Trang sau chỉ lấy các bản ghi (timestamp, id) nhỏ hơn con trỏ: DB tìm thẳng tới vị trí đó trên index
+(timestamp, id) thay vì đọc rồi bỏ qua `skip` dòng -> trang sâu tốn như trang đầu.
+Body giữ nguyên là danh sách (frontend cũ không đổi); con trỏ trang sau nằm ở header X-Next-Cursor
+(không có header = hết dữ liệu). skip/offset vẫn dùng được khi không gửi cursor.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import String, and_, literal, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Cursor]:
+    """Chuỗi con trỏ -> (timestamp, id). Sai định dạng -> 400"""
+    if not token:
+        return None
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Con trỏ phân trang không hợp lệ")
+
+
+def keyset_filter(timestamp_column, id_column, cursor: Cursor, dialect: Optional[str] = None):
+    """
+    (timestamp, id) < con trỏ. Viết timestamp <= T AND (timestamp < T OR id < I): vế đầu là khoảng tìm trên index,
+    vế sau chỉ lọc vài bản cùng T (OR đứng riêng thì SQLite / MySQL quét index từ đầu rồi mới lọc).
+    SQLite lưu thời gian dạng chuỗi, server_default (CURRENT_TIMESTAMP) không có phần µs: "...:00" < "...:00.000000"
+    -> so "nhỏ hơn hẳn" với chuỗi không µs để các bản cùng giây không lọt qua vế đầu.
+    """
+    timestamp, row_id = cursor
+    before = timestamp
+    if dialect == "sqlite" and timestamp.microsecond == 0:
+        before = literal(timestamp.strftime("%Y-%m-%d %H:%M:%S"), String)
+    return and_(timestamp_column <= timestamp, or_(timestamp_column < before, id_column < row_id))
+
+
+def set_next_cursor(response: Response, rows: Sequence, limit: int, timestamp_attr: str = "timestamp",
+                    id_attr: str = "id") -> list:
+    """
+    rows: kết quả lấy dư 1 bản (limit + 1). Còn dữ liệu thì đặt header con trỏ của bản cuối trang.
+    Trả về đúng limit bản để làm body.
+    """
+    page = list(rows[:limit])
+    if len(rows) > limit and page:
+        last = page[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(getattr(last, timestamp_attr), getattr(last, id_attr))
+    return page
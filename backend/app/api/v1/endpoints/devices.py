@@ -1,14 +1,17 @@
 import json
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, Body
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Body, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
 from api import deps
+from api.pagination import decode_cursor, set_next_cursor
 from crud import device as crud
 from schemas import device as schemas
-from models import models
 from services.mqtt_service import publish_command
+from services.heartbeat import heartbeat_flusher
+from services.timeseries import timeseries_store
 from core.config import settings
 
 router = APIRouter()
@@ -20,24 +23,22 @@ class ControlCommand(BaseModel):
 # ================= 1. API LẤY THÔNG TIN (GET) =================
 
 @router.get("/")
-def read_devices(
+async def read_devices(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_read_db),
     current_user = Depends(deps.get_current_active_user) # Ai login rồi đều xem được
 ):
     """
     Lấy danh sách tất cả thiết bị KÈM THEO dữ liệu cảm biến mới nhất.
     """
-    devices = crud.get_devices(db, skip=skip, limit=limit)
+    devices = await crud.get_devices_async(db, skip=skip, limit=limit)
+    # Số liệu mới nhất của cả trang trong 1 câu truy vấn (bảng device_latest_reading)
+    latest_by_device = await crud.get_latest_readings_async(db, [dev.device_id for dev in devices])
     
     result = []
     for dev in devices:
-        # 👇 FIX 1: Lấy bản ghi SensorData mới nhất của thiết bị này
-        latest_sensor = db.query(models.SensorData)\
-            .filter(models.SensorData.device_id == dev.device_id)\
-            .order_by(models.SensorData.timestamp.desc())\
-            .first()
+        latest_sensor = latest_by_device.get(dev.device_id)
             
         # Gộp thông tin thiết bị và thông số môi trường vào 1 JSON phẳng
         device_data = {
@@ -45,7 +46,8 @@ def read_devices(
             "name": dev.name,
             "zone_id": dev.zone_id,
             "status": dev.status.value if dev.status else "OFFLINE",
-            "last_seen": dev.last_seen,
+            # Nhịp tim mới nhất có thể còn nằm trong bộ nhớ (chưa tới chu kỳ ghi DB)
+            "last_seen": heartbeat_flusher.pending_last_seen(dev.device_id) or dev.last_seen,
             "fw_version": dev.fw_version,
             
             # Nếu có dữ liệu thì gắn vào, không thì trả về None (Frontend sẽ hiện '--')
@@ -67,20 +69,27 @@ def read_device(
     db_device = crud.get_device(db, device_id=device_id)
     if db_device is None:
         raise HTTPException(status_code=404, detail="Không tìm thấy thiết bị")
-    return db_device
+
+    response = schemas.DeviceResponse.model_validate(db_device)
+    pending_last_seen = heartbeat_flusher.pending_last_seen(device_id)
+    if pending_last_seen:
+        response.last_seen = pending_last_seen
+    return response
 
 @router.get("/{device_id}/history", response_model=List[schemas.SensorDataResponse])
-def read_sensor_history(
+async def read_sensor_history(
+    response: Response,
     device_id: str, 
     limit: int = 20, 
-    db: Session = Depends(deps.get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(deps.get_async_read_db),
     current_user = Depends(deps.get_current_active_user)
 ):
-    """Lấy dữ liệu lịch sử để vẽ biểu đồ."""
-    history = crud.get_sensor_history(db, device_id=device_id, limit=limit)
+    """Lấy dữ liệu lịch sử để vẽ biểu đồ. Trang cũ hơn: cursor = header X-Next-Cursor của trang trước."""
+    history = await timeseries_store.query_page_async(db, device_id, limit + 1, decode_cursor(cursor))
     if not history:
         return []
-    return history
+    return set_next_cursor(response, history, limit)
 
 # ================= 2. API CẬP NHẬT / TẠO MỚI =================
 
@@ -177,6 +186,36 @@ def control_device(
         "message": f"Đã gửi lệnh {action}",
         "sent_payload": mqtt_cmd
     }
+
+# ================= 4. API KHÓA AES RIÊNG (XOAY KHÓA) =================
+# Tiến trình này nạp lại bảng khóa ngay; Ingest Worker khác nhận khóa mới sau tối đa DEVICE_KEY_REFRESH_SECONDS
+
+@router.put("/{device_id}/key")
+def set_device_key(
+    device_id: str,
+    key_in: schemas.DeviceKeyUpdate,
+    db: Session = Depends(deps.get_db),
+    current_user = Depends(deps.get_current_active_superuser) # Chỉ ADMIN
+):
+    """Gán / đổi khóa AES riêng cho thiết bị."""
+    if not crud.get_device(db, device_id=device_id):
+        raise HTTPException(status_code=404, detail="Device not found")
+    try:
+        crud.set_device_key(db, device_id, key_in.aes_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "message": f"Đã đổi khóa AES của {device_id}"}
+
+@router.delete("/{device_id}/key")
+def delete_device_key(
+    device_id: str,
+    db: Session = Depends(deps.get_db),
+    current_user = Depends(deps.get_current_active_superuser) # Chỉ ADMIN
+):
+    """Xóa khóa riêng, thiết bị quay về dùng khóa chung."""
+    if not crud.delete_device_key(db, device_id):
+        raise HTTPException(status_code=404, detail="Thiết bị chưa có khóa AES riêng")
+    return {"status": "success", "message": f"{device_id} dùng lại khóa AES chung"}
 # import json
 # from typing import Any, List
 # from fastapi import APIRouter, Depends, HTTPException, Query
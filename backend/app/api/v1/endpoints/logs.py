@@ -1,41 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from db.session import get_db # Chỉnh đường dẫn get_db cho đúng với project của bạn
+from api.deps import get_read_db # API chỉ đọc: đọc ở read replica nếu có
+from api.pagination import decode_cursor, keyset_filter, set_next_cursor # Phân trang theo con trỏ
+from db.log_search import log_search # Tìm kiếm toàn văn (FTS5 / tsvector)
 from models.models import ActionLog, Device, LogLevel # Import các model cần thiết
 
 router = APIRouter()
 
 @router.get("/")
 def get_system_logs(
-    db: Session = Depends(get_db),
+    response: Response,
+    db: Session = Depends(get_read_db),
     skip: int = 0,
     limit: int = 100,
     level: Optional[LogLevel] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    sort: Literal["rank", "time"] = "rank",
+    cursor: Optional[str] = None
 ):
     """
     Lấy danh sách nhật ký hệ thống (Dành cho Kỹ thuật viên)
     Hỗ trợ phân trang, lọc theo Level (ERROR, WARN...) và tìm kiếm Text.
+    Tìm kiếm dùng chỉ mục toàn văn (db/log_search.py), khớp tiền tố từng từ;
+    sort=rank: kết quả liên quan nhất (trong LOG_SEARCH_RANK_WINDOW kết quả mới nhất) lên trước, sort=time: mới nhất lên trước.
+    Phân trang: skip (như cũ) hoặc cursor = header X-Next-Cursor của trang trước (api/pagination.py, luôn theo thời gian).
     """
+    after = decode_cursor(cursor)
+    if after is not None:
+        skip, sort = 0, "time"
     query = db.query(ActionLog)
+    order = [ActionLog.timestamp.desc(), ActionLog.log_id.desc()]
 
     # Lọc theo mức độ cảnh báo nếu có truyền lên
     if level:
         query = query.filter(ActionLog.level == level)
+    # Trang sau con trỏ: tìm thẳng tới vị trí trên index (timestamp, log_id), không đọc rồi bỏ qua skip dòng
+    if after is not None:
+        query = query.filter(keyset_filter(ActionLog.timestamp, ActionLog.log_id, after, db.get_bind().dialect.name))
         
     # Tìm kiếm theo lý do, mã thiết bị hoặc hành động
+    score = None
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            (ActionLog.reason.ilike(search_term)) |
-            (ActionLog.device_id.ilike(search_term)) |
-            (ActionLog.action.ilike(search_term))
-        )
+        found = log_search.apply(query, ActionLog, search, level=level, ranked=sort == "rank", depth=skip + limit + 1,
+                                 before_id=after[1] if after is not None else None)
+        if found is not None:
+            query, score = found
+            if score is not None:
+                order.insert(0, score)
+        else:
+            # DB không có chỉ mục toàn văn: quét cả bảng như cũ
+            search_term = f"%{search}%"
+            query = query.filter(
+                (ActionLog.reason.ilike(search_term)) |
+                (ActionLog.device_id.ilike(search_term)) |
+                (ActionLog.action.ilike(search_term))
+            )
 
-    # Sắp xếp mới nhất lên đầu
-    logs = query.order_by(ActionLog.timestamp.desc()).offset(skip).limit(limit).all()
+    # Sắp xếp mới nhất lên đầu (có từ khóa thì theo độ liên quan trước); lấy dư 1 bản để biết còn trang sau không
+    logs = query.order_by(*order).offset(skip).limit(limit + 1).all()
+    if score is None:
+        logs = set_next_cursor(response, logs, limit, id_attr="log_id")
+    else:
+        logs = logs[:limit]  # Xếp theo điểm: chỉ phân trang bằng skip
 
     # Format dữ liệu trả về cho khớp với Frontend (TechDashboard)
     result = []
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select
 from datetime import datetime, timedelta
-from typing import List, Any
+from typing import List, Any, Optional
 
 from api import deps
+from api.pagination import decode_cursor, keyset_filter, set_next_cursor
 from models import models
+from services.rollup import acc_average, floor_day
+from services.timeseries import timeseries_store
 # Bạn cần tạo schema này hoặc dùng Dict tạm thời
 from pydantic import BaseModel 
 
@@ -22,9 +26,9 @@ class DashboardData(BaseModel):
 
 # ================= API 1: BIỂU ĐỒ XU HƯỚNG (CHARTS) =================
 @router.get("/charts", response_model=DashboardData)
-def get_chart_data(
+async def get_chart_data(
     days: int = 7, 
-    db: Session = Depends(deps.get_db)
+    db: AsyncSession = Depends(deps.get_async_read_db)
 ):
     """
     Trả về dữ liệu cho 2 biểu đồ:
@@ -32,49 +36,35 @@ def get_chart_data(
     2. Biểu đồ hiệu suất (Pie Chart): So sánh số lần AI tưới vs Người tưới.
     """
     # --- 1. Xử lý Biểu đồ Môi trường (Line Chart) ---
+    # `days` ngày gần nhất tính cả hôm nay, mỗi ngày 1 điểm
     end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-    
-    # Query lấy nhiệt độ/độ ẩm trung bình theo ngày (Dùng Python xử lý cho đơn giản & tương thích mọi DB)
-    # Lấy dữ liệu thô
-    logs = db.query(models.SensorData)\
-        .filter(models.SensorData.timestamp >= start_date)\
-        .all()
+    start_date = floor_day(end_date) - timedelta(days=max(days, 1) - 1)
 
-    # Gom nhóm theo ngày
-    daily_data = {}
-    for log in logs:
-        day_str = log.timestamp.strftime("%d/%m") # VD: 18/02
-        if day_str not in daily_data:
-            daily_data[day_str] = {"temp_sum": 0, "hum_sum": 0, "count": 0}
-        
-        daily_data[day_str]["temp_sum"] += log.temp
-        daily_data[day_str]["hum_sum"] += log.hum_air
-        daily_data[day_str]["count"] += 1
+    # Gộp theo ngày ngay trong kho chuỗi thời gian (relational: đọc bảng gộp 1d -> 1h -> 1m -> sensor_data
+    # cho phần chưa gộp) thay vì kéo toàn bộ bản ghi thô về Python
+    series = await timeseries_store.aggregate_async(db, start_date, end_date, "1d")
 
-    # Chuẩn hóa mảng trả về
     labels = []
     temp_values = []
     hum_values = []
-    
-    # Sắp xếp theo ngày
-    sorted_keys = sorted(daily_data.keys(), key=lambda x: datetime.strptime(x + f"/{datetime.now().year}", "%d/%m/%Y"))
-
-    for day in sorted_keys:
-        item = daily_data[day]
-        labels.append(day)
-        temp_values.append(round(item["temp_sum"] / item["count"], 1))
-        hum_values.append(round(item["hum_sum"] / item["count"], 1))
+    for day, acc in series.items():
+        temp = acc_average(acc, "temp")
+        hum = acc_average(acc, "hum_air")
+        if temp is None or hum is None:
+            continue
+        labels.append(day.strftime("%d/%m")) # VD: 18/02
+        temp_values.append(temp)
+        hum_values.append(hum)
 
     # --- 2. Xử lý Biểu đồ Hiệu suất (Pie Chart) ---
     # Đếm số lần trigger bởi AI vs MANUAL trong 30 ngày qua
-    ai_count = db.query(models.ActionLog)\
-        .filter(models.ActionLog.trigger == "AI_MODEL")\
-        .count()
+    ai_count = await db.scalar(
+        select(func.count()).select_from(models.ActionLog).where(models.ActionLog.trigger == "AI_MODEL")
+    )
         
-    manual_count = db.query(models.ActionLog)\
-        .filter(models.ActionLog.trigger == "MANUAL")\
-        .count()
+    manual_count = await db.scalar(
+        select(func.count()).select_from(models.ActionLog).where(models.ActionLog.trigger == "MANUAL")
+    )
 
     return {
         "env_trend": {
@@ -91,62 +81,60 @@ def get_chart_data(
 # ================= API 2: NHẬT KÝ HOẠT ĐỘNG (ACTION LOGS) =================
 @router.get("/logs")
 def get_action_logs(
+    response: Response,
     skip: int = 0, 
     limit: int = 20, 
-    db: Session = Depends(deps.get_db)
+    cursor: Optional[str] = None,
+    db: Session = Depends(deps.get_read_db)
 ):
     """
     Lấy danh sách nhật ký hoạt động (Phân trang)
+    skip như cũ, hoặc cursor = header X-Next-Cursor của trang trước (trang sâu tốn như trang đầu)
     """
-    logs = db.query(models.ActionLog)\
-        .order_by(desc(models.ActionLog.timestamp))\
+    query = db.query(models.ActionLog)
+    after = decode_cursor(cursor)
+    if after is not None:
+        skip = 0
+        query = query.filter(keyset_filter(models.ActionLog.timestamp, models.ActionLog.log_id, after,
+                                           db.get_bind().dialect.name))
+    logs = query\
+        .order_by(desc(models.ActionLog.timestamp), desc(models.ActionLog.log_id))\
         .offset(skip)\
-        .limit(limit)\
+        .limit(limit + 1)\
         .all()
     
     # Trả về list dict đơn giản
-    return logs
+    return set_next_cursor(response, logs, limit, id_attr="log_id")
 
 @router.get("/charts")
 @router.get("/charts")
-def get_report_charts(db: Session = Depends(deps.get_db)):
+async def get_report_charts(db: AsyncSession = Depends(deps.get_async_read_db)):
     try:
         # --- 1. DỮ LIỆU BIỂU ĐỒ TRÒN (HIỆU SUẤT AI) ---
-        ai_count = db.query(models.DeviceLog).filter(models.DeviceLog.trigger == 'AI_MODEL').count()
-        manual_count = db.query(models.DeviceLog).filter(models.DeviceLog.trigger != 'AI_MODEL').count()
+        ai_count = await db.scalar(select(func.count()).select_from(models.DeviceLog).where(models.DeviceLog.trigger == 'AI_MODEL'))
+        manual_count = await db.scalar(select(func.count()).select_from(models.DeviceLog).where(models.DeviceLog.trigger != 'AI_MODEL'))
 
         # --- 2. DỮ LIỆU BIỂU ĐỒ ĐƯỜNG (XU HƯỚNG MÔI TRƯỜNG 7 NGÀY) ---
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        sensor_data = db.query(models.SensorData).filter(models.SensorData.timestamp >= seven_days_ago).all()
-        
-        # Gom nhóm dữ liệu 4 thông số theo từng ngày
-        daily_data = {}
-        for record in sensor_data:
-            day_str = record.timestamp.strftime("%d/%m")
-            if day_str not in daily_data:
-                daily_data[day_str] = {"temp": [], "hum_soil": [], "hum_air": [], "light": []} # Đã thêm 2 thông số
-            
-            if record.temp is not None: daily_data[day_str]["temp"].append(record.temp)
-            if record.hum_soil is not None: daily_data[day_str]["hum_soil"].append(record.hum_soil)
-            if record.hum_air is not None: daily_data[day_str]["hum_air"].append(record.hum_air)
-            if record.light is not None: daily_data[day_str]["light"].append(record.light)
+        # Trung bình 4 thông số theo từng ngày (services/timeseries.py)
+        today = floor_day(datetime.now())
+        daily_data = await timeseries_store.aggregate_async(db, today - timedelta(days=6), datetime.now(), "1d")
 
         labels, temps, hum_soils, hum_airs, lights = [], [], [], [], []
 
         # Hàm tiện ích tính trung bình an toàn
         def get_avg(day, key):
-            if day in daily_data and len(daily_data[day][key]) > 0:
-                return round(sum(daily_data[day][key]) / len(daily_data[day][key]), 1)
+            if day in daily_data:
+                return acc_average(daily_data[day], key) or 0
             return 0
 
         # Lấy 7 ngày gần nhất (từ cũ đến mới)
         for i in range(6, -1, -1):
-            day_key = (datetime.now() - timedelta(days=i)).strftime("%d/%m")
-            labels.append(day_key)
-            temps.append(get_avg(day_key, "temp"))
-            hum_soils.append(get_avg(day_key, "hum_soil"))
-            hum_airs.append(get_avg(day_key, "hum_air")) # Lấy trung bình ẩm khí
-            lights.append(get_avg(day_key, "light"))     # Lấy trung bình ánh sáng
+            day = today - timedelta(days=i)
+            labels.append(day.strftime("%d/%m"))
+            temps.append(get_avg(day, "temp"))
+            hum_soils.append(get_avg(day, "hum_soil"))
+            hum_airs.append(get_avg(day, "hum_air")) # Lấy trung bình ẩm khí
+            lights.append(get_avg(day, "light"))     # Lấy trung bình ánh sáng
 
         return {
             "env_trend": {
@@ -166,7 +154,7 @@ def get_report_charts(db: Session = Depends(deps.get_db)):
         raise HTTPException(status_code=500, detail="Lỗi trích xuất dữ liệu biểu đồ")
 
 @router.get("/logs")
-def get_report_logs(limit: int = 50, db: Session = Depends(deps.get_db)):
+def get_report_logs(limit: int = 50, db: Session = Depends(deps.get_read_db)):
     """
     API 2: Lấy danh sách 50 hành động tưới tiêu gần nhất
     """
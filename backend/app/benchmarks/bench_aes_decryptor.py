@@ -0,0 +1,137 @@
+"""
+Benchmark giải mã gói tin AES: core.security (tạo cipher mỗi gói) vs services/payload_crypto.py
+
+    cd backend/app
+    python -m benchmarks.bench_aes_decryptor --count 100000 --rate 10000 --seconds 5
+
+1. Tốc độ tối đa (msg/s) của từng cách: cũ / dùng lại cipher / giải mã theo lô.
+2. Chạy đều ở --rate msg/s (mặc định 10k) trong --seconds giây: mỗi 10ms giải mã 1 lô,
+   in ra tốc độ đạt được, % CPU 1 lõi đã dùng và độ trễ xử lý lô p50/p99.
+"""
+import argparse
+import base64
+import json
+import time
+
+from Crypto.Cipher import AES
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from core.config import settings
+from core.security import decrypt_payload_bytes
+from db.base import Base
+from models import models
+from services.payload_crypto import PayloadDecryptor
+
+DEVICES = 1000
+KEYED_DEVICES = 200  # 200 thiết bị có khóa riêng, còn lại dùng khóa chung
+
+
+def device_key(i: int) -> bytes:
+    return f"FarmKey{i:09d}".encode()
+
+
+def make_envelopes(count: int):
+    envelopes = []
+    for i in range(count):
+        device_id = f"ESP32:{i % DEVICES:08X}"
+        key = device_key(i % DEVICES) if i % DEVICES < KEYED_DEVICES else settings.AES_KEY
+        inner = json.dumps({"device_id": device_id, "temp": 25.5, "hum_air": 60, "hum_soil": 40, "light": 900}).encode()
+        inner += b"\x00" * (-len(inner) % 16)
+        data = base64.b64encode(AES.new(key, AES.MODE_ECB).encrypt(inner)).decode()
+        envelopes.append((device_id, data))
+    return envelopes
+
+
+def make_decryptor() -> PayloadDecryptor:
+    """Bộ giải mã dùng DB SQLite trong RAM chứa bảng device_keys"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    db.add_all([models.Device(device_id=f"ESP32:{i:08X}", name=f"Bench {i}") for i in range(KEYED_DEVICES)])
+    db.flush()
+    db.add_all([models.DeviceKey(device_id=f"ESP32:{i:08X}", aes_key=device_key(i).decode()) for i in range(KEYED_DEVICES)])
+    db.commit()
+    db.close()
+
+    decryptor = PayloadDecryptor(session_factory=Session)
+    decryptor.load_all()
+    return decryptor
+
+
+def run(name: str, func, envelopes) -> float:
+    started = time.perf_counter()
+    func(envelopes)
+    elapsed = time.perf_counter() - started
+    rate = len(envelopes) / elapsed
+    print(f"   {name:<22} {rate:>12,.0f} msg/s  ({elapsed * 1e6 / len(envelopes):.2f} µs/msg)")
+    return rate
+
+
+def paced(decryptor: PayloadDecryptor, envelopes, rate: int, seconds: float):
+    """Giải mã đều đặn rate msg/s theo nhịp 10ms (giống Ingest nhận gói tin liên tục)"""
+    tick = 0.01
+    per_tick = max(1, int(rate * tick))
+    latencies = []
+    done = 0
+    cursor = 0
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    next_tick = started
+    while time.perf_counter() - started < seconds:
+        batch = envelopes[cursor:cursor + per_tick]
+        if len(batch) < per_tick:
+            cursor = 0
+            batch = envelopes[:per_tick]
+        cursor += per_tick
+
+        t0 = time.perf_counter()
+        decryptor.decrypt_many(batch)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        done += len(batch)
+
+        next_tick += tick
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"⏱️  Chạy đều {rate:,} msg/s trong {seconds:g}s: đạt {done / wall:,.0f} msg/s, "
+          f"CPU {cpu / wall * 100:.1f}% (1 lõi), lô {per_tick} gói: p50 {p50:.2f}ms / p99 {p99:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark giải mã AES")
+    parser.add_argument("--count", type=int, default=100000, help="Số gói tin")
+    parser.add_argument("--rate", type=int, default=10000, help="Tốc độ mục tiêu khi chạy đều (msg/s)")
+    parser.add_argument("--seconds", type=float, default=5, help="Thời gian chạy đều")
+    args = parser.parse_args()
+
+    decryptor = make_decryptor()
+    envelopes = make_envelopes(args.count)
+    # Khóa riêng / khóa chung đều giải mã đúng, theo lô khớp từng gói, khớp với cách cũ (với các gói dùng khóa chung)
+    for (device_id, data), plain in zip(envelopes[:DEVICES], decryptor.decrypt_many(envelopes[:DEVICES])):
+        assert plain == decryptor.decrypt(data, device_id)
+        assert json.loads(plain)["device_id"] == device_id
+    default_only = [env for i, env in enumerate(envelopes) if i % DEVICES >= KEYED_DEVICES]
+    assert decrypt_payload_bytes(default_only[0][1]) == decryptor.decrypt(default_only[0][1])
+
+    print(f"📦 {args.count:,} gói AES, {DEVICES} thiết bị ({KEYED_DEVICES} có khóa riêng)")
+    old = run("cũ (AES.new mỗi gói)", lambda envs: [decrypt_payload_bytes(data) for _, data in envs], envelopes)
+    cached = run("dùng lại cipher", lambda envs: [decryptor.decrypt(data, device_id) for device_id, data in envs], envelopes)
+    for size in (100, 1000):
+        run(f"theo lô {size}", lambda envs: [decryptor.decrypt_many(envs[i:i + size]) for i in range(0, len(envs), size)], envelopes)
+    print(f"   ⚡ Dùng lại cipher nhanh hơn {cached / old:.1f} lần")
+
+    paced(decryptor, envelopes, args.rate, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
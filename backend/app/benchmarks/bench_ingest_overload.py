@@ -0,0 +1,89 @@
+"""
+Mô phỏng quá tải Ingest (DB chậm + burst) cho từng chính sách của services/ingest_queue.py
+
+    cd backend/app
+    python -m benchmarks.bench_ingest_overload --devices 1000 --rate 20000 --drain 2000 --seconds 3
+
+Producer đẩy --rate msg/s (giống on_message), Consumer chỉ rút được --drain msg/s (giống DB đang chậm).
+Với mỗi chính sách in ra: số bản ghi đã ghi, bị bỏ theo lý do, độ sâu hàng đợi lớn nhất,
+độ trễ put() p99 (block sẽ chặn luồng MQTT) và tỉ lệ thiết bị có bản ghi MỚI NHẤT tới được DB.
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+
+from services.ingest_queue import POLICIES, IngestQueue
+from services.ingest_writer import SensorReading
+
+
+def simulate(policy: str, devices: int, rate: int, drain: int, seconds: float, capacity: int):
+    q = IngestQueue(maxsize=capacity, policy=policy, block_timeout_ms=50, sample_seconds=1, sample_watermark=0.5)
+    written = {}   # device_id -> seq lớn nhất đã tới "DB"
+    written_count = 0
+    stop = threading.Event()
+
+    def consumer():
+        nonlocal written_count
+        batch = max(1, drain // 100)
+        while not stop.is_set() or q.qsize():
+            started = time.perf_counter()
+            for reading in q.drain(batch):
+                written_count += 1
+                if reading.temp > written.get(reading.device_id, -1):
+                    written[reading.device_id] = reading.temp
+            # Mỗi 10ms chỉ ghi được drain/100 bản ghi
+            time.sleep(max(0.0, 0.01 - (time.perf_counter() - started)))
+            if stop.is_set() and not q.qsize():
+                break
+
+    thread = threading.Thread(target=consumer, daemon=True)
+    thread.start()
+
+    last_seq = {}
+    latencies = []
+    sent = 0
+    started = time.perf_counter()
+    per_tick = max(1, rate // 100)
+    next_tick = started
+    while time.perf_counter() - started < seconds:
+        for _ in range(per_tick):
+            device_id = f"ESP32:{sent % devices:08X}"
+            seq = float(sent)
+            t0 = time.perf_counter()
+            q.put(SensorReading(device_id, seq, 60.0, 40.0, 900.0, None, None, None, False, datetime.now()))
+            latencies.append(time.perf_counter() - t0)
+            last_seq[device_id] = seq
+            sent += 1
+        next_tick += 0.01
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    stop.set()
+    thread.join()
+
+    stats = q.stats()
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    fresh = sum(1 for device_id, seq in last_seq.items() if written.get(device_id) == seq)
+    print(f"📦 {policy:<12} gửi={sent:,} ghi={written_count:,} bỏ={stats['dropped']} "
+          f"hàng đợi max={stats['high_water']}/{capacity} put p99={p99:.3f}ms "
+          f"bản mới nhất tới DB={fresh}/{len(last_seq)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mô phỏng quá tải Ingest")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--rate", type=int, default=20000, help="Tốc độ gói tin đến (msg/s)")
+    parser.add_argument("--drain", type=int, default=2000, help="Tốc độ DB ghi được (msg/s)")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--capacity", type=int, default=5000, help="Sức chứa hàng đợi")
+    args = parser.parse_args()
+
+    for policy in POLICIES:
+        simulate(policy, args.devices, args.rate, args.drain, args.seconds, args.capacity)
+
+
+if __name__ == "__main__":
+    main()
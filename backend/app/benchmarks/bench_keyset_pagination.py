@@ -0,0 +1,85 @@
+"""
+Benchmark phân trang nhật ký (/reports/logs, /logs): skip/offset vs con trỏ (api/pagination.py)
+
+    cd backend/app
+    python -m benchmarks.bench_keyset_pagination --rows 1000000
+
+Đo thời gian lấy trang thứ N (mới -> cũ, có / không lọc level) bằng OFFSET và bằng con trỏ (timestamp, log_id)
+trên index ix_action_logs_ts_id / ix_action_logs_level_ts_id.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import desc
+from sqlalchemy.orm import sessionmaker
+
+from api.pagination import keyset_filter
+from benchmarks.bench_log_search import seed
+from models import models
+
+PAGES = (1, 10, 100, 1000, 10000)
+
+
+def page_query(db, level, limit: int, skip: int = 0, cursor=None):
+    log = models.ActionLog
+    query = db.query(log)
+    if level is not None:
+        query = query.filter(log.level == level)
+    if cursor is not None:
+        query = query.filter(keyset_filter(log.timestamp, log.log_id, cursor, db.get_bind().dialect.name))
+    return query.order_by(desc(log.timestamp), desc(log.log_id)).offset(skip).limit(limit).all()
+
+
+def cursor_at(db, level, limit: int, page: int):
+    """Con trỏ của trang trước trang `page` (bản cuối trang page - 1), lấy 1 lần bằng OFFSET, không tính giờ"""
+    if page <= 1:
+        return None
+    last = page_query(db, level, 1, skip=(page - 1) * limit - 1)
+    return (last[0].timestamp, last[0].log_id) if last else None
+
+
+def timed(Session, fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        db = Session()
+        started = time.perf_counter()
+        fn(db)
+        times.append((time.perf_counter() - started) * 1e3)
+        db.close()
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark phân trang: OFFSET vs con trỏ")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Số bản ghi action_logs")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        engine = seed(os.path.join(tmp, "logs.db"), args.rows)
+        print(f"📦 {args.rows:,} action_logs tạo trong {time.perf_counter() - started:.1f}s")
+        Session = sessionmaker(bind=engine)
+
+        for level in (None, models.LogLevel.ERROR):
+            print(f"\n   level={level.value if level else '-'}   (ms, trung vị {args.repeat} lần, trang {args.limit} dòng)")
+            print(f"      {'trang':>8} {'OFFSET':>10} {'con trỏ':>10}")
+            for page in PAGES:
+                db = Session()
+                cursor = cursor_at(db, level, args.limit, page)
+                db.close()
+                if page > 1 and cursor is None:
+                    break
+                skip = (page - 1) * args.limit
+                ms_offset = timed(Session, lambda db: page_query(db, level, args.limit, skip=skip), args.repeat)
+                ms_cursor = timed(Session, lambda db: page_query(db, level, args.limit, cursor=cursor), args.repeat)
+                print(f"      {page:>8,} {ms_offset:>10.1f} {ms_cursor:>10.1f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark ô tìm kiếm nhật ký (/logs?search=...): ILIKE quét bảng vs chỉ mục toàn văn FTS5 (db/log_search.py)
+
+    cd backend/app
+    python -m benchmarks.bench_log_search --rows 2000000
+
+Tạo action_logs giả lập trong file SQLite tạm, đo thời gian từng từ khóa (có / không lọc level)
+với đúng câu truy vấn của endpoints/logs.get_system_logs.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from db.log_search import LogSearch
+from models import models
+
+REASONS = [
+    "Đất khô {v}% < 35% (AI tưới)", "Temp {v} > 35 (Heat Shock)", "Độ ẩm không khí {v}% thấp, phun sương",
+    "Mất kết nối thiết bị {v}s", "Người dùng tắt bơm thủ công", "Hết nước bồn chứa, dừng bơm", "Cảm biến lỗi, giá trị {v}",
+]
+SEARCHES = ["heat", "phun suong", "esp32 0000002", "mất kết", "bon chua", "pump_off", "khô", "esp"]
+
+
+def seed(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(1)
+    devices = [f"ESP32:{i:08X}" for i in range(200)]
+    actions, levels = list(models.ActionType), list(models.LogLevel)
+    start = datetime.now() - timedelta(days=365)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Device), [{"device_id": d, "name": d} for d in devices])
+        batch = []
+        for i in range(rows):
+            batch.append({"device_id": rng.choice(devices), "timestamp": start + timedelta(seconds=i * 15),
+                          "action": rng.choice(actions), "trigger": models.TriggerSource.SYSTEM,
+                          "reason": rng.choice(REASONS).format(v=rng.randint(1, 99)), "level": rng.choice(levels)})
+            if len(batch) >= 20000:
+                conn.execute(insert(models.ActionLog), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.ActionLog), batch)
+    return engine
+
+
+def query(db, searcher: LogSearch, search: str, level, limit: int):
+    """Giống get_system_logs (trang đầu, sort=rank)"""
+    q = db.query(models.ActionLog)
+    order = [models.ActionLog.timestamp.desc()]
+    if level:
+        q = q.filter(models.ActionLog.level == level)
+    found = searcher.apply(q, models.ActionLog, search, level=level, depth=limit)
+    if found is not None:
+        q, score = found
+        order.insert(0, score)
+    else:
+        term = f"%{search}%"
+        q = q.filter(models.ActionLog.reason.ilike(term) | models.ActionLog.device_id.ilike(term)
+                     | models.ActionLog.action.ilike(term))
+    return q.order_by(*order).limit(limit).all()
+
+
+def measure(Session, searcher: LogSearch, level, args):
+    result = {}
+    for search in SEARCHES:
+        times = []
+        for _ in range(args.repeat):
+            db = Session()
+            started = time.perf_counter()
+            rows = query(db, searcher, search, level, args.limit)
+            times.append((time.perf_counter() - started) * 1e3)
+            db.close()
+        result[search] = (statistics.median(times), len(rows))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tìm kiếm nhật ký: ILIKE vs FTS5")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Số bản ghi action_logs")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        engine = seed(os.path.join(tmp, "logs.db"), args.rows)
+        print(f"📦 {args.rows:,} action_logs tạo trong {time.perf_counter() - started:.1f}s")
+        Session = sessionmaker(bind=engine)
+
+        ilike = LogSearch()
+        fts = LogSearch()
+        started = time.perf_counter()
+        fts.install(engine)
+        assert fts.enabled, "SQLite không hỗ trợ FTS5"
+        print(f"🔎 Đánh chỉ mục FTS5 trong {time.perf_counter() - started:.1f}s")
+
+        for level in (None, models.LogLevel.ERROR):
+            slow, fast = measure(Session, ilike, level, args), measure(Session, fts, level, args)
+            print(f"\n   level={level.value if level else '-'}   (ms, trung vị {args.repeat} lần, trang {args.limit} dòng)")
+            print(f"      {'từ khóa':<18} {'ILIKE':>10} {'FTS5':>10} {'nhanh hơn':>10}")
+            for search in SEARCHES:
+                (ms_slow, _), (ms_fast, n) = slow[search], fast[search]
+                print(f"      {search:<18} {ms_slow:>10.1f} {ms_fast:>10.1f} {ms_slow / max(ms_fast, 1e-3):>9.0f}x   ({n} dòng)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
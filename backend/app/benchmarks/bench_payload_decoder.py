@@ -0,0 +1,111 @@
+"""
+So sánh tốc độ giải mã gói tin cảm biến: đường cũ vs services/payload_decoder.py
+
+    cd backend/app
+    python -m benchmarks.bench_payload_decoder --count 200000
+
+Đường cũ: bytes -> str -> json.loads -> dò key -> float() -> schemas.SensorDataInput (Pydantic) -> SensorReading
+Đường mới: bytes/memoryview -> msgspec Struct -> so sánh ngưỡng -> SensorReading
+Nhị phân: N x struct_message (24 byte) -> struct.iter_unpack / numpy.frombuffer -> SensorReading
+"""
+import argparse
+import base64
+import json
+import time
+from datetime import datetime
+
+from Crypto.Cipher import AES
+
+from core.config import settings
+from core.security import decrypt_payload
+from schemas import device as schemas
+from services.ingest_writer import SensorReading
+from services.payload_decoder import BINARY_RECORD, decode_binary_payload, decode_sensor_payload, msgspec, np
+
+
+def legacy_decode(payload: bytes):
+    """Bản sao logic giải mã cũ của mqtt_service.decode_message (bỏ phần hỏi Registry)"""
+    data_json = json.loads(payload.decode('utf-8'))
+    if "temp" in data_json and "device_id" in data_json:
+        sensor_data = data_json
+        device_id = data_json.get("device_id")
+    elif "data" in data_json:
+        sensor_data = decrypt_payload(data_json["data"])
+        device_id = sensor_data.get("device_id", "UNKNOWN")
+    else:
+        return None
+
+    temp = float(sensor_data.get("temp", 0))
+    hum_air = float(sensor_data.get("hum_air", 0))
+    hum_soil = float(sensor_data.get("hum_soil", 0))
+    light = float(sensor_data.get("light", 0))
+    is_error = temp <= -50 or temp >= 100 or hum_soil < 0 or hum_soil > 100
+    if not is_error:
+        schemas.SensorDataInput(temp=temp, hum_air=hum_air, hum_soil=hum_soil, light=light)
+
+    def opt(key):
+        value = sensor_data.get(key)
+        return None if value is None else bool(value)
+
+    return SensorReading(device_id, temp, hum_air, hum_soil, light,
+                         opt("pump_state"), opt("light_state"), opt("mist_state"),
+                         is_error, datetime.now())
+
+
+def make_plain(i: int) -> bytes:
+    return json.dumps({
+        "device_id": f"ESP32:{i % 1000:08X}", "temp": 20 + i % 15 + 0.5, "hum_air": 55.5,
+        "hum_soil": 30 + i % 40, "light": 800 + i % 200, "pump_state": i % 2, "mist_state": 0,
+    }).encode()
+
+
+def make_aes(i: int) -> bytes:
+    inner = make_plain(i)
+    inner += b"\x00" * (-len(inner) % 16)
+    cipher = AES.new(settings.AES_KEY, AES.MODE_ECB)
+    return json.dumps({"data": base64.b64encode(cipher.encrypt(inner)).decode()}).encode()
+
+
+def make_binary(i: int, records: int) -> bytes:
+    return b"".join(
+        BINARY_RECORD.pack(1, 20 + (i + k) % 15 + 0.5, 55.5, 30 + (i + k) % 40, 800 + (i + k) % 200, 1)
+        for k in range(records)
+    )
+
+
+def run(name: str, func, payloads, per_message: int = 1) -> float:
+    started = time.perf_counter()
+    for payload in payloads:
+        func(payload)
+    elapsed = time.perf_counter() - started
+    rate = len(payloads) * per_message / elapsed
+    print(f"   {name:<8} {rate:>12,.0f} bản ghi/s  ({elapsed * 1e6 / len(payloads) / per_message:.2f} µs/bản ghi)")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark giải mã gói tin cảm biến")
+    parser.add_argument("--count", type=int, default=200000, help="Số gói tin mỗi loại")
+    args = parser.parse_args()
+
+    print(f"🧪 msgspec: {'có' if msgspec else 'không (fallback orjson/json)'}, numpy: {'có' if np is not None else 'không'}")
+    for label, factory in (("Wokwi (JSON phẳng)", make_plain), ("ESP32 (AES)", make_aes)):
+        payloads = [factory(i) for i in range(args.count)]
+        # Kết quả 2 đường phải giống nhau (trừ received_at)
+        for payload in payloads[:1000]:
+            assert legacy_decode(payload)._replace(received_at=None) == decode_sensor_payload(payload)._replace(received_at=None)
+
+        print(f"📦 {label}: {args.count:,} gói tin")
+        old = run("cũ", legacy_decode, payloads)
+        new = run("mới", decode_sensor_payload, payloads)
+        print(f"   ⚡ Nhanh hơn {new / old:.1f} lần")
+
+    json_size = sum(len(make_plain(i)) for i in range(1000)) / 1000
+    print(f"📦 Nhị phân: {BINARY_RECORD.size} byte/bản ghi (JSON trung bình {json_size:.0f} byte, gấp {json_size / BINARY_RECORD.size:.1f} lần)")
+    for records in (1, 64):
+        payloads = [make_binary(i, records) for i in range(max(1, args.count // records))]
+        run(f"x{records}", lambda p: decode_binary_payload("ESP32:BENCH", p), payloads, per_message=records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark biểu đồ N ngày: gộp bản ghi thô trong Python (cách cũ) vs đọc bảng gộp (services/rollup.py)
+
+    cd backend/app
+    python -m benchmarks.bench_rollup_chart --devices 500 --days 30 --interval 900
+
+Sinh dữ liệu giả vào 1 DB SQLite tạm (mỗi thiết bị 1 bản ghi / --interval giây), gộp toàn bộ 1 lần
+(thời gian backfill), rồi đo 1 lần vẽ biểu đồ theo 2 cách: số dòng phải đọc và thời gian.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from models import models
+from services.rollup import LEVELS, RollupCompactor, acc_average, floor_day, load_watermarks, plan_pieces, read_series
+
+
+def populate(Session, devices: int, days: int, interval: int, now: datetime) -> int:
+    device_ids = [f"ESP32:{i:08X}" for i in range(devices)]
+    db = Session()
+    db.add_all([models.Device(device_id=d, name=d) for d in device_ids])
+    db.commit()
+
+    rng = random.Random(1)
+    start = now - timedelta(days=days)
+    total = 0
+    batch = []
+    ts = start
+    while ts < now:
+        for device_id in device_ids:
+            batch.append({"device_id": device_id, "timestamp": ts, "temp": 20 + rng.random() * 10,
+                          "hum_air": 60 + rng.random() * 20, "hum_soil": 40 + rng.random() * 20, "light": None})
+        if len(batch) >= 50000:
+            db.execute(insert(models.SensorData), batch)
+            total += len(batch)
+            batch = []
+        ts += timedelta(seconds=interval)
+    if batch:
+        db.execute(insert(models.SensorData), batch)
+        total += len(batch)
+    db.commit()
+    db.close()
+    return total
+
+
+def chart_raw(db, start: datetime):
+    """Cách cũ của reports.get_chart_data: kéo toàn bộ bản ghi thô rồi cộng theo ngày"""
+    rows = db.query(models.SensorData).filter(models.SensorData.timestamp >= start).all()
+    daily = {}
+    for row in rows:
+        item = daily.setdefault(floor_day(row.timestamp), [0.0, 0.0, 0])
+        item[0] += row.temp
+        item[1] += row.hum_air
+        item[2] += 1
+    return {day: round(t / n, 1) for day, (t, h, n) in sorted(daily.items())}, len(rows)
+
+
+def chart_rollup(db, start: datetime, end: datetime):
+    series = read_series(db, start, end, "1d")
+    return {day: acc_average(acc, "temp") for day, acc in series.items()}
+
+
+def rows_scanned(db, start: datetime, end: datetime) -> dict:
+    """Số dòng nguồn mà read_series phải đọc ở từng bảng"""
+    counts = {}
+    for level, low, high in plan_pieces(start, end, load_watermarks(db), len(LEVELS) - 1):
+        if level is None:
+            column, name = models.SensorData.timestamp, "sensor_data"
+        else:
+            column, name = level.model.bucket, level.model.__tablename__
+        counts[name] = counts.get(name, 0) + db.query(func.count()).filter(column >= low, column < high).scalar()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark biểu đồ từ bảng gộp")
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--interval", type=int, default=900, help="Giây giữa 2 bản ghi của 1 thiết bị")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+
+        now = datetime.now()
+        started = time.perf_counter()
+        total = populate(Session, args.devices, args.days, args.interval, now)
+        print(f"📦 {total:,} bản ghi thô ({args.devices} thiết bị x {args.days} ngày), sinh trong {time.perf_counter() - started:.1f}s")
+
+        compactor = RollupCompactor(session_factory=Session, lag_seconds=0)
+        started = time.perf_counter()
+        written = compactor.compact_once(now=now)
+        print(f"🧮 Backfill bảng gộp: {written} khung trong {time.perf_counter() - started:.1f}s")
+
+        start = floor_day(now) - timedelta(days=args.days - 1)
+        db = Session()
+        started = time.perf_counter()
+        old, raw_rows = chart_raw(db, start)
+        old_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        new = chart_rollup(db, start, now)
+        new_time = time.perf_counter() - started
+        scanned = rows_scanned(db, start, now)
+        db.close()
+        engine.dispose()
+
+        assert list(old) == list(new) and all(abs(old[d] - new[d]) <= 0.1 for d in old), "Kết quả 2 cách khác nhau"
+        print(f"   gộp thô trong Python   {raw_rows:>12,} dòng  {old_time * 1e3:>10.1f} ms")
+        print(f"   đọc bảng gộp           {sum(scanned.values()):>12,} dòng  {new_time * 1e3:>10.1f} ms   {scanned}")
+        print(f"   ⚡ Nhanh hơn {old_time / new_time:.0f} lần, đọc ít hơn {raw_rows / max(sum(scanned.values()), 1):.0f} lần số dòng")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark kho khối nén (services/sensor_blocks.py): dung lượng sensor_data trước / sau khi nén
+và thời gian đọc lịch sử 1 thiết bị (bảng nóng vs giải mã khối).
+
+    cd backend/app
+    python -m benchmarks.bench_sensor_blocks --devices 50 --hours 72 --interval 5
+
+Số đo sinh bằng VirtualDevice của tools/fleet_simulator.py (giống dữ liệu thật: đổi chậm, làm tròn 0.1),
+thời điểm nhận lệch vài ms quanh nhịp --interval giây như MQTT thật. Dung lượng đo bằng kích thước file
+SQLite sau VACUUM. Cuối cùng so từng bản ghi giải mã với bản gốc.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, desc, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from models import models
+from services.rollup import METRICS, floor_hour
+from services.sensor_blocks import SensorBlocks
+from tools.fleet_simulator import VirtualDevice
+
+
+def populate(Session, devices: int, hours: int, interval: int, now: datetime) -> int:
+    fleet = [VirtualDevice(f"ESP32:{i:08X}", seed=i, encrypted=False) for i in range(devices)]
+    db = Session()
+    db.add_all([models.Device(device_id=d.device_id, name=d.device_id) for d in fleet])
+    db.commit()
+
+    rng = random.Random(1)
+    start = floor_hour(now) - timedelta(hours=hours)
+    total = 0
+    batch = []
+    for step in range(hours * 3600 // interval):
+        tick = start + timedelta(seconds=step * interval)
+        sim_hour = (tick.hour + tick.minute / 60.0) % 24
+        for device in fleet:
+            device.advance(sim_hour, interval / 3600.0, interval)
+            reading = device.reading(sim_hour)
+            batch.append({"device_id": device.device_id, "timestamp": tick + timedelta(microseconds=rng.randint(0, 20000)),
+                          **{metric: reading[metric] for metric in METRICS}})
+        if len(batch) >= 50000:
+            db.execute(insert(models.SensorData), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.SensorData), batch)
+        total += len(batch)
+    db.commit()
+    db.close()
+    return total
+
+
+def vacuumed_size(engine, path: str) -> int:
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    return os.path.getsize(path)
+
+
+def history_hot(db, device_id: str, limit: int):
+    sd = models.SensorData
+    rows = db.query(sd).filter(sd.device_id == device_id).order_by(desc(sd.timestamp), desc(sd.id)).limit(limit).all()
+    return [(r.id, r.timestamp, [getattr(r, metric) for metric in METRICS]) for r in rows]
+
+
+def timed(Session, fn, repeat: int):
+    times, result = [], None
+    for _ in range(repeat):
+        db = Session()
+        started = time.perf_counter()
+        result = fn(db)
+        times.append((time.perf_counter() - started) * 1e3)
+        db.close()
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark kho khối nén sensor_blocks")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--hours", type=int, default=72)
+    parser.add_argument("--interval", type=int, default=5, help="Giây giữa 2 bản ghi của 1 thiết bị")
+    parser.add_argument("--limit", type=int, default=2000, help="Số bản ghi 1 lần xem lịch sử")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    now = datetime.now()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "blocks.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+
+        started = time.perf_counter()
+        total = populate(Session, args.devices, args.hours, args.interval, now)
+        print(f"📦 {total:,} bản ghi ({args.devices} thiết bị x {args.hours} giờ) tạo trong {time.perf_counter() - started:.1f}s")
+        device_id = "ESP32:00000000"
+        ms_hot, expected = timed(Session, lambda db: history_hot(db, device_id, args.limit), args.repeat)
+        before = vacuumed_size(engine, path)
+
+        store = SensorBlocks(session_factory=Session, after_hours=1)
+        started = time.perf_counter()
+        result = store.compress_once(now=now + timedelta(hours=1))  # Nén hết (dữ liệu sinh tới giờ hiện tại)
+        print(f"🗜️ Nén {result['rows']:,} bản ghi ({result['hours']} giờ) trong {time.perf_counter() - started:.1f}s")
+        after = vacuumed_size(engine, path)
+        db = Session()
+        info = store.status(db)
+        db.close()
+
+        ms_blocks, decoded = timed(Session, lambda db: store.newest(db, device_id, None, None, args.limit), args.repeat)
+        assert decoded == expected, "Dữ liệu giải mã khác bản gốc"
+
+        print(f"\n   file SQLite (sau VACUUM)   {before / 2 ** 20:>8.1f} MB -> {after / 2 ** 20:>6.1f} MB   ({before / after:.1f}x)")
+        print(f"   dữ liệu khối               {info['bytes'] / 2 ** 20:>8.1f} MB   ({info['bytes'] / max(info['rows'], 1):.1f} B/bản ghi,"
+              f" bảng nóng {before / max(total, 1):.1f} B/bản ghi)")
+        print(f"   lịch sử {args.limit} bản ghi      bảng nóng {ms_hot:.1f} ms, giải mã khối {ms_blocks:.1f} ms"
+              f" (trung vị {args.repeat} lần)")
+        print(f"   ✅ {len(decoded):,} bản ghi giải mã trùng khớp bản gốc")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
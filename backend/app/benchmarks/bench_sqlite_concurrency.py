@@ -0,0 +1,217 @@
+"""
+Benchmark ghi / đọc đồng thời trên SQLite: cấu hình cũ (legacy) vs SQLITE_PROFILE=production (db/session.py)
+
+    cd backend/app
+    python -m benchmarks.bench_sqlite_concurrency --writers 4 --async-writers 2 --readers 4 --seconds 15
+
+Mô phỏng các luồng của API chạy cùng lúc trên cùng 1 file DB:
+- mqtt: Writer ghi lô sensor_data + cập nhật last_seen, mỗi lô 1 COMMIT
+- control (--writers luồng): tưới / watchdog / request — đọc thiết bị, thêm action_logs, sửa trạng thái, COMMIT
+- async (--async-writers task trong 1 event loop): như control nhưng qua AsyncSession (aiosqlite) như watchdog_task /
+  auto_irrigation_task; production dùng chung 1 ghế ghi (WriteGate) với các luồng đồng bộ
+- report (--readers luồng): quét sensor_data N giờ gần nhất bằng ORM (yield_per) như báo cáo / gộp số liệu
+Đếm số lỗi "database is locked", số thao tác xong và độ trễ COMMIT của luồng ghi.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from db.session import RoutingSession, WriteGate, create_sqlite_engines
+from models import models
+
+
+def seed(path: str, devices, rows: int, hours: int, now: datetime):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(1)
+    step = hours * 3600 / max(rows, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Device), [{"device_id": d, "name": d, "status": models.DeviceStatus.ONLINE} for d in devices])
+        batch = []
+        for i in range(rows):
+            batch.append({"device_id": devices[i % len(devices)], "timestamp": now - timedelta(seconds=hours * 3600 - i * step),
+                          "temp": 20 + rng.random() * 10, "hum_air": 70.0, "hum_soil": 50.0, "light": None})
+            if len(batch) >= 10000:
+                conn.execute(insert(models.SensorData), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.SensorData), batch)
+    engine.dispose()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+        self.errors = {}
+        self.commit_ms = []
+
+    def ok(self, kind: str, commit_ms: float = None):
+        with self.lock:
+            self.ops[kind] = self.ops.get(kind, 0) + 1
+            if commit_ms is not None:
+                self.commit_ms.append(commit_ms)
+
+    def error(self, kind: str, e: Exception):
+        with self.lock:
+            key = f"{kind}: {'database is locked' if 'locked' in str(e) else type(e).__name__}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    @property
+    def locked(self) -> int:
+        return sum(count for key, count in self.errors.items() if key.endswith("database is locked"))
+
+
+def worker(kind: str, Session, devices, stats: Stats, stop: threading.Event, hours: int):
+    rng = random.Random(hash(kind + threading.current_thread().name))
+    while not stop.is_set():
+        db = Session()
+        try:
+            started = time.perf_counter()
+            if kind == "mqtt":
+                now = datetime.now()
+                rows = [{"device_id": rng.choice(devices), "timestamp": now, "temp": 25.0, "hum_air": 70.0,
+                         "hum_soil": 50.0, "light": None} for _ in range(100)]
+                db.execute(insert(models.SensorData), rows)
+                db.query(models.Device).filter(models.Device.device_id.in_({r["device_id"] for r in rows}))\
+                    .update({models.Device.last_seen: now}, synchronize_session=False)
+            elif kind == "control":
+                device = db.query(models.Device).filter(models.Device.device_id == rng.choice(devices)).first()
+                db.add(models.ActionLog(device_id=device.device_id, action=models.ActionType.PUMP_ON,
+                                        trigger=models.TriggerSource.SYSTEM, reason="bench", level=models.LogLevel.INFO))
+                device.pump_state = not device.pump_state
+            else:
+                since = datetime.now() - timedelta(hours=hours)
+                total = 0.0
+                for row in db.query(models.SensorData).filter(models.SensorData.timestamp >= since).yield_per(2000):
+                    total += row.temp or 0
+                stats.ok(kind)
+                continue
+            db.commit()
+            stats.ok(kind, (time.perf_counter() - started) * 1e3)
+        except (OperationalError, PoolTimeoutError) as e:
+            db.rollback()
+            stats.error(kind, e)
+        finally:
+            db.close()
+        if kind != "report":
+            time.sleep(0.01 if kind == "mqtt" else 0.005)  # Writer gom lô theo chu kỳ, không ghi liên tục
+
+
+async def async_worker(AsyncSession, devices, stats: Stats, stop: threading.Event, index: int):
+    rng = random.Random(f"async-{index}")
+    while not stop.is_set():
+        db = AsyncSession()
+        try:
+            started = time.perf_counter()
+            device = await db.scalar(select(models.Device).where(models.Device.device_id == rng.choice(devices)).limit(1))
+            db.add(models.ActionLog(device_id=device.device_id, action=models.ActionType.MIST_ON,
+                                    trigger=models.TriggerSource.AI_MODEL, reason="bench", level=models.LogLevel.INFO))
+            device.mist_state = not device.mist_state
+            await db.commit()
+            stats.ok("async", (time.perf_counter() - started) * 1e3)
+        except (OperationalError, PoolTimeoutError) as e:
+            await db.rollback()
+            stats.error("async", e)
+        finally:
+            await db.close()
+        await asyncio.sleep(0.005)
+
+
+def async_writers(make_session, devices, stats: Stats, stop: threading.Event, count: int):
+    """1 event loop riêng (như event loop của API): make_session() -> (AsyncSession factory, các engine cần đóng)"""
+    async def main():
+        AsyncSession, engines = make_session()
+        try:
+            await asyncio.gather(*(async_worker(AsyncSession, devices, stats, stop, i) for i in range(count)))
+        finally:
+            for engine in engines:
+                await engine.dispose()
+    asyncio.run(main())
+
+
+def run(name: str, Session, devices, args, make_async_session=None) -> Stats:
+    stats, stop = Stats(), threading.Event()
+    kinds = ["mqtt"] + ["control"] * args.writers + ["report"] * args.readers
+    threads = [threading.Thread(target=worker, args=(kind, Session, devices, stats, stop, args.hours), name=f"{kind}-{i}")
+               for i, kind in enumerate(kinds)]
+    if make_async_session and args.async_writers:
+        threads.append(threading.Thread(target=async_writers, name="async",
+                                        args=(make_async_session, devices, stats, stop, args.async_writers)))
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    latencies = sorted(stats.commit_ms) or [0.0]
+    print(f"\n   {name}")
+    print("      thao tác xong  " + "   ".join(f"{k} {v:,}" for k, v in sorted(stats.ops.items())))
+    print(f"      COMMIT (ms)    p50 {latencies[len(latencies) // 2]:.1f}   p99 {latencies[int(len(latencies) * 0.99)]:.1f}")
+    print(f"      lỗi            {sum(stats.errors.values()):,} ({stats.locked:,} database is locked)")
+    for key, count in sorted(stats.errors.items()):
+        print(f"         {key:<40} {count:,}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite ghi / đọc đồng thời: legacy vs production")
+    parser.add_argument("--writers", type=int, default=4, help="Số luồng control (ngoài 1 luồng mqtt)")
+    parser.add_argument("--async-writers", type=int, default=2, help="Số task ghi qua AsyncSession")
+    parser.add_argument("--readers", type=int, default=4, help="Số luồng báo cáo")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--rows", type=int, default=300_000, help="Số bản ghi sensor_data có sẵn")
+    parser.add_argument("--hours", type=int, default=24, help="Báo cáo quét N giờ gần nhất")
+    parser.add_argument("--devices", type=int, default=50)
+    args = parser.parse_args()
+
+    devices = [f"ESP32:{i:08X}" for i in range(args.devices)]
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path, production_path = os.path.join(tmp, "legacy.db"), os.path.join(tmp, "production.db")
+        print(f"📦 {args.rows:,} bản ghi / {args.hours} giờ, 1 mqtt + {args.writers} control + {args.async_writers} async"
+              f" + {args.readers} report, {args.seconds:.0f}s mỗi cấu hình")
+        seed(legacy_path, devices, args.rows, args.hours, datetime.now())
+        shutil.copy(legacy_path, production_path)
+
+        def legacy_async():
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{legacy_path}")
+            return async_sessionmaker(async_engine, expire_on_commit=False), [async_engine]
+
+        engine = create_engine(f"sqlite:///{legacy_path}", connect_args={"check_same_thread": False})
+        legacy = run("legacy (check_same_thread=False)", sessionmaker(bind=engine), devices, args, legacy_async)
+        engine.dispose()
+
+        gate = WriteGate()
+
+        def production_async():
+            async_write, async_read = create_sqlite_engines(f"sqlite+aiosqlite:///{production_path}",
+                                                            factory=create_async_engine, gate=gate)
+            return async_sessionmaker(sync_session_class=RoutingSession, expire_on_commit=False,
+                                      writer=async_write.sync_engine, reader=async_read.sync_engine), [async_write, async_read]
+
+        write_engine, read_engine = create_sqlite_engines(f"sqlite:///{production_path}", gate=gate)
+        production = run("production (WAL + 1 ghế ghi chung sync/async + pool đọc)",
+                         sessionmaker(class_=RoutingSession, writer=write_engine, reader=read_engine), devices, args,
+                         production_async)
+        write_engine.dispose()
+        read_engine.dispose()
+
+    print(f"\n   database is locked: legacy {legacy.locked:,} -> production {production.locked:,}")
+    assert production.locked == 0, "SQLITE_PROFILE=production vẫn gặp database is locked"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark chung cho các backend của TimeSeriesStore (services/timeseries.py): relational vs columnar
+
+    cd backend/app
+    python -m benchmarks.bench_timeseries --devices 200 --days 14 --interval 300
+
+Cùng 1 bộ dữ liệu giả, ghi theo lô như Writer (--batch bản ghi / lô, mỗi lô 1 COMMIT), rồi đo:
+- append: số bản ghi / giây
+- history: N bản ghi mới nhất của 1 thiết bị (API /devices/{id}/history)
+- range: 1 ngày ngẫu nhiên của 1 thiết bị
+- latest: bản ghi mới nhất của toàn bộ thiết bị
+- aggregate: biểu đồ theo ngày toàn bộ thiết bị (relational: trước và sau khi gộp bảng rollup)
+- dung lượng trên đĩa
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from crud import device as crud_device
+from db.base import Base
+from models import models
+from services.rollup import RollupCompactor, acc_average, floor_day
+from services.timeseries import ColumnarStore, RelationalStore
+
+
+def generate(device_ids, days: int, interval: int, now: datetime, batch: int):
+    """Sinh các lô bản ghi theo thời gian tăng dần (như Writer nhận từ MQTT)"""
+    rng = random.Random(1)
+    rows = []
+    ts = now - timedelta(days=days)
+    while ts < now:
+        for device_id in device_ids:
+            rows.append({"device_id": device_id, "timestamp": ts + timedelta(milliseconds=rng.randrange(1000)),
+                         "temp": round(20 + rng.random() * 10, 2), "hum_air": round(60 + rng.random() * 20, 2),
+                         "hum_soil": round(40 + rng.random() * 20, 2), "light": None})
+            if len(rows) >= batch:
+                yield rows
+                rows = []
+        ts += timedelta(seconds=interval)
+    if rows:
+        yield rows
+
+
+def disk_usage(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def timed(fn, repeat: int = 1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def run(name, store, Session, device_ids, args, now, results):
+    db = Session()
+    total = 0
+    started = time.perf_counter()
+    for rows in generate(device_ids, args.days, args.interval, now, args.batch):
+        total += store.append(db, rows)
+        crud_device.upsert_latest_readings(db, rows)  # Writer cập nhật với cả 2 backend
+        db.commit()
+    append_time = time.perf_counter() - started
+
+    rng = random.Random(2)
+    picks = [rng.choice(device_ids) for _ in range(args.queries)]
+    days = [now - timedelta(days=rng.randrange(1, args.days)) for _ in range(args.queries)]
+    history, history_time = timed(lambda: [store.query_range(db, d, limit=50) for d in picks])
+    ranges, range_time = timed(lambda: [store.query_range(db, d, day, day + timedelta(days=1)) for d, day in zip(picks, days)])
+    latest, latest_time = timed(lambda: store.latest(db, device_ids), repeat=3)
+    start = floor_day(now) - timedelta(days=args.days - 1)
+    chart, chart_time = timed(lambda: store.aggregate(db, start, now, "1d"))
+    db.close()
+
+    results[name] = {
+        "append": total / append_time,
+        "history": history_time / args.queries,
+        "range": range_time / args.queries,
+        "latest": latest_time,
+        "aggregate": chart_time,
+        "chart": {day: acc_average(acc, "temp") for day, acc in chart.items()},
+        "history_ts": [[p.timestamp for p in points] for points in history],
+        "range_rows": sum(len(points) for points in ranges),
+        "latest_n": len(latest),
+    }
+    print(f"   {name:<12} ghi {total:,} bản ghi trong {append_time:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các backend TimeSeriesStore")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--interval", type=int, default=300, help="Giây giữa 2 bản ghi của 1 thiết bị")
+    parser.add_argument("--batch", type=int, default=500, help="Số bản ghi / lô ghi")
+    parser.add_argument("--queries", type=int, default=100, help="Số truy vấn history / range")
+    args = parser.parse_args()
+
+    now = datetime.now().replace(microsecond=0)
+    device_ids = [f"ESP32:{i:08X}" for i in range(args.devices)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        db.add_all([models.Device(device_id=d, name=d) for d in device_ids])
+        db.commit()
+        db.close()
+
+        print(f"📦 {args.devices} thiết bị x {args.days} ngày, 1 bản ghi / {args.interval}s, lô {args.batch}")
+        columnar_dir = os.path.join(tmp, "columnar")
+        run("relational", RelationalStore(), Session, device_ids, args, now, results)
+        run("columnar", ColumnarStore(directory=columnar_dir), Session, device_ids, args, now, results)
+
+        # Relational sau khi gộp bảng rollup (API chạy nền mỗi ROLLUP_INTERVAL_SECONDS)
+        started = time.perf_counter()
+        RollupCompactor(session_factory=Session, lag_seconds=0).compact_once(now=now)
+        compact_time = time.perf_counter() - started
+        db = Session()
+        start = floor_day(now) - timedelta(days=args.days - 1)
+        _, rollup_chart_time = timed(lambda: RelationalStore().aggregate(db, start, now, "1d"))
+        db.close()
+        sizes = {"relational": disk_usage(db_path), "columnar": disk_usage(columnar_dir)}
+        engine.dispose()
+
+    rel, col = results["relational"], results["columnar"]
+    assert rel["history_ts"] == col["history_ts"], "history 2 backend khác nhau"
+    assert rel["range_rows"] == col["range_rows"] and rel["latest_n"] == col["latest_n"] == args.devices
+    assert rel["chart"].keys() == col["chart"].keys() and all(abs(rel["chart"][d] - col["chart"][d]) <= 0.1 for d in rel["chart"])
+
+    print(f"\n   {'':<24}{'relational':>14}{'columnar':>14}")
+    print(f"   {'append (bản ghi/s)':<24}{rel['append']:>14,.0f}{col['append']:>14,.0f}")
+    for key, label in (("history", "history 50 (ms)"), ("range", "range 1 ngày (ms)"), ("latest", "latest tất cả (ms)"),
+                       ("aggregate", "biểu đồ ngày (ms)")):
+        print(f"   {label:<24}{rel[key] * 1e3:>14.2f}{col[key] * 1e3:>14.2f}")
+    print(f"   {'  + bảng rollup (ms)':<24}{rollup_chart_time * 1e3:>14.2f}{'-':>14}   (gộp mất {compact_time:.1f}s)")
+    print(f"   {'dung lượng (MB)':<24}{sizes['relational'] / 2 ** 20:>14.1f}{sizes['columnar'] / 2 ** 20:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
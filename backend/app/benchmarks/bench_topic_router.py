@@ -0,0 +1,105 @@
+"""
+Benchmark định tuyến topic: thử lần lượt từng mẫu (regex) vs cây services/topic_router.py
+
+    cd backend/app
+    python -m benchmarks.bench_topic_router --farms 200 --devices 20000 --count 200000
+
+Mỗi nông trại có 3 mẫu riêng (farm/<id>/zone/{zone}/{device_id}/data, .../bin/{device_id}, farm/<id>/#)
+-> farms x 3 mẫu. Topic gửi tới lấy ngẫu nhiên trong --devices thiết bị.
+"""
+import argparse
+import random
+import re
+import time
+
+from services.topic_router import TopicRouter
+
+
+def make_patterns(farms: int):
+    patterns = []
+    for farm in range(farms):
+        patterns.append(f"farm/f{farm}/zone/{{zone}}/{{device_id}}/data")
+        patterns.append(f"farm/f{farm}/bin/{{device_id}}")
+        patterns.append(f"farm/f{farm}/#")
+    return patterns
+
+
+def make_topics(farms: int, devices: int, count: int, seed: int = 1):
+    rng = random.Random(seed)
+    device_topics = []
+    for i in range(devices):
+        farm = i % farms
+        if i % 4 == 0:
+            device_topics.append(f"farm/f{farm}/bin/ESP32:{i:08X}")
+        else:
+            device_topics.append(f"farm/f{farm}/zone/z{i % 7}/ESP32:{i:08X}/data")
+    return [rng.choice(device_topics) for _ in range(count)]
+
+
+def to_regex(pattern: str):
+    parts = []
+    for part in pattern.split("/"):
+        if part == "#":
+            parts.append("(?P<rest>.*)")
+        elif part.startswith("{"):
+            parts.append(f"(?P<{part[1:-1]}>[^/]+)")
+        else:
+            parts.append(re.escape(part))
+    return re.compile("/".join(parts) + "$")
+
+
+def run(name: str, func, topics) -> float:
+    started = time.perf_counter()
+    for topic in topics:
+        func(topic)
+    elapsed = time.perf_counter() - started
+    rate = len(topics) / elapsed
+    print(f"   {name:<26} {rate:>12,.0f} topic/s  ({elapsed * 1e6 / len(topics):.2f} µs/topic)")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark định tuyến topic")
+    parser.add_argument("--farms", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--count", type=int, default=200000)
+    args = parser.parse_args()
+
+    patterns = make_patterns(args.farms)
+    topics = make_topics(args.farms, args.devices, args.count)
+
+    regexes = [(to_regex(p), p) for p in patterns]
+
+    def probe(topic):
+        for regex, pattern in regexes:
+            m = regex.match(topic)
+            if m:
+                return pattern, m.groupdict()
+        return None, {}
+
+    router = TopicRouter()
+    for pattern in patterns:
+        router.add_route(pattern, pattern)
+    uncached = TopicRouter(cache_size=0)
+    for pattern in patterns:
+        uncached.add_route(pattern, pattern)
+
+    def trie_cold(topic):
+        uncached._cache.clear()
+        return uncached.match(topic)
+
+    # Kết quả phải giống nhau
+    for topic in topics[:2000]:
+        pattern, params = probe(topic)
+        route, route_params = router.match(topic)
+        assert route.pattern == pattern and route_params == params, topic
+
+    print(f"📦 {len(patterns)} mẫu topic ({args.farms} nông trại), {args.devices:,} thiết bị, {len(topics):,} gói")
+    old = run("thử lần lượt (regex)", probe, topics)
+    cold = run("cây (không nhớ kết quả)", trie_cold, topics)
+    hot = run("cây + nhớ theo topic", router.match, topics)
+    print(f"   ⚡ Cây nhanh hơn {cold / old:.1f} lần, có nhớ theo topic: {hot / old:.1f} lần")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,19 @@ class Settings:
     # Nếu .env không có hoặc lỗi, fallback về SQLite để hệ thống luôn chạy được.
     # LƯU Ý: Nếu bạn chưa cài MySQL, hãy xóa dòng DATABASE_URL trong file .env
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./smart_farm.db")
+    # AsyncSession (vòng lặp nền, API đọc nhiều): để trống = DATABASE_URL đổi sang aiosqlite / asyncpg / aiomysql
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", "")
+    # Read replica cho API chỉ đọc (lịch sử, biểu đồ, nhật ký, danh sách thiết bị), cách nhau dấu phẩy. Trống = đọc ở primary
+    DATABASE_REPLICA_URLS: list = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+    REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))  # Trễ hơn thì đọc ở replica khác / primary
+    REPLICA_CHECK_SECONDS: float = float(os.getenv("REPLICA_CHECK_SECONDS", 5))      # Chu kỳ đo lại độ trễ
+    # SQLite: legacy (mặc định) = 1 engine như cũ (chỉ check_same_thread=False)
+    #         production = WAL + 1 kết nối ghi duy nhất (các luồng xếp hàng) + pool kết nối chỉ đọc (bật tay)
+    SQLITE_PROFILE: str = os.getenv("SQLITE_PROFILE", "legacy")
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # Byte, 0 = tắt mmap
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))  # Chờ khóa của tiến trình khác (ingest_worker)
+    SQLITE_READ_POOL_SIZE: int = int(os.getenv("SQLITE_READ_POOL_SIZE", 8))
+    SQLITE_WRITE_WAIT_SECONDS: float = float(os.getenv("SQLITE_WRITE_WAIT_SECONDS", 30))  # Chờ tới lượt kết nối ghi
 
     # --- BẢO MẬT (SECURITY) ---
     SECRET_KEY: str = os.getenv("SECRET_KEY", "Mat_Ma_Mac_Dinh_Neu_Khong_Co_Env")
@@ -32,9 +45,22 @@ class Settings:
     MQTT_PORT: int = int(os.getenv("MQTT_PORT", 1883)) # Ép kiểu sang int
     MQTT_USER: str = os.getenv("MQTT_USER", "")
     MQTT_PASS: str = os.getenv("MQTT_PASS", "")
+    # Chế độ chạy MQTT: "asyncio" (chạy trên event loop của FastAPI) hoặc "thread" (luồng riêng của paho, dự phòng)
+    MQTT_TRANSPORT: str = os.getenv("MQTT_TRANSPORT", "asyncio")
+    MQTT_RECONNECT_MIN_SECONDS: float = float(os.getenv("MQTT_RECONNECT_MIN_SECONDS", 1))
+    MQTT_RECONNECT_MAX_SECONDS: float = float(os.getenv("MQTT_RECONNECT_MAX_SECONDS", 60))
+    # asyncio: mỗi lần socket có dữ liệu đọc liền tối đa N gói rồi giao cả loạt (giải mã AES theo lô)
+    MQTT_READ_BATCH: int = int(os.getenv("MQTT_READ_BATCH", 256))
 
     # --- MQTT TOPICS ---
     MQTT_TOPIC_SENSOR: str = os.getenv("MQTT_TOPIC_SENSOR", "k19/doan_tot_nghiep/project_xalach/sensor")
+    # Gói nhị phân (N x struct_message 24 byte), gateway gửi lên <MQTT_TOPIC_SENSOR_BIN>/<device_id>
+    MQTT_TOPIC_SENSOR_BIN: str = os.getenv("MQTT_TOPIC_SENSOR_BIN", MQTT_TOPIC_SENSOR + "/bin")
+    # Nhiều nông trại trên 1 backend: các mẫu topic có wildcard, cách nhau dấu phẩy (cú pháp: services/topic_router.py)
+    # VD: MQTT_FARM_TOPICS="farm/{farm}/zone/{zone}/{device_id}/data,farm/{farm}/data"
+    # Mẫu có {device_id} thì gói tin không cần gửi kèm device_id. Mẫu gói nhị phân BẮT BUỘC có {device_id}.
+    MQTT_FARM_TOPICS: list = [t.strip() for t in os.getenv("MQTT_FARM_TOPICS", "").split(",") if t.strip()]
+    MQTT_FARM_BIN_TOPICS: list = [t.strip() for t in os.getenv("MQTT_FARM_BIN_TOPICS", "").split(",") if t.strip()]
     
     # [QUAN TRỌNG] 
     # Trong code API (Python) và Firmware (C++) chúng ta dùng khái niệm "CONTROL" (Điều khiển chung)
@@ -42,6 +68,85 @@ class Settings:
     # Dòng dưới đây sẽ lấy giá trị PUMP trong .env gán cho biến CONTROL.
     MQTT_TOPIC_CONTROL: str = os.getenv("MQTT_TOPIC_PUMP", "k19/doan_tot_nghiep/project_xalach/control")
 
+    # --- INGEST (GHI DỮ LIỆU CẢM BIẾN THEO LÔ) ---
+    # on_message chỉ giải mã rồi đẩy vào hàng đợi, luồng Writer gom lô để ghi 1 lần
+    INGEST_QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", 10000))  # Sức chứa tối đa của hàng đợi
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", 500))    # Đủ N bản ghi thì ghi ngay
+    INGEST_FLUSH_MS: int = int(os.getenv("INGEST_FLUSH_MS", 500))        # Hoặc quá T mili-giây thì ghi
+    # Khi hàng đợi đầy (DB chậm / burst): block | drop_oldest | sample (xem services/ingest_queue.py)
+    # "block" chặn luồng nhận MQTT -> chỉ nên dùng với ingest_worker.py hoặc MQTT_TRANSPORT=thread
+    INGEST_OVERLOAD_POLICY: str = os.getenv("INGEST_OVERLOAD_POLICY", "drop_oldest")
+    INGEST_BLOCK_TIMEOUT_MS: int = int(os.getenv("INGEST_BLOCK_TIMEOUT_MS", 200))  # block: chờ tối đa rồi bỏ bản cũ
+    INGEST_SAMPLE_SECONDS: float = float(os.getenv("INGEST_SAMPLE_SECONDS", 5))     # sample: 1 bản ghi / thiết bị / N giây
+    INGEST_SAMPLE_WATERMARK: float = float(os.getenv("INGEST_SAMPLE_WATERMARK", 0.5))  # sample: bắt đầu lấy mẫu khi đầy 50%
+    # Tắt (false) khi chạy các tiến trình ingest_worker.py riêng: API không tự subscribe topic cảm biến nữa
+    INGEST_IN_API: bool = os.getenv("INGEST_IN_API", "true").lower() == "true"
+    # Nhóm Shared Subscription (MQTT v5) dùng chung cho các Ingest Worker
+    INGEST_SHARE_GROUP: str = os.getenv("INGEST_SHARE_GROUP", "smartfarm_ingest")
+    # Nhịp tim (last_seen) gom trong bộ nhớ, ghi 1 lần mỗi chu kỳ (phải nhỏ hơn nhiều so với 5 phút của Watchdog)
+    HEARTBEAT_FLUSH_SECONDS: float = float(os.getenv("HEARTBEAT_FLUSH_SECONDS", 15))
+    # Device Registry của mỗi tiến trình nạp lại trạng thái thiết bị từ DB mỗi N giây (Watchdog / API của tiến trình khác
+    # đổi status, trạng thái bơm/đèn...). 0 = chỉ nạp lúc khởi động
+    DEVICE_REGISTRY_REFRESH_SECONDS: float = float(os.getenv("DEVICE_REGISTRY_REFRESH_SECONDS", 30))
+    # Bảng khóa AES riêng (device_keys) của mỗi tiến trình nạp lại mỗi N giây: khóa đổi qua API của tiến trình khác
+    # có hiệu lực ở mọi Ingest Worker sau tối đa N giây. 0 = chỉ nạp lúc khởi động / khi chính tiến trình đổi khóa
+    DEVICE_KEY_REFRESH_SECONDS: float = float(os.getenv("DEVICE_KEY_REFRESH_SECONDS", 30))
+    # Chặn gói tin gửi lại (trùng "seq" / "ts" của thiết bị) trước khi vào hàng đợi. INGEST_DEDUP_WINDOW=0 để tắt
+    INGEST_DEDUP_WINDOW: int = int(os.getenv("INGEST_DEDUP_WINDOW", 64))          # Số khóa gần nhất nhớ cho mỗi thiết bị
+    INGEST_DEDUP_SECONDS: float = float(os.getenv("INGEST_DEDUP_SECONDS", 300))   # Mỗi khóa nhớ tối đa N giây
+    INGEST_DEDUP_MAX_DEVICES: int = int(os.getenv("INGEST_DEDUP_MAX_DEVICES", 100000))
+    # DB lỗi tạm thời (mất kết nối, bị khóa...) khi ghi lô: thử lại cùng lô, chờ tăng dần từ BACKOFF tới MAX mili-giây,
+    # tới khi ghi được. Lúc tắt Writer chỉ thử thêm tối đa INGEST_RETRY_ON_STOP lần
+    INGEST_RETRY_BACKOFF_MS: int = int(os.getenv("INGEST_RETRY_BACKOFF_MS", 200))
+    INGEST_RETRY_MAX_MS: int = int(os.getenv("INGEST_RETRY_MAX_MS", 10000))
+    INGEST_RETRY_ON_STOP: int = int(os.getenv("INGEST_RETRY_ON_STOP", 3))
+
+    # --- GIÁM SÁT (GET /metrics) ---
+    # Thời gian từng công đoạn của on_message chỉ đo 1 trên N gói tin (đo mọi gói sẽ tốn CPU ngang việc giải mã)
+    METRICS_STAGE_SAMPLE_EVERY: int = int(os.getenv("METRICS_STAGE_SAMPLE_EVERY", 8))
+    # Ghi lại gói tin cảm biến thô vào file (.sfcap) để phát lại bằng tools/mqtt_replay.py. Để trống = tắt
+    MQTT_CAPTURE_FILE: str = os.getenv("MQTT_CAPTURE_FILE", "")
+
+    # --- BẢNG GỘP SỐ LIỆU (sensor_rollup_1m / 1h / 1d) ---
+    ROLLUP_INTERVAL_SECONDS: float = float(os.getenv("ROLLUP_INTERVAL_SECONDS", 60))  # 0 = API không tự gộp
+    # Chỉ gộp các phút đã qua N giây (chờ Writer ghi nốt các lô đang trong hàng đợi)
+    ROLLUP_LAG_SECONDS: float = float(os.getenv("ROLLUP_LAG_SECONDS", 120))
+
+    # --- CHIA sensor_data THEO THÁNG (db/partitions.py) ---
+    # PostgreSQL: bảng partition khai báo; SQLite: mỗi tháng 1 file ATTACH. MySQL chưa hỗ trợ (bỏ qua)
+    SENSOR_PARTITIONING: bool = os.getenv("SENSOR_PARTITIONING", "false").lower() == "true"
+    SENSOR_PARTITION_AHEAD_MONTHS: int = int(os.getenv("SENSOR_PARTITION_AHEAD_MONTHS", 2))  # Tạo trước N tháng tới
+    SENSOR_PARTITION_CHECK_SECONDS: float = float(os.getenv("SENSOR_PARTITION_CHECK_SECONDS", 3600))
+    SENSOR_PARTITION_DIR: str = os.getenv("SENSOR_PARTITION_DIR", "")  # SQLite: để trống = <tên DB>_parts/
+    # Giữ N tháng trước tháng hiện tại (0 = giữ mãi). Hết hạn: drop = xóa hẳn, archive = tách ra giữ riêng
+    # SQLite chia partition: bắt buộc N > 0 và N + SENSOR_PARTITION_AHEAD_MONTHS <= 7 (giới hạn ATTACH của SQLite)
+    SENSOR_RETENTION_MONTHS: int = int(os.getenv("SENSOR_RETENTION_MONTHS", 0))
+    SENSOR_RETENTION_ACTION: str = os.getenv("SENSOR_RETENTION_ACTION", "drop")
+    SENSOR_ARCHIVE_DIR: str = os.getenv("SENSOR_ARCHIVE_DIR", "")  # SQLite archive: để trống = <thư mục partition>/archive
+
+    # --- TÌM KIẾM NHẬT KÝ (db/log_search.py) ---
+    # SQLite: FTS5, PostgreSQL: tsvector + GIN. false / DB khác = ILIKE quét cả bảng như cũ
+    LOG_FULLTEXT_SEARCH: bool = os.getenv("LOG_FULLTEXT_SEARCH", "true").lower() == "true"
+    LOG_SEARCH_RANK_WINDOW: int = int(os.getenv("LOG_SEARCH_RANK_WINDOW", 2000))  # sort=rank: chấm điểm N kết quả khớp mới nhất
+
+    # --- KHO KHỐI NÉN (services/sensor_blocks.py) ---
+    # Giờ đã đóng cũ hơn N giờ được nén kiểu Gorilla thành 1 khối / thiết bị / giờ ở bảng sensor_blocks (0 = tắt)
+    SENSOR_BLOCKS_AFTER_HOURS: int = int(os.getenv("SENSOR_BLOCKS_AFTER_HOURS", 0))
+    SENSOR_BLOCKS_INTERVAL_SECONDS: float = float(os.getenv("SENSOR_BLOCKS_INTERVAL_SECONDS", 600))
+
+    # --- KHO LẠNH (services/cold_archive.py) ---
+    # sensor_data cũ hơn N ngày được chuyển ra file cột nén theo thiết bị / ngày (0 = tắt)
+    COLD_ARCHIVE_AFTER_DAYS: int = int(os.getenv("COLD_ARCHIVE_AFTER_DAYS", 0))
+    COLD_ARCHIVE_DIR: str = os.getenv("COLD_ARCHIVE_DIR", "./sensor_archive")
+    COLD_ARCHIVE_INTERVAL_SECONDS: float = float(os.getenv("COLD_ARCHIVE_INTERVAL_SECONDS", 3600))
+
+    # --- KHO CHUỖI THỜI GIAN (services/timeseries.py) ---
+    # relational = bảng sensor_data; columnar = file cột nhúng (numpy) trong TIMESERIES_DIR, không cần bảng gộp
+    TIMESERIES_BACKEND: str = os.getenv("TIMESERIES_BACKEND", "relational")
+    TIMESERIES_DIR: str = os.getenv("TIMESERIES_DIR", "./timeseries_data")
+    TIMESERIES_CHUNK_ROWS: int = int(os.getenv("TIMESERIES_CHUNK_ROWS", 4096))  # Số bản ghi / khúc cột của 1 thiết bị
+    TIMESERIES_FSYNC: bool = os.getenv("TIMESERIES_FSYNC", "false").lower() == "true"  # fsync mỗi lần ghi (bền hơn, chậm hơn)
+
 settings = Settings()
 # import os
 # from dotenv import load_dotenv
@@ -0,0 +1,203 @@
+# core/metrics.py
+"""
+Bộ đếm / Histogram tối giản xuất ra định dạng văn bản của Prometheus (route GET /metrics).
+Tự viết thay vì dùng prometheus_client: chỉ cần vài loại số liệu, observe() phải thật rẻ
+vì nằm trên đường nóng on_message (mỗi gói tin gọi nhiều lần).
+"""
+import bisect
+import itertools
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from core.config import settings
+
+# Mốc mặc định (giây): từ vài micro-giây (giải mã) tới vài giây (DB nghẽn)
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Bộ đếm chỉ tăng, có nhãn: counter.inc("saved") / counter.inc("saved", 10)"""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in sorted(items):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram có nhãn. Mỗi bộ nhãn giữ 1 mảng đếm theo mốc (không cộng dồn),
+    chỉ cộng dồn lúc render -> observe() chỉ là bisect + 2 phép cộng.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # nhãn -> [counts..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def _get_series(self, label_values: Tuple[str, ...]) -> list:
+        series = self._series.get(label_values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+        return series
+
+    def observe(self, seconds: float, *label_values: str):
+        series = self._get_series(label_values)
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def labels(self, *label_values: str) -> "HistogramChild":
+        """Gắn sẵn nhãn để observe() trên đường nóng không phải tra dict mỗi lần"""
+        return HistogramChild(self.buckets, self._get_series(label_values))
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for label_values, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class HistogramChild:
+    __slots__ = ("_buckets", "_series")
+
+    def __init__(self, buckets: Tuple[float, ...], series: list):
+        self._buckets = buckets
+        self._series = series
+
+    def observe(self, seconds: float):
+        series = self._series
+        series[bisect.bisect_left(self._buckets, seconds)] += 1
+        series[-1] += seconds
+
+
+class Sampler:
+    """Trả về True 1 lần mỗi `every` lần gọi (đo thời gian theo mẫu trên đường nóng)"""
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self._ticks = itertools.count()
+
+    def __call__(self) -> bool:
+        return next(self._ticks) % self.every == 0
+
+
+class Gauge:
+    """Giá trị tức thời, đọc lúc render từ 1 hàm: [(nhãn..., giá trị), ...]"""
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], Iterable[tuple]], labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for *label_values, value in self._collect():
+            lines.append(f"{self.name}{_format_labels(self.label_names, tuple(label_values))} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Iterable[tuple]], labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, collect, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Registry dùng chung cho toàn bộ tiến trình
+metrics = MetricsRegistry()
+
+# --- SỐ LIỆU INGEST (đường on_message -> Writer -> DB) ---
+INGEST_STAGE_SECONDS = metrics.histogram(
+    "smartfarm_ingest_stage_seconds",
+    "Thời gian xử lý từng công đoạn Ingest (decode, decrypt, validate, device_lookup, db_write, total)",
+    labels=("stage",),
+)
+# Các công đoạn tính theo từng gói tin chỉ đo 1/N gói (METRICS_STAGE_SAMPLE_EVERY), db_write đo mọi lô.
+# Số gói tin chính xác xem ở smartfarm_ingest_messages_total.
+STAGE_DECODE = INGEST_STAGE_SECONDS.labels("decode")
+STAGE_DECRYPT = INGEST_STAGE_SECONDS.labels("decrypt")
+STAGE_VALIDATE = INGEST_STAGE_SECONDS.labels("validate")
+STAGE_DEVICE_LOOKUP = INGEST_STAGE_SECONDS.labels("device_lookup")
+STAGE_DB_WRITE = INGEST_STAGE_SECONDS.labels("db_write")
+STAGE_TOTAL = INGEST_STAGE_SECONDS.labels("total")
+stage_sampler = Sampler(settings.METRICS_STAGE_SAMPLE_EVERY)
+INGEST_MESSAGES = metrics.counter(
+    "smartfarm_ingest_messages_total",
+    "Số bản ghi cảm biến theo kết quả xử lý",
+    labels=("outcome",),
+)
+
+# --- GỬI LỆNH MQTT ---
+MQTT_PUBLISH_SECONDS = metrics.histogram(
+    "smartfarm_mqtt_publish_seconds",
+    "Độ trễ gửi tin MQTT: publish -> Broker xác nhận (QoS 1) / đã ghi xong socket (QoS 0)",
+    labels=("qos",),
+)
@@ -59,11 +59,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 # Dùng hàm này nếu ESP32 gửi dữ liệu dạng mã hóa (Encrypted).
 # Nếu ESP32 gửi JSON thường thì không cần gọi hàm này.
 
-def decrypt_payload(encrypted_base64: str) -> Optional[dict]:
+def decrypt_payload_bytes(encrypted_base64) -> Optional[bytes]:
     """
-    Giải mã dữ liệu AES từ ESP32 gửi lên.
-    Input: Chuỗi Base64 (Ví dụ: "8J+SglRlbXA9MzIuNS4uLg==")
-    Output: Dictionary Python (Ví dụ: {"temp": 32, "hum": 80})
+    Giải mã AES nhưng KHÔNG parse JSON: trả về bytes JSON thô
+    (để bộ giải mã nhanh services/payload_decoder.py tự parse thẳng vào Struct).
     """
     try:
         # 1. Decode Base64 về dạng bytes
@@ -77,17 +76,25 @@ def decrypt_payload(encrypted_base64: str) -> Optional[dict]:
         decrypted_padded = cipher.decrypt(encrypted_bytes)
 
         # 4. Xử lý Padding (ESP32 thường dùng Zero Padding)
-        # Loại bỏ các ký tự null (\x00) ở cuối chuỗi
-        decrypted_bytes = decrypted_padded.rstrip(b'\x00')
+        # Loại bỏ các ký tự null (\x00) ở cuối chuỗi, làm sạch khoảng trắng thừa
+        return decrypted_padded.rstrip(b'\x00').strip()
 
-        # 5. Chuyển thành chuỗi JSON và parse thành Dict
-        json_str = decrypted_bytes.decode('utf-8')
-        
-        # Làm sạch chuỗi JSON (Xóa khoảng trắng thừa, ký tự xuống dòng)
-        json_str = json_str.strip()
-        
-        return json.loads(json_str)
+    except Exception as e:
+        print(f"❌ Lỗi giải mã AES: {e}")
+        return None
 
+def decrypt_payload(encrypted_base64: str) -> Optional[dict]:
+    """
+    Giải mã dữ liệu AES từ ESP32 gửi lên.
+    Input: Chuỗi Base64 (Ví dụ: "8J+SglRlbXA9MzIuNS4uLg==")
+    Output: Dictionary Python (Ví dụ: {"temp": 32, "hum": 80})
+    """
+    decrypted_bytes = decrypt_payload_bytes(encrypted_base64)
+    if decrypted_bytes is None:
+        return None
+    try:
+        # 5. Chuyển thành chuỗi JSON và parse thành Dict
+        return json.loads(decrypted_bytes.decode('utf-8'))
     except Exception as e:
         print(f"❌ Lỗi giải mã AES: {e}")
         return None
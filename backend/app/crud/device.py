@@ -1,9 +1,15 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import and_, case, desc, func, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional
 
+from db.partitions import sensor_partitions
 from models import models
 from schemas import device as schemas
+from services.device_registry import device_registry
+from services.payload_crypto import AES_KEY_SIZES, payload_decryptor
 
 # --- 1. IMPORT LOGGER ---
 from core.logger import get_logger
@@ -21,6 +27,11 @@ def get_devices(db: Session, skip: int = 0, limit: int = 100):
     """Lấy danh sách thiết bị"""
     return db.query(models.Device).offset(skip).limit(limit).all()
 
+async def get_devices_async(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.Device]:
+    """get_devices cho AsyncSession"""
+    result = await db.execute(select(models.Device).offset(skip).limit(limit))
+    return list(result.scalars().all())
+
 def create_device(db: Session, device: schemas.DeviceCreate):
     """Tạo thiết bị mới thủ công (Admin)"""
     logger.info(f"Admin creating new device: {device.device_id} - {device.name}")
@@ -35,6 +46,8 @@ def create_device(db: Session, device: schemas.DeviceCreate):
         db.add(db_device)
         db.commit()
         db.refresh(db_device)
+        # Xóa "thiết bị lạ" trong bộ nhớ đệm để Ingest nhận ngay thiết bị mới
+        device_registry.invalidate(device.device_id)
         logger.info(f"Device created successfully: {device.device_id}")
         return db_device
     except Exception as e:
@@ -42,6 +55,30 @@ def create_device(db: Session, device: schemas.DeviceCreate):
         db.rollback()
         raise e
 
+def set_device_key(db: Session, device_id: str, aes_key: str):
+    """Gán / đổi khóa AES riêng cho 1 thiết bị (16, 24 hoặc 32 ký tự)"""
+    if len(aes_key.encode("utf-8")) not in AES_KEY_SIZES:
+        raise ValueError("AES key must be 16, 24 or 32 bytes long")
+
+    db_key = db.query(models.DeviceKey).filter(models.DeviceKey.device_id == device_id).first()
+    if db_key:
+        db_key.aes_key = aes_key
+    else:
+        db_key = models.DeviceKey(device_id=device_id, aes_key=aes_key)
+        db.add(db_key)
+    db.commit()
+    # Bảng khóa trong bộ nhớ của bộ giải mã phải nạp lại
+    payload_decryptor.invalidate()
+    logger.info(f"AES key updated for device: {device_id}")
+    return db_key
+
+def delete_device_key(db: Session, device_id: str) -> bool:
+    """Xóa khóa riêng -> thiết bị quay về dùng khóa chung settings.AES_KEY"""
+    deleted = db.query(models.DeviceKey).filter(models.DeviceKey.device_id == device_id).delete()
+    db.commit()
+    payload_decryptor.invalidate()
+    return bool(deleted)
+
 def update_device(db: Session, device_id: str, device_in: schemas.DeviceUpdate):
     """
     Cập nhật thiết bị (Có Log debug chi tiết lỗi Silent Failure)
@@ -75,6 +112,7 @@ def update_device(db: Session, device_id: str, device_in: schemas.DeviceUpdate):
         db.add(db_device)
         db.commit()
         db.refresh(db_device)
+        device_registry.invalidate(device_id)
         logger.info(f"✅ Device {device_id} updated successfully.")
         return db_device
     except Exception as e:
@@ -98,6 +136,7 @@ def update_device_status(db: Session, device_id: str):
             last_seen=datetime.now()
         )
         db.add(device)
+        device_registry.invalidate(device_id)
         logger.info(f"Auto-created device {device_id} in DB.")
     else:
         # Cập nhật trạng thái
@@ -127,6 +166,16 @@ def create_sensor_reading(db: Session, data: schemas.SensorDataInput, device_id:
         light=data.light
     )
     db.add(db_sensor)
+    db.flush()
+    db.refresh(db_sensor)  # Lấy timestamp do DB sinh ra
+    upsert_latest_readings(db, [{
+        "device_id": device_id,
+        "timestamp": db_sensor.timestamp,
+        "temp": db_sensor.temp,
+        "hum_air": db_sensor.hum_air,
+        "hum_soil": db_sensor.hum_soil,
+        "light": db_sensor.light,
+    }])
     db.commit()
     db.refresh(db_sensor)
     
@@ -135,18 +184,201 @@ def create_sensor_reading(db: Session, data: schemas.SensorDataInput, device_id:
     
     return db_sensor
 
-def get_sensor_history(db: Session, device_id: str, limit: int = 50):
-    return db.query(models.SensorData)\
-             .filter(models.SensorData.device_id == device_id)\
-             .order_by(desc(models.SensorData.timestamp))\
-             .limit(limit)\
-             .all()
+def create_sensor_readings_bulk(db: Session, rows: List[dict]):
+    """
+    Ghi nhiều bản ghi cảm biến bằng 1 câu INSERT (executemany).
+    Không commit ở đây: Writer tự commit 1 lần cho cả lô.
+    """
+    if not rows:
+        return 0
+    sensor_partitions.insert_sensor_rows(db, rows)
+    return len(rows)
+
+def update_devices_bulk(db: Session, changes: List[dict]):
+    """
+    Cập nhật nhiều thiết bị theo khóa chính (mỗi dict phải có 'device_id').
+    Không commit ở đây: Writer tự commit 1 lần cho cả lô.
+    """
+    if not changes:
+        return 0
+    db.execute(update(models.Device), changes)
+    return len(changes)
+
+def get_sensor_history(db: Session, device_id: str, limit: int = 50, before: Optional[datetime] = None):
+    """
+    N bản ghi mới nhất của thiết bị (trước mốc before nếu có), mới -> cũ, cùng timestamp thì id lớn trước.
+    sensor_data chia theo tháng: đọc lần lượt từ tháng mới nhất về trước, đủ N bản thì dừng
+    (không quét các tháng cũ).
+    """
+    result = []
+    for start, end in sensor_partitions.history_ranges(db):
+        if before is not None:
+            if start is not None and start >= before:
+                continue
+            end = before if end is None else min(end, before)
+        sd = sensor_partitions.sensor_entity(db, start, end)
+        query = db.query(sd).filter(sd.device_id == device_id)
+        if start is not None:
+            query = query.filter(sd.timestamp >= start)
+        if end is not None:
+            query = query.filter(sd.timestamp < end)
+        result += query.order_by(desc(sd.timestamp), desc(sd.id)).limit(limit - len(result)).all()
+        if len(result) >= limit:
+            break
+    return result
+
+# ================= 2b. SỐ LIỆU MỚI NHẤT (device_latest_reading) =================
+
+LATEST_COLUMNS = ("timestamp", "temp", "hum_air", "hum_soil", "light")
+
+def upsert_latest_readings(db: Session, rows: List[dict]):
+    """
+    Ghi số liệu mới nhất của từng thiết bị (mỗi dict: device_id + LATEST_COLUMNS).
+    Chỉ ghi đè khi bản ghi mới có timestamp >= bản đang lưu: nhiều Writer / worker ghi lệch thứ tự
+    vẫn giữ đúng bản mới nhất. Không commit ở đây: Writer tự commit cùng lô với sensor_data.
+    """
+    # Trong 1 lô mỗi thiết bị chỉ giữ bản mới nhất (1 câu lệnh không được đụng 1 khóa 2 lần)
+    newest: Dict[str, dict] = {}
+    for row in rows:
+        current = newest.get(row["device_id"])
+        if current is None or row["timestamp"] >= current["timestamp"]:
+            newest[row["device_id"]] = row
+    if not newest:
+        return 0
+    values = [{"device_id": r["device_id"], **{c: r.get(c) for c in LATEST_COLUMNS}} for r in newest.values()]
+
+    table = models.DeviceLatestReading.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.device_id],
+            set_={c: stmt.excluded[c] for c in LATEST_COLUMNS},
+            where=table.c.timestamp.is_(None) | (table.c.timestamp <= stmt.excluded.timestamp),
+        )
+        db.execute(stmt, values)
+    elif dialect == "mysql":
+        # MySQL gán lần lượt từ trái qua phải -> timestamp phải gán CUỐI để các cột khác so với giá trị cũ
+        stmt = mysql.insert(table)
+        newer = table.c.timestamp.is_(None) | (table.c.timestamp <= stmt.inserted.timestamp)
+        stmt = stmt.on_duplicate_key_update([
+            (c, case((newer, stmt.inserted[c]), else_=table.c[c]))
+            for c in LATEST_COLUMNS[1:] + LATEST_COLUMNS[:1]
+        ])
+        db.execute(stmt, values)
+    else:
+        existing = dict(db.execute(
+            select(table.c.device_id, table.c.timestamp).where(table.c.device_id.in_(list(newest)))
+        ).all())
+        fresh = [v for v in values if v["device_id"] not in existing]
+        newer_rows = [
+            v for v in values
+            if v["device_id"] in existing and (existing[v["device_id"]] is None or existing[v["device_id"]] <= v["timestamp"])
+        ]
+        if fresh:
+            db.execute(insert(table), fresh)
+        if newer_rows:
+            db.execute(update(models.DeviceLatestReading), newer_rows)
+    return len(values)
 
 def get_latest_sensor_reading(db: Session, device_id: str):
-    return db.query(models.SensorData)\
-             .filter(models.SensorData.device_id == device_id)\
-             .order_by(desc(models.SensorData.timestamp))\
-             .first()
+    """Số liệu mới nhất của 1 thiết bị (tra khóa chính, không quét sensor_data)"""
+    return db.get(models.DeviceLatestReading, device_id)
+
+def get_latest_readings(db: Session, device_ids: Iterable[str]) -> Dict[str, models.DeviceLatestReading]:
+    """Số liệu mới nhất của nhiều thiết bị trong 1 câu truy vấn: {device_id: DeviceLatestReading}"""
+    device_ids = list(device_ids)
+    if not device_ids:
+        return {}
+    rows = db.query(models.DeviceLatestReading)\
+             .filter(models.DeviceLatestReading.device_id.in_(device_ids))\
+             .all()
+    return {row.device_id: row for row in rows}
+
+async def get_latest_sensor_reading_async(db: AsyncSession, device_id: str) -> Optional[models.DeviceLatestReading]:
+    """get_latest_sensor_reading cho AsyncSession"""
+    return await db.get(models.DeviceLatestReading, device_id)
+
+async def get_latest_readings_async(db: AsyncSession, device_ids: Iterable[str]) -> Dict[str, models.DeviceLatestReading]:
+    """get_latest_readings cho AsyncSession"""
+    device_ids = list(device_ids)
+    if not device_ids:
+        return {}
+    result = await db.execute(
+        select(models.DeviceLatestReading).where(models.DeviceLatestReading.device_id.in_(device_ids))
+    )
+    return {row.device_id: row for row in result.scalars()}
+
+def newest_sensor_rows(sd, device_ids: Optional[List[str]] = None):
+    """SELECT bản ghi sensor_data (sd: sensor_partitions.sensor_entity) mới nhất của từng thiết bị (cùng timestamp -> id lớn nhất)"""
+    newest = select(sd.device_id, func.max(sd.timestamp).label("ts")).group_by(sd.device_id)
+    if device_ids is not None:
+        newest = newest.where(sd.device_id.in_(device_ids))
+    newest = newest.subquery()
+    picked = select(func.max(sd.id))\
+        .join(newest, and_(sd.device_id == newest.c.device_id, sd.timestamp == newest.c.ts))\
+        .group_by(sd.device_id)
+    return select(sd.id, sd.device_id, *(getattr(sd, c) for c in LATEST_COLUMNS)).where(sd.id.in_(picked))
+
+def _scan_latest(db: Session, device_ids: List[str]) -> dict:
+    """
+    Bản ghi mới nhất của từng thiết bị đọc từ kho chuỗi thời gian đang dùng (TIMESERIES_BACKEND),
+    không qua chính bảng device_latest_reading (services/timeseries.py import module này nên import muộn)
+    """
+    from services.timeseries import timeseries_store
+    return timeseries_store.scan_latest(db, device_ids)
+
+def _millis(ts: Optional[datetime]) -> Optional[datetime]:
+    """So timestamp ở độ chính xác mili-giây, giờ địa phương không múi (kho lạnh giữ tới ms, Postgres trả về có múi)"""
+    if ts is None:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+
+def rebuild_latest_readings(db: Session, device_ids: Optional[List[str]] = None, chunk_size: int = 1000) -> int:
+    """
+    Dựng lại device_latest_reading từ kho chuỗi thời gian (backfill / repair).
+    device_ids = None -> toàn bộ thiết bị. Chạy từng nhóm chunk_size thiết bị, mỗi nhóm 1 lần COMMIT;
+    ghi bằng upsert_latest_readings nên Writer đang chạy song song ghi bản mới hơn cũng không bị đè.
+    Trả về số thiết bị có số liệu.
+    """
+    if device_ids is None:
+        device_ids = [row[0] for row in db.query(models.Device.device_id).order_by(models.Device.device_id).all()]
+    written = 0
+    for start in range(0, len(device_ids), chunk_size):
+        chunk = device_ids[start:start + chunk_size]
+        rows = [
+            {"device_id": device_id, **{c: getattr(point, c) for c in LATEST_COLUMNS}}
+            for device_id, point in _scan_latest(db, chunk).items()
+        ]
+        # Xóa trước để sửa cả trường hợp bảng đang giữ bản "mới hơn" dữ liệu thật (dữ liệu đã bị xóa)
+        db.query(models.DeviceLatestReading)\
+          .filter(models.DeviceLatestReading.device_id.in_(chunk))\
+          .delete(synchronize_session=False)
+        written += upsert_latest_readings(db, rows)
+        db.commit()
+        logger.info(f"🔁 Latest readings rebuilt: {min(start + chunk_size, len(device_ids))}/{len(device_ids)} devices")
+    return written
+
+def find_stale_latest_readings(db: Session, chunk_size: int = 1000) -> List[str]:
+    """
+    Thiết bị có device_latest_reading lệch với kho chuỗi thời gian (sensor_data + kho khối + kho lạnh, hoặc file cột):
+    thiếu dòng, timestamp khác bản mới nhất, hoặc còn dòng trong khi không còn bản ghi nào.
+    So sánh timestamp sau khi đọc ra datetime (SQLite lưu chuỗi, server_default và ORM khác định dạng).
+    """
+    latest = models.DeviceLatestReading
+    stored = dict(db.execute(select(latest.device_id, latest.timestamp)).all())
+    device_ids = sorted({row[0] for row in db.query(models.Device.device_id).all()} | stored.keys())
+    stale = []
+    for start in range(0, len(device_ids), chunk_size):
+        chunk = device_ids[start:start + chunk_size]
+        newest = _scan_latest(db, chunk)
+        for device_id in chunk:
+            point = newest.get(device_id)
+            if _millis(point.timestamp if point else None) != _millis(stored.get(device_id)):
+                stale.append(device_id)
+    return stale
 
 # ================= 3. NHẬT KÝ HOẠT ĐỘNG (LOGS) =================
 
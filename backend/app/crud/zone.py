@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 from models.models import Zone, User, UserRole
+from services.device_registry import device_registry
 from schemas.zone import ZoneCreate
 from schemas.zone import ZoneUpdate
 
@@ -79,7 +80,10 @@ def delete_zone(db: Session, zone_id: int):
     """Xóa Zone khỏi hệ thống"""
     db_zone = get_zone(db, zone_id)
     if db_zone:
+        device_ids = [d.device_id for d in db_zone.devices]
         db.delete(db_zone)
         db.commit()
+        # Các thiết bị trong Zone đã bị đổi zone_id -> nạp lại từ DB
+        device_registry.invalidate_many(device_ids)
         return True
     return False
\ No newline at end of file
@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from core.config import settings
 from db.base import Base  # Import metadata để tạo bảng
+from db.log_search import log_search
 from db.session import engine
 from models.models import User, UserRole  # Import Model User
 from core.security import get_password_hash
@@ -9,6 +10,12 @@ def init_db(db: Session) -> None:
     # 1. TẠO TOÀN BỘ BẢNG (Nếu chưa có)
     # Dòng này tương đương với câu lệnh "CREATE TABLE IF NOT EXISTS..." trong SQL
     Base.metadata.create_all(bind=engine)
+    # Bảng đã có từ phiên bản trước: create_all không thêm index mới -> tạo bù
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    # Chỉ mục toàn văn cho ô tìm kiếm nhật ký (FTS5 / tsvector)
+    log_search.install(engine)
 
     # 2. TẠO USER ADMIN MẶC ĐỊNH
     # Kiểm tra xem admin đã tồn tại chưa
@@ -29,4 +36,4 @@ def init_db(db: Session) -> None:
         db.refresh(user_in)
         print("Đã tạo Admin thành công!")
     else:
-        print(f"Admin {settings.FIRST_SUPERUSER} đã tồn tại. Bỏ qua.")
\ No newline at end of file
+        print(f"Admin {settings.FIRST_SUPERUSER} đã tồn tại. Bỏ qua.")
@@ -0,0 +1,130 @@
+"""
+Chỉ mục toàn văn cho action_logs (LOG_FULLTEXT_SEARCH=true), dùng cho ô tìm kiếm của /logs.
+
+- SQLite: bảng ảo FTS5 action_logs_fts (external content = action_logs, rowid = log_id),
+  3 trigger INSERT / UPDATE / DELETE giữ đồng bộ. Tách từ unicode61 bỏ dấu -> "kho" khớp "khô".
+- PostgreSQL: cột tsvector action_logs.search_vector (trigger BEFORE INSERT / UPDATE) + index GIN.
+  Không dùng index biểu thức: ép Enum -> text không IMMUTABLE.
+- Khác (MySQL...): không có chỉ mục, endpoint quay về ILIKE như cũ.
+
+Từ khóa được tách thành các từ chữ / số (AND), từ cuối khớp tiền tố vì người dùng đang gõ dở:
+"pump_on esp" khớp "PUMP_ON ... ESP32:...". Các từ trước khớp nguyên từ (tiền tố của từ phổ biến như "esp32"
+phải gộp cả danh sách dòng, nguyên từ thì giao nhau nhảy cóc được).
+Chỉ mục đi từ log_id lớn nhất (mới nhất) và dừng sớm: mỗi trang chỉ đọc skip + limit kết quả khớp.
+Xếp hạng bm25 (SQLite) / ts_rank (PostgreSQL) trong LOG_SEARCH_RANK_WINDOW kết quả khớp mới nhất
+(từ phổ biến khớp hàng trăm nghìn dòng, chấm điểm hết thì mất hàng trăm ms), bằng điểm thì mới nhất lên trước.
+Lọc level: SQLite đưa vào biểu thức MATCH (cột level của FTS5) -> không phải đọc lại action_logs để lọc.
+install() (init_db) tạo chỉ mục và nạp lại dữ liệu cũ một lần khi bảng đã có sẵn từ phiên bản trước.
+"""
+import re
+from typing import Optional
+
+from sqlalchemy import Float, Integer, column, false, func, literal_column, select, text
+
+from core.config import settings
+from core.logger import get_logger
+
+logger = get_logger("Log_Search")
+
+FTS_TABLE = "action_logs_fts"
+TOKEN = re.compile(r"[^\W_]+")  # Khớp cách unicode61 / parser của Postgres tách từ ("PUMP_ON" -> pump, on)
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "reason, device_id, action, level, content='action_logs', content_rowid='log_id', prefix='2 3', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON action_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, reason, device_id, action, level) VALUES (new.log_id, new.reason, new.device_id, new.action, new.level); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON action_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, reason, device_id, action, level) "
+    "VALUES ('delete', old.log_id, old.reason, old.device_id, old.action, old.level); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF reason, device_id, action, level ON action_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, reason, device_id, action, level) "
+    "VALUES ('delete', old.log_id, old.reason, old.device_id, old.action, old.level); "
+    f"INSERT INTO {FTS_TABLE}(rowid, reason, device_id, action, level) VALUES (new.log_id, new.reason, new.device_id, new.action, new.level); END",
+]
+
+PG_VECTOR = "to_tsvector('simple', coalesce({0}.reason, '') || ' ' || coalesce({0}.device_id, '') || ' ' || coalesce({0}.action::text, ''))"
+PG_DDL = [
+    "ALTER TABLE action_logs ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE OR REPLACE FUNCTION action_logs_search_vector() RETURNS trigger AS $$ BEGIN "
+    f"NEW.search_vector := {PG_VECTOR.format('NEW')}; RETURN NEW; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS action_logs_search_vector ON action_logs",
+    "CREATE TRIGGER action_logs_search_vector BEFORE INSERT OR UPDATE OF reason, device_id, action ON action_logs "
+    "FOR EACH ROW EXECUTE FUNCTION action_logs_search_vector()",
+    "CREATE INDEX IF NOT EXISTS ix_action_logs_search_vector ON action_logs USING GIN (search_vector)",
+]
+
+
+class LogSearch:
+    def __init__(self):
+        self.enabled = False
+        self.dialect: Optional[str] = None
+
+    # ---------------- Tạo chỉ mục ----------------
+    def install(self, engine):
+        """Tạo bảng FTS5 / cột tsvector + trigger (gọi sau create_all). Lỗi thì chỉ log, tìm kiếm quay về ILIKE"""
+        self.dialect = engine.dialect.name
+        if not settings.LOG_FULLTEXT_SEARCH or self.dialect not in ("sqlite", "postgresql"):
+            return
+        try:
+            with engine.begin() as conn:
+                if self.dialect == "sqlite":
+                    existed = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :n"), {"n": FTS_TABLE}).first()
+                    for ddl in SQLITE_DDL:
+                        conn.execute(text(ddl))
+                    if not existed:
+                        # Bảng action_logs có từ trước: đánh chỉ mục toàn bộ dữ liệu cũ
+                        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                else:
+                    for ddl in PG_DDL:
+                        conn.execute(text(ddl))
+                    conn.execute(text(f"UPDATE action_logs SET search_vector = {PG_VECTOR.format('action_logs')} "
+                                      "WHERE search_vector IS NULL"))
+            self.enabled = True
+            logger.info(f"🔎 Chỉ mục toàn văn action_logs sẵn sàng ({self.dialect})")
+        except Exception as e:
+            logger.warning(f"⚠️ Không tạo được chỉ mục toàn văn action_logs, tìm kiếm dùng ILIKE: {e}")
+
+    # ---------------- Tìm kiếm ----------------
+    @staticmethod
+    def terms(search: str):
+        return [t.lower() for t in TOKEN.findall(search)]
+
+    def apply(self, query, model, search: str, level=None, ranked: bool = True, depth: int = 100,
+              before_id: Optional[int] = None):
+        """
+        Lọc query (select ActionLog) theo từ khóa (và level) qua chỉ mục toàn văn, chỉ xét các kết quả khớp mới nhất:
+        depth (= skip + limit của trang) khi xếp theo thời gian, thêm LOG_SEARCH_RANK_WINDOW khi xếp theo điểm.
+        before_id (con trỏ phân trang, api/pagination.py): chỉ xét log_id < before_id. log_id tăng theo thời gian ghi
+        (timestamp là server_default) nên khớp với điều kiện (timestamp, log_id) < con trỏ của endpoint.
+        Trả về (query, cột điểm để ORDER BY tăng dần) hoặc None nếu không dùng được chỉ mục (gọi nơi khác dùng ILIKE).
+        Từ khóa không có chữ / số nào -> (query không còn dòng nào, None).
+        """
+        if not self.enabled:
+            return None
+        terms = self.terms(search)
+        if not terms:
+            return query.filter(false()), None
+        window = max(depth, settings.LOG_SEARCH_RANK_WINDOW) if ranked else depth
+        if self.dialect == "sqlite":
+            match = "{reason device_id action} : (" + " ".join(f'"{t}"' for t in terms) + "*)"
+            if level is not None:
+                match += f' AND level : "{level.name.lower()}"'
+            # Trọng số cột level = 0: không ảnh hưởng điểm
+            hits = text(f"SELECT rowid AS log_id, bm25({FTS_TABLE}, 1.0, 1.0, 1.0, 0.0) AS score FROM {FTS_TABLE} "
+                        f"WHERE {FTS_TABLE} MATCH :match AND rowid < :before ORDER BY rowid DESC LIMIT :window")\
+                .bindparams(match=match, window=window, before=before_id if before_id is not None else 2 ** 63 - 1).columns(column("log_id", Integer), column("score", Float)).subquery("fts")
+            return query.join(hits, hits.c.log_id == model.log_id), (hits.c.score if ranked else None)
+        tsquery = func.to_tsquery("simple", " & ".join(terms) + ":*")
+        vector = literal_column(f"{model.__tablename__}.search_vector")
+        hits = select(model.log_id).where(vector.op("@@")(tsquery))
+        if level is not None:
+            hits = hits.where(model.level == level)
+        if before_id is not None:
+            hits = hits.where(model.log_id < before_id)
+        query = query.filter(model.log_id.in_(hits.order_by(model.log_id.desc()).limit(window)))
+        return query, (-func.ts_rank(vector, tsquery) if ranked else None)
+
+# Dùng chung cho toàn bộ tiến trình (init_db gọi install)
+log_search = LogSearch()
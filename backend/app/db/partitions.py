@@ -0,0 +1,469 @@
+"""
+Chia bảng sensor_data theo tháng (SENSOR_PARTITIONING=true).
+
+- PostgreSQL: sensor_data là bảng PARTITION BY RANGE (timestamp), khóa chính (id, timestamp).
+  Mỗi tháng 1 partition sensor_data_YYYYMM, dữ liệu ngoài mọi khoảng rơi vào sensor_data_default.
+  Câu truy vấn có điều kiện timestamp được Postgres tự bỏ qua các partition không liên quan.
+- SQLite: mỗi tháng 1 file <tên DB>_parts/sensor_data_YYYYMM.db, ATTACH vào mọi kết nối với tên sd_YYYYMM.
+  main.sensor_data đóng vai partition mặc định (dữ liệu cũ, ngoài khoảng). Đọc qua sensor_entity(db, từ, tới)
+  (UNION ALL chỉ các tháng giao với khoảng cần đọc), ghi qua insert_sensor_rows() (chia lô theo tháng).
+  id của tháng YYYYMM bắt đầu từ YYYYMM * 10^9 -> không trùng giữa các file.
+  SQLite chỉ ATTACH được tối đa 10 file -> bắt buộc có hạn lưu trữ: SENSOR_RETENTION_MONTHS (> 0)
+  + SENSOR_PARTITION_AHEAD_MONTHS + tháng hiện tại + 1 tháng chuyển giao (file tháng mới đã tạo, tháng cũ nhất chưa gỡ)
+  <= 9, nếu không install() từ chối chạy (tháng không ATTACH được sẽ mất khỏi mọi truy vấn mà không ai biết).
+- MySQL: chưa hỗ trợ, vẫn 1 bảng.
+
+maintain() (lúc khởi động + mỗi SENSOR_PARTITION_CHECK_SECONDS):
+- Tạo trước partition cho tháng hiện tại và SENSOR_PARTITION_AHEAD_MONTHS tháng tới.
+- Hết hạn (SENSOR_RETENTION_MONTHS): DROP / DETACH cả partition (PG), gỡ rồi xóa / chuyển file (SQLite).
+  Không quét DELETE từng dòng; chỉ phần mặc định (và DB không chia partition) mới DELETE theo lô.
+"""
+import glob
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, column, delete, event, func, insert, select, table, text, union_all
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import CreateIndex, CreateTable, PrimaryKeyConstraint
+
+from core.config import settings
+from core.logger import get_logger
+from models import models
+
+logger = get_logger("Sensor_Partitions")
+
+ID_BLOCK = 10 ** 9          # SQLite: id của tháng YYYYMM bắt đầu từ YYYYMM * ID_BLOCK
+SQLITE_MAX_ATTACHED = 9     # Giới hạn mặc định của SQLite là 10, chừa 1 chỗ cho công cụ
+SCAN_SECONDS = 30           # SQLite: quét lại thư mục partition (tiến trình khác tạo file mới) tối đa mỗi N giây
+RETENTION_BATCH = 10000     # DELETE theo lô ở phần mặc định
+PARTITION_FILE = re.compile(r"sensor_data_(\d{6})\.db")
+PG_PARTITION = re.compile(r"sensor_data_(\d{6})")
+
+
+def month_start(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """Cộng tháng cho mốc đầu tháng (ngày 1)"""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def month_key(ts: datetime) -> str:
+    return f"{ts.year:04d}{ts.month:02d}"
+
+
+def key_month(key: str) -> datetime:
+    return datetime(int(key[:4]), int(key[4:]), 1)
+
+
+# ================= POSTGRESQL: DDL CỦA BẢNG PARTITION =================
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _pg_primary_key(constraint, compiler, **kw):
+    """Bảng partition của Postgres: khóa chính bắt buộc chứa cột chia partition (timestamp)"""
+    tbl = constraint.table
+    if tbl is not None and tbl.dialect_options["postgresql"]["partition_by"] \
+            and "timestamp" in tbl.c and "timestamp" not in constraint.columns:
+        columns = list(constraint.columns) + [tbl.c.timestamp]
+        return "PRIMARY KEY (%s)" % ", ".join(compiler.preparer.quote(c.name) for c in columns)
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+@event.listens_for(models.SensorData.__table__, "after_create")
+def _pg_default_partition(target, connection, **kw):
+    if connection.dialect.name == "postgresql" and target.dialect_options["postgresql"]["partition_by"]:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS sensor_data_default PARTITION OF sensor_data DEFAULT"))
+
+
+# ================= SQLITE: BẢNG TRONG TỪNG FILE THÁNG =================
+
+def _partition_table(schema: Optional[str] = None) -> Table:
+    """Bảng sensor_data trong 1 file tháng: cùng cột với models.SensorData, không có khóa ngoại (khác file)"""
+    tbl = Table(
+        "sensor_data", MetaData(),
+        *(Column(c.name, c.type, primary_key=c.primary_key) for c in models.SensorData.__table__.columns),
+        schema=schema,
+        sqlite_autoincrement=True,
+    )
+    Index("ix_sensor_data_timestamp", tbl.c.timestamp)
+    Index("ix_sensor_data_device_ts", tbl.c.device_id, tbl.c.timestamp)  # SQLite: index luôn kèm rowid (= id) -> khớp con trỏ (timestamp, id)
+    return tbl
+
+
+class SensorPartitions:
+    def __init__(self):
+        self.engine = None
+        self._engines = []                   # Các engine cần bỏ pool khi gỡ file hết hạn (engine ghi + engine đọc)
+        self.dialect = None
+        self.enabled = False
+        self.directory: Optional[str] = None
+        self._files: Dict[str, str] = {}      # SQLite: YYYYMM -> đường dẫn file
+        self._generation = 0                 # Tăng mỗi khi danh sách file đổi -> kết nối ATTACH lại
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Table] = {}
+
+    # ---------------- Khởi tạo ----------------
+    def install(self, engine, dispose: bool = True):
+        """
+        Gắn vào engine (db/session.py gọi ngay sau create_engine; engine đầu tiên là engine ghi).
+        dispose=False: không bỏ pool khi gỡ file hết hạn (pool của engine async), kết nối DETACH lúc lấy ra
+        """
+        if dispose:
+            self._engines.append(engine)
+        if self.engine is not None:
+            # Engine đọc cùng DB: chỉ cần ATTACH cùng danh sách file
+            if self.sqlite:
+                event.listen(engine, "checkout", self._on_checkout)
+            return
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.enabled = settings.SENSOR_PARTITIONING and self.dialect in ("postgresql", "sqlite")
+        if settings.SENSOR_PARTITIONING and not self.enabled:
+            logger.warning(f"⚠️ SENSOR_PARTITIONING chưa hỗ trợ {self.dialect}, sensor_data vẫn là 1 bảng")
+        if not self.enabled or self.dialect != "sqlite":
+            return
+
+        database = engine.url.database
+        if not database or database == ":memory:":
+            logger.warning("⚠️ SQLite trong RAM không chia partition được, sensor_data vẫn là 1 bảng")
+            self.enabled = False
+            return
+        months = settings.SENSOR_RETENTION_MONTHS + settings.SENSOR_PARTITION_AHEAD_MONTHS + 2
+        if settings.SENSOR_RETENTION_MONTHS <= 0 or months > SQLITE_MAX_ATTACHED:
+            raise ValueError(
+                f"SENSOR_PARTITIONING trên SQLite cần SENSOR_RETENTION_MONTHS > 0 và SENSOR_RETENTION_MONTHS + "
+                f"SENSOR_PARTITION_AHEAD_MONTHS <= {SQLITE_MAX_ATTACHED - 2} (hiện tại {settings.SENSOR_RETENTION_MONTHS} + "
+                f"{settings.SENSOR_PARTITION_AHEAD_MONTHS}): SQLite chỉ ATTACH được {SQLITE_MAX_ATTACHED} file tháng"
+            )
+        self.directory = settings.SENSOR_PARTITION_DIR or os.path.splitext(os.path.abspath(database))[0] + "_parts"
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+        event.listen(engine, "checkout", self._on_checkout)
+
+    @property
+    def sqlite(self) -> bool:
+        return self.enabled and self.dialect == "sqlite"
+
+    # ---------------- SQLite: ATTACH file tháng vào từng kết nối ----------------
+    def scan(self):
+        found = {}
+        for path in glob.glob(os.path.join(self.directory, "sensor_data_*.db")):
+            match = PARTITION_FILE.fullmatch(os.path.basename(path))
+            if match:
+                found[match.group(1)] = path
+        with self._lock:
+            self._last_scan = time.monotonic()
+            if found != self._files:
+                self._files = found
+                self._generation += 1
+
+    def _attachable(self) -> Dict[str, str]:
+        with self._lock:
+            keys = sorted(self._files)
+            if len(keys) > SQLITE_MAX_ATTACHED:
+                # install() đã chặn cấu hình sai: chỉ còn xảy ra khi vừa giảm SENSOR_RETENTION_MONTHS mà maintain()
+                # chưa chạy (main.py chạy lúc khởi động), hoặc có người chép thêm file vào thư mục partition
+                logger.error(f"❌ Có {len(keys)} file partition, SQLite chỉ ATTACH {SQLITE_MAX_ATTACHED} tháng mới nhất: "
+                             f"dữ liệu các tháng {keys[:-SQLITE_MAX_ATTACHED]} KHÔNG có trong truy vấn")
+                keys = keys[-SQLITE_MAX_ATTACHED:]
+            return {key: self._files[key] for key in keys}
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        if time.monotonic() - self._last_scan > SCAN_SECONDS:
+            self.scan()
+        generation = self._generation
+        if connection_record.info.get("sensor_generation") == generation:
+            return
+        wanted = self._attachable()
+        attached = dict(connection_record.info.get("sensor_partitions", {}))
+        cursor = dbapi_connection.cursor()
+        try:
+            for key in list(attached):
+                if wanted.get(key) != attached[key]:
+                    cursor.execute(f"DETACH DATABASE sd_{key}")
+                    del attached[key]
+            for key, path in wanted.items():
+                if key not in attached:
+                    cursor.execute(f"ATTACH DATABASE ? AS sd_{key}", (path,))
+                    attached[key] = path
+        finally:
+            cursor.close()
+        connection_record.info["sensor_partitions"] = attached
+        connection_record.info["sensor_generation"] = generation
+
+    def partition_table(self, key: str) -> Table:
+        tbl = self._tables.get(key)
+        if tbl is None:
+            tbl = self._tables[key] = _partition_table(f"sd_{key}")
+        return tbl
+
+    def attached(self, db, write: bool = False) -> Dict[str, str]:
+        """Các tháng đã ATTACH trên kết nối của session này ({} nếu không chia partition kiểu SQLite)"""
+        if not self.sqlite:
+            return {}
+        # write=True: hỏi đúng kết nối sẽ chạy câu ghi (RoutingSession chọn engine ghi theo câu lệnh)
+        bind_arguments = {"clause": insert(models.SensorData.__table__)} if write else None
+        return db.connection(bind_arguments=bind_arguments).info.get("sensor_partitions") or {}
+
+    # ---------------- Đọc / ghi ----------------
+    def sensor_entity(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        """
+        Thực thể thay cho models.SensorData khi đọc dữ liệu trong [start, end):
+        SQLite chia partition -> UNION ALL của main.sensor_data và các tháng giao với khoảng đó.
+        Còn lại (PG tự cắt partition, DB không chia) -> chính models.SensorData.
+        """
+        attached = self.attached(db)
+        keys = [
+            key for key in sorted(attached)
+            if (end is None or key_month(key) < end) and (start is None or add_months(key_month(key), 1) > start)
+        ]
+        if not keys:
+            return models.SensorData
+        names = [c.name for c in models.SensorData.__table__.columns]
+        tables = [models.SensorData.__table__] + [self.partition_table(key) for key in keys]
+        union = union_all(*(select(*(t.c[name] for name in names)) for t in tables)).subquery("sensor_data")
+        return aliased(models.SensorData, union, adapt_on_names=True)
+
+    def insert_sensor_rows(self, db, rows: List[dict]):
+        """INSERT nhiều bản ghi; SQLite chia partition thì mỗi tháng 1 câu vào đúng file"""
+        attached = self.attached(db, write=True)
+        if not attached:
+            db.execute(insert(models.SensorData), rows)
+            return
+        groups: Dict[Optional[str], List[dict]] = {}
+        for row in rows:
+            key = month_key(row["timestamp"]) if row.get("timestamp") else None
+            groups.setdefault(key if key in attached else None, []).append(row)
+        for key, group in groups.items():
+            db.execute(insert(self.partition_table(key) if key else models.SensorData.__table__), group)
+
+    def delete_sensor_ids(self, db, ids: List[int], start: datetime, end: datetime) -> int:
+        """DELETE theo id các bản ghi có timestamp trong [start, end) (SQLite chia partition: ở main + các tháng giao khoảng)"""
+        tables = [models.SensorData.__table__] + [
+            self.partition_table(key) for key in sorted(self.attached(db, write=True))
+            if key_month(key) < end and add_months(key_month(key), 1) > start
+        ]
+        deleted = 0
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            for tbl in tables:
+                deleted += db.execute(delete(tbl).where(tbl.c.id.in_(batch))).rowcount
+        return deleted
+
+    def history_ranges(self, db) -> List[Tuple[Optional[datetime], Optional[datetime]]]:
+        """
+        Các khoảng thời gian từ mới tới cũ, mỗi khoảng chỉ chạm 1 tháng (+ phần mặc định):
+        đọc "N bản ghi mới nhất" lần lượt theo thứ tự này, đủ thì dừng.
+        """
+        # Postgres tự đọc partition theo thứ tự (Ordered Append) và dừng khi đủ LIMIT: 1 câu là đủ
+        keys = sorted(self.attached(db))
+        if not keys:
+            return [(None, None)]
+        months = [key_month(key) for key in reversed(keys)]
+        ranges = [(add_months(months[0], 1), None)]
+        ranges += [(month, add_months(month, 1)) for month in months]
+        ranges.append((None, months[-1]))
+        return ranges
+
+    # ---------------- Tạo trước partition ----------------
+    def ensure(self, now: Optional[datetime] = None) -> List[str]:
+        """Tạo partition cho tháng hiện tại và SENSOR_PARTITION_AHEAD_MONTHS tháng tới. Trả về các tháng vừa tạo."""
+        if not self.enabled:
+            return []
+        first = month_start(now or datetime.now())
+        return self.create_months([add_months(first, i) for i in range(settings.SENSOR_PARTITION_AHEAD_MONTHS + 1)])
+
+    def create_months(self, months: List[datetime]) -> List[str]:
+        created = []
+        if self.dialect == "postgresql":
+            with self.engine.connect() as conn:
+                if not self.pg_is_partitioned(conn):
+                    logger.warning("⚠️ sensor_data trên Postgres chưa phải bảng partition: chạy python -m tools.partitions migrate")
+                    return []
+                existing = set(self._pg_months(conn))
+            for month in months:
+                key = month_key(month)
+                if key in existing:
+                    continue
+                try:
+                    with self.engine.begin() as conn:
+                        self.create_pg_partition(conn, month)
+                    created.append(key)
+                except Exception as e:
+                    # Thường do sensor_data_default đã có dữ liệu của tháng này
+                    logger.error(f"❌ Không tạo được partition sensor_data_{key}: {e}")
+        else:
+            for month in months:
+                key = month_key(month)
+                path = os.path.join(self.directory, f"sensor_data_{key}.db")
+                if not os.path.exists(path):
+                    self._create_sqlite_file(path, key)
+                    created.append(key)
+            if created:
+                self.scan()
+        if created:
+            logger.info(f"🗂️ Đã tạo partition sensor_data: {', '.join(created)}")
+        return created
+
+    @staticmethod
+    def create_pg_partition(conn, month: datetime):
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS sensor_data_{month_key(month)} PARTITION OF sensor_data "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+        ))
+
+    @staticmethod
+    def _create_sqlite_file(path: str, key: str):
+        """Tạo file tháng dưới tên tạm rồi link sang tên thật: tiến trình khác quét thư mục chỉ thấy file hoàn chỉnh"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        tbl = _partition_table()
+        conn = sqlite3.connect(tmp)
+        try:
+            if settings.SQLITE_PROFILE == "production":
+                conn.execute("PRAGMA journal_mode=WAL")  # Giống DB chính (db/session.py): đọc không chặn ghi
+            conn.execute(str(CreateTable(tbl).compile(dialect=sqlite_dialect.dialect())))
+            for index in tbl.indexes:
+                conn.execute(str(CreateIndex(index).compile(dialect=sqlite_dialect.dialect())))
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('sensor_data', ?)", (int(key) * ID_BLOCK,))
+            conn.commit()
+        finally:
+            conn.close()
+        try:
+            os.link(tmp, path)  # Không ghi đè nếu tiến trình khác (worker) vừa tạo xong cùng tháng
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+
+    @staticmethod
+    def pg_is_partitioned(conn) -> bool:
+        return conn.execute(text(
+            "SELECT 1 FROM pg_class WHERE relname = 'sensor_data' AND relkind = 'p' AND pg_table_is_visible(oid)"
+        )).first() is not None
+
+    @staticmethod
+    def _pg_months(conn) -> List[str]:
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'sensor_data' AND pg_table_is_visible(p.oid)"
+        )).scalars().all()
+        return [m.group(1) for m in (PG_PARTITION.fullmatch(name) for name in names) if m]
+
+    def months(self) -> List[str]:
+        """Danh sách tháng đang có partition (YYYYMM)"""
+        if not self.enabled:
+            return []
+        if self.sqlite:
+            self.scan()
+            with self._lock:
+                return sorted(self._files)
+        with self.engine.connect() as conn:
+            return sorted(self._pg_months(conn))
+
+    # ---------------- Hết hạn ----------------
+    def apply_retention(self, now: Optional[datetime] = None) -> dict:
+        """Bỏ các tháng cũ hơn SENSOR_RETENTION_MONTHS. Trả về {"partitions": [...], "deleted_rows": n}"""
+        result = {"partitions": [], "deleted_rows": 0}
+        if settings.SENSOR_RETENTION_MONTHS <= 0:
+            return result
+        cutoff = add_months(month_start(now or datetime.now()), -settings.SENSOR_RETENTION_MONTHS)
+        archive = settings.SENSOR_RETENTION_ACTION == "archive"
+        expired = [key for key in self.months() if key_month(key) < cutoff]
+
+        if self.dialect == "postgresql" and expired:
+            for key in expired:
+                with self.engine.begin() as conn:
+                    if archive:
+                        conn.execute(text(f"ALTER TABLE sensor_data DETACH PARTITION sensor_data_{key}"))
+                        conn.execute(text(f"ALTER TABLE sensor_data_{key} RENAME TO sensor_data_archive_{key}"))
+                    else:
+                        conn.execute(text(f"DROP TABLE sensor_data_{key}"))
+                result["partitions"].append(key)
+        elif self.sqlite and expired:
+            with self._lock:
+                for key in expired:
+                    self._files.pop(key, None)
+                self._generation += 1
+            # Kết nối đang nằm trong pool vẫn giữ file -> bỏ pool cũ, kết nối mới sẽ ATTACH lại danh sách mới
+            for engine in self._engines:
+                engine.dispose()
+            archive_dir = settings.SENSOR_ARCHIVE_DIR or os.path.join(self.directory, "archive")
+            for key in expired:
+                path = os.path.join(self.directory, f"sensor_data_{key}.db")
+                try:
+                    if archive:
+                        os.makedirs(archive_dir, exist_ok=True)
+                        shutil.move(path, os.path.join(archive_dir, os.path.basename(path)))
+                    else:
+                        os.remove(path)
+                    result["partitions"].append(key)
+                except OSError as e:
+                    logger.error(f"❌ Không gỡ được {path} (thử lại lần sau): {e}")
+            self.scan()
+
+        result["deleted_rows"] = self._delete_default(cutoff)
+        if result["partitions"] or result["deleted_rows"]:
+            action = "Chuyển vào kho" if archive else "Đã xóa"
+            logger.info(f"🧹 {action} partition {result['partitions']}, DELETE {result['deleted_rows']} dòng cũ hơn {cutoff:%Y-%m}")
+        return result
+
+    def _delete_default(self, cutoff: datetime) -> int:
+        """Phần mặc định (hoặc cả bảng khi không chia partition): DELETE theo lô, mỗi lô 1 transaction"""
+        if self.dialect == "postgresql" and self.enabled:
+            target = table("sensor_data_default", column("id"), column("timestamp"))
+        else:
+            target = models.SensorData.__table__
+        total = 0
+        while True:
+            with self.engine.begin() as conn:
+                if self.dialect == "mysql":
+                    stmt = delete(target).where(target.c.timestamp < cutoff).with_dialect_options(mysql_limit=RETENTION_BATCH)
+                else:
+                    ids = select(target.c.id).where(target.c.timestamp < cutoff).limit(RETENTION_BATCH).scalar_subquery()
+                    stmt = delete(target).where(target.c.id.in_(ids))
+                count = conn.execute(stmt).rowcount
+            total += count
+            if count < RETENTION_BATCH:
+                return total
+
+    def maintain(self, now: Optional[datetime] = None) -> dict:
+        """Áp dụng hạn lưu trữ + tạo trước partition (main.py gọi định kỳ). Gỡ tháng hết hạn TRƯỚC khi tạo tháng mới."""
+        try:
+            retention = self.apply_retention(now)
+            return {"created": self.ensure(now), **retention}
+        except Exception as e:
+            logger.error(f"❌ Lỗi bảo trì partition sensor_data: {e}", exc_info=True)
+            return {}
+
+    # ---------------- Thống kê ----------------
+    def stats(self) -> List[Tuple[str, int]]:
+        """[(tên partition, số dòng)] kể cả phần mặc định"""
+        counts = []
+        with self.engine.connect() as conn:
+            if self.dialect == "postgresql" and self.enabled:
+                for key in sorted(self._pg_months(conn)):
+                    counts.append((f"sensor_data_{key}", conn.execute(text(f"SELECT count(*) FROM sensor_data_{key}")).scalar()))
+                counts.append(("sensor_data_default", conn.execute(text("SELECT count(*) FROM sensor_data_default")).scalar()))
+                return counts
+            for key in sorted(conn.info.get("sensor_partitions") or {}):
+                counts.append((f"sd_{key}.sensor_data", conn.execute(select(func.count()).select_from(self.partition_table(key))).scalar()))
+            counts.append(("sensor_data", conn.execute(select(func.count()).select_from(models.SensorData.__table__)).scalar()))
+        return counts
+
+
+# Dùng chung cho toàn bộ tiến trình (db/session.py gắn vào engine chính)
+sensor_partitions = SensorPartitions()
@@ -0,0 +1,122 @@
+"""
+Đọc từ read replica (DATABASE_REPLICA_URLS, cách nhau dấu phẩy).
+
+Chỉ các API đọc (lịch sử, biểu đồ, nhật ký, danh sách thiết bị) lấy session qua deps.get_read_db /
+deps.get_async_read_db: SELECT chạy ở 1 replica, lỡ có ghi thì RoutingSession vẫn đưa về primary.
+Ingest, điều khiển, đăng nhập... dùng SessionLocal như cũ -> luôn ở primary.
+
+Ngân sách trễ: mỗi REPLICA_CHECK_SECONDS đo độ trễ từng replica
+- PostgreSQL: đang nhận WAL (pg_stat_wal_receiver đang streaming) và đã phát lại hết WAL nhận được thì coi là 0,
+  ngược lại now() - pg_last_xact_replay_timestamp() (mất kết nối tới primary thì trễ tăng dần theo thời gian;
+  chưa phát lại giao dịch nào -> không đo được)
+- MySQL: Seconds_Behind_Source của SHOW REPLICA STATUS
+- Khác: không đo được -> 0
+Replica trễ hơn REPLICA_MAX_LAG_SECONDS hoặc không kết nối được thì bỏ qua tới lần đo sau;
+không còn replica nào đạt thì đọc ở primary.
+"""
+import itertools
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from core.config import settings
+from core.logger import get_logger
+from core.metrics import metrics
+
+logger = get_logger("Replicas")
+
+# receive LSN = replay LSN cũng đúng khi WAL receiver đã ngắt (không nhận thêm gì) -> chỉ tin khi đang streaming.
+# Không có quyền pg_read_all_stats thì status là NULL nhưng view vẫn có 1 dòng khi tiến trình receiver còn chạy.
+PG_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming') "
+    "AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, engine, async_engine):
+        self.engine = engine
+        self.async_engine = async_engine
+        url = engine.url
+        self.name = f"{url.host or 'local'}:{url.port or ''}/{url.database or ''}"
+        self.lag: Optional[float] = None  # None = chưa đo / không kết nối được
+
+
+class ReplicaSet:
+    def __init__(self, max_lag: float = settings.REPLICA_MAX_LAG_SECONDS, check_seconds: float = settings.REPLICA_CHECK_SECONDS):
+        self.replicas: List[Replica] = []
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def install(self, engine, async_engine):
+        """Thêm 1 replica (db/session.py gọi với cặp engine đồng bộ / async của từng URL)"""
+        self.replicas.append(Replica(engine, async_engine))
+
+    @property
+    def due(self) -> bool:
+        return bool(self.replicas) and time.monotonic() - self._checked >= self.check_seconds
+
+    # ---------------- Đo độ trễ ----------------
+    @staticmethod
+    def _measure(replica: Replica) -> Optional[float]:
+        try:
+            with replica.engine.connect() as conn:
+                dialect = conn.dialect.name
+                if dialect == "postgresql":
+                    lag = conn.execute(text(PG_LAG_SQL)).scalar()
+                    return None if lag is None else float(lag)
+                if dialect == "mysql":
+                    try:
+                        row = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+                        key = "Seconds_Behind_Source"
+                    except Exception:
+                        row = conn.execute(text("SHOW SLAVE STATUS")).mappings().first()  # MySQL < 8.0.22
+                        key = "Seconds_Behind_Master"
+                    if row is None:
+                        return 0.0  # Không phải replica (VD: cùng 1 máy chủ khi thử nghiệm)
+                    return None if row[key] is None else float(row[key])  # NULL = luồng sao chép đang dừng
+                return 0.0
+        except Exception as e:
+            logger.warning(f"⚠️ Không đo được độ trễ replica {replica.name}: {e}")
+            return None
+
+    def refresh(self):
+        """Đo lại độ trễ mọi replica (1 luồng đo, các luồng khác dùng kết quả cũ)"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            for replica in self.replicas:
+                lag = self._measure(replica)
+                if (lag is None or lag > self.max_lag) and replica.lag is not None and replica.lag <= self.max_lag:
+                    logger.warning(f"⚠️ Replica {replica.name} trễ {lag if lag is not None else '?'}s, tạm đọc ở nơi khác")
+                replica.lag = lag
+            self._checked = time.monotonic()
+        finally:
+            self._lock.release()
+
+    # ---------------- Chọn replica ----------------
+    def pick(self, refresh: bool = True) -> Optional[Replica]:
+        """Replica kế tiếp (xoay vòng) còn trong ngân sách trễ, None = đọc ở primary"""
+        if refresh and self.due:
+            self.refresh()
+        healthy = [r for r in self.replicas if r.lag is not None and r.lag <= self.max_lag]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+
+# Dùng chung cho toàn bộ tiến trình (db/session.py thêm replica theo DATABASE_REPLICA_URLS)
+replica_set = ReplicaSet()
+
+metrics.gauge(
+    "smartfarm_replica_lag_seconds", "Độ trễ đo được của từng read replica (-1 = không kết nối được)",
+    lambda: [(r.name, -1 if r.lag is None else r.lag) for r in replica_set.replicas],
+    labels=("replica",),
+)
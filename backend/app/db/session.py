@@ -1,6 +1,17 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import threading
+from collections import deque
+
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.util import await_only
 from core.config import settings
+from db.partitions import sensor_partitions
+from db.replicas import replica_set
 
 def get_db():
     db = SessionLocal()
@@ -8,24 +19,260 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def read_session() -> Session:
+    """Session cho API chỉ đọc: SELECT ở 1 read replica còn trong ngân sách trễ (không có thì như SessionLocal)"""
+    replica = replica_set.pick()
+    if replica is None:
+        return SessionLocal()
+    return RoutingSession(writer=engine, reader=replica.engine, autoflush=False)
+
+def async_read_session() -> AsyncSession:
+    """read_session cho AsyncSession. Gọi từ event loop: chỉ dùng kết quả đo trễ đã có (deps đo lại ở luồng phụ)"""
+    replica = replica_set.pick(refresh=False)
+    if replica is None:
+        return AsyncSessionLocal()
+    return AsyncSession(sync_session_class=RoutingSession, writer=async_engine.sync_engine,
+                        reader=replica.async_engine.sync_engine, autoflush=False, expire_on_commit=False)
 # In ra để kiểm tra xem nó đang lấy URL nào (Debug)
 print(f"Connecting to Database: {settings.DATABASE_URL}")
 
+
+# ================= SQLITE PRODUCTION: 1 KẾT NỐI GHI + POOL ĐỌC =================
+
+def sqlite_pragmas(engine, read_only: bool = False):
+    """WAL (đọc không chặn ghi), synchronous=NORMAL, mmap, busy_timeout cho mọi kết nối mới của engine"""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        if not read_only:
+            # Tự BEGIN IMMEDIATE ở sự kiện "begin" (pysqlite mặc định BEGIN DEFERRED -> nâng khóa giữa chừng dễ "database is locked")
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+            cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+    if not read_only:
+        @event.listens_for(engine, "begin")
+        def _on_begin(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+class WriteGate:
+    """
+    1 "ghế" ghi cho cả tiến trình, dùng chung giữa engine ghi đồng bộ và engine ghi aiosqlite:
+    lấy kết nối ghi của engine nào cũng phải giữ ghế tới khi trả kết nối về pool -> tại mỗi thời điểm chỉ 1 kết nối
+    của tiến trình đang ghi, 2 pool không tranh khóa file với nhau bằng busy_timeout.
+    Ghế trao lần lượt theo thứ tự chờ (luồng đồng bộ và task async như nhau), chờ quá SQLITE_WRITE_WAIT_SECONDS
+    -> sqlalchemy TimeoutError như khi chờ pool. Task async chờ bằng Future -> không chặn event loop.
+    """
+
+    class _Waiter:
+        __slots__ = ("notify", "granted")
+
+        def __init__(self, notify):
+            self.notify = notify
+            self.granted = False
+
+    def __init__(self, timeout: float = settings.SQLITE_WRITE_WAIT_SECONDS):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._held = False
+        self._waiters = deque()
+
+    def install(self, engine, is_async: bool = False):
+        @event.listens_for(engine, "checkout")
+        def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+            acquired = await_only(self.acquire_async()) if is_async else self.acquire()
+            if not acquired:
+                raise sa_exc.TimeoutError(f"Chờ kết nối ghi SQLite quá {self.timeout:.0f}s")
+            connection_record.info["write_gate"] = True
+
+        @event.listens_for(engine, "checkin")
+        def _on_checkin(dbapi_connection, connection_record):
+            # Lấy ghế thất bại thì pool vẫn gọi checkin -> chỉ trả ghế đã giữ
+            if connection_record.info.pop("write_gate", False):
+                self.release()
+
+    def acquire(self) -> bool:
+        ready = threading.Event()
+        waiter = self._enqueue(ready.set)
+        if waiter is None or ready.wait(self.timeout):
+            return True
+        return self._abandon(waiter)
+
+    async def acquire_async(self) -> bool:
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        waiter = self._enqueue(lambda: loop.call_soon_threadsafe(_resolve, ready))
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(ready), self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._abandon(waiter)
+        except BaseException:
+            # Task bị hủy đúng lúc vừa được trao ghế -> trả lại cho người kế tiếp
+            if self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self._held = False
+
+    def _enqueue(self, notify):
+        """None = lấy được ghế ngay, ngược lại xếp hàng"""
+        with self._lock:
+            if not self._held and not self._waiters:
+                self._held = True
+                return None
+            waiter = self._Waiter(notify)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter) -> bool:
+        """Thôi chờ. True nếu ghế đã kịp được trao (người gọi đang giữ ghế)"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def create_sqlite_engines(url, factory=create_engine, gate: WriteGate = None):
+    """
+    (engine ghi, engine đọc) cho SQLite chế độ production:
+    - engine ghi: pool đúng 1 kết nối -> các luồng (MQTT Writer, tưới, watchdog, request) xếp hàng lấy kết nối
+      thay vì tranh khóa file rồi nhận "database is locked"
+    - engine đọc: SQLITE_READ_POOL_SIZE kết nối query_only, WAL nên đọc song song với ghi
+    factory=create_async_engine: cặp engine aiosqlite cho AsyncSessionLocal. Truyền cùng `gate` với cặp đồng bộ
+    để kết nối ghi aiosqlite và kết nối ghi đồng bộ lần lượt giữ 1 ghế ghi duy nhất (WriteGate)
+    """
+    connect_args = {"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    write_engine = factory(url, connect_args=connect_args, pool_size=1, max_overflow=0,
+                           pool_timeout=settings.SQLITE_WRITE_WAIT_SECONDS)
+    sqlite_pragmas(getattr(write_engine, "sync_engine", write_engine))
+    (gate or WriteGate()).install(getattr(write_engine, "sync_engine", write_engine), is_async=factory is create_async_engine)
+    read_engine = factory(url, connect_args=connect_args, pool_size=settings.SQLITE_READ_POOL_SIZE, max_overflow=0)
+    sqlite_pragmas(getattr(read_engine, "sync_engine", read_engine), read_only=True)
+    return write_engine, read_engine
+
+
+# Driver bất đồng bộ tương ứng với DATABASE_URL (ASYNC_DATABASE_URL để chỉ định riêng)
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+def async_database_url(url: str):
+    """sqlite:// -> sqlite+aiosqlite://, postgresql(+psycopg2):// -> postgresql+asyncpg://, mysql(+pymysql):// -> mysql+aiomysql://"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+class RoutingSession(Session):
+    """
+    Session chia đường: flush / INSERT / UPDATE / DELETE qua engine ghi, SELECT qua engine đọc.
+    Đã ghi trong transaction thì mọi câu sau đó (tới COMMIT / ROLLBACK) cũng đi engine ghi -> đọc được dữ liệu vừa ghi.
+    """
+
+    def __init__(self, *args, writer=None, reader=None, **kwargs):
+        kwargs["bind"] = writer
+        super().__init__(*args, **kwargs)
+        self._writer = writer
+        self._reader = reader or writer
+        self._writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._writing or self._flushing or isinstance(clause, UpdateBase):
+            self._writing = True
+            return self._writer
+        return self._reader
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            self._writing = False
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._writing = False
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._writing = False
+
+
 # --- LOGIC TỰ ĐỘNG NHẬN DIỆN LOẠI DB ---
 
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL)
+
 if "sqlite" in settings.DATABASE_URL:
     # Cấu hình riêng cho SQLite
-    connect_args = {"check_same_thread": False}
-    engine = create_engine(
-        settings.DATABASE_URL, 
-        connect_args=connect_args
-    )
+    database = settings.DATABASE_URL.split("///", 1)[-1]
+    sqlite_production = settings.SQLITE_PROFILE == "production" and database and not database.startswith(":memory:")
+    engine_options = {"connect_args": {"check_same_thread": False}}
 else:
     # Cấu hình cho MySQL / PostgreSQL
-    engine = create_engine(
-        settings.DATABASE_URL,
-        pool_pre_ping=True,  # Tự động kết nối lại nếu bị ngắt (Rất quan trọng với MySQL)
-        pool_recycle=3600    # Tái tạo kết nối sau 1 giờ
-    )
+    sqlite_production = False
+    engine_options = {
+        "pool_pre_ping": True,  # Tự động kết nối lại nếu bị ngắt (Rất quan trọng với MySQL)
+        "pool_recycle": 3600,   # Tái tạo kết nối sau 1 giờ
+    }
+
+if sqlite_production:
+    # Cặp đồng bộ và cặp aiosqlite chung 1 ghế ghi
+    sqlite_write_gate = WriteGate()
+    engine, read_engine = create_sqlite_engines(settings.DATABASE_URL, gate=sqlite_write_gate)
+    async_engine, async_read_engine = create_sqlite_engines(ASYNC_DATABASE_URL, factory=create_async_engine,
+                                                            gate=sqlite_write_gate)
+else:
+    engine = read_engine = create_engine(settings.DATABASE_URL, **engine_options)
+    async_engine = async_read_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options)
+
+# sensor_data chia theo tháng (SENSOR_PARTITIONING): SQLite ATTACH các file tháng vào mỗi kết nối
+sensor_partitions.install(engine)
+for extra in {read_engine, async_engine.sync_engine, async_read_engine.sync_engine} - {engine}:
+    # Pool async chỉ đóng được trong event loop -> không dispose khi bỏ partition, kết nối tự DETACH lúc lấy ra
+    sensor_partitions.install(extra, dispose=extra is read_engine)
+
+if sqlite_production:
+    SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, writer=engine, reader=read_engine)
+    # AsyncSession bọc 1 Session đồng bộ: dùng lại RoutingSession với cặp engine aiosqlite
+    AsyncSessionLocal = async_sessionmaker(sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False,
+                                           writer=async_engine.sync_engine, reader=async_read_engine.sync_engine)
+else:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # expire_on_commit=False: đọc thuộc tính sau COMMIT không phát sinh truy vấn ngầm (không làm được trong async)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# Read replica: cùng cấu hình pool với primary
+for replica_url in settings.DATABASE_REPLICA_URLS:
+    replica_options = engine_options if "sqlite" in replica_url else {"pool_pre_ping": True, "pool_recycle": 3600}
+    replica_set.install(create_engine(replica_url, **replica_options),
+                        create_async_engine(async_database_url(replica_url), **replica_options))
@@ -0,0 +1,150 @@
+"""
+Tiến trình Ingest độc lập: nhận dữ liệu cảm biến từ MQTT và ghi DB, chạy được N bản song song.
+
+    # Broker hỗ trợ MQTT v5 -> Shared Subscription ($share/<group>/<topic>), Broker tự chia tải
+    # (bản gửi lại QoS 1 có thể tới worker khác -> không bị bộ chống trùng của từng worker chặn)
+    python ingest_worker.py --workers 4 --worker-id 0 --mode shared
+
+    # Broker cũ (chỉ MQTT 3.1.1) -> mọi worker nhận hết, mỗi worker chỉ giải mã gói của thiết bị thuộc phần mình
+    # (device_id lấy từ topic hoặc vỏ gói tin; gói AES không ghi device_id ngoài vỏ thì phải giải mã mới biết)
+    python ingest_worker.py --workers 4 --worker-id 0 --mode hash
+
+    # Kiểm tra: nhiều worker không mất / không ghi trùng bản ghi, trạng thái thiết bị đúng
+    python -m pytest -q backend/app/tests/test_ingest_worker.py
+
+Khi chạy worker riêng, đặt INGEST_IN_API=false để API (main.py) không tự subscribe topic cảm biến nữa.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import time
+import zlib
+
+import paho.mqtt.client as mqtt
+
+from core.config import settings
+from core.logger import get_logger
+from core.metrics import STAGE_TOTAL, stage_sampler
+from db.partitions import sensor_partitions
+from services.device_registry import device_registry
+from services.ingest_writer import IngestWriter, SensorReading
+from services.mqtt_service import decode_mqtt_message, decode_mqtt_messages, sensor_router
+from services.payload_crypto import payload_decryptor
+from services.mqtt_transport import AsyncioMqttTransport
+
+logger = get_logger("Ingest_Worker")
+
+
+def partition_of(device_id: str, workers: int) -> int:
+    """Thiết bị thuộc worker nào (CRC32 ổn định giữa các tiến trình, khác với hash() của Python)"""
+    return zlib.crc32(device_id.encode("utf-8")) % workers
+
+
+class IngestWorker:
+    """1 worker = 1 kết nối MQTT + 1 Ingest Writer riêng"""
+
+    def __init__(self, worker_id: int, workers: int, mode: str = "shared", writer: IngestWriter = None):
+        if not 0 <= worker_id < workers:
+            raise ValueError(f"worker_id phải nằm trong [0, {workers - 1}]")
+        self.worker_id = worker_id
+        self.workers = workers
+        self.mode = mode
+        self.writer = writer or IngestWriter()
+        self.transport = None
+        # hash: bỏ gói của worker khác ngay từ topic / vỏ gói tin, không giải mã (AES) gói không thuộc mình
+        self._owns = self.owns if mode == "hash" and workers > 1 else None
+
+    def owns(self, device_id: str) -> bool:
+        # Shared Subscription: Broker đã chia sẵn, gói nào tới tay là của mình
+        if self.mode == "shared" or self.workers == 1:
+            return True
+        return partition_of(device_id, self.workers) == self.worker_id
+
+    def accept(self, reading: SensorReading) -> bool:
+        if not self.owns(reading.device_id):
+            return False
+        return self.writer.put(reading)
+
+    def handle(self, msg):
+        if not stage_sampler():
+            for reading in decode_mqtt_message(msg, owns=self._owns):
+                self.accept(reading)
+            return
+        self._handle_timed(msg)
+
+    def handle_batch(self, msgs: list):
+        """Cả loạt tin nhắn transport đọc được trong 1 lần: gói AES giải mã chung 1 lô (decrypt_many)"""
+        batch = []
+        for msg in msgs:
+            if stage_sampler():
+                self._handle_timed(msg)
+            else:
+                batch.append(msg)
+        for reading in decode_mqtt_messages(batch, owns=self._owns):
+            self.accept(reading)
+
+    def _handle_timed(self, msg):
+        started = time.perf_counter()
+        for reading in decode_mqtt_message(msg, timed=True, owns=self._owns):
+            self.accept(reading)
+        STAGE_TOTAL.observe(time.perf_counter() - started)
+
+    def subscription_topics(self) -> list:
+        topics = sensor_router.subscriptions()
+        if self.mode == "shared":
+            return [f"$share/{settings.INGEST_SHARE_GROUP}/{topic}" for topic in topics]
+        return topics
+
+    async def run(self, stop_event: asyncio.Event):
+        protocol = mqtt.MQTTv5 if self.mode == "shared" else mqtt.MQTTv311
+        self.transport = AsyncioMqttTransport(
+            client_id=f"smartfarm-ingest-{self.worker_id}",
+            handler=self.handle,
+            batch_handler=self.handle_batch,
+            protocol=protocol,
+        )
+        for topic in self.subscription_topics():
+            self.transport.add_subscription(topic)
+
+        device_registry.load_all()
+        payload_decryptor.load_all()
+        sensor_partitions.ensure()  # API có thể chưa chạy: tự tạo partition tháng này trước khi ghi
+        self.writer.start()
+        await self.transport.start()
+        logger.info(f"🚜 Ingest Worker {self.worker_id}/{self.workers} ({self.mode}) -> {', '.join(self.subscription_topics())}")
+
+        await stop_event.wait()
+
+        await self.transport.stop()
+        self.writer.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Farm Ingest Worker")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", 1)), help="Tổng số worker")
+    parser.add_argument("--worker-id", type=int, default=int(os.getenv("INGEST_WORKER_ID", 0)), help="Số thứ tự worker này (0..N-1)")
+    parser.add_argument("--mode", choices=["shared", "hash"], default=os.getenv("INGEST_MODE", "shared"),
+                        help="shared = MQTT v5 Shared Subscription, hash = chia theo CRC32(device_id)")
+    args = parser.parse_args()
+
+    worker = IngestWorker(args.worker_id, args.workers, args.mode)
+
+    async def runner():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:  # Windows
+                pass
+        await worker.run(stop_event)
+
+    try:
+        asyncio.run(runner())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,32 @@
-import threading
 import asyncio
 from datetime import datetime, timedelta # [THÊM MỚI] Để tính toán thời gian
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import select
 
 # Import các module của dự án
 from core.config import settings
+from core.metrics import metrics
 from db.init_db import init_db
-from db.session import SessionLocal
-from services.mqtt_service import client as mqtt_client 
+from db.partitions import sensor_partitions
+from db.replicas import replica_set
+from db.session import AsyncSessionLocal, SessionLocal, async_engine, async_read_engine
+from services.mqtt_service import start_mqtt, stop_mqtt
+from services.ingest_writer import ingest_writer
+from services.device_registry import device_registry
+from services.payload_crypto import payload_decryptor
+from services.heartbeat import heartbeat_flusher
+from services.rollup import rollup_compactor
+from services.cold_archive import cold_archive
+from services.sensor_blocks import sensor_blocks
+from services.timeseries import timeseries_store
+from api.pagination import NEXT_CURSOR_HEADER
 from api.v1.api import api_router
 
 from services.irrigation_logic import auto_irrigation_task 
-from models.models import Device # [THÊM MỚI] Import model Device để check DB
+from models.models import Device, DeviceStatus # [THÊM MỚI] Import model Device để check DB
 
 # ========================================================
 # [THÊM MỚI] TIẾN TRÌNH WATCHDOG (CHÓ CANH GÁC)
@@ -23,28 +36,65 @@ async def watchdog_task():
     while True:
         await asyncio.sleep(60) # Cứ 1 phút đi tuần 1 lần
         
-        db = SessionLocal()
+        # Ghi nốt nhịp tim đang gom trong bộ nhớ để không xử oan thiết bị còn sống (ghi đồng bộ -> luồng phụ)
+        await asyncio.to_thread(heartbeat_flusher.flush)
+
+        db = AsyncSessionLocal()
         try:
             # Quy định: 5 phút không có tín hiệu -> Tuyên án OFFLINE
             timeout_threshold = datetime.now() - timedelta(minutes=5)
             
             # Tìm các mạch đang ONLINE nhưng đã bặt vô âm tín quá 5 phút
-            offline_devices = db.query(Device).filter(
+            offline_devices = (await db.execute(select(Device).where(
                 Device.status == "ONLINE",
                 Device.last_seen < timeout_threshold
-            ).all()
+            ))).scalars().all()
             
             for dev in offline_devices:
                 dev.status = "OFFLINE"
+                device_registry.update(dev.device_id, status=DeviceStatus.OFFLINE)
                 print(f"🚨 [WATCHDOG] CẢNH BÁO: Thiết bị '{dev.name}' đã mất kết nối!")
             
             if offline_devices:
-                db.commit() # Lưu thay đổi vào DB
+                await db.commit() # Lưu thay đổi vào DB
                 
         except Exception as e:
             print(f"❌ Lỗi Watchdog: {e}")
         finally:
-            db.close() # Rất quan trọng: Phải đóng DB để không tràn RAM
+            await db.close() # Rất quan trọng: Phải đóng DB để không tràn RAM
+
+# ========================================================
+# TIẾN TRÌNH GỘP SỐ LIỆU (sensor_rollup_1m / 1h / 1d)
+# ========================================================
+async def rollup_task():
+    """Gộp dần sensor_data vào các bảng rollup cho báo cáo, chạy trong luồng phụ để không chặn MQTT"""
+    while True:
+        await asyncio.sleep(settings.ROLLUP_INTERVAL_SECONDS)
+        await asyncio.to_thread(rollup_compactor.compact_once)
+
+# ========================================================
+# TIẾN TRÌNH NÉN CÁC GIỜ ĐÃ ĐÓNG THÀNH KHỐI (sensor_blocks)
+# ========================================================
+async def sensor_blocks_task():
+    while True:
+        await asyncio.sleep(settings.SENSOR_BLOCKS_INTERVAL_SECONDS)
+        await asyncio.to_thread(sensor_blocks.compress_once)
+
+# ========================================================
+# TIẾN TRÌNH CHUYỂN DỮ LIỆU CŨ VÀO KHO LẠNH (giữ sensor_data nhỏ)
+# ========================================================
+async def cold_archive_task():
+    while True:
+        await asyncio.sleep(settings.COLD_ARCHIVE_INTERVAL_SECONDS)
+        await asyncio.to_thread(cold_archive.archive_once)
+
+# ========================================================
+# TIẾN TRÌNH BẢO TRÌ PARTITION sensor_data (tạo trước tháng mới, bỏ tháng hết hạn)
+# ========================================================
+async def partition_task():
+    while True:
+        await asyncio.sleep(settings.SENSOR_PARTITION_CHECK_SECONDS)
+        await asyncio.to_thread(sensor_partitions.maintain)
 
 # --- CẤU HÌNH VÒNG ĐỜI ỨNG DỤNG (LIFESPAN) ---
 @asynccontextmanager
@@ -60,10 +110,30 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"❌ Database Init Error: {e}")
 
+    # Chia sensor_data theo tháng: tạo sẵn partition trước khi Writer ghi
+    partition_process = None
+    if sensor_partitions.enabled:
+        sensor_partitions.maintain()
+        partition_process = asyncio.create_task(partition_task())
+        print(f"🗂️ Sensor Partitions Ready ({', '.join(sensor_partitions.months())})")
+
+    # Nạp sẵn danh sách thiết bị (và bảng khóa AES riêng) vào bộ nhớ để Ingest không phải hỏi DB
+    try:
+        device_registry.load_all()
+        payload_decryptor.load_all()
+    except Exception as e:
+        print(f"❌ Device Registry Load Error: {e}")
+
+    # Writer phải chạy TRƯỚC MQTT để on_message có chỗ đẩy dữ liệu vào
+    try:
+        ingest_writer.start()
+        print("💾 Ingest Writer Started")
+    except Exception as e:
+        print(f"❌ Ingest Writer Start Error: {e}")
+
+    # MQTT chạy ngay trên event loop này (hoặc luồng riêng nếu MQTT_TRANSPORT=thread)
     try:
-        mqtt_thread = threading.Thread(target=mqtt_client.loop_forever)
-        mqtt_thread.daemon = True 
-        mqtt_thread.start()
+        await start_mqtt()
         print("📡 MQTT Service Started")
     except Exception as e:
         print(f"❌ MQTT Start Error: {e}")
@@ -81,6 +151,34 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"❌ Watchdog Task Start Error: {e}")
 
+    # Gộp số liệu cho báo cáo (nhiều bản API dùng chung DB: chỉ bật ở 1 bản, các bản khác đặt = 0)
+    # Backend columnar tự gộp lúc đọc, không dùng bảng gộp
+    rollup_process = None
+    if settings.ROLLUP_INTERVAL_SECONDS > 0 and timeseries_store.name == "relational":
+        try:
+            rollup_process = asyncio.create_task(rollup_task())
+            print(f"🧮 Rollup Task Started (every {settings.ROLLUP_INTERVAL_SECONDS:g}s)")
+        except Exception as e:
+            print(f"❌ Rollup Task Start Error: {e}")
+
+    # Nén giờ cũ thành khối: cũng chỉ cho sensor_data (backend relational)
+    sensor_blocks_process = None
+    if settings.SENSOR_BLOCKS_AFTER_HOURS > 0 and timeseries_store.name == "relational":
+        try:
+            sensor_blocks_process = asyncio.create_task(sensor_blocks_task())
+            print(f"🗜️ Sensor Blocks Task Started (> {settings.SENSOR_BLOCKS_AFTER_HOURS} hours)")
+        except Exception as e:
+            print(f"❌ Sensor Blocks Task Start Error: {e}")
+
+    # Kho lạnh chỉ áp dụng cho sensor_data (backend relational)
+    cold_archive_process = None
+    if settings.COLD_ARCHIVE_AFTER_DAYS > 0 and timeseries_store.name == "relational":
+        try:
+            cold_archive_process = asyncio.create_task(cold_archive_task())
+            print(f"🧊 Cold Archive Task Started (> {settings.COLD_ARCHIVE_AFTER_DAYS} days)")
+        except Exception as e:
+            print(f"❌ Cold Archive Task Start Error: {e}")
+
     yield # <--- Server chạy tại đây (Chờ request)
 
     # ================= TẮT (SHUTDOWN) =================
@@ -89,17 +187,38 @@ async def lifespan(app: FastAPI):
     try:
         ai_task.cancel()
         watchdog_process.cancel() # [THÊM MỚI] Tắt chó canh gác
+        if rollup_process:
+            rollup_process.cancel()
+        if partition_process:
+            partition_process.cancel()
+        if sensor_blocks_process:
+            sensor_blocks_process.cancel()
+        if cold_archive_process:
+            cold_archive_process.cancel()
         print("🛑 Background Tasks Stopped")
     except Exception:
         pass
 
     try:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
+        await stop_mqtt()
         print("📴 MQTT Disconnected")
     except Exception as e:
         pass
 
+    # Tắt MQTT xong mới dừng Writer để ghi nốt dữ liệu còn trong hàng đợi
+    try:
+        ingest_writer.stop()
+        print("💾 Ingest Writer Flushed & Stopped")
+    except Exception as e:
+        print(f"❌ Ingest Writer Stop Error: {e}")
+
+    # Pool của AsyncSession phải đóng trong event loop
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    for replica in replica_set.replicas:
+        await replica.async_engine.dispose()
+
 # --- KHỞI TẠO APP ---
 app = FastAPI(
     title=getattr(settings, "PROJECT_NAME", "Smart Farm AIoT System"),
@@ -119,6 +238,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"], 
+    expose_headers=[NEXT_CURSOR_HEADER],  # Frontend đọc được con trỏ trang sau (api/pagination.py)
 )
 
 api_prefix = getattr(settings, "API_V1_STR", "/api/v1")
@@ -128,6 +248,16 @@ app.include_router(api_router, prefix=api_prefix)
 def root():
     return {"message": "Welcome to Smart Farm AIoT System API"}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Số liệu Ingest theo định dạng văn bản của Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/ingest")
+def ingest_health():
+    """Bộ đếm Ingest: đang chờ / đã lưu / bị bỏ (theo lý do) khi quá tải"""
+    return ingest_writer.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, Text, BigInteger, Boolean
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, Text, BigInteger, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
+from datetime import datetime
 
 # QUAN TRỌNG: Phải import Base từ db.base để init_db.py nhận diện được bảng
 from db.base import Base 
+from core.config import settings
 
 # ================= ENUMS (Định nghĩa các lựa chọn cố định) =================
 
@@ -144,6 +146,18 @@ class Device(Base):
     sensor_data = relationship("SensorData", back_populates="device")
     logs = relationship("ActionLog", back_populates="device")
 
+
+class DeviceKey(Base):
+    """
+    Bảng Khóa AES riêng của từng thiết bị:
+    Thiết bị không có dòng ở đây thì dùng khóa chung settings.AES_KEY.
+    """
+    __tablename__ = "device_keys"
+
+    device_id = Column(String(50), ForeignKey("devices.device_id"), primary_key=True)
+    aes_key = Column(String(32), nullable=False)  # 16 / 24 / 32 ký tự (AES-128/192/256)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 # ================= CÁC BẢNG DỮ LIỆU LỚN (BIG DATA) =================
 
 class SensorData(Base):
@@ -152,10 +166,18 @@ class SensorData(Base):
     Lưu lịch sử lâu dài để vẽ biểu đồ & Train lại AI sau này.
     """
     __tablename__ = "sensor_data"
+    __table_args__ = (
+        # Lịch sử 1 thiết bị mới -> cũ, phân trang theo con trỏ (timestamp, id)
+        Index("ix_sensor_data_device_ts_id", "device_id", "timestamp", "id"),
+        # PostgreSQL: chia partition theo tháng (khóa chính thành (id, timestamp), xem db/partitions.py)
+        {"postgresql_partition_by": "RANGE (timestamp)"} if settings.SENSOR_PARTITIONING else {},
+    )
 
     id = Column(Integer, primary_key=True, index=True) # Dùng BigInt vì dữ liệu sẽ rất nhiều
     device_id = Column(String(50), ForeignKey("devices.device_id"))
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Báo cáo / gộp số liệu lọc theo thời gian. Giờ địa phương không kèm múi giờ như mọi chỗ khác (datetime.now(),
+    # received_at của Ingest Writer): SQLite func.now() là giờ UTC nên Python tự điền, server_default chỉ còn cho SQL tay
+    timestamp = Column(DateTime(timezone=True), default=datetime.now, server_default=func.now(), index=True)
     
     # Các thông số môi trường
     temp = Column(Float)      # Nhiệt độ không khí
@@ -166,6 +188,130 @@ class SensorData(Base):
     device = relationship("Device", back_populates="sensor_data")
 
 
+class DeviceLatestReading(Base):
+    """
+    Bảng Số Liệu Mới Nhất (1 dòng / thiết bị):
+    Ingest Writer upsert cùng lô với sensor_data, Dashboard và AI đọc bảng này
+    thay vì ORDER BY timestamp DESC LIMIT 1 trên sensor_data cho từng thiết bị.
+    Lệch với sensor_data (dữ liệu cũ, xóa tay...) -> python -m tools.latest_readings repair
+    """
+    __tablename__ = "device_latest_reading"
+
+    device_id = Column(String(50), ForeignKey("devices.device_id"), primary_key=True)
+    timestamp = Column(DateTime(timezone=True))
+    temp = Column(Float)
+    hum_air = Column(Float)
+    hum_soil = Column(Float)
+    light = Column(Float, nullable=True)
+
+
+class SensorRollupMixin:
+    """
+    Cột chung của 3 bảng gộp số liệu theo khung thời gian (1 phút / 1 giờ / 1 ngày).
+    Mỗi dòng = 1 thiết bị trong 1 khung: count/sum/min/max của từng thông số
+    (count riêng vì light có thể NULL). Trung bình = sum / count.
+    Do services/rollup.py (RollupCompactor) ghi, báo cáo đọc bảng thô nhất vừa khớp khoảng thời gian.
+    """
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # Đầu khung (giờ địa phương)
+    device_id = Column(String(50), ForeignKey("devices.device_id"), primary_key=True)
+    samples = Column(Integer, nullable=False, default=0)        # Số bản ghi sensor_data trong khung
+
+    temp_count = Column(Integer, nullable=False, default=0)
+    temp_sum = Column(Float, nullable=False, default=0)
+    temp_min = Column(Float)
+    temp_max = Column(Float)
+
+    hum_air_count = Column(Integer, nullable=False, default=0)
+    hum_air_sum = Column(Float, nullable=False, default=0)
+    hum_air_min = Column(Float)
+    hum_air_max = Column(Float)
+
+    hum_soil_count = Column(Integer, nullable=False, default=0)
+    hum_soil_sum = Column(Float, nullable=False, default=0)
+    hum_soil_min = Column(Float)
+    hum_soil_max = Column(Float)
+
+    light_count = Column(Integer, nullable=False, default=0)
+    light_sum = Column(Float, nullable=False, default=0)
+    light_min = Column(Float)
+    light_max = Column(Float)
+
+
+class SensorRollup1m(SensorRollupMixin, Base):
+    __tablename__ = "sensor_rollup_1m"
+
+
+class SensorRollup1h(SensorRollupMixin, Base):
+    __tablename__ = "sensor_rollup_1h"
+
+
+class SensorRollup1d(SensorRollupMixin, Base):
+    __tablename__ = "sensor_rollup_1d"
+
+
+class RollupWatermark(Base):
+    """
+    Mốc đã gộp xong của từng bảng rollup: mọi khung có bucket < watermark đã đầy đủ,
+    dữ liệu từ watermark trở đi phải đọc ở bảng mịn hơn (hoặc sensor_data).
+    """
+    __tablename__ = "rollup_watermarks"
+
+    level = Column(String(10), primary_key=True)  # "1m" / "1h" / "1d"
+    watermark = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class RollupLateData(Base):
+    """
+    Số liệu cảm biến COMMIT muộn hơn ROLLUP_LAG_SECONDS (Writer tồn đọng khi DB nghẽn...), có thể đã nằm sau watermark:
+    Writer ghi mốc cũ nhất của lô cùng transaction, RollupCompactor đọc rồi dời watermark về trước mốc đó để gộp lại.
+    """
+    __tablename__ = "rollup_late_data"
+
+    id = Column(Integer, primary_key=True)
+    since = Column(DateTime(timezone=True), nullable=False)
+
+
+class DataMigration(Base):
+    """Các bước sửa dữ liệu chạy 1 lần (tools/*) đã áp dụng: chạy lại sẽ hỏng dữ liệu nên phải ghi nhận"""
+    __tablename__ = "data_migrations"
+
+    name = Column(String(100), primary_key=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.now)
+    rows = Column(Integer, nullable=False, default=0)  # Số dòng đã sửa
+
+
+class SensorArchiveChunk(Base):
+    """
+    Danh mục kho lạnh (services/cold_archive.py): mỗi dòng là 1 file chứa toàn bộ
+    sensor_data của 1 thiết bị trong 1 ngày đã được chuyển ra khỏi bảng nóng.
+    """
+    __tablename__ = "sensor_archive_chunks"
+
+    device_id = Column(String(50), primary_key=True)
+    day = Column(DateTime, primary_key=True, index=True)  # 00:00 của ngày (giờ địa phương)
+    path = Column(String(255), nullable=False)            # Đường dẫn tương đối trong COLD_ARCHIVE_DIR
+    rows = Column(Integer, nullable=False)
+    first_ts = Column(DateTime, nullable=False)
+    last_ts = Column(DateTime, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SensorBlock(Base):
+    """
+    Kho khối nén (services/sensor_blocks.py): mỗi dòng là toàn bộ sensor_data của 1 thiết bị
+    trong 1 giờ, nén delta-of-delta (thời gian, id) + XOR (số đo) kiểu Gorilla.
+    """
+    __tablename__ = "sensor_blocks"
+
+    device_id = Column(String(50), primary_key=True)
+    hour = Column(DateTime, primary_key=True, index=True)  # Đầu giờ (giờ địa phương)
+    rows = Column(Integer, nullable=False)
+    first_ts = Column(DateTime, nullable=False)
+    last_ts = Column(DateTime, nullable=False)
+    data = Column(LargeBinary(2 ** 24), nullable=False)   # MySQL: MEDIUMBLOB (BLOB chỉ 64KB)
+
+
 class ActionLog(Base):
     """
     Bảng Nhật Ký Hoạt Động:
@@ -173,6 +319,11 @@ class ActionLog(Base):
     Rất quan trọng khi bảo vệ đồ án.
     """
     __tablename__ = "action_logs"
+    __table_args__ = (
+        # /logs, /reports/logs: mới -> cũ, phân trang theo con trỏ (timestamp, log_id), có / không lọc level
+        Index("ix_action_logs_ts_id", "timestamp", "log_id"),
+        Index("ix_action_logs_level_ts_id", "level", "timestamp", "log_id"),
+    )
 
     log_id = Column(Integer, primary_key=True, index=True)
     device_id = Column(String(50), ForeignKey("devices.device_id"))
@@ -72,6 +72,10 @@ class DeviceUpdate(BaseModel):
     name: Optional[str] = None
     zone_id: Optional[int] = None
     status: Optional[DeviceStatus] = None # Thêm trường này nếu muốn Admin đổi trạng thái
+
+class DeviceKeyUpdate(BaseModel):
+    """Khóa AES riêng của thiết bị (PUT /devices/{device_id}/key). Không bao giờ trả về trong response."""
+    aes_key: str = Field(..., min_length=16, max_length=32, description="16, 24 hoặc 32 ký tự")
     
 class DeviceResponse(DeviceBase):
     """
@@ -0,0 +1,280 @@
+"""
+Kho lạnh cho sensor_data (COLD_ARCHIVE_AFTER_DAYS > 0).
+
+Bản ghi cũ hơn N ngày được chuyển khỏi bảng nóng sang file cột, mỗi thiết bị / mỗi ngày 1 file
+COLD_ARCHIVE_DIR/YYYYMMDD/<device_id>.sfa, danh mục nằm ở bảng sensor_archive_chunks.
+Bảng nóng chỉ còn vài ngày gần nhất -> vừa bộ nhớ đệm của DB.
+
+Định dạng .sfa (các cột nằm liền nhau, np.memmap đọc thẳng từng cột, không phải giải nén):
+    header  32 byte: b"SFA1", version (u16), 0 (u16), rows (u32), 00:00 của ngày (µs, i64), đệm
+    id      int64[rows]
+    ts      int32[rows]   mili-giây kể từ 00:00 của ngày, tăng dần
+    temp, hum_air, hum_soil, light   int32[rows]   giá trị x 1000 (NULL = INT32_MIN)
+-> 24 byte / bản ghi (timestamp giữ tới mili-giây, số đo tới 0.001).
+Đọc 1 khoảng thời gian: tìm nhị phân trên cột ts rồi chỉ giải mã đoạn cần, các trang còn lại không bị đọc.
+
+Lịch sử (/devices/{id}/history), báo cáo và bộ gộp rollup đọc bảng nóng + kho lạnh như 1 nguồn.
+Bật cả kho khối nén (services/sensor_blocks.py): ngày cũ được chuyển từ bảng nóng lẫn sensor_blocks ra file.
+"""
+import os
+import struct
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import numpy as np
+from sqlalchemy import func, select
+
+from core.config import settings
+from core.logger import get_logger
+from db.partitions import sensor_partitions
+from db.session import SessionLocal
+from models import models
+from services.rollup import METRICS, _naive, floor_day
+
+logger = get_logger("Cold_Archive")
+
+MAGIC = b"SFA1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIq")
+HEADER_SIZE = 32
+SCALE = 1000
+NULL = np.iinfo(np.int32).min
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_us(ts: datetime) -> int:
+    """Giờ địa phương (naive) -> số µs kể từ 1970-01-01 (không đổi múi giờ: khung ngày khớp floor_day)"""
+    return (_naive(ts) - EPOCH) // timedelta(microseconds=1)
+
+
+def from_us(value) -> datetime:
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+# ================= 1. ĐỊNH DẠNG FILE .sfa =================
+
+def write_chunk(path: str, day: datetime, columns: Dict[str, np.ndarray]):
+    """Ghi 1 file (columns: id, ts (µs), METRICS (float, NaN = NULL) đã sắp theo ts). Ghi file tạm rồi đổi tên."""
+    rows = len(columns["id"])
+    day_us = to_us(day)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, rows, day_us).ljust(HEADER_SIZE, b"\0"))
+        f.write(columns["id"].astype("<i8").tobytes())
+        f.write(((columns["ts"] - day_us) // 1000).astype("<i4").tobytes())
+        for metric in METRICS:
+            values = columns[metric]
+            scaled = np.clip(np.round(np.nan_to_num(values) * SCALE), NULL + 1, np.iinfo(np.int32).max)
+            f.write(np.where(np.isnan(values), NULL, scaled).astype("<i4").tobytes())
+    os.replace(tmp, path)
+
+
+def read_chunk(path: str, start_us: Optional[int] = None, end_us: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Các cột của 1 file trong [start, end) (ts: µs, số đo: float với NaN = NULL)"""
+    with open(path, "rb") as f:
+        magic, version, _, rows, day_us = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} không phải file kho lạnh hợp lệ")
+
+    def column(dtype: str, offset: int):
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(rows,))
+
+    ts_ms = column("<i4", HEADER_SIZE + 8 * rows)
+    low = 0 if start_us is None else int(np.searchsorted(ts_ms, -(-(start_us - day_us) // 1000), "left"))
+    high = rows if end_us is None else int(np.searchsorted(ts_ms, -(-(end_us - day_us) // 1000), "left"))
+    result = {
+        "id": np.array(column("<i8", HEADER_SIZE)[low:high]),
+        "ts": day_us + ts_ms[low:high].astype(np.int64) * 1000,
+    }
+    offset = HEADER_SIZE + 12 * rows
+    for metric in METRICS:
+        raw = column("<i4", offset)[low:high]
+        result[metric] = np.where(raw == NULL, np.nan, raw / SCALE)
+        offset += 4 * rows
+    return result
+
+
+def iter_rows(columns: Dict[str, np.ndarray]) -> Iterator[Tuple[int, datetime, list]]:
+    """(id, timestamp, [temp, hum_air, hum_soil, light] với None = NULL) theo thứ tự trong file"""
+    metrics = [columns[metric].tolist() for metric in METRICS]
+    for i, (row_id, ts) in enumerate(zip(columns["id"].tolist(), columns["ts"].tolist())):
+        yield row_id, from_us(ts), [None if values[i] != values[i] else values[i] for values in metrics]
+
+
+# ================= 2. KHO LẠNH =================
+
+def _sensor_blocks():
+    """services/sensor_blocks.py import module này nên import muộn"""
+    from services.sensor_blocks import sensor_blocks
+    return sensor_blocks
+
+
+class ColdArchive:
+    def __init__(self, session_factory=SessionLocal, directory: str = settings.COLD_ARCHIVE_DIR,
+                 after_days: int = settings.COLD_ARCHIVE_AFTER_DAYS):
+        self._session_factory = session_factory
+        self.directory = os.path.abspath(directory)
+        self.after_days = after_days
+        self._lock = threading.Lock()  # Chỉ 1 luồng chuyển dữ liệu tại 1 thời điểm
+
+    # ---------------- Đọc ----------------
+    def chunks(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None,
+               device_id: Optional[str] = None, newest_first: bool = False) -> List[models.SensorArchiveChunk]:
+        """Các file có ngày giao [start, end) (danh mục không có dòng nào -> không tốn gì)"""
+        chunk = models.SensorArchiveChunk
+        query = db.query(chunk)
+        if device_id is not None:
+            query = query.filter(chunk.device_id == device_id)
+        if start is not None:
+            query = query.filter(chunk.last_ts >= start)
+        if end is not None:
+            query = query.filter(chunk.first_ts < end)
+        order = chunk.day.desc() if newest_first else chunk.day
+        return query.order_by(order, chunk.device_id).all()
+
+    def read(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None,
+             device_id: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """(device_id, các cột) của từng file trong [start, end)"""
+        start_us = None if start is None else to_us(start)
+        end_us = None if end is None else to_us(end)
+        for chunk in self.chunks(db, start, end, device_id):
+            columns = read_chunk(os.path.join(self.directory, chunk.path), start_us, end_us)
+            if len(columns["id"]):
+                yield chunk.device_id, columns
+
+    def readings(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[Tuple[str, datetime, list]]:
+        """(device_id, timestamp, [số đo]) của mọi bản ghi đã lưu kho trong [start, end)"""
+        for device_id, columns in self.read(db, start, end):
+            for _, ts, values in iter_rows(columns):
+                yield device_id, ts, values
+
+    def newest(self, db, device_id: str, start: Optional[datetime], end: Optional[datetime],
+               limit: Optional[int]) -> List[Tuple[int, datetime, list]]:
+        """Tối đa limit bản ghi mới nhất của 1 thiết bị trong [start, end) (mới -> cũ). Các ngày không chồng nhau: đủ thì dừng."""
+        result = []
+        start_us = None if start is None else to_us(start)
+        end_us = None if end is None else to_us(end)
+        for chunk in self.chunks(db, start, end, device_id, newest_first=True):
+            columns = read_chunk(os.path.join(self.directory, chunk.path), start_us, end_us)
+            result += reversed(list(iter_rows(columns)))
+            if limit is not None and len(result) >= limit:
+                return result[:limit]
+        return result
+
+    def first_time(self, db, after: Optional[datetime], before: datetime) -> Optional[datetime]:
+        """Mốc (có thể sớm hơn thực tế) của bản ghi lưu kho đầu tiên trong [after, before)"""
+        chunk = models.SensorArchiveChunk
+        query = db.query(func.min(chunk.first_ts)).filter(chunk.first_ts < before)
+        if after is not None:
+            query = query.filter(chunk.last_ts >= after)
+        first = query.scalar()
+        if first is None:
+            return None
+        return max(first, after) if after is not None else first
+
+    # ---------------- Chuyển dữ liệu nóng -> lạnh ----------------
+    def archive_once(self, now: Optional[datetime] = None) -> dict:
+        """Chuyển mọi ngày cũ hơn after_days khỏi sensor_data, mỗi ngày 1 transaction. Trả về {"days", "rows"}."""
+        result = {"days": 0, "rows": 0}
+        if self.after_days <= 0:
+            return result
+        cutoff = floor_day(now or datetime.now()) - timedelta(days=self.after_days)
+        with self._lock:
+            db = self._session_factory()
+            try:
+                while True:
+                    sd = sensor_partitions.sensor_entity(db, None, cutoff)
+                    oldest = _naive(db.query(func.min(sd.timestamp)).filter(sd.timestamp < cutoff).scalar())
+                    blocked = _sensor_blocks().first_time(db, None, cutoff)
+                    if blocked is not None and (oldest is None or blocked < oldest):
+                        oldest = blocked
+                    if oldest is None:
+                        break
+                    moved = self._archive_day(db, floor_day(oldest))
+                    if not moved:
+                        break
+                    result["days"] += 1
+                    result["rows"] += moved
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Lỗi chuyển dữ liệu vào kho lạnh: {e}", exc_info=True)
+            finally:
+                db.close()
+        if result["rows"]:
+            logger.info(f"🧊 Đã chuyển {result['rows']:,} bản ghi ({result['days']} ngày) trước {cutoff:%Y-%m-%d} vào kho lạnh")
+        return result
+
+    def _archive_day(self, db, day: datetime) -> int:
+        end = day + timedelta(days=1)
+        sd = sensor_partitions.sensor_entity(db, day, end)
+        rows = db.execute(
+            select(sd.id, sd.device_id, sd.timestamp, *(getattr(sd, metric) for metric in METRICS))
+            .where(sd.timestamp >= day, sd.timestamp < end)
+        ).all()
+        by_device: Dict[str, list] = {}
+        for row in rows:
+            by_device.setdefault(row[1], []).append(row)
+
+        by_columns: Dict[str, Dict[str, np.ndarray]] = {}
+        for device_id, device_rows in by_device.items():
+            columns = {
+                "id": np.array([r[0] for r in device_rows], dtype=np.int64),
+                "ts": np.array([to_us(r[2]) for r in device_rows], dtype=np.int64),
+            }
+            for i, metric in enumerate(METRICS):
+                columns[metric] = np.array([np.nan if r[3 + i] is None else r[3 + i] for r in device_rows], dtype=np.float64)
+            by_columns[device_id] = columns
+        # Các giờ của ngày đã nén ở sensor_blocks
+        blocked = 0
+        for device_id, columns in _sensor_blocks().read(db, day, end):
+            blocked += len(columns["id"])
+            if device_id in by_columns:
+                columns = {key: np.concatenate([by_columns[device_id][key], columns[key]]) for key in columns}
+            by_columns[device_id] = columns
+        for device_id, columns in by_columns.items():
+            self._write(db, device_id, day, columns)
+
+        ids = [row[0] for row in rows]
+        deleted = sensor_partitions.delete_sensor_ids(db, ids, day, end)
+        if deleted != len(ids):
+            # Không xóa được hết -> dừng để không lặp mãi ở cùng 1 ngày
+            db.rollback()
+            logger.error(f"❌ Kho lạnh {day:%Y-%m-%d}: chỉ xóa được {deleted}/{len(ids)} bản ghi khỏi sensor_data")
+            return 0
+        if blocked:
+            _sensor_blocks().delete(db, day, end)
+        db.commit()
+        return len(ids) + blocked
+
+    def _write(self, db, device_id: str, day: datetime, columns: Dict[str, np.ndarray]):
+        """Ghi (hoặc gộp thêm vào) file của 1 thiết bị / 1 ngày và cập nhật danh mục (chưa commit)"""
+        existing = db.get(models.SensorArchiveChunk, (device_id, day))
+        relative = f"{day:%Y%m%d}/{quote(device_id, safe='')}.sfa"
+        path = os.path.join(self.directory, relative)
+        if existing is not None:
+            # Bản ghi tới muộn của ngày đã lưu kho: gộp với file cũ, bỏ trùng id (lần chạy trước lỗi giữa chừng)
+            old = read_chunk(os.path.join(self.directory, existing.path))
+            columns = {key: np.concatenate([old[key], columns[key]]) for key in columns}
+            _, unique = np.unique(columns["id"], return_index=True)
+            columns = {key: value[unique] for key, value in columns.items()}
+        order = np.lexsort((columns["id"], columns["ts"]))
+        columns = {key: value[order] for key, value in columns.items()}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_chunk(path, day, columns)
+        db.merge(models.SensorArchiveChunk(
+            device_id=device_id, day=day, path=relative, rows=len(columns["id"]),
+            first_ts=from_us(columns["ts"][0]), last_ts=from_us(columns["ts"][-1]),
+        ))
+
+    def status(self, db) -> dict:
+        chunk = models.SensorArchiveChunk
+        files, rows, first, last = db.query(func.count(), func.sum(chunk.rows), func.min(chunk.day), func.max(chunk.day)).one()
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(self.directory) for name in names)
+        return {"files": files, "rows": rows or 0, "first_day": first, "last_day": last, "bytes": size}
+
+
+# Dùng chung cho toàn bộ tiến trình (main.py chạy nền mỗi COLD_ARCHIVE_INTERVAL_SECONDS)
+cold_archive = ColdArchive()
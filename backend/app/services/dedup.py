@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+from core.config import settings
+
+
+class DedupWindow:
+    """
+    Chặn gói tin bị gửi lại (QoS 1 + Wi-Fi chập chờn -> cùng 1 bản ghi tới 2 lần).
+    Mỗi thiết bị nhớ tối đa per_device khóa gần nhất (seq hoặc ts của thiết bị), mỗi khóa sống ttl_seconds:
+    thiết bị khởi động lại đếm seq từ 0 sau khi khóa cũ hết hạn sẽ không bị chặn nhầm.
+    Số thiết bị được nhớ cũng có giới hạn (bỏ thiết bị lâu không gửi nhất - LRU).
+    Cửa sổ nằm trong bộ nhớ của từng tiến trình: chỉ chặn được bản gửi lại tới CÙNG tiến trình. ingest_worker.py
+    --mode hash (mỗi thiết bị chỉ 1 worker giữ) chặn đủ; --mode shared thì Broker có thể giao bản gửi lại cho worker
+    khác -> bản đó vẫn được lưu (trùng trong sensor_data), dùng --mode hash nếu cần chống trùng tuyệt đối.
+    """
+
+    def __init__(self, per_device: int = settings.INGEST_DEDUP_WINDOW,
+                 ttl_seconds: float = settings.INGEST_DEDUP_SECONDS,
+                 max_devices: int = settings.INGEST_DEDUP_MAX_DEVICES):
+        self.per_device = per_device
+        self.ttl = ttl_seconds
+        self.max_devices = max_devices
+        # device_id -> (khóa -> hạn, vòng khóa theo thứ tự nhận)
+        self._devices: "OrderedDict[str, Tuple[Dict[Hashable, float], Deque[Tuple[Hashable, float]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicate_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_device > 0
+
+    def is_duplicate(self, device_id: str, key: Hashable, now: Optional[float] = None) -> bool:
+        """
+        True nếu (device_id, key) đã ghi nhớ và còn hạn (gói trùng). Không ghi nhớ gì:
+        Ingest Writer chỉ gọi remember() sau khi bản ghi đã COMMIT, gói chưa lưu được mà thiết bị gửi lại vẫn được nhận.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            return self._is_duplicate(device_id, key, now)
+
+    def remember(self, device_id: str, key: Hashable, now: Optional[float] = None):
+        """Ghi nhớ khóa của bản ghi đã lưu"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._remember(device_id, key, now)
+
+    def count_duplicate(self):
+        """Gói trùng do nơi gọi tự phát hiện (vd. 2 bản cùng khóa trong 1 lô chưa COMMIT)"""
+        with self._lock:
+            self.duplicate_count += 1
+
+    def _is_duplicate(self, device_id: str, key: Hashable, now: float) -> bool:
+        entry = self._devices.get(device_id)
+        if entry is None:
+            return False
+        expires = entry[0].get(key)
+        if expires is not None and expires > now:
+            self.duplicate_count += 1
+            return True
+        return False
+
+    def _remember(self, device_id: str, key: Hashable, now: float):
+        entry = self._devices.get(device_id)
+        if entry is None:
+            entry = self._devices[device_id] = ({}, deque())
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+        keys, ring = entry
+
+        # Bỏ khóa đã hết hạn hoặc vượt quá sức chứa của vòng
+        while ring and (ring[0][1] <= now or len(ring) >= self.per_device):
+            old_key, old_expires = ring.popleft()
+            if keys.get(old_key) == old_expires:
+                del keys[old_key]
+
+        expires = now + self.ttl
+        keys[key] = expires
+        ring.append((key, expires))
+
+    def tracked_devices(self) -> int:
+        return len(self._devices)
@@ -0,0 +1,159 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Iterable
+
+from core.config import settings
+from db.session import SessionLocal
+from models import models
+
+from core.logger import get_logger
+
+logger = get_logger("Device_Registry")
+
+# Thiết bị lạ (chưa đăng ký) được nhớ trong bao lâu trước khi hỏi lại DB
+UNKNOWN_DEVICE_TTL_SECONDS = 30
+
+
+class DeviceRecord:
+    """Bản sao gọn nhẹ của 1 dòng trong bảng devices (chỉ các trường Ingest cần)"""
+    __slots__ = ("device_id", "status", "zone_id", "pump_state", "light_state", "mist_state", "last_seen")
+
+    def __init__(self, device_id: str, status, zone_id: Optional[int] = None,
+                 pump_state: bool = False, light_state: bool = False, mist_state: bool = False,
+                 last_seen: Optional[datetime] = None):
+        self.device_id = device_id
+        self.status = status
+        self.zone_id = zone_id
+        self.pump_state = pump_state
+        self.light_state = light_state
+        self.mist_state = mist_state
+        self.last_seen = last_seen
+
+    @classmethod
+    def from_model(cls, device: models.Device) -> "DeviceRecord":
+        return cls(
+            device_id=device.device_id,
+            status=device.status or models.DeviceStatus.OFFLINE,
+            zone_id=device.zone_id,
+            pump_state=bool(device.pump_state),
+            light_state=bool(device.light_state),
+            mist_state=bool(device.mist_state),
+            last_seen=device.last_seen,
+        )
+
+
+class DeviceRegistry:
+    """
+    Bộ nhớ đệm device_id -> DeviceRecord dùng chung cho cả tiến trình.
+    - Ingest hỏi Registry trước, chỉ chạm DB khi gặp device_id chưa có trong bộ nhớ.
+    - Thiết bị lạ được nhớ tạm (negative cache) để không bị spam SELECT.
+    - CRUD thiết bị/zone gọi invalidate() để lần sau nạp lại từ DB.
+    - invalidate() chỉ có tác dụng trong tiến trình gọi nó: Watchdog của API đổi OFFLINE, API bật bơm...
+      không tới được Registry của Ingest Worker -> Writer gọi refresh_if_due() để nạp lại toàn bộ
+      mỗi refresh_seconds (nếu không, worker tưởng thiết bị vẫn ONLINE và không bao giờ ghi lại ONLINE).
+    """
+
+    def __init__(self, session_factory=SessionLocal, unknown_ttl: float = UNKNOWN_DEVICE_TTL_SECONDS,
+                 refresh_seconds: float = settings.DEVICE_REGISTRY_REFRESH_SECONDS):
+        self._session_factory = session_factory
+        self._unknown_ttl = unknown_ttl
+        self.refresh_seconds = refresh_seconds
+        self._records: Dict[str, DeviceRecord] = {}
+        self._unknown: Dict[str, float] = {}  # device_id -> hạn hết nhớ (monotonic)
+        self._lock = threading.RLock()
+        self._loaded_at = time.monotonic()
+
+    # ---------------- ĐỌC ----------------
+    def get(self, device_id: str) -> Optional[DeviceRecord]:
+        """Trả về bản ghi thiết bị, hoặc None nếu thiết bị không tồn tại trong CSDL"""
+        with self._lock:
+            record = self._records.get(device_id)
+            if record is not None:
+                return record
+            expires = self._unknown.get(device_id)
+            if expires is not None and expires > time.monotonic():
+                return None
+
+        # Cache miss -> hỏi DB đúng 1 lần
+        db = self._session_factory()
+        try:
+            device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
+            record = DeviceRecord.from_model(device) if device else None
+        finally:
+            db.close()
+
+        with self._lock:
+            if record is None:
+                self._unknown[device_id] = time.monotonic() + self._unknown_ttl
+            else:
+                self._unknown.pop(device_id, None)
+                # Nếu luồng khác đã nạp trước thì giữ bản đó (có thể mới hơn)
+                record = self._records.setdefault(device_id, record)
+        return record
+
+    def is_known(self, device_id: str) -> bool:
+        return self.get(device_id) is not None
+
+    def load_all(self, db=None):
+        """Nạp toàn bộ thiết bị vào bộ nhớ (gọi lúc khởi động)"""
+        records = self._reload(db)
+        logger.info(f"📇 Device Registry loaded {len(records)} devices")
+
+    def refresh_if_due(self) -> bool:
+        """Nạp lại từ DB nếu đã quá refresh_seconds kể từ lần nạp trước (Writer gọi giữa 2 lô)"""
+        if self.refresh_seconds <= 0 or time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return False
+        try:
+            records = self._reload()
+        except Exception as e:
+            # DB lỗi: giữ bản cũ, thử lại ở chu kỳ sau
+            self._loaded_at = time.monotonic()
+            logger.error(f"❌ Không nạp lại được Device Registry: {e}")
+            return False
+        logger.debug(f"📇 Device Registry refreshed {len(records)} devices")
+        return True
+
+    def _reload(self, db=None) -> Dict[str, DeviceRecord]:
+        own_session = db is None
+        db = db or self._session_factory()
+        try:
+            records = {d.device_id: DeviceRecord.from_model(d) for d in db.query(models.Device).all()}
+        finally:
+            if own_session:
+                db.close()
+        with self._lock:
+            self._records = records
+            self._unknown.clear()
+            self._loaded_at = time.monotonic()
+        return records
+
+    # ---------------- GHI ----------------
+    def update(self, device_id: str, **fields):
+        """Cập nhật bản sao trong bộ nhớ sau khi DB đã (hoặc sắp) được ghi"""
+        with self._lock:
+            record = self._records.get(device_id)
+            if record is None:
+                return
+            for field, value in fields.items():
+                setattr(record, field, value)
+
+    def invalidate(self, device_id: Optional[str] = None):
+        """Xóa 1 thiết bị (hoặc toàn bộ nếu không truyền) để lần sau nạp lại từ DB"""
+        with self._lock:
+            if device_id is None:
+                self._records.clear()
+                self._unknown.clear()
+            else:
+                self._records.pop(device_id, None)
+                self._unknown.pop(device_id, None)
+
+    def invalidate_many(self, device_ids: Iterable[str]):
+        with self._lock:
+            for device_id in device_ids:
+                self._records.pop(device_id, None)
+                self._unknown.pop(device_id, None)
+
+
+# Registry dùng chung cho toàn bộ tiến trình
+device_registry = DeviceRegistry()
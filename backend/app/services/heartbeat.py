@@ -0,0 +1,81 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from core.config import settings
+from db.session import SessionLocal
+from crud import device as crud_device
+
+from core.logger import get_logger
+
+logger = get_logger("Heartbeat")
+
+
+class HeartbeatFlusher:
+    """
+    Gom nhịp tim (last_seen) của thiết bị trong bộ nhớ rồi ghi 1 câu UPDATE mỗi chu kỳ.
+    - Mỗi gói tin chỉ gọi touch() (không chạm DB).
+    - Chuyển trạng thái (OFFLINE->ONLINE, ->ERROR) vẫn do Ingest Writer ghi ngay.
+    - Watchdog và API /devices đọc pending_last_seen()/flush() để thấy giá trị mới nhất.
+    """
+
+    def __init__(self, session_factory=SessionLocal, interval_seconds: float = settings.HEARTBEAT_FLUSH_SECONDS):
+        self._session_factory = session_factory
+        self.interval = interval_seconds
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Chỉ 1 luồng được flush tại 1 thời điểm
+        self._last_flush = time.monotonic()
+
+    def touch(self, device_id: str, seen_at: datetime):
+        """Ghi nhận nhịp tim trong bộ nhớ (giữ mốc thời gian mới nhất)"""
+        with self._lock:
+            current = self._pending.get(device_id)
+            if current is None or seen_at > current:
+                self._pending[device_id] = seen_at
+
+    def pending_last_seen(self, device_id: str) -> Optional[datetime]:
+        """last_seen chưa kịp ghi xuống DB (None nếu không có)"""
+        with self._lock:
+            return self._pending.get(device_id)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush_if_due(self) -> int:
+        if time.monotonic() - self._last_flush < self.interval:
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """Ghi toàn bộ nhịp tim đang chờ bằng 1 câu UPDATE (executemany theo khóa chính)"""
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+
+            db = self._session_factory()
+            try:
+                crud_device.update_devices_bulk(
+                    db, [{"device_id": device_id, "last_seen": seen_at} for device_id, seen_at in pending.items()]
+                )
+                db.commit()
+                logger.debug(f"💓 Flushed heartbeats for {len(pending)} devices")
+                return len(pending)
+            except Exception as e:
+                db.rollback()
+                # Trả lại bộ nhớ để lần sau ghi tiếp (không làm mất nhịp tim)
+                for device_id, seen_at in pending.items():
+                    self.touch(device_id, seen_at)
+                logger.error(f"❌ Lỗi ghi nhịp tim thiết bị: {e}")
+                return 0
+            finally:
+                db.close()
+
+
+# Bộ gom nhịp tim dùng chung cho toàn bộ tiến trình
+heartbeat_flusher = HeartbeatFlusher()
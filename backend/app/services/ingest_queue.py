@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from core.config import settings
+
+from core.logger import get_logger
+
+logger = get_logger("Ingest_Queue")
+
+# Các chính sách khi hàng đợi quá tải (INGEST_OVERLOAD_POLICY)
+POLICY_BLOCK = "block"               # Chờ Writer rút bớt (tối đa block_timeout), hết hạn thì xử như drop_oldest
+POLICY_DROP_OLDEST = "drop_oldest"   # Bỏ bản ghi cũ nhất, ưu tiên bỏ bản ghi đã có bản mới hơn của cùng thiết bị
+POLICY_SAMPLE = "sample"             # Quá ngưỡng: mỗi thiết bị chỉ giữ 1 bản ghi / sample_seconds (bản mới thay bản cũ)
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SAMPLE)
+
+# Lý do bị bỏ (dùng làm nhãn cho bộ đếm)
+DROP_SUPERSEDED = "superseded"   # Đã có bản ghi mới hơn của cùng thiết bị trong hàng đợi
+DROP_OLDEST = "oldest"           # Hàng đợi đầy toàn thiết bị khác nhau -> bỏ bản ghi cũ nhất
+DROP_SAMPLED = "sampled"         # Bị lấy mẫu (policy sample)
+
+# Số phần tử tối đa được duyệt từ đầu hàng đợi để tìm bản ghi "đã cũ" trước khi bỏ bản cũ nhất
+EVICT_SCAN_LIMIT = 256
+
+
+class IngestQueue:
+    """
+    Hàng đợi có giới hạn giữa on_message (MQTT) và Ingest Writer, có chính sách quá tải rõ ràng.
+    Nguyên tắc chung: bản ghi MỚI NHẤT của mỗi thiết bị luôn được ưu tiên giữ hơn lịch sử,
+    vì nó quyết định trạng thái thiết bị (ONLINE/ERROR, bơm, đèn...) và dữ liệu AI đọc.
+
+    Mỗi phần tử là 1 ô [reading]; bỏ 1 bản ghi ở giữa hàng = đặt ô về None (không phải dịch mảng),
+    get() tự bỏ qua các ô rỗng.
+    """
+
+    def __init__(self, maxsize: int = settings.INGEST_QUEUE_SIZE,
+                 policy: str = settings.INGEST_OVERLOAD_POLICY,
+                 block_timeout_ms: int = settings.INGEST_BLOCK_TIMEOUT_MS,
+                 sample_seconds: float = settings.INGEST_SAMPLE_SECONDS,
+                 sample_watermark: float = settings.INGEST_SAMPLE_WATERMARK):
+        if policy not in POLICIES:
+            raise ValueError(f"INGEST_OVERLOAD_POLICY phải là một trong {POLICIES}, nhận được '{policy}'")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout_ms / 1000.0
+        self.sample_seconds = sample_seconds
+        self.sample_threshold = int(maxsize * sample_watermark)
+
+        self._items: Deque[list] = deque()
+        self._by_device: Dict[str, Deque[list]] = {}   # device_id -> các ô đang chờ (cũ -> mới)
+        self._last_accepted: Dict[str, float] = {}      # device_id -> lần nhận gần nhất (policy sample)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        # Bộ đếm
+        self.enqueued_count = 0
+        self.blocked_count = 0
+        self.dropped: Dict[str, int] = {DROP_SUPERSEDED: 0, DROP_OLDEST: 0, DROP_SAMPLED: 0}
+        self.high_water = 0
+
+    # ---------------- Trạng thái ----------------
+    def qsize(self) -> int:
+        return self._size
+
+    @property
+    def dropped_count(self) -> int:
+        return sum(self.dropped.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "queued": self._size,
+                "capacity": self.maxsize,
+                "high_water": self.high_water,
+                "enqueued": self.enqueued_count,
+                "blocked": self.blocked_count,
+                "dropped": dict(self.dropped),
+                "dropped_total": sum(self.dropped.values()),
+            }
+
+    # ---------------- Phía nhận MQTT ----------------
+    def put(self, reading) -> bool:
+        """
+        Đẩy 1 bản ghi vào hàng đợi. Trả về False nếu chính bản ghi này bị bỏ (policy sample).
+        Chỉ policy block mới có thể chặn luồng gọi (tối đa block_timeout).
+        """
+        device_id = reading.device_id
+        with self._lock:
+            pending = self._by_device.get(device_id)
+
+            # Policy sample: quá ngưỡng thì mỗi thiết bị chỉ được thêm 1 bản ghi mỗi sample_seconds,
+            # bản ghi đến sớm hơn sẽ THAY bản đang chờ của thiết bị đó (giữ bản mới nhất)
+            if self.policy == POLICY_SAMPLE and self._size >= self.sample_threshold:
+                now = time.monotonic()
+                if now - self._last_accepted.get(device_id, 0.0) < self.sample_seconds:
+                    self.dropped[DROP_SAMPLED] += 1
+                    if pending:
+                        pending[-1][0] = reading
+                        return True
+                    return False
+                self._last_accepted[device_id] = now
+            elif self.policy == POLICY_SAMPLE:
+                self._last_accepted[device_id] = time.monotonic()
+
+            if self._size >= self.maxsize and self.policy == POLICY_BLOCK:
+                self.blocked_count += 1
+                self._not_full.wait_for(lambda: self._size < self.maxsize, self.block_timeout)
+                pending = self._by_device.get(device_id)
+
+            if self._size >= self.maxsize:
+                self._evict(pending)
+                pending = self._by_device.get(device_id)
+
+            cell = [reading]
+            self._items.append(cell)
+            if pending is None:
+                pending = self._by_device[device_id] = deque()
+            pending.append(cell)
+            self._size += 1
+            self.enqueued_count += 1
+            if self._size > self.high_water:
+                self.high_water = self._size
+
+            # Quá nhiều ô rỗng (bị bỏ giữa hàng) -> dọn 1 lần để bộ nhớ không phình
+            if len(self._items) > 2 * self.maxsize:
+                self._items = deque(c for c in self._items if c[0] is not None)
+
+            self._not_empty.notify()
+            return True
+
+    def _evict(self, pending: Optional[Deque[list]]):
+        """Hàng đợi đầy: bỏ 1 bản ghi, ưu tiên bản đã có bản mới hơn của cùng thiết bị"""
+        # 1. Thiết bị đang gửi còn bản ghi chờ -> bản cũ nhất của nó sắp bị bản mới thay thế
+        if pending:
+            self._discard(pending[0], DROP_SUPERSEDED)
+            return
+
+        # 2. Tìm từ đầu hàng bản ghi của thiết bị có >= 2 bản đang chờ
+        for scanned, cell in enumerate(self._items):
+            if scanned >= EVICT_SCAN_LIMIT:
+                break
+            reading = cell[0]
+            if reading is not None and len(self._by_device[reading.device_id]) > 1:
+                self._discard(cell, DROP_SUPERSEDED)
+                return
+
+        # 3. Toàn bản ghi mới nhất của các thiết bị khác nhau -> đành bỏ bản cũ nhất
+        while self._items:
+            cell = self._items[0]
+            if cell[0] is None:
+                self._items.popleft()
+                continue
+            self._discard(cell, DROP_OLDEST)
+            return
+
+    def _discard(self, cell: list, reason: str):
+        device_id = cell[0].device_id
+        pending = self._by_device[device_id]
+        if pending[0] is cell:
+            pending.popleft()
+        else:
+            # So sánh bằng "is": 2 bản ghi giống hệt nhau vẫn là 2 ô khác nhau
+            for index, other in enumerate(pending):
+                if other is cell:
+                    del pending[index]
+                    break
+        if not pending:
+            del self._by_device[device_id]
+        cell[0] = None
+        self._size -= 1
+        self.dropped[reason] += 1
+
+    # ---------------- Phía Writer ----------------
+    def _pop(self):
+        while True:
+            cell = self._items.popleft()
+            reading = cell[0]
+            if reading is None:
+                continue
+            pending = self._by_device[reading.device_id]
+            pending.popleft()
+            if not pending:
+                del self._by_device[reading.device_id]
+            self._size -= 1
+            self._not_full.notify()
+            return reading
+
+    def get(self, timeout: Optional[float] = None):
+        """Lấy bản ghi cũ nhất, chờ tối đa timeout giây. Ném queue.Empty nếu không có."""
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._size > 0, timeout):
+                raise queue.Empty
+            return self._pop()
+
+    def get_nowait(self):
+        with self._lock:
+            if self._size == 0:
+                raise queue.Empty
+            return self._pop()
+
+    def drain(self, limit: int) -> List:
+        """Lấy tối đa limit bản ghi trong 1 lần khóa"""
+        with self._lock:
+            batch = []
+            while self._size and len(batch) < limit:
+                batch.append(self._pop())
+            return batch
@@ -0,0 +1,362 @@
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional, List
+
+from sqlalchemy import exc as sa_exc
+
+from core.config import settings
+from core.metrics import INGEST_MESSAGES, STAGE_DB_WRITE, metrics
+from db.session import SessionLocal
+from models import models
+from crud import device as crud_device
+from services.dedup import DedupWindow
+from services.device_registry import DeviceRegistry, device_registry
+from services.heartbeat import HeartbeatFlusher, heartbeat_flusher
+from services.ingest_queue import IngestQueue
+from services.payload_crypto import payload_decryptor
+from services.rollup import mark_late
+from services.timeseries import TimeSeriesStore, timeseries_store
+
+from core.logger import get_logger
+
+logger = get_logger("Ingest_Writer")
+
+# =========================================================================
+# 1. BẢN GHI CẢM BIẾN ĐÃ GIẢI MÃ (Gọn nhẹ, không dính tới Session DB)
+# =========================================================================
+class SensorReading(NamedTuple):
+    """Một gói tin cảm biến đã giải mã xong, đang chờ Writer ghi xuống DB"""
+    device_id: str
+    temp: float
+    hum_air: float
+    hum_soil: float
+    light: float
+    pump_state: Optional[bool]   # None = gói tin không gửi kèm trạng thái bơm
+    light_state: Optional[bool]
+    mist_state: Optional[bool]
+    is_error: bool               # True = số liệu bất thường (cảm biến hỏng)
+    received_at: datetime        # Thời điểm Server nhận được gói tin (giờ địa phương, không kèm múi giờ = sensor_data.timestamp)
+    dedup_key: Optional[float] = None   # "seq" hoặc "ts" do thiết bị gửi kèm (None = không chống trùng được)
+
+
+# =========================================================================
+# 2. WRITER CHẠY NGẦM: GOM LÔ -> 1 LẦN INSERT -> 1 LẦN COMMIT
+# =========================================================================
+class IngestWriter:
+    """
+    on_message chỉ việc put() vào hàng đợi (có giới hạn, chính sách quá tải: services/ingest_queue.py).
+    Luồng Writer rút hàng đợi và ghi xuống DB khi:
+    - Gom đủ batch_size bản ghi, HOẶC
+    - Quá flush_ms mili-giây kể từ bản ghi đầu tiên của lô.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        registry: DeviceRegistry = device_registry,
+        heartbeats: HeartbeatFlusher = heartbeat_flusher,
+        max_queue: int = settings.INGEST_QUEUE_SIZE,
+        batch_size: int = settings.INGEST_BATCH_SIZE,
+        flush_ms: int = settings.INGEST_FLUSH_MS,
+        policy: str = settings.INGEST_OVERLOAD_POLICY,
+        dedup: Optional[DedupWindow] = None,
+        store: TimeSeriesStore = timeseries_store,
+        retry_backoff_ms: int = settings.INGEST_RETRY_BACKOFF_MS,
+        retry_max_ms: int = settings.INGEST_RETRY_MAX_MS,
+        retry_on_stop: int = settings.INGEST_RETRY_ON_STOP,
+    ):
+        self._session_factory = session_factory
+        self._store = store
+        self._registry = registry
+        self._heartbeats = heartbeats
+        self._queue = IngestQueue(maxsize=max_queue, policy=policy)
+        self._dedup = dedup or DedupWindow()
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.retry_backoff = retry_backoff_ms / 1000.0
+        self.retry_max = retry_max_ms / 1000.0
+        self.retry_on_stop = retry_on_stop
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Bộ đếm đơn giản để theo dõi
+        self.saved_count = 0
+        self.rejected_count = 0
+        self._overload_logged_at = 0.0
+
+    # ---------------- API cho phía nhận MQTT ----------------
+    def put(self, reading: SensorReading) -> bool:
+        """
+        Đẩy 1 bản ghi vào hàng đợi. Chỉ chặn luồng MQTT khi INGEST_OVERLOAD_POLICY=block.
+        Bản ghi trùng với bản đã lưu (thiết bị gửi lại cùng seq/ts) bị bỏ ngay tại đây, không tới được DB.
+        """
+        key = reading.dedup_key
+        if key is not None and self._dedup.enabled and self._dedup.is_duplicate(reading.device_id, key):
+            INGEST_MESSAGES.inc("duplicate")
+            return False
+
+        dropped_before = self._queue.dropped_count
+        accepted = self._queue.put(reading)
+        if self._queue.dropped_count != dropped_before:
+            # Quá tải: log tối đa 1 lần / 10 giây để log không làm nặng thêm
+            now = time.monotonic()
+            if now - self._overload_logged_at >= 10:
+                self._overload_logged_at = now
+                logger.warning(f"⚠️ Hàng đợi Ingest quá tải ({self._queue.policy}): {self._queue.stats()}")
+        return accepted
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def dropped_count(self) -> int:
+        return self._queue.dropped_count
+
+    def stats(self) -> dict:
+        """Bộ đếm của Writer + hàng đợi (cho API theo dõi)"""
+        return {
+            "saved": self.saved_count,
+            "rejected": self.rejected_count,
+            "duplicates": self._dedup.duplicate_count,
+            "queue": self._queue.stats(),
+        }
+
+    # ---------------- Vòng đời ----------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"💾 Ingest Writer started (batch={self.batch_size}, flush={int(self.flush_interval * 1000)}ms)")
+
+    def stop(self, timeout: float = 5.0):
+        """Dừng Writer và ghi nốt những gì còn trong hàng đợi"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush_pending()
+        self._heartbeats.flush()
+        logger.info(f"🛑 Ingest Writer stopped (saved={self.saved_count}, rejected={self.rejected_count}, dropped={self.dropped_count})")
+
+    def flush_pending(self):
+        """Rút sạch hàng đợi và ghi ngay (dùng khi tắt server hoặc khi test)"""
+        batch = self._drain(self.batch_size)
+        while batch:
+            self.write_batch(batch)
+            batch = self._drain(self.batch_size)
+
+    # ---------------- Luồng chạy ngầm ----------------
+    def _drain(self, limit: int) -> List[SensorReading]:
+        return self._queue.drain(limit)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # Đến chu kỳ thì ghi gộp nhịp tim (last_seen) của mọi thiết bị
+            self._heartbeats.flush_if_due()
+            # Trạng thái thiết bị do tiến trình khác đổi (Watchdog, API điều khiển) -> nạp lại định kỳ
+            self._registry.refresh_if_due()
+            # Khóa AES riêng do API của tiến trình khác đổi
+            payload_decryptor.refresh_if_due()
+
+            # Chờ bản ghi đầu tiên của lô (thức dậy định kỳ để kiểm tra cờ dừng)
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Gom tiếp cho tới khi đủ lô hoặc hết hạn T mili-giây
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.write_batch(batch)
+
+    # ---------------- Ghi xuống DB ----------------
+    def write_batch(self, batch: List[SensorReading]) -> int:
+        """
+        Ghi 1 lô, DB lỗi thì KHÔNG bỏ lô:
+        - Lỗi tạm thời (mất kết nối, "database is locked", hết chờ kết nối ghi...): thử lại cùng lô, chờ tăng dần
+          từ retry_backoff tới retry_max, tới khi ghi được (đang tắt Writer thì chỉ thử thêm retry_on_stop lần).
+          Trong lúc chờ, hàng đợi đầy thì chính sách quá tải xử lý như khi DB chậm.
+        - Lỗi khác (bản ghi vi phạm ràng buộc...): chia đôi lô và ghi từng nửa -> chỉ bỏ đúng bản ghi gây lỗi.
+        Khóa chống trùng chỉ được ghi nhớ sau COMMIT: bản ghi chưa lưu được mà thiết bị gửi lại (QoS 1) vẫn được nhận.
+        Kho không transaction (columnar) chỉ được ghi sau COMMIT -> thử lại / chia đôi không ghi trùng.
+        Trả về số bản ghi SensorData đã lưu.
+        """
+        if not batch:
+            return 0
+        delay = self.retry_backoff
+        attempt = 0
+        while True:
+            try:
+                return self._write_once(batch)
+            except Exception as e:
+                attempt += 1
+                transient = _is_transient(e)
+                if transient and (not self._stop_event.is_set() or attempt <= self.retry_on_stop):
+                    INGEST_MESSAGES.inc("db_retry", amount=len(batch))
+                    logger.warning(f"⚠️ DB lỗi khi ghi lô {len(batch)} bản ghi (lần {attempt}), thử lại sau {delay:.1f}s: {e}")
+                    self._stop_event.wait(delay)
+                    delay = min(delay * 2, self.retry_max)
+                    continue
+                if not transient and len(batch) > 1:
+                    middle = len(batch) // 2
+                    return self.write_batch(batch[:middle]) + self.write_batch(batch[middle:])
+                INGEST_MESSAGES.inc("db_error", amount=len(batch))
+                logger.error(f"❌ Bỏ lô dữ liệu cảm biến ({len(batch)} bản ghi) sau {attempt} lần ghi lỗi: {e}", exc_info=True)
+                return 0
+
+    def _write_once(self, batch: List[SensorReading]) -> int:
+        """
+        Xử lý 1 lô: trạng thái thiết bị quyết định trong bộ nhớ (Device Registry).
+        Chỉ thiết bị ĐỔI trạng thái mới bị UPDATE ngay; nhịp tim thường do
+        Heartbeat Flusher gom lại. Sau đó 1 câu INSERT SensorData, 1 câu upsert
+        device_latest_reading, 1 lần COMMIT. Lỗi DB: rollback rồi ném lại cho write_batch.
+        """
+        started = time.perf_counter()
+        db = self._session_factory()
+        device_changes = {}  # device_id -> các cột cần UPDATE trong bảng devices
+        try:
+            rows = []
+            rejected = 0
+            duplicates = 0
+            keys = set()  # Khóa chống trùng của lô, ghi nhớ sau COMMIT
+            for r in batch:
+                # Bản gửi lại tới trước khi bản gốc kịp COMMIT: cùng lô, hoặc lô trước vừa lưu xong
+                if r.dedup_key is not None and self._dedup.enabled:
+                    key = (r.device_id, r.dedup_key)
+                    if key in keys:
+                        self._dedup.count_duplicate()
+                        duplicates += 1
+                        continue
+                    if self._dedup.is_duplicate(r.device_id, r.dedup_key):
+                        duplicates += 1
+                        continue
+                    keys.add(key)
+
+                # Hỏi Registry trong bộ nhớ, chỉ chạm DB khi gặp thiết bị chưa nạp
+                record = self._registry.get(r.device_id)
+                if record is None:
+                    rejected += 1
+                    logger.warning(f"⚠️ Mạch '{r.device_id}' gửi dữ liệu nhưng không tồn tại trong CSDL!")
+                    continue
+
+                # Nhịp tim luôn chỉ ghi nhận trong bộ nhớ, Heartbeat Flusher sẽ gom lại ghi sau
+                self._heartbeats.touch(r.device_id, r.received_at)
+
+                # CƠ CHẾ 1: PHÁT HIỆN LỖI -> chuyển ERROR, KHÔNG lưu dữ liệu rác
+                if r.is_error:
+                    if record.status != models.DeviceStatus.ERROR:
+                        logger.warning(f"🛠️ [LỖI PHẦN CỨNG] Mạch '{r.device_id}' gửi dữ liệu bất thường (T={r.temp}, H={r.hum_soil}). Đã chuyển sang ERROR!")
+                        # Chuyển trạng thái -> ghi NGAY trong lô này
+                        changes = device_changes.setdefault(r.device_id, {"device_id": r.device_id})
+                        changes["status"] = models.DeviceStatus.ERROR
+                        changes["last_seen"] = r.received_at
+                    self._registry.update(r.device_id, status=models.DeviceStatus.ERROR, last_seen=r.received_at)
+                    continue
+
+                # CƠ CHẾ 2: PHỤC HỒI & GIA HẠN SỰ SỐNG
+                actuators = {
+                    field: value
+                    for field, value in (("pump_state", r.pump_state), ("light_state", r.light_state), ("mist_state", r.mist_state))
+                    if value is not None and value != getattr(record, field)
+                }
+                if record.status != models.DeviceStatus.ONLINE or actuators:
+                    if record.status in (models.DeviceStatus.OFFLINE, models.DeviceStatus.ERROR):
+                        logger.info(f"🎉 [PHỤC HỒI] Mạch '{r.device_id}' đã hoạt động bình thường trở lại!")
+                    changes = device_changes.setdefault(r.device_id, {"device_id": r.device_id})
+                    changes["status"] = models.DeviceStatus.ONLINE
+                    changes["last_seen"] = r.received_at
+                    changes.update(actuators)
+                self._registry.update(r.device_id, status=models.DeviceStatus.ONLINE, last_seen=r.received_at, **actuators)
+
+                rows.append({
+                    "device_id": r.device_id,
+                    "timestamp": r.received_at,
+                    "temp": r.temp,
+                    "hum_air": r.hum_air,
+                    "hum_soil": r.hum_soil,
+                    "light": r.light,
+                })
+
+            crud_device.update_devices_bulk(db, list(device_changes.values()))
+            if self._store.transactional:
+                self._store.append(db, rows)
+            # Số liệu mới nhất ghi cùng transaction -> không bao giờ lệch với sensor_data
+            crud_device.upsert_latest_readings(db, rows)
+            if rows:
+                # Lô tồn đọng lâu (DB nghẽn) -> báo RollupCompactor gộp lại các khung đã qua watermark
+                mark_late(db, min(row["timestamp"] for row in rows))
+            db.commit()
+            for device_id, key in keys:
+                self._dedup.remember(device_id, key)
+            if not self._store.transactional:
+                self._append_after_commit(rows)
+
+            self.saved_count += len(rows)
+            self.rejected_count += rejected
+            STAGE_DB_WRITE.observe(time.perf_counter() - started)
+            INGEST_MESSAGES.inc("saved", amount=len(rows))
+            if rejected:
+                INGEST_MESSAGES.inc("rejected_unknown_device", amount=rejected)
+            if duplicates:
+                INGEST_MESSAGES.inc("duplicate", amount=duplicates)
+            errors = len(batch) - len(rows) - rejected - duplicates
+            if errors:
+                INGEST_MESSAGES.inc("error_status", amount=errors)
+            logger.debug(f"💾 [DB] Batch saved: {len(rows)}/{len(batch)} readings, {len(device_changes)} devices")
+            return len(rows)
+
+        except Exception:
+            db.rollback()
+            # Bộ nhớ đệm đã lệch với DB -> buộc nạp lại các thiết bị trong lô
+            self._registry.invalidate_many(device_changes.keys())
+            raise
+        finally:
+            db.close()
+
+
+    def _append_after_commit(self, rows: List[dict]):
+        """
+        Backend ghi ngoài DB (columnar): chỉ ghi khi phần DB đã COMMIT, và KHÔNG ném lỗi lại cho write_batch
+        -> thử lại / chia đôi lô không bao giờ ghi trùng bản ghi đã nằm trong file.
+        """
+        try:
+            self._store.append(None, rows)
+        except Exception as e:
+            INGEST_MESSAGES.inc("store_error", amount=len(rows))
+            logger.error(f"❌ Không ghi được {len(rows)} bản ghi vào kho {self._store.name}: {e}", exc_info=True)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Lỗi của DB / kết nối (ghi lại cùng lô sau 1 lúc là được), khác với lỗi do chính dữ liệu của lô"""
+    if isinstance(error, (sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.TimeoutError)):
+        return True
+    return getattr(error, "connection_invalidated", False)
+
+
+# Writer dùng chung cho toàn bộ tiến trình (main.py khởi động/tắt)
+ingest_writer = IngestWriter()
+
+metrics.gauge(
+    "smartfarm_ingest_queue_depth", "Số bản ghi đang chờ trong hàng đợi Ingest",
+    lambda: [(ingest_writer.qsize(),)],
+)
+metrics.gauge(
+    "smartfarm_ingest_queue_dropped", "Số bản ghi hàng đợi Ingest đã bỏ khi quá tải, theo lý do",
+    lambda: list(ingest_writer.stats()["queue"]["dropped"].items()),
+    labels=("reason",),
+)
@@ -5,10 +5,15 @@ import pandas as pd
 import os
 from datetime import datetime, timedelta
 
-from db.session import SessionLocal
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from db.session import AsyncSessionLocal
 from models import models
+from crud import device as crud_device
 from core.email_service import send_alert_email
 from services.mqtt_service import publish_command # [THÊM MỚI] Gọi hàm gửi MQTT
+from services.device_registry import device_registry
 
 # Import bộ Logger xịn sò của bạn
 from core.logger import get_logger
@@ -54,8 +59,8 @@ async def execute_pump_timer(device_id: str, zone_id: int, duration_seconds: int
         publish_command(topic, payload_off)
         logger.info(f"🛑 [TIMER] Đã gửi MQTT tắt bơm {device_id} sau {duration_seconds} giây.")
         
-        # Mở kết nối DB riêng cho luồng này để cập nhật trạng thái kết thúc
-        db = SessionLocal()
+        # Mở kết nối DB riêng cho luồng này để cập nhật trạng thái kết thúc (async: không chặn các hẹn giờ khác)
+        db = AsyncSessionLocal()
         try:
             # 1. Ghi log Tắt bơm do hết giờ
             new_log = models.ActionLog(
@@ -68,18 +73,19 @@ async def execute_pump_timer(device_id: str, zone_id: int, duration_seconds: int
             db.add(new_log)
             
             # 2. Cập nhật Digital Twin: Báo cho Web biết là Bơm đã tắt
-            dev = db.query(models.Device).filter(models.Device.device_id == device_id).first()
+            dev = await db.scalar(select(models.Device).where(models.Device.device_id == device_id).limit(1))
             if dev:
                 dev.pump_state = False
             
-            db.commit()
+            await db.commit()
+            device_registry.update(device_id, pump_state=False)
 
             # 3. Xóa trạng thái PUMP_ON trong bộ nhớ để AI có thể kích hoạt lại nếu đất vẫn khô
             if zone_id in device_states and device_states[zone_id] == "PUMP_ON":
                 device_states[zone_id] = "IDLE"
                 
         finally:
-            db.close()
+            await db.close()
             
     except Exception as e:
         logger.error(f"❌ [TIMER] Lỗi tiến trình bơm: {e}", exc_info=True)
@@ -93,8 +99,9 @@ async def auto_irrigation_task():
     
     while True:
         try:
-            db = SessionLocal()
-            zones = db.query(models.Zone).all()
+            db = AsyncSessionLocal()
+            # AsyncSession không tự nạp quan hệ khi truy cập -> nạp sẵn zone.setting
+            zones = (await db.execute(select(models.Zone).options(selectinload(models.Zone.setting)))).scalars().all()
             now = datetime.now()
             
             for zone in zones:
@@ -105,14 +112,12 @@ async def auto_irrigation_task():
                     continue # Nếu Nông dân đang bật THỦ CÔNG thì AI bỏ qua
                 
                 # 2. TÌM THIẾT BỊ TRONG VƯỜN
-                device = db.query(models.Device).filter(models.Device.zone_id == zone.zone_id).first()
+                device = await db.scalar(select(models.Device).where(models.Device.zone_id == zone.zone_id).limit(1))
                 if not device or device.status != 'ONLINE':
                     continue # Bỏ qua nếu vườn chưa có mạch hoặc mạch rớt mạng
                 
-                # 3. LẤY DỮ LIỆU CẢM BIẾN MỚI NHẤT TỪ BẢNG SensorData
-                latest_data = db.query(models.SensorData).filter(
-                    models.SensorData.device_id == device.device_id
-                ).order_by(models.SensorData.timestamp.desc()).first()
+                # 3. LẤY DỮ LIỆU CẢM BIẾN MỚI NHẤT (bảng device_latest_reading, tra theo khóa chính)
+                latest_data = await crud_device.get_latest_sensor_reading_async(db, device.device_id)
 
                 if not latest_data or latest_data.temp is None or latest_data.hum_soil is None:
                     continue # Bỏ qua nếu mạch chưa gửi data nào lên
@@ -124,7 +129,7 @@ async def auto_irrigation_task():
                 hour = now.hour
                 
                 # Lấy Email Nông dân để gửi cảnh báo
-                farmer = db.query(models.User).filter(models.User.user_id == zone.farmer_id).first()
+                farmer = await db.scalar(select(models.User).where(models.User.user_id == zone.farmer_id).limit(1))
                 farmer_email = farmer.email if farmer else None
                 farmer_name = farmer.full_name if farmer else "Nông dân"
 
@@ -154,7 +159,8 @@ async def auto_irrigation_task():
                             db.add(new_log)
                             
                             device.mist_state = True
-                            db.commit()
+                            await db.commit()
+                            device_registry.update(device.device_id, mist_state=True)
                             device_states[zone.zone_id] = "MIST_ON"
                             logger.warning(f"📝 [Log DB]: Ghi nhận bật Phun sương tại {zone.name}")
 
@@ -218,7 +224,8 @@ async def auto_irrigation_task():
                                 db.add(new_log)
                                 
                                 device.pump_state = True
-                                db.commit()
+                                await db.commit()
+                                device_registry.update(device.device_id, pump_state=True)
                                 
                                 device_states[zone.zone_id] = "PUMP_ON"
                                 logger.info(f"📝 [Log DB]: Ghi nhận bật Máy bơm tại {zone.name}")
@@ -237,7 +244,8 @@ async def auto_irrigation_task():
                                 )
                                 db.add(new_log)
                                 device.pump_state = False 
-                                db.commit()
+                                await db.commit()
+                                device_registry.update(device.device_id, pump_state=False)
                                 
                                 device_states[zone.zone_id] = "IDLE"
                                 logger.info(f"📝 [Log DB]: Ghi nhận tắt Máy bơm tại {zone.name}")
@@ -256,7 +264,8 @@ async def auto_irrigation_task():
                                 )
                                 db.add(new_log)
                                 device.mist_state = False 
-                                db.commit()
+                                await db.commit()
+                                device_registry.update(device.device_id, mist_state=False)
                                 
                                 device_states[zone.zone_id] = "IDLE"
                                 logger.info(f"📝 [Log DB]: Ghi nhận tắt Phun sương tại {zone.name}")
@@ -287,7 +296,7 @@ async def auto_irrigation_task():
         except Exception as e:
             logger.error(f"❌ Lỗi trong vòng lặp AI: {e}", exc_info=True)
         finally:
-            db.close() 
+            await db.close() 
             
         # Hệ thống ngủ 60 giây trước khi quét lượt tiếp theo
         await asyncio.sleep(60)
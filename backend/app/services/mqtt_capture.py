@@ -0,0 +1,85 @@
+"""
+Ghi lại gói tin MQTT thô (topic + payload + thời điểm nhận) vào file để phát lại khi đo tải.
+
+Định dạng file (.sfcap):
+    MAGIC (6 byte "SFCAP\\x01")
+    Lặp lại mỗi gói tin:
+        <d   thời điểm nhận (Unix time, float64)
+        <H   độ dài topic (byte)
+        <I   độ dài payload (byte)
+        topic (UTF-8) + payload (nguyên văn, không giải mã)
+"""
+import os
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator, NamedTuple
+
+from core.logger import get_logger
+
+logger = get_logger("MQTT_Capture")
+
+MAGIC = b"SFCAP\x01"
+RECORD_HEADER = struct.Struct("<dHI")
+
+
+class CapturedMessage(NamedTuple):
+    received_at: float   # Unix time
+    topic: str
+    payload: bytes
+
+
+class CaptureWriter:
+    """Ghi nối tiếp gói tin vào file capture. An toàn khi gọi từ nhiều luồng."""
+
+    def __init__(self, path: str):
+        self.path = path
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            with open(path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{path} không phải file capture (.sfcap)")
+        self._file: BinaryIO = open(path, "ab", buffering=64 * 1024)
+        if is_new:
+            self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, topic: str, payload: bytes, received_at: float = None):
+        topic_bytes = topic.encode("utf-8")
+        header = RECORD_HEADER.pack(received_at or time.time(), len(topic_bytes), len(payload))
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(header)
+            self._file.write(topic_bytes)
+            self._file.write(payload)
+            self.count += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+        logger.info(f"📼 Capture closed: {self.path} ({self.count} messages)")
+
+
+def read_capture(path: str) -> Iterator[CapturedMessage]:
+    """Đọc lần lượt các gói tin trong file capture (bỏ qua bản ghi cuối nếu bị cắt dở)"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} không phải file capture (.sfcap)")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            received_at, topic_len, payload_len = RECORD_HEADER.unpack(header)
+            body = f.read(topic_len + payload_len)
+            if len(body) < topic_len + payload_len:
+                logger.warning(f"⚠️ {path}: bản ghi cuối bị cắt dở, bỏ qua")
+                return
+            yield CapturedMessage(received_at, body[:topic_len].decode("utf-8"), body[topic_len:])
@@ -1,155 +1,246 @@
-import json
-import paho.mqtt.client as mqtt
-from sqlalchemy.orm import Session
+import time
+from typing import Callable, List, Optional
 
 # Import cấu hình
 from core.config import settings
-from core.security import decrypt_payload
-from db.session import SessionLocal
-from crud import device as crud_device
-from schemas import device as schemas
-
-# 1. Khởi tạo Client MQTT
-client = mqtt.Client()
-
-# 2. Callback khi kết nối thành công
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print(f"✅ [MQTT] Đã kết nối Broker: {settings.MQTT_BROKER}")
-        # Subscribe vào topic Sensor
-        client.subscribe(settings.MQTT_TOPIC_SENSOR)
-        print(f"📡 [MQTT] Đang lắng nghe: {settings.MQTT_TOPIC_SENSOR}")
-    else:
-        print(f"❌ [MQTT] Lỗi kết nối, code: {rc}")
+from core.metrics import INGEST_MESSAGES, STAGE_DEVICE_LOOKUP, STAGE_TOTAL, stage_sampler
+from services.ingest_writer import SensorReading, ingest_writer
+from services.payload_decoder import (
+    BINARY_RECORD_SIZE, PayloadError, decode_binary_payload, decode_sensor_payload, decode_sensor_payloads, peek_device_id,
+)
+from services.device_registry import device_registry
+from services.mqtt_capture import CaptureWriter
+from services.mqtt_transport import create_transport
+from services.topic_router import TopicRouter
+
+# 1. Khởi tạo kết nối MQTT (asyncio hoặc luồng riêng, tùy settings.MQTT_TRANSPORT)
+# KHÔNG kết nối lúc import nữa: main.py gọi start_mqtt() trong lifespan
+transport = create_transport(handler=lambda msg: on_message(None, None, msg), batch_handler=lambda msgs: on_messages(msgs))
+client = transport.client
+
+# Chế độ ghi lại gói tin thô (MQTT_CAPTURE_FILE) để phát lại khi đo tải
+capture = CaptureWriter(settings.MQTT_CAPTURE_FILE) if settings.MQTT_CAPTURE_FILE else None
+
+# 2. Khởi động / Dừng (gọi từ main.lifespan)
+async def start_mqtt():
+    await transport.start()
+    print(f"📡 [MQTT] Transport: {type(transport).__name__} -> {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
+
+async def stop_mqtt():
+    await transport.stop()
+    if capture:
+        capture.close()
 
 # 3. Callback khi nhận tin nhắn (QUAN TRỌNG NHẤT)
 def on_message(client, userdata, msg):
     """
     Hàm này chạy mỗi khi Wokwi hoặc ESP32 gửi dữ liệu lên.
+    Chỉ giải mã + kiểm tra sơ bộ rồi đẩy vào hàng đợi.
+    Việc ghi DB do Ingest Writer gom lô xử lý (services/ingest_writer.py).
     """
-    db: Session = SessionLocal()
-    try:
-        # A. Giải mã gói tin sang chuỗi
-        payload_str = msg.payload.decode('utf-8')
-        # print(f"📩 [RAW]: {payload_str}") # Bật lên nếu muốn debug
-
-        try:
-            data_json = json.loads(payload_str)
-        except json.JSONDecodeError:
-            print("⚠️ Lỗi JSON: Gói tin không đúng định dạng")
-            return
-
-        sensor_data = None
-        device_id = "UNKNOWN"
-
-        # --- TRƯỜNG HỢP 1: Dữ liệu từ Wokwi (JSON phẳng, không mã hóa) ---
-        # Wokwi gửi: {"temp": 24, "hum_air": 40, "device_id": "..."}
-        if "temp" in data_json and "device_id" in data_json:
-            sensor_data = data_json
-            device_id = data_json.get("device_id")
-            # print("🔹 Nhận dữ liệu Wokwi (Không mã hóa)")
-
-        # --- TRƯỜNG HỢP 2: Dữ liệu từ ESP32 thật (Có mã hóa AES) ---
-        # ESP32 gửi: {"data": "chuỗi_mã_hóa_base64..."}
-        elif "data" in data_json:
-            decrypted = decrypt_payload(data_json["data"])
-            if decrypted:
-                sensor_data = decrypted
-                device_id = decrypted.get("device_id", "UNKNOWN")
-                print("🔐 Nhận dữ liệu AES (Đã giải mã)")
-            else:
-                print("❌ Giải mã AES thất bại")
-                return
-        
+    if capture:
+        capture.write(msg.topic, msg.payload)
+
+    if not stage_sampler():
+        for reading in decode_mqtt_message(msg):
+            ingest_writer.put(reading)
+        return
+    _on_message_timed(msg)
+
+def _on_message_timed(msg):
+    # Gói tin được chọn để đo thời gian từng công đoạn (1/N gói, xem METRICS_STAGE_SAMPLE_EVERY)
+    started = time.perf_counter()
+    for reading in decode_mqtt_message(msg, timed=True):
+        ingest_writer.put(reading)
+    STAGE_TOTAL.observe(time.perf_counter() - started)
+
+def on_messages(msgs: list):
+    """
+    Như on_message cho cả loạt tin nhắn transport đọc được trong 1 lần (AsyncioMqttTransport.batch_handler):
+    gói AES của cả loạt giải mã bằng 1 lần decrypt_many. Gói được chọn để đo thời gian vẫn đi đường từng gói.
+    """
+    batch = []
+    for msg in msgs:
+        if capture:
+            capture.write(msg.topic, msg.payload)
+        if stage_sampler():
+            _on_message_timed(msg)
         else:
-            print("⚠️ Gói tin thiếu trường dữ liệu quan trọng")
-            return
-
-        # --- KIỂM TRA & LƯU VÀO DATABASE ---
-        if sensor_data and device_id:
-            try:
-                from models.models import Device
-                from datetime import datetime
-                
-                device = db.query(Device).filter(Device.device_id == device_id).first()
-                if not device:
-                    print("⚠️ Mạch gửi dữ liệu nhưng không tồn tại trong CSDL!")
-                    return
-
-                # Trích xuất dữ liệu cảm biến
-                temp = float(sensor_data.get("temp", 0))
-                hum_air = float(sensor_data.get("hum_air", 0))
-                hum_soil = float(sensor_data.get("hum_soil", 0))
-                light = float(sensor_data.get("light", 0))
-
-                # ==========================================
-                # CƠ CHẾ 1: PHÁT HIỆN LỖI (ERROR DETECTION)
-                # ==========================================
-                # Giả sử cảm biến hỏng sẽ gửi nhiệt độ = -999 hoặc -50
-                is_error = False
-                if temp <= -50 or temp >= 100 or hum_soil < 0 or hum_soil > 100:
-                    is_error = True
-
-                if is_error:
-                    if device.status != "ERROR":
-                        device.status = "ERROR"
-                        print(f"🛠️ [LỖI PHẦN CỨNG] Mạch '{device.name}' gửi dữ liệu bất thường (T={temp}, H={hum_soil}). Đã chuyển sang ERROR!")
-                    device.last_seen = datetime.now() # Vẫn cập nhật giờ để biết nó chưa chết hẳn
-                    db.commit()
-                    return # CHẶN LẠI! Không lưu cục dữ liệu rác này vào bảng SensorData!
-
-                # ==========================================
-                # CƠ CHẾ 2: PHỤC HỒI (RECOVERY) & GIA HẠN SỰ SỐNG
-                # ==========================================
-                # Nếu dữ liệu hợp lệ và mạch đang bị đánh dấu OFFLINE hoặc ERROR -> Phục hồi về ONLINE
-                if device.status in ["OFFLINE", "ERROR"]:
-                    device.status = "ONLINE"
-                    print(f"🎉 [PHỤC HỒI] Mạch '{device.name}' đã hoạt động bình thường trở lại!")
-                
-                # Cập nhật nhịp tim (Bơm máu)
-                device.last_seen = datetime.now()
-                # (Không cần db.commit() ở đây vì hàm create_sensor_reading bên dưới đã commit)
-                device.pump_state = bool(sensor_data.get("pump_state", device.pump_state))
-                device.light_state = bool(sensor_data.get("light_state", device.light_state))
-                device.mist_state = bool(sensor_data.get("mist_state", device.mist_state))
-                # Map dữ liệu vào Schema
-                sensor_input = schemas.SensorDataInput(
-                    temp=temp, hum_air=hum_air, hum_soil=hum_soil, light=light
-                )
-
-                # Gọi hàm CRUD để lưu lịch sử
-                crud_device.create_sensor_reading(db, sensor_input, device_id)
-                print(f"💾 [DB] Saved: Dev={device_id} | T={temp} | H={hum_air} | Đất={hum_soil} | AS={light}")
-
-            except Exception as e:
-                print(f"❌ Lỗi khi xử lý DB MQTT: {e}")
+            batch.append(msg)
+    for reading in decode_mqtt_messages(batch):
+        ingest_writer.put(reading)
+
+# Lý do PayloadError -> nhãn outcome của smartfarm_ingest_messages_total
+PAYLOAD_ERROR_OUTCOMES = {
+    "json": "json_error",
+    "missing_fields": "missing_fields",
+    "decrypt": "decrypt_error",
+    "invalid": "invalid",
+    "binary_size": "binary_size_error",
+    "identity": "identity_mismatch",
+}
+
+def _count_payload_error(e: PayloadError, amount: int = 1):
+    INGEST_MESSAGES.inc(PAYLOAD_ERROR_OUTCOMES.get(e.reason, e.reason), amount=amount)
+
+def _is_known_device(device_id: str, timed: bool = False) -> bool:
+    if not timed:
+        return device_registry.is_known(device_id)
+    started = time.perf_counter()
+    known = device_registry.is_known(device_id)
+    STAGE_DEVICE_LOOKUP.observe(time.perf_counter() - started)
+    return known
+
+def decode_mqtt_message(msg, timed: bool = False, owns: Optional[Callable[[str], bool]] = None) -> List[SensorReading]:
+    """
+    Chọn bộ giải mã theo topic qua sensor_router: JSON hoặc nhị phân (device_id lấy từ topic).
+    owns: chỉ giải mã gói của các thiết bị mà owns(device_id) = True (ingest_worker --mode hash).
+    """
+    route, params = sensor_router.match(msg.topic)
+    if route is None:
+        INGEST_MESSAGES.inc("unrouted")
+        return []
+    if owns is not None and not _owned(route, msg, params, owns):
+        return []
+    return route.handler(msg, params, timed)
+
+def _owned(route, msg, params: dict, owns: Callable[[str], bool]) -> bool:
+    """
+    Gói tin có thuộc phần của mình không, biết được TRƯỚC khi giải mã: device_id từ topic, không có thì từ vỏ gói tin.
+    Gói AES chỉ có device_id bên trong -> chưa biết, coi như thuộc (người gọi kiểm tra lại sau khi giải mã).
+    """
+    device_id = params.get("device_id")
+    if device_id is None and route.handler is _route_json:
+        device_id = peek_device_id(msg.payload)
+    return device_id is None or owns(device_id)
+
+def decode_mqtt_messages(msgs: list, owns: Optional[Callable[[str], bool]] = None) -> List[SensorReading]:
+    """decode_mqtt_message cho cả loạt: các gói JSON (Wokwi / AES) giải mã chung 1 lô (decode_sensor_payloads)"""
+    readings = []
+    pending = []  # (payload, topic_device_id) của các gói JSON
+    for msg in msgs:
+        route, params = sensor_router.match(msg.topic)
+        if route is None:
+            INGEST_MESSAGES.inc("unrouted")
+            continue
+        if owns is not None and not _owned(route, msg, params, owns):
+            continue
+        if route.handler is not _route_json:
+            readings.extend(route.handler(msg, params))
+            continue
+        topic_device_id = params.get("device_id")
+        if topic_device_id is not None and not _is_known_device(topic_device_id):
+            INGEST_MESSAGES.inc("rejected_unknown_device")
+            print("⚠️ Mạch gửi dữ liệu nhưng không tồn tại trong CSDL!")
+            continue
+        pending.append((msg.payload, topic_device_id))
+    if not pending:
+        return readings
 
+    try:
+        results = decode_sensor_payloads(pending)
     except Exception as e:
+        INGEST_MESSAGES.inc("internal_error", amount=len(pending))
         print(f"❌ Lỗi hệ thống MQTT: {e}")
-    finally:
-        db.close() # Luôn đóng kết nối DB
-
-# 4. Cấu hình & Kết nối
-if settings.MQTT_USER and settings.MQTT_PASS:
-    client.username_pw_set(settings.MQTT_USER, settings.MQTT_PASS)
+        return readings
+    for (_, topic_device_id), result in zip(pending, results):
+        if isinstance(result, PayloadError):
+            _count_payload_error(result)
+            print(result)
+        elif topic_device_id is None and not _is_known_device(result.device_id):
+            INGEST_MESSAGES.inc("rejected_unknown_device")
+            print("⚠️ Mạch gửi dữ liệu nhưng không tồn tại trong CSDL!")
+        else:
+            readings.append(result)
+    return readings
 
-client.on_connect = on_connect
-client.on_message = on_message
+def _route_json(msg, params: dict, timed: bool = False) -> List[SensorReading]:
+    reading = decode_message(msg.payload, timed, params.get("device_id"))
+    return [reading] if reading else []
 
-try:
-    # Kết nối nhưng KHÔNG gọi loop_forever ở đây (main.py sẽ lo việc đó)
-    client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
-except Exception as e:
-    print(f"❌ [CRITICAL] Không thể kết nối MQTT: {e}")
+def _route_binary(msg, params: dict, timed: bool = False) -> List[SensorReading]:
+    return decode_binary_message(params["device_id"], msg.payload, timed)
 
+def decode_message(payload: bytes, timed: bool = False, topic_device_id: Optional[str] = None) -> Optional[SensorReading]:
+    """
+    Giải mã 1 gói tin cảm biến thành SensorReading (None nếu gói tin bị loại).
+    Tách riêng để Ingest Worker (ingest_worker.py) dùng lại với Writer của riêng nó.
+    Phần parse/kiểm tra ngưỡng nằm ở services/payload_decoder.py (đường nhanh, không qua Pydantic).
+    topic_device_id: topic đã mang sẵn device_id -> hỏi Registry TRƯỚC khi giải mã (thiết bị lạ bị loại
+    mà không tốn công parse/giải mã AES) và không phải hỏi lại sau đó.
+    """
+    if topic_device_id is not None and not _is_known_device(topic_device_id, timed):
+        INGEST_MESSAGES.inc("rejected_unknown_device")
+        print("⚠️ Mạch gửi dữ liệu nhưng không tồn tại trong CSDL!")
+        return None
+    try:
+        reading = decode_sensor_payload(payload, timed=timed, topic_device_id=topic_device_id)
+    except PayloadError as e:
+        _count_payload_error(e)
+        print(e)
+        return None
+    except Exception as e:
+        INGEST_MESSAGES.inc("internal_error")
+        print(f"❌ Lỗi hệ thống MQTT: {e}")
+        return None
+
+    # Hỏi Registry trong bộ nhớ (không chạm DB nếu đã biết thiết bị)
+    if topic_device_id is None and not _is_known_device(reading.device_id, timed):
+        INGEST_MESSAGES.inc("rejected_unknown_device")
+        print("⚠️ Mạch gửi dữ liệu nhưng không tồn tại trong CSDL!")
+        return None
+    return reading
+
+def decode_binary_message(device_id: str, payload: bytes, timed: bool = False) -> List[SensorReading]:
+    """Giải mã gói nhị phân của 1 thiết bị (device_id lấy từ cuối topic)"""
+    if not _is_known_device(device_id, timed):
+        INGEST_MESSAGES.inc("rejected_unknown_device", amount=max(1, len(payload) // BINARY_RECORD_SIZE))
+        print("⚠️ Mạch gửi dữ liệu nhưng không tồn tại trong CSDL!")
+        return []
+    try:
+        return decode_binary_payload(device_id, payload, timed=timed)
+    except PayloadError as e:
+        _count_payload_error(e)
+        print(e)
+    except Exception as e:
+        INGEST_MESSAGES.inc("internal_error")
+        print(f"❌ Lỗi hệ thống MQTT: {e}")
+    return []
 
-# 5. Hàm gửi lệnh (Dùng cho API điều khiển)
+def build_sensor_router() -> TopicRouter:
+    """
+    Các topic cảm biến mà Ingest nhận:
+    - MQTT_TOPIC_SENSOR: JSON (Wokwi / AES), device_id nằm trong gói tin
+    - <MQTT_TOPIC_SENSOR_BIN>/{device_id}: gói nhị phân của gateway
+    - MQTT_FARM_TOPICS / MQTT_FARM_BIN_TOPICS: topic nhiều nông trại (farm, zone, device_id lấy từ topic)
+    """
+    router = TopicRouter()
+    router.add_route(settings.MQTT_TOPIC_SENSOR, _route_json)
+    router.add_route(settings.MQTT_TOPIC_SENSOR_BIN + "/{device_id}", _route_binary)
+    for pattern in settings.MQTT_FARM_TOPICS:
+        router.add_route(pattern, _route_json)
+    for pattern in settings.MQTT_FARM_BIN_TOPICS:
+        route = router.add_route(pattern, _route_binary)
+        if "device_id" not in route.param_names:
+            raise ValueError(f"Mẫu topic nhị phân phải có {{device_id}}: {pattern}")
+    return router
+
+sensor_router = build_sensor_router()
+# Khi tách Ingest ra các tiến trình riêng (ingest_worker.py) thì API chỉ còn gửi lệnh
+if settings.INGEST_IN_API:
+    for topic in sensor_router.subscriptions():
+        transport.add_subscription(topic)
+
+# 4. Hàm gửi lệnh (Dùng cho API điều khiển)
 def publish_command(topic: str, message: str):
     """
     Gửi lệnh điều khiển xuống thiết bị (PUMP_ON, LIGHT_OFF...)
+    Gọi được từ cả code async (AI tưới) lẫn luồng API đồng bộ.
     """
     try:
-        client.publish(topic, message)
+        if not transport.publish(topic, message):
+            print("⚠️ [MQTT] Không thể gửi lệnh: Client chưa kết nối.")
+            return False
         print(f"📤 [MQTT] Gửi lệnh: {message} -> {topic}")
         return True
     except Exception as e:
@@ -0,0 +1,332 @@
+import abc
+import asyncio
+import random
+import select
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from core.config import settings
+from core.logger import get_logger
+from core.metrics import MQTT_PUBLISH_SECONDS
+
+logger = get_logger("MQTT_Transport")
+
+# Kiểu hàm xử lý tin nhắn: nhận đúng 1 tham số là paho MQTTMessage
+MessageHandler = Callable[[mqtt.MQTTMessage], None]
+# Xử lý cả loạt tin nhắn đọc được trong 1 lần (chỉ AsyncioMqttTransport dùng)
+BatchHandler = Callable[[List[mqtt.MQTTMessage]], None]
+
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """Thời gian chờ kết nối lại: tăng gấp đôi mỗi lần + nhiễu ngẫu nhiên (jitter) để tránh cả đàn cùng kết nối lại"""
+    delay = min(maximum, base * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class MqttTransport(abc.ABC):
+    """
+    Lớp cha dùng chung cho 2 chế độ chạy MQTT:
+    - AsyncioMqttTransport: chạy thẳng trên event loop của uvicorn (mặc định).
+    - ThreadMqttTransport: chế độ dự phòng, paho tự chạy luồng riêng như trước.
+    """
+
+    def __init__(self, client_id: str = "", handler: Optional[MessageHandler] = None,
+                 protocol=mqtt.MQTTv311, batch_handler: Optional[BatchHandler] = None):
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=client_id,
+            protocol=protocol,
+        )
+        if settings.MQTT_USER and settings.MQTT_PASS:
+            self.client.username_pw_set(settings.MQTT_USER, settings.MQTT_PASS)
+
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self._subscriptions: Dict[str, int] = {}  # topic -> qos (tự đăng ký lại khi kết nối lại)
+
+        # Đo độ trễ gửi lệnh: thời điểm publish -> broker xác nhận (PUBACK) / đã ghi xong socket (QoS 0)
+        # -> /metrics (smartfarm_mqtt_publish_seconds) + publish_latencies_ms (1000 lần gần nhất, cho công cụ đo)
+        self._publish_started: Dict[int, Tuple[float, int]] = {}  # mid -> (thời điểm publish, qos)
+        self.publish_latencies_ms = deque(maxlen=1000)
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+
+    # ---------------- Trạng thái ----------------
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    # ---------------- Callback của paho ----------------
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"❌ [MQTT] Lỗi kết nối, code: {reason_code}")
+            return
+        logger.info(f"✅ [MQTT] Đã kết nối Broker: {settings.MQTT_BROKER}")
+        for topic, qos in self._subscriptions.items():
+            client.subscribe(topic, qos)
+            logger.info(f"📡 [MQTT] Đang lắng nghe: {topic}")
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        logger.warning(f"📴 [MQTT] Mất kết nối Broker (code: {reason_code})")
+
+    def _on_message(self, client, userdata, msg):
+        if self.handler:
+            self.handler(msg)
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        pending = self._publish_started.pop(mid, None)
+        if pending is not None:
+            started, qos = pending
+            elapsed = time.perf_counter() - started
+            MQTT_PUBLISH_SECONDS.observe(elapsed, str(qos))
+            self.publish_latencies_ms.append(elapsed * 1000)
+
+    # ---------------- API chung ----------------
+    def add_subscription(self, topic: str, qos: int = 0):
+        """Ghi nhớ topic và đăng ký ngay nếu đang kết nối"""
+        self._subscriptions[topic] = qos
+        if self.is_connected():
+            self._do(self.client.subscribe, topic, qos)
+
+    def publish(self, topic: str, payload, qos: int = 0) -> bool:
+        """Gửi tin nhắn. An toàn khi gọi từ bất kỳ luồng nào."""
+        if not self.is_connected():
+            return False
+        self._do(self._publish_now, topic, payload, qos)
+        return True
+
+    def _publish_now(self, topic: str, payload, qos: int):
+        started = time.perf_counter()
+        info = self.client.publish(topic, payload, qos)
+        self._publish_started[info.mid] = (started, qos)
+
+    def _do(self, func, *args):
+        """Thực thi 1 thao tác trên client (lớp con quyết định chạy ở luồng nào)"""
+        func(*args)
+
+    @abc.abstractmethod
+    async def start(self):
+        """Bắt đầu kết nối tới Broker (không chờ kết nối xong)"""
+
+    @abc.abstractmethod
+    async def stop(self):
+        """Ngắt kết nối và dừng phần chạy ngầm"""
+
+
+class AsyncioMqttTransport(MqttTransport):
+    """
+    paho chạy trên event loop: socket được đăng ký với add_reader/add_writer,
+    không còn luồng loop_forever riêng -> không nhảy luồng khi publish từ code async.
+    Tự kết nối lại với backoff có jitter.
+    Có batch_handler: mỗi lần socket có dữ liệu thì đọc liền tới read_batch gói, giao cả loạt 1 lần.
+    """
+
+    def __init__(self, *args, reconnect_min: float = settings.MQTT_RECONNECT_MIN_SECONDS,
+                 reconnect_max: float = settings.MQTT_RECONNECT_MAX_SECONDS,
+                 read_batch: int = settings.MQTT_READ_BATCH, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.read_batch = max(1, read_batch)
+        self._batch: Optional[list] = None  # Tin nhắn của lần đọc đang chạy (_read_ready)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._misc_task: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._disconnected: Optional[asyncio.Event] = None
+        self._messages: Optional[asyncio.Queue] = None
+        self._stopping = False
+
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # ---------------- Gắn socket vào event loop ----------------
+    # client.connect chạy ở luồng phụ (connect) -> các callback socket có thể tới từ luồng đó:
+    # lấy fd ngay (socket còn mở), việc gắn / gỡ khỏi loop luôn chạy trên luồng của loop
+    def _on_socket_open(self, client, userdata, sock):
+        self._do(self._attach_socket, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._do(self._detach_socket, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._do(self._loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._do(self._loop.remove_writer, sock.fileno())
+
+    def _attach_socket(self, fd: int):
+        self._loop.add_reader(fd, self._read_ready)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _detach_socket(self, fd: int):
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+
+    def _read_ready(self):
+        """Socket có dữ liệu: không có batch_handler thì đọc 1 gói như cũ, có thì đọc tới khi socket cạn"""
+        if self.batch_handler is None:
+            self.client.loop_read()
+            return
+        self._batch = []
+        try:
+            for _ in range(self.read_batch):
+                if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS or not self._readable():
+                    break
+        finally:
+            batch, self._batch = self._batch, None
+            if batch:
+                self.batch_handler(batch)
+
+    def _readable(self) -> bool:
+        sock = self.client.socket()
+        if sock is None:
+            return False
+        # TLS: dữ liệu đã giải mã có thể nằm sẵn trong bộ đệm SSL, select không thấy
+        pending = getattr(sock, "pending", None)
+        if pending is not None and pending():
+            return True
+        return bool(select.select([sock], [], [], 0)[0])
+
+    async def _misc_loop(self):
+        """Gửi PING giữ kết nối và kiểm tra timeout (thay cho phần việc của loop_forever)"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+        # loop_misc báo lỗi -> socket đã chết
+        self._disconnected.set()
+
+    # ---------------- Callback ----------------
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        super()._on_connect(client, userdata, flags, reason_code, properties)
+        if not reason_code.is_failure:
+            self._disconnected.clear()
+            self._connected.set()
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        super()._on_disconnect(client, userdata, disconnect_flags, reason_code, properties)
+        self._connected.clear()
+        self._disconnected.set()
+
+    def _on_message(self, client, userdata, msg):
+        # Đang đọc theo loạt -> gom lại; có handler thì xử lý ngay trên loop; không thì xếp hàng cho messages()
+        if self._batch is not None:
+            self._batch.append(msg)
+        elif self.handler:
+            self.handler(msg)
+        else:
+            self._messages.put_nowait(msg)
+
+    # ---------------- API ----------------
+    def _do(self, func, *args):
+        # Mọi thao tác lên client phải chạy trên luồng của event loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    async def connect(self, timeout: float = 10.0):
+        """Kết nối tới Broker và chờ CONNACK"""
+        # Phân giải DNS bất đồng bộ để không chặn event loop
+        infos = await self._loop.getaddrinfo(settings.MQTT_BROKER, settings.MQTT_PORT, type=socket.SOCK_STREAM)
+        host = infos[0][4][0]
+        self._disconnected.clear()
+        # Bắt tay TCP của paho là lời gọi chặn (Broker không phản hồi -> chờ tới timeout) -> chạy ở luồng phụ
+        await self._loop.run_in_executor(None, self.client.connect, host, settings.MQTT_PORT, 60)
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def subscribe(self, topic: str, qos: int = 0):
+        self.add_subscription(topic, qos)
+
+    async def publish_async(self, topic: str, payload, qos: int = 0) -> bool:
+        return self.publish(topic, payload, qos)
+
+    async def messages(self):
+        """Duyệt tin nhắn đến: async for msg in transport.messages()"""
+        while True:
+            yield await self._messages.get()
+
+    async def _run(self):
+        attempt = 0
+        while not self._stopping:
+            try:
+                await self.connect()
+                attempt = 0
+                await self._disconnected.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ [MQTT] Không thể kết nối Broker: {e}")
+
+            if self._stopping:
+                break
+            delay = backoff_delay(attempt, self.reconnect_min, self.reconnect_max)
+            attempt += 1
+            logger.info(f"🔁 [MQTT] Thử kết nối lại sau {delay:.1f}s (lần {attempt})")
+            await asyncio.sleep(delay)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._connected = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._messages = asyncio.Queue()
+        self._stopping = False
+        self._runner = self._loop.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        if self.is_connected():
+            self.client.disconnect()
+        for task in (self._runner, self._misc_task):
+            if task:
+                task.cancel()
+        self._runner = self._misc_task = None
+
+
+class ThreadMqttTransport(MqttTransport):
+    """Chế độ dự phòng: paho tự quản lý luồng mạng và tự kết nối lại (loop_start)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client.reconnect_delay_set(
+            min_delay=int(settings.MQTT_RECONNECT_MIN_SECONDS) or 1,
+            max_delay=int(settings.MQTT_RECONNECT_MAX_SECONDS),
+        )
+        self._publish_lock = threading.Lock()
+
+    def _publish_now(self, topic: str, payload, qos: int):
+        # publish của paho đã an toàn đa luồng, khóa để ghi nhận mid không bị lẫn
+        with self._publish_lock:
+            super()._publish_now(topic, payload, qos)
+
+    async def start(self):
+        try:
+            self.client.connect_async(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
+            self.client.loop_start()
+        except Exception as e:
+            logger.error(f"❌ [CRITICAL] Không thể kết nối MQTT: {e}")
+
+    async def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def create_transport(mode: str = settings.MQTT_TRANSPORT, **kwargs) -> MqttTransport:
+    """Chọn chế độ chạy MQTT theo cấu hình (asyncio | thread)"""
+    if mode == "thread":
+        return ThreadMqttTransport(**kwargs)
+    return AsyncioMqttTransport(**kwargs)
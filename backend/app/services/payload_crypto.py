@@ -0,0 +1,151 @@
+import binascii
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from Crypto.Cipher import AES
+
+from core.config import settings
+from db.session import SessionLocal
+from models import models
+
+from core.logger import get_logger
+
+logger = get_logger("Payload_Crypto")
+
+AES_KEY_SIZES = (16, 24, 32)
+
+
+class PayloadDecryptor:
+    """
+    Giải mã gói tin AES (ECB, Zero Padding) của ESP32, thay cho core.security.decrypt_payload:
+    - Mỗi khóa chỉ tạo cipher 1 lần rồi dùng lại (ECB không giữ trạng thái giữa các lần giải mã).
+      Mỗi lần nạp bảng khóa thì bỏ cipher của khóa không còn dùng (khóa đã xoay / đã xóa).
+    - Bảng khóa riêng từng thiết bị (device_keys) nạp vào bộ nhớ; CRUD gọi invalidate() khi đổi khóa.
+      invalidate() chỉ có tác dụng trong tiến trình gọi nó: tiến trình khác (ingest_worker.py, worker uvicorn khác)
+      nhận khóa mới khi Ingest Writer gọi refresh_if_due() (mỗi DEVICE_KEY_REFRESH_SECONDS).
+    - decrypt_many(): giải mã cả lô, các gói cùng khóa được nối lại và giải mã bằng 1 lệnh gọi duy nhất.
+    """
+
+    def __init__(self, session_factory=SessionLocal, default_key: bytes = settings.AES_KEY,
+                 refresh_seconds: float = settings.DEVICE_KEY_REFRESH_SECONDS):
+        self._session_factory = session_factory
+        self.default_key = default_key
+        self.refresh_seconds = refresh_seconds
+        self._keys: Dict[str, bytes] = {}
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._ciphers: Dict[bytes, object] = {}
+        self._lock = threading.Lock()
+
+    # ---------------- BẢNG KHÓA ----------------
+    def load_all(self, db=None):
+        """Nạp toàn bộ bảng device_keys vào bộ nhớ (gọi lúc khởi động hoặc sau invalidate)"""
+        try:
+            rows = self._read_keys(db)
+        except Exception as e:
+            # Không đọc được bảng khóa -> tạm dùng khóa chung, không làm dừng Ingest
+            logger.error(f"❌ Không nạp được bảng device_keys: {e}")
+            rows = []
+        keys = self._store(rows)
+        logger.info(f"🔑 Loaded {len(keys)} per-device AES keys")
+
+    def refresh_if_due(self) -> bool:
+        """Nạp lại bảng khóa nếu đã quá refresh_seconds kể từ lần nạp trước (Writer gọi giữa 2 lô)"""
+        if self.refresh_seconds <= 0 or time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return False
+        try:
+            rows = self._read_keys()
+        except Exception as e:
+            # DB lỗi: giữ bảng khóa cũ (khác load_all: không rơi về khóa chung), thử lại ở chu kỳ sau
+            self._loaded_at = time.monotonic()
+            logger.error(f"❌ Không nạp lại được bảng device_keys: {e}")
+            return False
+        keys = self._store(rows)
+        logger.debug(f"🔑 Refreshed {len(keys)} per-device AES keys")
+        return True
+
+    def _read_keys(self, db=None):
+        own_session = db is None
+        db = db or self._session_factory()
+        try:
+            return db.query(models.DeviceKey.device_id, models.DeviceKey.aes_key).all()
+        finally:
+            if own_session:
+                db.close()
+
+    def _store(self, rows) -> Dict[str, bytes]:
+        """Thay cả bảng khóa trong bộ nhớ (bỏ khóa sai độ dài)"""
+        keys = {}
+        for device_id, aes_key in rows:
+            key = aes_key.encode("utf-8")
+            if len(key) not in AES_KEY_SIZES:
+                logger.error(f"❌ Khóa AES của {device_id} dài {len(key)} byte (phải là 16/24/32), bỏ qua")
+                continue
+            keys[device_id] = key
+        in_use = set(keys.values())
+        in_use.add(self.default_key)
+        with self._lock:
+            self._keys = keys
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+            self._ciphers = {key: cipher for key, cipher in self._ciphers.items() if key in in_use}
+        return keys
+
+    def invalidate(self):
+        """Đánh dấu bảng khóa đã cũ, lần giải mã sau sẽ nạp lại từ DB"""
+        with self._lock:
+            self._loaded = False
+
+    def key_for(self, device_id: Optional[str]) -> bytes:
+        if not self._loaded:
+            self.load_all()
+        if device_id is None:
+            return self.default_key
+        return self._keys.get(device_id, self.default_key)
+
+    def _cipher(self, key: bytes):
+        cipher = self._ciphers.get(key)
+        if cipher is None:
+            cipher = self._ciphers.setdefault(key, AES.new(key, AES.MODE_ECB))
+        return cipher
+
+    # ---------------- GIẢI MÃ ----------------
+    def decrypt(self, encrypted_base64, device_id: Optional[str] = None) -> Optional[bytes]:
+        """Base64 -> AES -> bytes JSON thô (đã bỏ Zero Padding). None nếu gói tin hỏng."""
+        try:
+            encrypted = binascii.a2b_base64(encrypted_base64)
+            return self._cipher(self.key_for(device_id)).decrypt(encrypted).rstrip(b"\x00").strip()
+        except (binascii.Error, ValueError, TypeError):
+            return None
+
+    def decrypt_many(self, envelopes: Sequence[Tuple[Optional[str], str]]) -> List[Optional[bytes]]:
+        """
+        Giải mã nhiều gói tin 1 lần. envelopes: [(device_id hoặc None, chuỗi Base64), ...]
+        Kết quả đúng thứ tự đầu vào, gói nào hỏng thì là None.
+        """
+        results: List[Optional[bytes]] = [None] * len(envelopes)
+
+        # Gom theo khóa: ECB giải mã từng khối 16 byte độc lập nên nối các gói lại vẫn đúng
+        groups: Dict[bytes, List[Tuple[int, bytes]]] = {}
+        for index, (device_id, encrypted_base64) in enumerate(envelopes):
+            try:
+                encrypted = binascii.a2b_base64(encrypted_base64)
+            except (binascii.Error, ValueError, TypeError):
+                continue
+            if not encrypted or len(encrypted) % AES.block_size:
+                continue
+            groups.setdefault(self.key_for(device_id), []).append((index, encrypted))
+
+        for key, items in groups.items():
+            plain = self._cipher(key).decrypt(b"".join(encrypted for _, encrypted in items))
+            offset = 0
+            for index, encrypted in items:
+                end = offset + len(encrypted)
+                results[index] = plain[offset:end].rstrip(b"\x00").strip()
+                offset = end
+        return results
+
+
+# Bộ giải mã dùng chung cho toàn bộ tiến trình
+payload_decryptor = PayloadDecryptor()
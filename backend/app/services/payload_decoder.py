@@ -0,0 +1,406 @@
+"""
+Bộ giải mã nhanh cho gói tin cảm biến (thay cho chuỗi decode -> json.loads -> dò key -> Pydantic).
+
+- Nhận thẳng msg.payload (bytes / bytearray / memoryview), không decode sang str.
+- Có msgspec: parse thẳng vào Struct có kiểu (1 lượt duy nhất, không tạo dict trung gian).
+  Không có msgspec: dùng orjson, cuối cùng là json của thư viện chuẩn.
+- Phân loại vỏ gói tin đúng 1 lần: Wokwi (JSON phẳng) hay ESP32 ({"data": "<AES Base64>"}).
+- Kiểm tra ngưỡng bằng so sánh số thực, cùng giới hạn với schemas.SensorDataInput.
+- Trường tùy chọn "seq" (số thứ tự gói của thiết bị) hoặc "ts" (giờ của thiết bị) -> SensorReading.dedup_key
+  để Ingest Writer bỏ gói bị gửi lại (services/dedup.py). Gói AES: đặt 2 trường này bên trong phần mã hóa.
+"""
+import struct
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple, Union
+
+from core.metrics import INGEST_MESSAGES, STAGE_DECODE, STAGE_DECRYPT, STAGE_VALIDATE
+from services.ingest_writer import SensorReading
+from services.payload_crypto import payload_decryptor
+
+try:
+    import msgspec
+except ImportError:  # Thư viện tùy chọn
+    msgspec = None
+
+try:
+    import numpy as np
+except ImportError:  # Thư viện tùy chọn (chỉ dùng cho gói nhị phân nhiều bản ghi)
+    np = None
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+
+class PayloadError(ValueError):
+    """Gói tin bị loại. reason: json | missing_fields | decrypt | invalid | binary_size | identity"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+# Cùng giới hạn với schemas.SensorDataInput (temp -10..80, hum_air 0..100, hum_soil 0..4095, light >= 0)
+TEMP_MIN, TEMP_MAX = -10.0, 80.0
+HUM_AIR_MIN, HUM_AIR_MAX = 0.0, 100.0
+HUM_SOIL_MIN, HUM_SOIL_MAX = 0.0, 4095.0
+
+
+_FIELDS = ("device_id", "temp", "hum_air", "hum_soil", "light",
+           "pump_state", "light_state", "mist_state", "data", "seq", "ts")
+
+if msgspec is not None:
+    class RawSensorPayload(msgspec.Struct, gc=False):
+        """Mọi trường của cả 2 loại vỏ gói tin; trường nào không gửi thì là None"""
+        device_id: Optional[str] = None
+        temp: Optional[float] = None
+        hum_air: Optional[float] = None
+        hum_soil: Optional[float] = None
+        light: Optional[float] = None
+        pump_state: Optional[bool] = None
+        light_state: Optional[bool] = None
+        mist_state: Optional[bool] = None
+        data: Optional[str] = None   # Vỏ AES của ESP32
+        seq: Optional[int] = None    # Số thứ tự gói (tăng dần, về 0 khi khởi động lại)
+        ts: Optional[float] = None   # Hoặc thời điểm đo theo đồng hồ thiết bị
+
+    # strict=False: chấp nhận "24.5" (chuỗi) cho số thực và 0/1 cho trạng thái bật/tắt, như float()/bool() cũ
+    _struct_decode = msgspec.json.Decoder(RawSensorPayload, strict=False).decode
+else:
+    class RawSensorPayload:
+        """Bản thay thế khi không cài msgspec (cùng tên trường)"""
+        __slots__ = _FIELDS
+
+        def __init__(self, *values):
+            for name, value in zip(_FIELDS, values):
+                setattr(self, name, value)
+
+    _struct_decode = None
+
+
+def _to_float(value):
+    return None if value is None else float(value)
+
+
+def _to_bool(value):
+    return None if value is None else bool(value)
+
+
+def _to_int(value):
+    return None if value is None else int(value)
+
+
+def _parse(payload) -> "RawSensorPayload":
+    """Parse JSON đúng 1 lần thành RawSensorPayload"""
+    if _struct_decode is not None:
+        try:
+            return _struct_decode(payload)
+        except msgspec.ValidationError:
+            # Kiểu lạ (VD: "pump_state": 2) -> đi đường chậm bên dưới để ép kiểu như cũ
+            pass
+        except msgspec.DecodeError:
+            raise PayloadError("json", "⚠️ Lỗi JSON: Gói tin không đúng định dạng")
+
+    try:
+        if isinstance(payload, memoryview) and _json_loads.__module__ == "json":
+            payload = payload.tobytes()
+        obj = _json_loads(payload)
+    except Exception:
+        raise PayloadError("json", "⚠️ Lỗi JSON: Gói tin không đúng định dạng")
+    if not isinstance(obj, dict):
+        raise PayloadError("missing_fields", "⚠️ Gói tin thiếu trường dữ liệu quan trọng")
+
+    get = obj.get
+    try:
+        return RawSensorPayload(
+            get("device_id"),
+            _to_float(get("temp")), _to_float(get("hum_air")),
+            _to_float(get("hum_soil")), _to_float(get("light")),
+            _to_bool(get("pump_state")), _to_bool(get("light_state")), _to_bool(get("mist_state")),
+            get("data"), _to_int(get("seq")), _to_float(get("ts")),
+        )
+    except (TypeError, ValueError):
+        raise PayloadError("invalid", "❌ Số liệu cảm biến không hợp lệ")
+
+
+if msgspec is not None:
+    class _EnvelopeId(msgspec.Struct, gc=False):
+        """Chỉ lấy device_id ở vỏ gói tin, các trường khác bỏ qua"""
+        device_id: Optional[str] = None
+
+    _peek_decode = msgspec.json.Decoder(_EnvelopeId).decode
+else:
+    _peek_decode = None
+
+
+def peek_device_id(payload) -> Optional[str]:
+    """
+    device_id ở vỏ gói tin, chưa giải mã AES / kiểm tra ngưỡng (ingest_worker --mode hash bỏ gói của worker khác
+    trước khi tốn công giải mã). None = vỏ không có device_id (gói AES chỉ có device_id bên trong) hoặc đọc không được.
+    """
+    try:
+        if _peek_decode is not None:
+            return _peek_decode(payload).device_id
+        if isinstance(payload, memoryview) and _json_loads.__module__ == "json":
+            payload = payload.tobytes()
+        device_id = _json_loads(payload).get("device_id")
+    except Exception:
+        return None
+    return device_id if isinstance(device_id, str) else None
+
+
+# Dựng NamedTuple trực tiếp bằng tuple.__new__ (bỏ qua __new__ sinh tự động, rẻ hơn ~3 lần)
+_new_reading = tuple.__new__
+_clock = time.perf_counter
+
+
+def _open_envelope(payload, topic_device_id: Optional[str]):
+    """Parse vỏ gói tin -> (raw, device_id, có phải vỏ AES không)"""
+    raw = _parse(payload)
+    device_id = raw.device_id
+    if topic_device_id is not None:
+        if device_id is None:
+            device_id = topic_device_id
+        elif device_id != topic_device_id:
+            raise PayloadError("identity", f"❌ device_id trong gói tin ({device_id}) khác với topic ({topic_device_id})")
+
+    # --- PHÂN LOẠI VỎ GÓI TIN (1 lần) ---
+    if raw.temp is not None and device_id is not None:
+        # TRƯỜNG HỢP 1: Wokwi (JSON phẳng, không mã hóa)
+        return raw, device_id, False
+    if raw.data is not None:
+        # TRƯỜNG HỢP 2: ESP32 thật ({"data": "<AES Base64>"}, có thể kèm "device_id" để chọn khóa riêng)
+        return raw, device_id, True
+    raise PayloadError("missing_fields", "⚠️ Gói tin thiếu trường dữ liệu quan trọng")
+
+
+def _open_plain(plain: Optional[bytes], outer_id: Optional[str]):
+    """Phần đã giải mã AES -> (raw, device_id)"""
+    if plain is None:
+        raise PayloadError("decrypt", "❌ Giải mã AES thất bại")
+    try:
+        raw = _parse(plain)
+    except PayloadError:
+        # Giải mã ra rác = sai khóa hoặc gói tin hỏng
+        raise PayloadError("decrypt", "❌ Giải mã AES thất bại (sai khóa hoặc gói tin hỏng)")
+    device_id = raw.device_id or outer_id or "UNKNOWN"
+    if outer_id is not None and device_id != outer_id:
+        raise PayloadError("decrypt", f"❌ device_id ngoài vỏ ({outer_id}) khác bên trong gói AES ({device_id})")
+    return raw, device_id
+
+
+def _build_reading(raw, device_id: str, received_at: Optional[datetime]) -> SensorReading:
+    """Kiểm tra ngưỡng -> SensorReading"""
+    temp = raw.temp
+    if temp is None:
+        temp = 0.0
+    hum_air = raw.hum_air
+    hum_soil = raw.hum_soil
+    light = raw.light
+    if hum_air is None:
+        hum_air = 0.0
+    if hum_soil is None:
+        hum_soil = 0.0
+    if light is None:
+        light = 0.0
+
+    # CƠ CHẾ 1: PHÁT HIỆN LỖI (cảm biến hỏng gửi -999, -50...) -> Writer chuyển ERROR, không lưu
+    is_error = temp <= -50.0 or temp >= 100.0 or hum_soil < 0.0 or hum_soil > 100.0
+
+    # Chặn số liệu ảo (tương đương validate của schemas.SensorDataInput)
+    if not is_error and not (
+        TEMP_MIN <= temp <= TEMP_MAX
+        and HUM_AIR_MIN <= hum_air <= HUM_AIR_MAX
+        and HUM_SOIL_MIN <= hum_soil <= HUM_SOIL_MAX
+        and light >= 0.0
+    ):
+        raise PayloadError("invalid", f"❌ Số liệu ngoài ngưỡng: Dev={device_id} T={temp} H={hum_air} Đất={hum_soil} AS={light}")
+
+    # Trạng thái thiết bị: None = gói tin không gửi (giữ nguyên trạng thái cũ trong DB)
+    dedup_key = raw.seq
+    if dedup_key is None:
+        dedup_key = raw.ts
+    return _new_reading(SensorReading, (
+        device_id, temp, hum_air, hum_soil, light,
+        raw.pump_state, raw.light_state, raw.mist_state,
+        is_error, received_at or datetime.now(), dedup_key,
+    ))
+
+
+def decode_sensor_payload(payload, received_at: Optional[datetime] = None, timed: bool = False,
+                          topic_device_id: Optional[str] = None) -> SensorReading:
+    """
+    bytes/memoryview của msg.payload -> SensorReading.
+    Ném PayloadError nếu gói tin bị loại (sai JSON, thiếu trường, giải mã AES lỗi, số liệu ảo).
+    timed=True: ghi thời gian các công đoạn decode / decrypt / validate vào /metrics.
+    topic_device_id: device_id lấy từ topic (services/topic_router.py) -> gói tin không cần gửi kèm device_id,
+    nếu có gửi thì phải trùng.
+    """
+    if timed:
+        started = _clock()
+        decrypt_elapsed = 0.0
+    raw, device_id, encrypted = _open_envelope(payload, topic_device_id)
+    if encrypted:
+        if timed:
+            decrypt_started = _clock()
+        plain = payload_decryptor.decrypt(raw.data, device_id)
+        if timed:
+            decrypt_elapsed = _clock() - decrypt_started
+            STAGE_DECRYPT.observe(decrypt_elapsed)
+        raw, device_id = _open_plain(plain, device_id)
+
+    if not timed:
+        return _build_reading(raw, device_id, received_at)
+    validate_started = _clock()
+    STAGE_DECODE.observe(validate_started - started - decrypt_elapsed)
+    reading = _build_reading(raw, device_id, received_at)
+    STAGE_VALIDATE.observe(_clock() - validate_started)
+    return reading
+
+
+def decode_sensor_payloads(payloads: Sequence[Tuple[object, Optional[str]]],
+                           received_at: Optional[datetime] = None) -> List[Union[SensorReading, PayloadError]]:
+    """
+    Giải mã cả lô gói tin JSON. payloads: [(msg.payload, topic_device_id hoặc None), ...]
+    Mọi vỏ AES của lô được giải mã bằng 1 lần payload_decryptor.decrypt_many (gói cùng khóa = 1 lệnh gọi AES).
+    Kết quả đúng thứ tự đầu vào: SensorReading, hoặc PayloadError nếu gói đó bị loại.
+    """
+    results: List[Union[SensorReading, PayloadError, None]] = [None] * len(payloads)
+    opened = []
+    envelopes = []
+    for index, (payload, topic_device_id) in enumerate(payloads):
+        try:
+            raw, device_id, encrypted = _open_envelope(payload, topic_device_id)
+        except PayloadError as e:
+            results[index] = e
+            continue
+        opened.append((index, raw, device_id, encrypted))
+        if encrypted:
+            envelopes.append((device_id, raw.data))
+
+    plains = iter(payload_decryptor.decrypt_many(envelopes) if envelopes else ())
+    for index, raw, device_id, encrypted in opened:
+        try:
+            if encrypted:
+                raw, device_id = _open_plain(next(plains), device_id)
+            results[index] = _build_reading(raw, device_id, received_at)
+        except PayloadError as e:
+            results[index] = e
+    return results
+
+
+# =========================================================================
+# ĐỊNH DẠNG NHỊ PHÂN (khớp struct_message trong 1_firmware/*/src/common.h)
+# =========================================================================
+# typedef struct { int id; float temp; float hum_air; int hum_soil; int light; int command; }
+# ESP32 là little-endian, không có padding -> 24 byte / bản ghi. 1 gói tin = N bản ghi nối liền.
+# device_id không nằm trong struct mà nằm ở cuối topic: <MQTT_TOPIC_SENSOR_BIN>/<device_id>
+BINARY_RECORD = struct.Struct("<iffiii")
+BINARY_RECORD_SIZE = BINARY_RECORD.size
+NODE_SENSOR = 1           # struct_message.id: 1=Sensor, 2=Control, 3=Gateway
+NUMPY_MIN_RECORDS = 16    # Từ bao nhiêu bản ghi thì dùng numpy.frombuffer thay cho struct
+
+# Lệnh cuối cùng gateway đã gửi (struct_message.command) -> (pump_state, light_state, mist_state)
+# None = lệnh không liên quan tới thiết bị đó (giữ nguyên trạng thái cũ trong DB)
+CMD_STATES = {
+    1: (True, None, None), 2: (False, None, None),    # CMD_PUMP_ON / CMD_PUMP_OFF
+    3: (None, None, True), 4: (None, None, False),    # CMD_MIST_ON / CMD_MIST_OFF
+    5: (None, True, None), 6: (None, False, None),    # CMD_LIGHT_ON / CMD_LIGHT_OFF
+}
+NO_STATE = (None, None, None)
+
+if np is not None:
+    BINARY_DTYPE = np.dtype([
+        ("id", "<i4"), ("temp", "<f4"), ("hum_air", "<f4"),
+        ("hum_soil", "<i4"), ("light", "<i4"), ("command", "<i4"),
+    ])
+
+
+def _binary_reading(device_id: str, temp: float, hum_air: float, hum_soil: float, light: float,
+                    command: int, is_error: bool, received_at: datetime) -> SensorReading:
+    # struct_message không có seq/ts -> gói nhị phân không qua cửa sổ chống trùng (dedup_key=None)
+    pump_state, light_state, mist_state = CMD_STATES.get(command, NO_STATE)
+    return _new_reading(SensorReading, (
+        device_id, temp, hum_air, hum_soil, light,
+        pump_state, light_state, mist_state, is_error, received_at, None,
+    ))
+
+
+def _decode_binary_struct(device_id: str, payload, received_at: datetime) -> List[SensorReading]:
+    readings = []
+    for node_id, temp, hum_air, hum_soil, light, command in BINARY_RECORD.iter_unpack(payload):
+        if node_id != NODE_SENSOR:
+            continue
+        # float32 -> làm tròn 2 chữ số để không lưu 24.299999237 thay cho 24.3
+        # (round() không có ndigits rẻ hơn round(x, 2) nhiều lần)
+        temp = round(temp * 100) / 100
+        hum_air = round(hum_air * 100) / 100
+        is_error = temp <= -50.0 or temp >= 100.0 or hum_soil < 0 or hum_soil > 100
+        if not is_error and not (
+            TEMP_MIN <= temp <= TEMP_MAX
+            and HUM_AIR_MIN <= hum_air <= HUM_AIR_MAX
+            and HUM_SOIL_MIN <= hum_soil <= HUM_SOIL_MAX
+            and light >= 0
+        ):
+            INGEST_MESSAGES.inc("invalid")
+            continue
+        readings.append(_binary_reading(device_id, temp, hum_air, float(hum_soil), float(light),
+                                        command, is_error, received_at))
+    return readings
+
+
+def _decode_binary_numpy(device_id: str, payload, received_at: datetime) -> List[SensorReading]:
+    records = np.frombuffer(payload, dtype=BINARY_DTYPE)
+    records = records[records["id"] == NODE_SENSOR]
+
+    temp = np.round(records["temp"].astype(np.float64) * 100) / 100
+    hum_air = np.round(records["hum_air"].astype(np.float64) * 100) / 100
+    hum_soil = records["hum_soil"]
+    light = records["light"]
+
+    # Cùng luật với đường JSON, tính trên cả mảng 1 lần
+    is_error = (temp <= -50.0) | (temp >= 100.0) | (hum_soil < 0) | (hum_soil > 100)
+    valid = (
+        (temp >= TEMP_MIN) & (temp <= TEMP_MAX)
+        & (hum_air >= HUM_AIR_MIN) & (hum_air <= HUM_AIR_MAX)
+        & (hum_soil >= HUM_SOIL_MIN) & (hum_soil <= HUM_SOIL_MAX)
+        & (light >= 0)
+    )
+    keep = is_error | valid
+    invalid = len(keep) - int(keep.sum())
+    if invalid:
+        INGEST_MESSAGES.inc("invalid", amount=invalid)
+
+    return [
+        _binary_reading(device_id, t, h, float(s), float(l), c, e, received_at)
+        for t, h, s, l, c, e in zip(
+            temp[keep].tolist(), hum_air[keep].tolist(), hum_soil[keep].tolist(),
+            light[keep].tolist(), records["command"][keep].tolist(), is_error[keep].tolist(),
+        )
+    ]
+
+
+def decode_binary_payload(device_id: str, payload, received_at: Optional[datetime] = None,
+                          timed: bool = False) -> List[SensorReading]:
+    """
+    Gói tin nhị phân (N x struct_message) -> danh sách SensorReading của 1 thiết bị.
+    Bản ghi không phải của Sensor Node (id != 1) và bản ghi có số liệu ảo bị bỏ qua.
+    Ném PayloadError nếu độ dài gói tin không chia hết cho 24 byte.
+    """
+    size = len(payload)
+    if size == 0 or size % BINARY_RECORD_SIZE:
+        raise PayloadError("binary_size", f"⚠️ Gói tin nhị phân sai độ dài: {size} byte (phải là bội số của {BINARY_RECORD_SIZE})")
+
+    started = _clock()
+    received_at = received_at or datetime.now()
+    if np is not None and size // BINARY_RECORD_SIZE >= NUMPY_MIN_RECORDS:
+        readings = _decode_binary_numpy(device_id, payload, received_at)
+    else:
+        readings = _decode_binary_struct(device_id, payload, received_at)
+    if timed:
+        STAGE_DECODE.observe(_clock() - started)
+    return readings
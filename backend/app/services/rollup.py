@@ -0,0 +1,373 @@
+"""
+Bảng gộp số liệu cảm biến theo khung 1 phút / 1 giờ / 1 ngày (sensor_rollup_1m / 1h / 1d).
+
+Ghi (RollupCompactor, chạy nền mỗi ROLLUP_INTERVAL_SECONDS):
+- sensor_data -> 1m cho các phút đã đóng (trễ ROLLUP_LAG_SECONDS để Writer ghi nốt lô đang chờ),
+  1m -> 1h cho các giờ đã gộp đủ phút, 1h -> 1d cho các ngày đã gộp đủ giờ.
+- Mỗi bảng có 1 watermark (rollup_watermarks): khung < watermark đã đầy đủ. Mỗi bước xóa rồi ghi lại
+  đúng khoảng [watermark, mốc mới) và dời watermark trong CÙNG 1 transaction -> chạy lại bao nhiêu lần cũng đúng.
+  Lô COMMIT muộn (Writer tồn đọng khi DB nghẽn): Writer ghi mốc cũ nhất vào rollup_late_data (mark_late),
+  lần gộp sau dời watermark từng bảng về khung chứa mốc đó rồi gộp lại.
+  Dữ liệu cũ nạp muộn: python -m tools.rollups rebuild --since ... (dời watermark về trước rồi gộp lại).
+
+Đọc (read_series): chia khoảng thời gian thành các đoạn khớp khung của bảng thô nhất có thể,
+phần lẻ 2 đầu và phần chưa gộp xong đọc ở bảng mịn hơn, cuối cùng mới tới sensor_data.
+Biểu đồ 30 ngày của 500 thiết bị: ~15 nghìn dòng 1d + phần của hôm nay, thay vì hàng chục triệu dòng thô.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, insert, select
+
+from core.config import settings
+from core.logger import get_logger
+from core.metrics import metrics
+from db.partitions import sensor_partitions
+from db.session import SessionLocal
+from models import models
+
+logger = get_logger("Rollup")
+
+METRICS = ("temp", "hum_air", "hum_soil", "light")
+# Thứ tự cột của 1 khung (cũng là thứ tự phần tử của bộ cộng dồn acc)
+ROLLUP_FIELDS = ("samples",) + tuple(f"{m}_{k}" for m in METRICS for k in ("count", "sum", "min", "max"))
+# Mỗi bước gộp tối đa N khung của bảng đích (1m: 1 giờ dữ liệu thô / bước)
+STEP_BUCKETS = 60
+
+
+def floor_minute(ts: datetime) -> datetime:
+    return ts.replace(second=0, microsecond=0)
+
+
+def floor_hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RollupLevel(NamedTuple):
+    name: str
+    model: type
+    step: timedelta
+    floor: Callable[[datetime], datetime]
+
+    def ceil(self, ts: datetime) -> datetime:
+        start = self.floor(ts)
+        return start if start == ts else start + self.step
+
+
+LEVELS = (
+    RollupLevel("1m", models.SensorRollup1m, timedelta(minutes=1), floor_minute),
+    RollupLevel("1h", models.SensorRollup1h, timedelta(hours=1), floor_hour),
+    RollupLevel("1d", models.SensorRollup1d, timedelta(days=1), floor_day),
+)
+LEVEL_INDEX = {level.name: index for index, level in enumerate(LEVELS)}
+
+
+def _naive(ts: Optional[datetime]) -> Optional[datetime]:
+    """Postgres (timezone=True) trả về datetime có múi giờ -> đổi về giờ địa phương không múi như phần còn lại của hệ thống"""
+    if ts is not None and ts.tzinfo is not None:
+        return ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def _archives():
+    """
+    Bản ghi thô gồm sensor_data + kho khối nén (giờ cũ) + kho lạnh (ngày cũ)
+    (services/cold_archive.py, services/sensor_blocks.py import module này nên import muộn)
+    """
+    from services.cold_archive import cold_archive
+    from services.sensor_blocks import sensor_blocks
+    return sensor_blocks, cold_archive
+
+
+# ================= BỘ CỘNG DỒN 1 KHUNG =================
+# acc = [samples, temp_count, temp_sum, temp_min, temp_max, hum_air_count, ...] (đúng thứ tự ROLLUP_FIELDS)
+
+def new_acc() -> list:
+    return [0] + [0, 0.0, None, None] * len(METRICS)
+
+
+def add_reading(acc: list, values) -> None:
+    """Cộng 1 bản ghi thô (temp, hum_air, hum_soil, light)"""
+    acc[0] += 1
+    i = 1
+    for value in values:
+        if value is not None:
+            acc[i] += 1
+            acc[i + 1] += value
+            if acc[i + 2] is None or value < acc[i + 2]:
+                acc[i + 2] = value
+            if acc[i + 3] is None or value > acc[i + 3]:
+                acc[i + 3] = value
+        i += 4
+
+
+def add_rollup(acc: list, row) -> None:
+    """Cộng 1 khung đã gộp (cùng thứ tự ROLLUP_FIELDS)"""
+    acc[0] += row[0] or 0
+    for i in range(1, len(acc), 4):
+        acc[i] += row[i] or 0
+        acc[i + 1] += row[i + 1] or 0
+        low, high = row[i + 2], row[i + 3]
+        if low is not None and (acc[i + 2] is None or low < acc[i + 2]):
+            acc[i + 2] = low
+        if high is not None and (acc[i + 3] is None or high > acc[i + 3]):
+            acc[i + 3] = high
+
+
+def acc_average(acc: list, metric: str, digits: int = 1) -> Optional[float]:
+    i = 1 + METRICS.index(metric) * 4
+    return round(acc[i + 1] / acc[i], digits) if acc[i] else None
+
+
+# ================= GHI: GỘP DẦN THEO WATERMARK =================
+
+class RollupCompactor:
+    def __init__(self, session_factory=SessionLocal, lag_seconds: float = settings.ROLLUP_LAG_SECONDS):
+        self._session_factory = session_factory
+        self.lag = lag_seconds
+        self._lock = threading.Lock()  # Chỉ 1 luồng gộp tại 1 thời điểm
+        self.watermarks: Dict[str, Optional[datetime]] = {level.name: None for level in LEVELS}
+
+    def compact_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Gộp tới hiện tại (trừ độ trễ). Trả về số khung đã ghi của từng bảng."""
+        with self._lock:
+            db = self._session_factory()
+            written = {}
+            try:
+                self._rewind_late(db)
+                # Bảng 1m gộp tới phút đã đóng; bảng sau chỉ gộp tới watermark của bảng trước
+                source_end = floor_minute((now or datetime.now()) - timedelta(seconds=self.lag))
+                for index, level in enumerate(LEVELS):
+                    written[level.name] = self._compact_level(db, index, source_end)
+                    source_end = self.watermarks[level.name]
+                    if source_end is None:
+                        break
+                if any(written.values()):
+                    logger.debug(f"🧮 Rollup: {written}")
+                return written
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Lỗi gộp số liệu cảm biến: {e}", exc_info=True)
+                return written
+            finally:
+                db.close()
+
+    def _compact_level(self, db, index: int, source_end: datetime) -> int:
+        level = LEVELS[index]
+        end = level.floor(source_end)
+        row = db.get(models.RollupWatermark, level.name)
+        start = _naive(row.watermark) if row else None
+        if start is None:
+            first = self._next_source_time(db, index, None, end)
+            if first is None:
+                return 0
+            start = level.floor(first)
+
+        written = 0
+        while start < end:
+            step_end = min(end, start + level.step * STEP_BUCKETS)
+            buckets = self._fold(db, index, start, step_end)
+            if not buckets and step_end < end:
+                # Khoảng trống (mất điện, chưa có thiết bị...) -> nhảy thẳng tới dữ liệu kế tiếp
+                following = self._next_source_time(db, index, step_end, end)
+                step_end = level.floor(following) if following is not None else end
+
+            model = level.model
+            db.query(model).filter(model.bucket >= start, model.bucket < step_end).delete(synchronize_session=False)
+            if buckets:
+                db.execute(insert(model.__table__), [
+                    {"bucket": bucket, "device_id": device_id, **dict(zip(ROLLUP_FIELDS, acc))}
+                    for (device_id, bucket), acc in buckets.items()
+                ])
+            db.merge(models.RollupWatermark(level=level.name, watermark=step_end))
+            db.commit()
+            written += len(buckets)
+            start = step_end
+
+        self.watermarks[level.name] = start
+        return written
+
+    @staticmethod
+    def _next_source_time(db, index: int, after: Optional[datetime], before: datetime) -> Optional[datetime]:
+        """Mốc thời gian nhỏ nhất của nguồn (sensor_data hoặc bảng mịn hơn) trong [after, before)"""
+        column = sensor_partitions.sensor_entity(db, after, before).timestamp if index == 0 else LEVELS[index - 1].model.bucket
+        query = db.query(func.min(column)).filter(column < before)
+        if after is not None:
+            query = query.filter(column >= after)
+        first = _naive(query.scalar())
+        if index == 0:
+            for archive in _archives():
+                archived = archive.first_time(db, after, before)
+                if archived is not None and (first is None or archived < first):
+                    first = archived
+        return first
+
+    @staticmethod
+    def _fold(db, index: int, start: datetime, end: datetime) -> Dict[Tuple[str, datetime], list]:
+        """Gộp nguồn trong [start, end) thành {(device_id, bucket): acc}"""
+        floor = LEVELS[index].floor
+        buckets: Dict[Tuple[str, datetime], list] = {}
+        if index == 0:
+            sd = sensor_partitions.sensor_entity(db, start, end)
+            rows = db.connection().execute(
+                select(sd.device_id, sd.timestamp, sd.temp, sd.hum_air, sd.hum_soil, sd.light)
+                .where(sd.timestamp >= start, sd.timestamp < end)
+                .execution_options(yield_per=10000)
+            )
+            for device_id, ts, *values in rows:
+                key = (device_id, floor(_naive(ts)))
+                acc = buckets.get(key)
+                if acc is None:
+                    acc = buckets[key] = new_acc()
+                add_reading(acc, values)
+            for archive in _archives():
+                for device_id, ts, values in archive.readings(db, start, end):
+                    key = (device_id, floor(ts))
+                    acc = buckets.get(key)
+                    if acc is None:
+                        acc = buckets[key] = new_acc()
+                    add_reading(acc, values)
+        else:
+            source = LEVELS[index - 1].model
+            rows = db.connection().execute(
+                select(source.device_id, source.bucket, *(getattr(source, f) for f in ROLLUP_FIELDS))
+                .where(source.bucket >= start, source.bucket < end)
+                .execution_options(yield_per=10000)
+            )
+            for device_id, bucket, *values in rows:
+                key = (device_id, floor(_naive(bucket)))
+                acc = buckets.get(key)
+                if acc is None:
+                    acc = buckets[key] = new_acc()
+                add_rollup(acc, values)
+        return buckets
+
+    def _rewind_late(self, db) -> None:
+        """
+        Số liệu COMMIT muộn (mark_late) -> dời watermark từng bảng về khung chứa mốc cũ nhất.
+        Chỉ xóa đúng các mốc đã đọc: mốc Writer ghi thêm trong lúc đang gộp để lại cho lần sau.
+        """
+        late = db.query(models.RollupLateData.id, models.RollupLateData.since).all()
+        if not late:
+            return
+        since = min(_naive(ts) for _, ts in late)
+        for row in db.query(models.RollupWatermark).all():
+            index = LEVEL_INDEX.get(row.level)
+            if index is not None and _naive(row.watermark) > LEVELS[index].floor(since):
+                row.watermark = LEVELS[index].floor(since)
+        db.query(models.RollupLateData).filter(models.RollupLateData.id.in_([i for i, _ in late])).delete(synchronize_session=False)
+        db.commit()
+        logger.info(f"🧮 Rollup: {len(late)} lô số liệu ghi muộn, gộp lại từ {since:%Y-%m-%d %H:%M}")
+
+    def rewind(self, since: datetime) -> None:
+        """Dời watermark của mọi bảng về trước `since` (đầu ngày) để lần gộp sau tính lại từ đó"""
+        with self._lock:
+            db = self._session_factory()
+            try:
+                since = floor_day(since)
+                for row in db.query(models.RollupWatermark).all():
+                    if _naive(row.watermark) > since:
+                        row.watermark = since
+                db.commit()
+                self.watermarks = {level.name: None for level in LEVELS}
+            finally:
+                db.close()
+
+
+def mark_late(db, oldest: datetime, now: Optional[datetime] = None) -> bool:
+    """
+    Gọi trong transaction ghi sensor_data, ngay trước COMMIT, với mốc cũ nhất của lô.
+    Lô cũ hơn nửa ROLLUP_LAG_SECONDS có thể đã bị lần gộp đang / vừa chạy bỏ qua (lần gộp chỉ đọc tới now - lag,
+    nửa còn lại là khoảng chờ COMMIT) -> ghi mốc vào rollup_late_data. Lô bình thường (vừa nhận) không ghi gì.
+    """
+    if oldest >= (now or datetime.now()) - timedelta(seconds=settings.ROLLUP_LAG_SECONDS / 2):
+        return False
+    db.add(models.RollupLateData(since=oldest))
+    return True
+
+
+# ================= ĐỌC: BẢNG THÔ NHẤT VỪA KHỚP =================
+
+def load_watermarks(db) -> Dict[str, datetime]:
+    return {row.level: _naive(row.watermark) for row in db.query(models.RollupWatermark).all()}
+
+
+def plan_pieces(start: datetime, end: datetime, watermarks: Dict[str, datetime], top: int) -> List[Tuple[Optional[RollupLevel], datetime, datetime]]:
+    """
+    Chia [start, end) thành các đoạn (bảng, từ, tới): đoạn giữa đọc ở LEVELS[top] (khớp khung, chưa vượt watermark),
+    2 đầu lẻ đọc ở bảng mịn hơn, bảng None = sensor_data.
+    """
+    if start >= end:
+        return []
+    if top < 0:
+        return [(None, start, end)]
+    level = LEVELS[top]
+    watermark = watermarks.get(level.name)
+    low = level.ceil(start)
+    high = min(level.floor(end), watermark) if watermark is not None else low
+    if low >= high:
+        return plan_pieces(start, end, watermarks, top - 1)
+    return (plan_pieces(start, low, watermarks, top - 1)
+            + [(level, low, high)]
+            + plan_pieces(high, end, watermarks, top - 1))
+
+
+def read_series(db, start: datetime, end: datetime, granularity: str = "1d") -> Dict[datetime, list]:
+    """
+    Số liệu của TẤT CẢ thiết bị gộp theo khung granularity ("1m" / "1h" / "1d") trong [start, end):
+    {đầu khung: acc} theo thứ tự thời gian. Trung bình 1 thông số: acc_average(acc, "temp").
+    """
+    top = LEVEL_INDEX[granularity]
+    floor = LEVELS[top].floor
+    series: Dict[datetime, list] = {}
+
+    def acc_for(ts: datetime) -> list:
+        key = floor(_naive(ts))
+        acc = series.get(key)
+        if acc is None:
+            acc = series[key] = new_acc()
+        return acc
+
+    for level, low, high in plan_pieces(start, end, load_watermarks(db), top):
+        if level is None:
+            sd = sensor_partitions.sensor_entity(db, low, high)
+            rows = db.connection().execute(
+                select(sd.timestamp, sd.temp, sd.hum_air, sd.hum_soil, sd.light)
+                .where(sd.timestamp >= low, sd.timestamp < high)
+                .execution_options(yield_per=10000)
+            )
+            for ts, *values in rows:
+                add_reading(acc_for(ts), values)
+            for archive in _archives():
+                for _, ts, values in archive.readings(db, low, high):
+                    add_reading(acc_for(ts), values)
+            continue
+
+        # Cộng các thiết bị ngay trong DB: mỗi khung chỉ trả về 1 dòng
+        model = level.model
+        columns = []
+        for field in ROLLUP_FIELDS:
+            column = getattr(model, field)
+            columns.append(func.min(column) if field.endswith("_min") else func.max(column) if field.endswith("_max") else func.sum(column))
+        rows = db.query(model.bucket, *columns)\
+            .filter(model.bucket >= low, model.bucket < high)\
+            .group_by(model.bucket)
+        for bucket, *values in rows:
+            add_rollup(acc_for(bucket), values)
+
+    return dict(sorted(series.items()))
+
+
+# Bộ gộp dùng chung cho toàn bộ tiến trình (main.py chạy nền)
+rollup_compactor = RollupCompactor()
+
+metrics.gauge(
+    "smartfarm_rollup_lag_seconds", "Độ trễ của watermark từng bảng gộp so với hiện tại",
+    lambda: [(name, (datetime.now() - wm).total_seconds()) for name, wm in rollup_compactor.watermarks.items() if wm is not None],
+    labels=("level",),
+)
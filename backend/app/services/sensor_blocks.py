@@ -0,0 +1,354 @@
+"""
+Kho khối nén cho sensor_data (SENSOR_BLOCKS_AFTER_HOURS > 0).
+
+Giờ đã đóng cũ hơn N giờ được chuyển khỏi bảng nóng thành khối nén kiểu Gorilla, mỗi thiết bị / mỗi giờ
+1 dòng ở bảng sensor_blocks (BLOB). Số đo thay đổi chậm -> phần lớn bản ghi chỉ còn vài bit.
+
+Định dạng khối:
+    header  24 byte: b"SFB1", version (u16), 0 (u16), rows (u32), 0 (u32), ts đầu (µs, i64)
+    6 luồng (ts, id, temp, hum_air, hum_soil, light), mỗi luồng: độ dài (u32) + dữ liệu
+    - ts, id (luồng số nguyên): giá trị đầu (i64) + delta-of-delta từng bản (zigzag),
+      mỗi bản 2 bit chọn độ rộng DOD_WIDTHS + phần giá trị đúng độ rộng đó (0 bit khi đều nhịp)
+    - số đo (luồng float64): XOR với giá trị trước. 1 bit / bản (0 = không đổi);
+      bản có đổi thêm 6 bit số 0 đầu + 6 bit (độ dài - 1) + các bit có nghĩa. NULL = NaN.
+Khác Gorilla gốc: các trường độ dài cố định (bộ chọn, cờ, số 0 đầu / độ dài) tách khỏi phần bit có nghĩa
+và bỏ trường hợp "dùng lại cửa sổ trước" -> vị trí từng trường tính bằng cumsum, mã hóa / giải mã đều
+vector hóa bằng numpy (không có vòng lặp Python theo từng bản ghi). Không mất dữ liệu (float64 giữ nguyên bit).
+
+Lịch sử (/devices/{id}/history) chỉ giải mã các khối có giờ giao khoảng cần đọc (mới -> cũ, đủ limit thì dừng);
+báo cáo, bộ gộp rollup đọc bảng nóng + kho khối + kho lạnh như 1 nguồn.
+Kho lạnh (COLD_ARCHIVE_AFTER_DAYS) chuyển tiếp các ngày cũ từ cả bảng nóng lẫn kho khối ra file.
+"""
+import struct
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_, delete, func, select
+
+from core.config import settings
+from core.logger import get_logger
+from db.partitions import sensor_partitions
+from db.session import SessionLocal
+from models import models
+from services.cold_archive import from_us, iter_rows, to_us
+from services.rollup import METRICS, _naive, floor_hour
+
+logger = get_logger("Sensor_Blocks")
+
+MAGIC = b"SFB1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIq")
+LENGTH = struct.Struct("<I")
+FIRST = struct.Struct("<q")
+DOD_WIDTHS = np.array([0, 10, 22, 64], dtype=np.int64)  # µs: đều nhịp / lệch < 0.5ms / < 2s / bất kỳ
+STREAMS = ("ts", "id") + METRICS
+
+
+# ================= 1. ĐÓNG / MỞ GÓI BIT (vector hóa) =================
+
+def pack_bits(values: np.ndarray, widths: np.ndarray) -> bytes:
+    """Ghi nối các trường: values[i] (uint64) lấy widths[i] bit thấp, bit cao trước"""
+    widths = widths.astype(np.int64)
+    total = int(widths.sum())
+    if total == 0:
+        return b""
+    field = np.repeat(np.arange(len(widths)), widths)
+    within = np.arange(total) - np.repeat(np.cumsum(widths) - widths, widths)
+    shift = (widths[field] - 1 - within).astype(np.uint64)
+    bits = (values.astype(np.uint64)[field] >> shift) & np.uint64(1)
+    return np.packbits(bits.astype(np.uint8)).tobytes()
+
+
+def unpack_bits(data: bytes, widths: np.ndarray) -> np.ndarray:
+    """Ngược lại của pack_bits: các trường (uint64) có độ rộng widths (trường 0 bit = 0)"""
+    widths = widths.astype(np.int64)
+    values = np.zeros(len(widths), dtype=np.uint64)
+    total = int(widths.sum())
+    if total == 0:
+        return values
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=total).astype(np.uint64)
+    nonzero = np.flatnonzero(widths)
+    starts = np.cumsum(widths) - widths
+    field = np.repeat(np.arange(len(widths)), widths)
+    shift = (widths[field] - 1 - (np.arange(total) - starts[field])).astype(np.uint64)
+    values[nonzero] = np.add.reduceat(bits << shift, starts[nonzero])
+    return values
+
+
+def _split(data: bytes, sizes: List[int]) -> List[bytes]:
+    parts, offset = [], 0
+    for size in sizes:
+        parts.append(data[offset:offset + size])
+        offset += size
+    parts.append(data[offset:])
+    return parts
+
+
+# ================= 2. LUỒNG SỐ NGUYÊN: DELTA-OF-DELTA =================
+
+def encode_ints(values: np.ndarray) -> bytes:
+    """ts (µs) / id tăng gần đều: giá trị đầu + delta-of-delta zigzag, 2 bit chọn độ rộng / bản"""
+    values = values.astype(np.int64)
+    if len(values) == 0:
+        return b""
+    dod = np.diff(np.diff(values), prepend=0)
+    zigzag = ((dod << 1) ^ (dod >> 63)).view(np.uint64)
+    # Độ rộng nhỏ nhất trong DOD_WIDTHS chứa được giá trị
+    selector = sum(((zigzag >> np.uint64(width)) != 0).astype(np.int64) for width in DOD_WIDTHS[:-1])
+    head = pack_bits(selector.astype(np.uint64), np.full(len(dod), 2))
+    return FIRST.pack(int(values[0])) + head + pack_bits(zigzag, DOD_WIDTHS[selector])
+
+
+def decode_ints(data: bytes, rows: int) -> np.ndarray:
+    if rows == 0:
+        return np.empty(0, dtype=np.int64)
+    first = FIRST.unpack_from(data)[0]
+    n = rows - 1
+    head_size = (2 * n + 7) // 8
+    head, payload = _split(data[FIRST.size:], [head_size])
+    selector = unpack_bits(head, np.full(n, 2)).astype(np.int64)
+    zigzag = unpack_bits(payload, DOD_WIDTHS[selector])
+    dod = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+    return first + np.concatenate(([0], np.cumsum(np.cumsum(dod))))
+
+
+# ================= 3. LUỒNG SỐ ĐO: XOR =================
+
+def encode_floats(values: np.ndarray) -> bytes:
+    """float64 (NaN = NULL): XOR với giá trị trước, chỉ ghi cửa sổ bit có nghĩa của phần khác 0"""
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    if len(bits) == 0:
+        return b""
+    xor = bits ^ np.concatenate(([np.uint64(0)], bits[:-1]))
+    changed = xor != 0
+    flags = np.packbits(changed.astype(np.uint8)).tobytes()
+    x = xor[changed]
+    if len(x) == 0:
+        return flags
+    # Số bit 0 đầu / cuối của từng giá trị 64 bit (so từng bit, vector hóa)
+    mask = (x[:, None] >> np.arange(63, -1, -1, dtype=np.uint64)) & np.uint64(1)
+    leading = np.argmax(mask, axis=1)
+    trailing = np.argmax(mask[:, ::-1], axis=1)
+    length = 64 - leading - trailing
+    head = pack_bits(np.column_stack((leading, length - 1)).ravel().astype(np.uint64), np.full(2 * len(x), 6))
+    return flags + head + pack_bits(x >> trailing.astype(np.uint64), length)
+
+
+def decode_floats(data: bytes, rows: int) -> np.ndarray:
+    if rows == 0:
+        return np.empty(0, dtype=np.float64)
+    flag_size = (rows + 7) // 8
+    flags = np.unpackbits(np.frombuffer(data[:flag_size], dtype=np.uint8), count=rows).astype(bool)
+    changed = int(flags.sum())
+    head, payload = _split(data[flag_size:], [(12 * changed + 7) // 8])
+    fields = unpack_bits(head, np.full(2 * changed, 6)).astype(np.int64).reshape(-1, 2)
+    leading, length = fields[:, 0], fields[:, 1] + 1
+    xor = np.zeros(rows, dtype=np.uint64)
+    xor[flags] = unpack_bits(payload, length) << (64 - leading - length).astype(np.uint64)
+    return np.bitwise_xor.accumulate(xor).view(np.float64)
+
+
+# ================= 4. KHỐI =================
+
+def encode_block(columns: Dict[str, np.ndarray]) -> bytes:
+    """columns: id, ts (µs), METRICS (float, NaN = NULL) đã sắp theo (ts, id)"""
+    rows = len(columns["id"])
+    streams = [encode_ints(columns["ts"]), encode_ints(columns["id"])]
+    streams += [encode_floats(columns[metric]) for metric in METRICS]
+    first_us = int(columns["ts"][0]) if rows else 0
+    return HEADER.pack(MAGIC, VERSION, 0, rows, 0, first_us) + b"".join(LENGTH.pack(len(s)) + s for s in streams)
+
+
+def decode_block(data: bytes, start_us: Optional[int] = None, end_us: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Các cột của 1 khối trong [start, end) (ts: µs, số đo: float với NaN = NULL)"""
+    magic, version, _, rows, _, _ = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Khối sensor_blocks không hợp lệ")
+    offset, streams = HEADER.size, []
+    for _ in STREAMS:
+        size = LENGTH.unpack_from(data, offset)[0]
+        offset += LENGTH.size
+        streams.append(data[offset:offset + size])
+        offset += size
+    ts = decode_ints(streams[0], rows)
+    low = 0 if start_us is None else int(np.searchsorted(ts, start_us, "left"))
+    high = rows if end_us is None else int(np.searchsorted(ts, end_us, "left"))
+    result = {"id": decode_ints(streams[1], rows)[low:high], "ts": ts[low:high]}
+    for metric, stream in zip(METRICS, streams[2:]):
+        result[metric] = decode_floats(stream, rows)[low:high]
+    return result
+
+
+# ================= 5. KHO KHỐI =================
+
+class SensorBlocks:
+    def __init__(self, session_factory=SessionLocal, after_hours: int = settings.SENSOR_BLOCKS_AFTER_HOURS):
+        self._session_factory = session_factory
+        self.after_hours = after_hours
+        self._lock = threading.Lock()  # Chỉ 1 luồng nén tại 1 thời điểm
+
+    # ---------------- Đọc ----------------
+    def blocks(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None,
+               device_id: Optional[str] = None, newest_first: bool = False) -> List[models.SensorBlock]:
+        """Các khối có giờ giao [start, end) (bảng không có dòng nào -> không tốn gì)"""
+        block = models.SensorBlock
+        query = db.query(block)
+        if device_id is not None:
+            query = query.filter(block.device_id == device_id)
+        if start is not None:
+            query = query.filter(block.last_ts >= start)
+        if end is not None:
+            query = query.filter(block.first_ts < end)
+        order = block.hour.desc() if newest_first else block.hour
+        return query.order_by(order, block.device_id).all()
+
+    def read(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None,
+             device_id: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """(device_id, các cột) của từng khối trong [start, end)"""
+        start_us = None if start is None else to_us(start)
+        end_us = None if end is None else to_us(end)
+        for block in self.blocks(db, start, end, device_id):
+            columns = decode_block(block.data, start_us, end_us)
+            if len(columns["id"]):
+                yield block.device_id, columns
+
+    def readings(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[Tuple[str, datetime, list]]:
+        """(device_id, timestamp, [số đo]) của mọi bản ghi đã nén trong [start, end)"""
+        for device_id, columns in self.read(db, start, end):
+            for _, ts, values in iter_rows(columns):
+                yield device_id, ts, values
+
+    def newest(self, db, device_id: str, start: Optional[datetime], end: Optional[datetime],
+               limit: Optional[int]) -> List[Tuple[int, datetime, list]]:
+        """Tối đa limit bản ghi mới nhất của 1 thiết bị trong [start, end) (mới -> cũ). Chỉ giải mã tới khi đủ limit."""
+        result = []
+        start_us = None if start is None else to_us(start)
+        end_us = None if end is None else to_us(end)
+        for block in self.blocks(db, start, end, device_id, newest_first=True):
+            columns = decode_block(block.data, start_us, end_us)
+            result += reversed(list(iter_rows(columns)))
+            if limit is not None and len(result) >= limit:
+                return result[:limit]
+        return result
+
+    def latest(self, db, device_ids: List[str]) -> Dict[str, Tuple[int, datetime, list]]:
+        """
+        Bản ghi đã nén mới nhất của từng thiết bị: 1 câu truy vấn cho cả nhóm, chỉ giải mã khối giờ mới nhất
+        của mỗi thiết bị (khối đã sắp theo (ts, id) -> bản cuối khối)
+        """
+        if not device_ids:
+            return {}
+        block = models.SensorBlock
+        newest = select(block.device_id, func.max(block.hour).label("hour"))\
+            .where(block.device_id.in_(device_ids)).group_by(block.device_id).subquery()
+        result = {}
+        for row in db.query(block).join(newest, and_(block.device_id == newest.c.device_id, block.hour == newest.c.hour)):
+            columns = decode_block(row.data)
+            if len(columns["id"]):
+                last = {key: value[-1:] for key, value in columns.items()}
+                result[row.device_id] = next(iter_rows(last))
+        return result
+
+    def first_time(self, db, after: Optional[datetime], before: datetime) -> Optional[datetime]:
+        """Mốc (có thể sớm hơn thực tế) của bản ghi đã nén đầu tiên trong [after, before)"""
+        block = models.SensorBlock
+        query = db.query(func.min(block.first_ts)).filter(block.first_ts < before)
+        if after is not None:
+            query = query.filter(block.last_ts >= after)
+        first = query.scalar()
+        if first is None:
+            return None
+        return max(first, after) if after is not None else first
+
+    def delete(self, db, start: datetime, end: datetime) -> int:
+        """Xóa các khối có giờ trong [start, end) (kho lạnh đã chuyển ra file). Chưa commit."""
+        block = models.SensorBlock
+        return db.execute(delete(block).where(block.hour >= start, block.hour < end)).rowcount
+
+    # ---------------- Nén dữ liệu nóng ----------------
+    def compress_once(self, now: Optional[datetime] = None) -> dict:
+        """Nén mọi giờ cũ hơn after_hours khỏi sensor_data, mỗi giờ 1 transaction. Trả về {"hours", "rows"}."""
+        result = {"hours": 0, "rows": 0}
+        if self.after_hours <= 0:
+            return result
+        cutoff = floor_hour(now or datetime.now()) - timedelta(hours=self.after_hours)
+        with self._lock:
+            db = self._session_factory()
+            try:
+                while True:
+                    sd = sensor_partitions.sensor_entity(db, None, cutoff)
+                    oldest = _naive(db.query(func.min(sd.timestamp)).filter(sd.timestamp < cutoff).scalar())
+                    if oldest is None:
+                        break
+                    moved = self._compress_hour(db, floor_hour(oldest))
+                    if not moved:
+                        break
+                    result["hours"] += 1
+                    result["rows"] += moved
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Lỗi nén dữ liệu vào sensor_blocks: {e}", exc_info=True)
+            finally:
+                db.close()
+        if result["rows"]:
+            logger.info(f"🗜️ Đã nén {result['rows']:,} bản ghi ({result['hours']} giờ) trước {cutoff:%Y-%m-%d %H:00} vào sensor_blocks")
+        return result
+
+    def _compress_hour(self, db, hour: datetime) -> int:
+        end = hour + timedelta(hours=1)
+        sd = sensor_partitions.sensor_entity(db, hour, end)
+        rows = db.execute(
+            select(sd.id, sd.device_id, sd.timestamp, *(getattr(sd, metric) for metric in METRICS))
+            .where(sd.timestamp >= hour, sd.timestamp < end)
+        ).all()
+        by_device: Dict[str, list] = {}
+        for row in rows:
+            by_device.setdefault(row[1], []).append(row)
+
+        for device_id, device_rows in by_device.items():
+            columns = {
+                "id": np.array([r[0] for r in device_rows], dtype=np.int64),
+                "ts": np.array([to_us(r[2]) for r in device_rows], dtype=np.int64),
+            }
+            for i, metric in enumerate(METRICS):
+                columns[metric] = np.array([np.nan if r[3 + i] is None else r[3 + i] for r in device_rows], dtype=np.float64)
+            self._write(db, device_id, hour, columns)
+
+        ids = [row[0] for row in rows]
+        deleted = sensor_partitions.delete_sensor_ids(db, ids, hour, end)
+        if deleted != len(ids):
+            # Không xóa được hết -> dừng để không lặp mãi ở cùng 1 giờ
+            db.rollback()
+            logger.error(f"❌ sensor_blocks {hour:%Y-%m-%d %H:00}: chỉ xóa được {deleted}/{len(ids)} bản ghi khỏi sensor_data")
+            return 0
+        db.commit()
+        return len(ids)
+
+    def _write(self, db, device_id: str, hour: datetime, columns: Dict[str, np.ndarray]):
+        """Ghi (hoặc gộp thêm vào) khối của 1 thiết bị / 1 giờ (chưa commit)"""
+        existing = db.get(models.SensorBlock, (device_id, hour))
+        if existing is not None:
+            # Bản ghi tới muộn của giờ đã nén: gộp với khối cũ, bỏ trùng id
+            old = decode_block(existing.data)
+            columns = {key: np.concatenate([old[key], columns[key]]) for key in columns}
+            _, unique = np.unique(columns["id"], return_index=True)
+            columns = {key: value[unique] for key, value in columns.items()}
+        order = np.lexsort((columns["id"], columns["ts"]))
+        columns = {key: value[order] for key, value in columns.items()}
+        db.merge(models.SensorBlock(
+            device_id=device_id, hour=hour, rows=len(columns["id"]),
+            first_ts=from_us(columns["ts"][0]), last_ts=from_us(columns["ts"][-1]), data=encode_block(columns),
+        ))
+
+    def status(self, db) -> dict:
+        block = models.SensorBlock
+        blocks, rows, size, first, last = db.query(
+            func.count(), func.sum(block.rows), func.sum(func.length(block.data)), func.min(block.hour), func.max(block.hour)
+        ).one()
+        return {"blocks": blocks, "rows": rows or 0, "bytes": size or 0, "first_hour": first, "last_hour": last}
+
+
+# Dùng chung cho toàn bộ tiến trình (main.py chạy nền mỗi SENSOR_BLOCKS_INTERVAL_SECONDS)
+sensor_blocks = SensorBlocks()
@@ -0,0 +1,412 @@
+"""
+Kho chuỗi thời gian (TimeSeriesStore): mọi thao tác đọc/ghi số liệu cảm biến thô đi qua đây.
+
+TIMESERIES_BACKEND chọn backend:
+- relational (mặc định): bảng sensor_data (+ partition theo tháng, bảng gộp rollup) như trước.
+- columnar: file cột nhúng, chỉ ghi nối thêm, mỗi thiết bị 1 thư mục trong TIMESERIES_DIR:
+      <device_id>/a_<seq>.log                        nhật ký đang ghi: bản ghi cố định 40 byte (LOG_DTYPE), chỉ append
+      <device_id>/c_<seq>_<n>_<first>_<last>.npz      khúc đã đóng: mỗi cột 1 mảng numpy (n bản ghi, ts từ first tới last µs)
+  Đủ TIMESERIES_CHUNK_ROWS bản ghi thì nhật ký được đóng thành 1 khúc cột. Đọc theo khoảng thời gian
+  chỉ mở các khúc có [first, last] giao với khoảng đó (lọc theo tên file). id = số thứ tự bản ghi của thiết bị.
+  Mỗi thiết bị chỉ nên có 1 tiến trình ghi (Writer của API hoặc ingest_worker --mode hash).
+
+Bảng device_latest_reading (danh sách thiết bị, AI tưới) vẫn do Writer cập nhật với cả 2 backend.
+"""
+import abc
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+from sqlalchemy import desc
+
+from core.config import settings
+from core.logger import get_logger
+from crud import device as crud_device
+from db.partitions import sensor_partitions
+from services.cold_archive import cold_archive, from_us, to_us
+from services.rollup import METRICS, _naive, read_series
+from services.sensor_blocks import sensor_blocks
+
+logger = get_logger("TimeSeries")
+
+
+class TimeSeriesPoint(NamedTuple):
+    """1 bản ghi cảm biến (cùng thuộc tính với models.SensorData -> dùng được với SensorDataResponse)"""
+    id: Optional[int]
+    device_id: str
+    timestamp: datetime
+    temp: Optional[float]
+    hum_air: Optional[float]
+    hum_soil: Optional[float]
+    light: Optional[float]
+
+
+class TimeSeriesStore(abc.ABC):
+    """
+    Giao diện chung. db = Session SQLAlchemy của request / lô ghi (backend không cần DB thì bỏ qua).
+    - append: ghi 1 lô (mỗi dict: device_id, timestamp + METRICS). Không commit: người gọi commit.
+      transactional = False: backend ghi thẳng ra ngoài DB (không rollback được) -> người gọi chỉ append
+      SAU khi COMMIT phần DB thành công, ghi lại lô khi DB lỗi không nhân đôi bản ghi.
+    - query_range: bản ghi của 1 thiết bị trong [start, end), mới -> cũ (cùng timestamp thì id lớn trước), tối đa limit.
+    - query_page: limit bản ghi kế tiếp sau con trỏ (timestamp, id) của trang trước (api/pagination.py).
+    - latest: bản ghi mới nhất của từng thiết bị (đường nhanh cho API / AI, relational đọc bảng device_latest_reading).
+    - scan_latest: như latest nhưng đọc từ chính dữ liệu đã lưu, không qua device_latest_reading
+      (tools/latest_readings.py kiểm tra / dựng lại bảng đó).
+    - aggregate: TẤT CẢ thiết bị gộp theo khung "1m" / "1h" / "1d": {đầu khung: acc} (định dạng acc của services/rollup.py).
+    Bản *_async nhận AsyncSession (endpoint `async def`): mặc định chạy bản đồng bộ qua run_sync -> chờ DB
+    bằng driver async, không chặn event loop.
+    """
+    name = ""
+    transactional = True
+
+    @abc.abstractmethod
+    def append(self, db, rows: List[dict]) -> int:
+        ...
+
+    @abc.abstractmethod
+    def query_range(self, db, device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    limit: Optional[int] = None) -> list:
+        ...
+
+    @abc.abstractmethod
+    def latest(self, db, device_ids: Iterable[str]) -> Dict[str, TimeSeriesPoint]:
+        ...
+
+    def scan_latest(self, db, device_ids: Iterable[str]) -> Dict[str, TimeSeriesPoint]:
+        result = {}
+        for device_id in device_ids:
+            points = self.query_range(db, device_id, limit=1)
+            if points:
+                result[device_id] = points[0]
+        return result
+
+    def query_page(self, db, device_id: str, limit: int, cursor: Optional[Tuple[datetime, int]] = None) -> list:
+        """
+        Keyset: query_range(end = timestamp con trỏ + 1µs) -> mọi backend tìm thẳng tới mốc đó (index / tên khúc),
+        trang sâu tốn như trang đầu. Các bản cùng timestamp có id >= id con trỏ (đã trả ở trang trước) luôn đứng
+        đầu kết quả -> lấy dư rồi bỏ, bỏ nhiều hơn phần dư thì đọc lại với đúng số đó.
+        """
+        if cursor is None:
+            return self.query_range(db, device_id, limit=limit)
+        timestamp, row_id = _naive(cursor[0]), cursor[1]
+        end, extra = timestamp + timedelta(microseconds=1), 1
+        while True:
+            points = self.query_range(db, device_id, end=end, limit=limit + extra)
+            page = [p for p in points if (_naive(p.timestamp), p.id) < (timestamp, row_id)]
+            if len(page) >= limit or len(points) < limit + extra:
+                return page[:limit]
+            extra = len(points) - len(page) + 1
+
+    @abc.abstractmethod
+    def aggregate(self, db, start: datetime, end: datetime, granularity: str = "1d") -> Dict[datetime, list]:
+        ...
+
+    async def query_range_async(self, db, device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                limit: Optional[int] = None) -> list:
+        return await db.run_sync(self.query_range, device_id, start, end, limit)
+
+    async def aggregate_async(self, db, start: datetime, end: datetime, granularity: str = "1d") -> Dict[datetime, list]:
+        return await db.run_sync(self.aggregate, start, end, granularity)
+
+    async def query_page_async(self, db, device_id: str, limit: int, cursor: Optional[Tuple[datetime, int]] = None) -> list:
+        return await db.run_sync(self.query_page, device_id, limit, cursor)
+
+
+# ================= 1. RELATIONAL: sensor_data =================
+
+class RelationalStore(TimeSeriesStore):
+    name = "relational"
+
+    def append(self, db, rows: List[dict]) -> int:
+        return crud_device.create_sensor_readings_bulk(db, rows)
+
+    def query_range(self, db, device_id, start=None, end=None, limit=None):
+        points = self._query_hot(db, device_id, start, end, limit)
+        # Kho khối nén, rồi kho lạnh (dữ liệu càng cũ càng nằm sau): đã đủ limit bản ghi thì chỉ cần
+        # các bản mới hơn bản thứ limit (thường là không có -> không giải mã khối / đọc file nào)
+        for archive in (sensor_blocks, cold_archive):
+            archive_start = start
+            if limit is not None and len(points) >= limit:
+                oldest = _naive(points[limit - 1].timestamp)
+                archive_start = max(_naive(start), oldest) if start is not None else oldest
+            rows = archive.newest(db, device_id, archive_start, end, limit)
+            if rows:
+                points = points + [TimeSeriesPoint(row_id, device_id, ts, *values) for row_id, ts, values in rows]
+                points.sort(key=lambda p: (_naive(p.timestamp), p.id), reverse=True)
+        return points[:limit] if limit is not None else points
+
+    @staticmethod
+    def _query_hot(db, device_id, start, end, limit):
+        if start is None and limit is not None:
+            return crud_device.get_sensor_history(db, device_id, limit, before=end)
+        sd = sensor_partitions.sensor_entity(db, start, end)
+        query = db.query(sd).filter(sd.device_id == device_id)
+        if start is not None:
+            query = query.filter(sd.timestamp >= start)
+        if end is not None:
+            query = query.filter(sd.timestamp < end)
+        query = query.order_by(desc(sd.timestamp), desc(sd.id))
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    def latest(self, db, device_ids):
+        return {
+            device_id: TimeSeriesPoint(None, device_id, row.timestamp, row.temp, row.hum_air, row.hum_soil, row.light)
+            for device_id, row in crud_device.get_latest_readings(db, list(device_ids)).items()
+        }
+
+    def scan_latest(self, db, device_ids):
+        device_ids = list(device_ids)
+        sd = sensor_partitions.sensor_entity(db)
+        result = {
+            row.device_id: TimeSeriesPoint(row.id, row.device_id, row.timestamp, row.temp, row.hum_air, row.hum_soil, row.light)
+            for row in db.execute(crud_device.newest_sensor_rows(sd, device_ids))
+        }
+        # Thiết bị không còn bản ghi nào trong bảng nóng: bản mới nhất trong kho khối nén (1 câu cho cả nhóm),
+        # còn thiếu nữa thì kho lạnh
+        missing = [device_id for device_id in device_ids if device_id not in result]
+        for device_id, (row_id, ts, values) in sensor_blocks.latest(db, missing).items():
+            result[device_id] = TimeSeriesPoint(row_id, device_id, ts, *values)
+        missing = [device_id for device_id in missing if device_id not in result]
+        result.update(super().scan_latest(db, missing))
+        return result
+
+    def aggregate(self, db, start, end, granularity="1d"):
+        return read_series(db, start, end, granularity)
+
+
+# ================= 2. COLUMNAR: FILE CỘT NHÚNG (numpy) =================
+
+LOG_DTYPE = np.dtype([("ts", "<i8")] + [(metric, "<f8") for metric in METRICS])
+BUCKET_US = {"1m": 60 * 10 ** 6, "1h": 3600 * 10 ** 6, "1d": 86400 * 10 ** 6}
+
+
+class _Source(NamedTuple):
+    """1 khúc đã đóng (path .npz) hoặc 1 nhật ký đang ghi (path .log, first/last chưa biết)"""
+    seq: int
+    rows: int
+    first: Optional[int]
+    last: Optional[int]
+    path: str
+
+
+class ColumnarStore(TimeSeriesStore):
+    name = "columnar"
+    transactional = False  # Ghi file ngay, không nằm trong transaction của DB
+
+    def __init__(self, directory: str = settings.TIMESERIES_DIR, chunk_rows: int = settings.TIMESERIES_CHUNK_ROWS,
+                 fsync: bool = settings.TIMESERIES_FSYNC):
+        self.directory = os.path.abspath(directory)
+        self.chunk_rows = chunk_rows
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._next_seq: Dict[str, Tuple[int, int]] = {}  # device_id -> (seq của nhật ký đang ghi, số bản ghi trong đó)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _device_dir(self, device_id: str) -> str:
+        return os.path.join(self.directory, quote(device_id, safe=""))
+
+    def _sources(self, device_id: str) -> List[_Source]:
+        """Các khúc + nhật ký của thiết bị, theo seq tăng dần (quét thư mục mỗi lần: tiến trình khác có thể vừa ghi)"""
+        folder = self._device_dir(device_id)
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return []
+        chunks, logs = {}, {}
+        for name in names:
+            if name.startswith("c_") and name.endswith(".npz"):
+                seq, rows, first, last = (int(part) for part in name[2:-4].split("_"))
+                chunks[seq] = _Source(seq, rows, first, last, os.path.join(folder, name))
+            elif name.startswith("a_") and name.endswith(".log"):
+                path = os.path.join(folder, name)
+                logs[int(name[2:-4])] = _Source(int(name[2:-4]), os.path.getsize(path) // LOG_DTYPE.itemsize, None, None, path)
+        # Nhật ký đã được đóng thành khúc cùng seq (tắt máy giữa chừng lúc đóng khúc) -> bỏ qua
+        sources = list(chunks.values()) + [log for seq, log in logs.items() if seq not in chunks]
+        return sorted(sources, key=lambda s: s.seq)
+
+    # ---------------- Ghi ----------------
+    def append(self, db, rows: List[dict]) -> int:
+        by_device: Dict[str, List[dict]] = {}
+        for row in rows:
+            by_device.setdefault(row["device_id"], []).append(row)
+        with self._lock:
+            for device_id, device_rows in by_device.items():
+                records = np.empty(len(device_rows), dtype=LOG_DTYPE)
+                records["ts"] = [to_us(r["timestamp"]) for r in device_rows]
+                for metric in METRICS:
+                    records[metric] = [np.nan if r.get(metric) is None else r[metric] for r in device_rows]
+                self._append_device(device_id, records)
+        return len(rows)
+
+    def _append_device(self, device_id: str, records: np.ndarray):
+        state = self._next_seq.get(device_id)
+        if state is None:
+            state = self._open_log(device_id)
+        seq, count = state
+        path = os.path.join(self._device_dir(device_id), f"a_{seq:012d}.log")
+        with open(path, "ab") as f:
+            f.write(records.tobytes())
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        count += len(records)
+        if count >= self.chunk_rows:
+            self._seal(device_id, seq, path)
+            seq, count = seq + count, 0
+        self._next_seq[device_id] = (seq, count)
+
+    def _open_log(self, device_id: str) -> Tuple[int, int]:
+        """Tìm nhật ký đang ghi của thiết bị (lần đầu ghi sau khi khởi động)"""
+        os.makedirs(self._device_dir(device_id), exist_ok=True)
+        sources = self._sources(device_id)
+        if not sources:
+            return 0, 0
+        tail = sources[-1]
+        if tail.path.endswith(".npz"):
+            return tail.seq + tail.rows, 0
+        # Cắt phần bản ghi ghi dở (tắt máy giữa lúc write)
+        if os.path.getsize(tail.path) != tail.rows * LOG_DTYPE.itemsize:
+            with open(tail.path, "r+b") as f:
+                f.truncate(tail.rows * LOG_DTYPE.itemsize)
+        return tail.seq, tail.rows
+
+    def _seal(self, device_id: str, seq: int, log_path: str):
+        """Nhật ký đầy -> khúc cột .npz (ghi file tạm rồi đổi tên), xong mới xóa nhật ký"""
+        records = np.fromfile(log_path, dtype=LOG_DTYPE)
+        name = f"c_{seq:012d}_{len(records)}_{records['ts'].min()}_{records['ts'].max()}.npz"
+        path = os.path.join(self._device_dir(device_id), name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **{field: np.ascontiguousarray(records[field]) for field in LOG_DTYPE.names})
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        os.remove(log_path)
+
+    # ---------------- Đọc ----------------
+    @staticmethod
+    def _load(source: _Source, fields: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+        """Đọc các cột cần thiết của 1 nguồn + cột id (seq + vị trí)"""
+        if source.path.endswith(".npz"):
+            with np.load(source.path) as data:
+                columns = {field: data[field] for field in fields}
+        else:
+            records = np.fromfile(source.path, dtype=LOG_DTYPE, count=source.rows)
+            columns = {field: records[field] for field in fields}
+        columns["id"] = np.arange(source.seq, source.seq + len(columns["ts"]), dtype=np.int64)
+        return columns
+
+    def _read(self, device_id: str, start_us: Optional[int], end_us: Optional[int], fields: Tuple[str, ...],
+              limit: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Các cột của 1 thiết bị trong [start, end); có limit thì đọc từ khúc mới nhất, đủ thì dừng"""
+        for attempt in range(3):
+            try:
+                return self._read_once(device_id, start_us, end_us, fields, limit)
+            except FileNotFoundError:
+                # Writer vừa đóng nhật ký thành khúc (nhật ký bị xóa) giữa lúc liệt kê và lúc đọc -> liệt kê lại
+                if attempt == 2:
+                    raise
+
+    def _read_once(self, device_id, start_us, end_us, fields, limit):
+        sources = [
+            s for s in self._sources(device_id)
+            if s.first is None or ((start_us is None or s.last >= start_us) and (end_us is None or s.first < end_us))
+        ]
+        # Nhật ký đang ghi (chứa bản mới nhất) trước, sau đó các khúc theo last giảm dần
+        sources.sort(key=lambda s: (s.first is not None, -(s.last or 0)))
+        parts = []
+        kept = 0
+        threshold = None
+        for source in sources:
+            if limit is not None and kept >= limit and source.last is not None and source.last < threshold:
+                break
+            columns = self._load(source, fields)
+            mask = np.ones(len(columns["ts"]), dtype=bool)
+            if start_us is not None:
+                mask &= columns["ts"] >= start_us
+            if end_us is not None:
+                mask &= columns["ts"] < end_us
+            columns = {key: value[mask] for key, value in columns.items()}
+            parts.append(columns)
+            kept += len(columns["ts"])
+            if limit is not None and kept >= limit:
+                # Mốc ts của bản thứ limit (tính từ mới nhất): khúc nào cũ hơn hẳn mốc này thì khỏi đọc
+                all_ts = np.concatenate([p["ts"] for p in parts])
+                threshold = np.partition(all_ts, len(all_ts) - limit)[len(all_ts) - limit]
+        if not parts:
+            return {key: np.empty(0) for key in fields + ("id",)}
+        return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+    def query_range(self, db, device_id, start=None, end=None, limit=None):
+        columns = self._read(device_id, None if start is None else to_us(start), None if end is None else to_us(end),
+                             LOG_DTYPE.names, limit)
+        order = np.lexsort((-columns["id"], -columns["ts"]))  # Mới -> cũ, cùng ts thì bản ghi sau trước
+        if limit is not None:
+            order = order[:limit]
+        points = []
+        for i in order:
+            values = [None if np.isnan(columns[metric][i]) else float(columns[metric][i]) for metric in METRICS]
+            points.append(TimeSeriesPoint(int(columns["id"][i]), device_id, from_us(columns["ts"][i]), *values))
+        return points
+
+    def latest(self, db, device_ids):
+        return self.scan_latest(db, device_ids)
+
+    # Không dùng DB, đọc file + numpy: chạy ở luồng phụ thay vì trên event loop
+    async def query_range_async(self, db, device_id, start=None, end=None, limit=None):
+        return await asyncio.to_thread(self.query_range, None, device_id, start, end, limit)
+
+    async def query_page_async(self, db, device_id, limit, cursor=None):
+        return await asyncio.to_thread(self.query_page, None, device_id, limit, cursor)
+
+    async def aggregate_async(self, db, start, end, granularity="1d"):
+        return await asyncio.to_thread(self.aggregate, None, start, end, granularity)
+
+    def device_ids(self) -> List[str]:
+        return [unquote(name) for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name))]
+
+    def aggregate(self, db, start, end, granularity="1d"):
+        if granularity not in BUCKET_US:
+            raise ValueError(f"Khung không hợp lệ: {granularity} (1m / 1h / 1d)")
+        step = BUCKET_US[granularity]
+        start_us, end_us = to_us(start), to_us(end)
+        parts = [self._read(device_id, start_us, end_us, LOG_DTYPE.names) for device_id in self.device_ids()]
+        parts = [p for p in parts if len(p["ts"])]
+        if not parts:
+            return {}
+        ts = np.concatenate([p["ts"] for p in parts])
+        order = np.argsort(ts // step, kind="stable")
+        buckets = (ts // step)[order]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        accs = [[int(n)] for n in np.diff(np.r_[starts, len(buckets)])]
+        for metric in METRICS:
+            values = np.concatenate([p[metric] for p in parts])[order]
+            valid = ~np.isnan(values)
+            counts = np.add.reduceat(valid.astype(np.int64), starts)
+            sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+            lows = np.minimum.reduceat(np.where(valid, values, np.inf), starts)
+            highs = np.maximum.reduceat(np.where(valid, values, -np.inf), starts)
+            for acc, count, total, low, high in zip(accs, counts, sums, lows, highs):
+                acc += [int(count), float(total), float(low), float(high)] if count else [0, 0.0, None, None]
+        return {from_us(bucket * step): acc for bucket, acc in zip(buckets[starts], accs)}
+
+
+# ================= 3. CHỌN BACKEND THEO CẤU HÌNH =================
+
+def create_timeseries_store(backend: str = settings.TIMESERIES_BACKEND) -> TimeSeriesStore:
+    if backend == "columnar":
+        return ColumnarStore()
+    if backend != "relational":
+        logger.warning(f"⚠️ TIMESERIES_BACKEND={backend} không hợp lệ, dùng relational")
+    return RelationalStore()
+
+
+# Dùng chung cho toàn bộ tiến trình (Writer ghi, API lịch sử / báo cáo đọc)
+timeseries_store = create_timeseries_store()
@@ -0,0 +1,168 @@
+"""
+Bộ định tuyến topic MQTT: 1 backend nhận dữ liệu của nhiều nông trại qua topic có wildcard.
+
+    router = TopicRouter()
+    router.add_route("farm/{farm}/zone/{zone}/{device_id}/data", handle_json)
+    router.add_route("farm/{farm}/#", handle_other)
+    router.subscriptions()      # ["farm/+/zone/+/+/data", "farm/+/#"] -> đăng ký với Broker
+    router.dispatch(msg)        # handle_json(msg, {"farm": "f1", "zone": "z3", "device_id": "ESP32:01"})
+
+Cú pháp mẫu (theo từng đoạn phân cách bởi "/"):
+- chữ thường: phải khớp đúng
+- {ten}: khớp 1 đoạn bất kỳ và lấy giá trị ra params["ten"] (đăng ký với Broker là "+")
+- +: khớp 1 đoạn bất kỳ, không lấy giá trị
+- # hoặc {ten...}: khớp phần còn lại (chỉ được đứng cuối), {ten...} lấy cả phần còn lại làm params["ten"]
+
+Các mẫu được dựng sẵn thành 1 cây (trie) theo từng đoạn: tìm route = đi xuống cây, không thử lần lượt từng mẫu.
+Nhiều mẫu cùng khớp thì ưu tiên đoạn chính xác > 1 đoạn > nhiều đoạn (#). Kết quả được nhớ theo topic
+(số topic thực tế hữu hạn: mỗi thiết bị 1 - 2 topic) nên gói tin thứ 2 trở đi chỉ tốn 1 lần tra dict.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.logger import get_logger
+
+logger = get_logger("Topic_Router")
+
+# Hàm xử lý: handler(msg, params) -> tùy ứng dụng
+RouteHandler = Callable[[Any, Dict[str, str]], Any]
+EMPTY_PARAMS: Dict[str, str] = {}
+
+
+class Route:
+    __slots__ = ("pattern", "handler", "subscription", "param_names")
+
+    def __init__(self, pattern: str, handler: RouteHandler, subscription: str, param_names: Tuple[Optional[str], ...]):
+        self.pattern = pattern
+        self.handler = handler
+        self.subscription = subscription   # Topic filter gửi cho Broker
+        self.param_names = param_names     # Tên của từng đoạn wildcard theo thứ tự (None = không lấy)
+
+
+class _Node:
+    __slots__ = ("literals", "single", "multi", "route")
+
+    def __init__(self):
+        self.literals: Dict[str, "_Node"] = {}
+        self.single: Optional["_Node"] = None   # Đoạn "+" / {ten}
+        self.multi: Optional[Route] = None      # Đoạn "#" / {ten...} (luôn là lá)
+        self.route: Optional[Route] = None      # Route kết thúc đúng tại nút này
+
+
+def _parse_pattern(pattern: str) -> Tuple[List[Tuple[str, Optional[str]]], str]:
+    """Mẫu -> [(loại, giá trị)] với loại: lit | one | rest; kèm topic filter cho Broker"""
+    parts = pattern.split("/")
+    tokens, filters = [], []
+    for index, part in enumerate(parts):
+        is_last = index == len(parts) - 1
+        if part == "#" or (part.startswith("{") and part.endswith("...}")):
+            if not is_last:
+                raise ValueError(f"'{part}' chỉ được đứng cuối mẫu topic: {pattern}")
+            tokens.append(("rest", part[1:-4] if part != "#" else None))
+            filters.append("#")
+        elif part == "+" or (part.startswith("{") and part.endswith("}")):
+            tokens.append(("one", part[1:-1] if part != "+" else None))
+            filters.append("+")
+        elif "+" in part or "#" in part or "{" in part or "}" in part:
+            raise ValueError(f"Đoạn topic không hợp lệ '{part}' trong: {pattern}")
+        else:
+            tokens.append(("lit", part))
+            filters.append(part)
+    return tokens, "/".join(filters)
+
+
+class TopicRouter:
+    def __init__(self, cache_size: int = 100000):
+        self._root = _Node()
+        self._routes: List[Route] = []
+        self._cache: Dict[str, Tuple[Optional[Route], Dict[str, str]]] = {}
+        self.cache_size = cache_size
+
+    # ---------------- Đăng ký ----------------
+    def add_route(self, pattern: str, handler: RouteHandler) -> Route:
+        tokens, subscription = _parse_pattern(pattern)
+        node = self._root
+        names = []
+        route = Route(pattern, handler, subscription, ())
+        for kind, value in tokens:
+            if kind == "lit":
+                node = node.literals.setdefault(value, _Node())
+            elif kind == "one":
+                names.append(value)
+                if node.single is None:
+                    node.single = _Node()
+                node = node.single
+            else:
+                names.append(value)
+                if node.multi is not None:
+                    raise ValueError(f"Mẫu topic '{pattern}' trùng với '{node.multi.pattern}'")
+                node.multi = route
+                node = None
+                break
+        if node is not None:
+            if node.route is not None:
+                raise ValueError(f"Mẫu topic '{pattern}' trùng với '{node.route.pattern}'")
+            node.route = route
+        route.param_names = tuple(names)
+        self._routes.append(route)
+        self._cache.clear()
+        return route
+
+    def subscriptions(self) -> List[str]:
+        """Danh sách topic filter (không lặp) để subscribe với Broker"""
+        return list(dict.fromkeys(route.subscription for route in self._routes))
+
+    # ---------------- Tìm route ----------------
+    def match(self, topic: str) -> Tuple[Optional[Route], Dict[str, str]]:
+        """(route, params) của topic; (None, {}) nếu không mẫu nào khớp. params dùng chung, KHÔNG được sửa."""
+        hit = self._cache.get(topic)
+        if hit is not None:
+            return hit
+
+        segments = topic.split("/")
+        values: List[str] = []
+        route = self._walk(self._root, segments, 0, values)
+        if route is None:
+            hit = (None, EMPTY_PARAMS)
+        else:
+            params = {name: value for name, value in zip(route.param_names, values) if name is not None}
+            hit = (route, params or EMPTY_PARAMS)
+
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = hit
+        return hit
+
+    def _walk(self, node: _Node, segments: List[str], index: int, values: List[str]) -> Optional[Route]:
+        if index == len(segments):
+            if node.route is not None:
+                return node.route
+            # "a/#" cũng khớp chính "a" (theo chuẩn MQTT)
+            if node.multi is not None:
+                values.append("")
+                return node.multi
+            return None
+
+        segment = segments[index]
+        child = node.literals.get(segment)
+        if child is not None:
+            route = self._walk(child, segments, index + 1, values)
+            if route is not None:
+                return route
+        if node.single is not None:
+            values.append(segment)
+            route = self._walk(node.single, segments, index + 1, values)
+            if route is not None:
+                return route
+            values.pop()
+        if node.multi is not None:
+            values.append("/".join(segments[index:]))
+            return node.multi
+        return None
+
+    def dispatch(self, msg) -> Any:
+        """Gọi handler của route khớp với msg.topic. Trả về None nếu không có route nào."""
+        route, params = self.match(msg.topic)
+        if route is None:
+            logger.debug(f"🔀 Không có route cho topic: {msg.topic}")
+            return None
+        return route.handler(msg, params)
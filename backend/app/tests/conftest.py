@@ -0,0 +1,37 @@
+"""
+Cấu hình chung cho pytest (chạy từ thư mục gốc repo hoặc backend/app):
+
+    python -m pytest -q backend/app/tests
+
+DB dùng file SQLite tạm, đặt DATABASE_URL TRƯỚC khi import bất kỳ module nào của app
+(db/session.py tạo engine lúc import).
+"""
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+_tmp = tempfile.mkdtemp(prefix="smartfarm-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ["ASYNC_DATABASE_URL"] = ""
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["TIMESERIES_BACKEND"] = "relational"
+os.environ["SENSOR_PARTITIONING"] = "false"
+os.environ["SQLITE_PROFILE"] = "production"  # Cấu hình nên dùng khi chạy thật (mặc định vẫn là legacy)
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db_factory():
+    """Tạo lại toàn bộ bảng cho mỗi test, trả về SessionLocal"""
+    from db.base import Base
+    from db.session import SessionLocal, engine
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield SessionLocal
+    Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,97 @@
+"""
+Xoay khóa AES riêng qua API (PUT / DELETE /devices/{device_id}/key): tiến trình gọi API nạp lại ngay,
+bộ giải mã của tiến trình khác (PayloadDecryptor riêng) nhận khóa mới ở lần refresh_if_due() kế tiếp.
+"""
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+from Crypto.Cipher import AES
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import deps
+from api.v1.endpoints import devices
+from core.config import settings
+from models import models
+from services.payload_crypto import PayloadDecryptor, payload_decryptor
+
+DEVICE = "AA:BB:CC:DD:EE:01"
+NEW_KEY = "RotatedKey000001"
+
+
+def encrypt(key: bytes, device_id: str) -> str:
+    inner = json.dumps({"device_id": device_id, "temp": 25.0}).encode()
+    inner += b"\x00" * (-len(inner) % 16)
+    return base64.b64encode(AES.new(key, AES.MODE_ECB).encrypt(inner)).decode()
+
+
+def decrypts_with(decryptor: PayloadDecryptor, key: bytes) -> bool:
+    plain = decryptor.decrypt(encrypt(key, DEVICE), DEVICE)
+    try:
+        return json.loads(plain)["device_id"] == DEVICE
+    except (TypeError, ValueError):
+        return False
+
+
+@pytest.fixture
+def client(db_factory):
+    db = db_factory()
+    db.add(models.Device(device_id=DEVICE, name=DEVICE))
+    db.commit()
+    db.close()
+
+    def get_db():
+        db = db_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(devices.router, prefix="/devices")
+    app.dependency_overrides[deps.get_db] = get_db
+    app.dependency_overrides[deps.get_current_active_superuser] = lambda: SimpleNamespace(role="ADMIN", username="admin")
+    yield TestClient(app)
+    payload_decryptor.invalidate()
+
+
+def test_key_rotation_reaches_other_processes(client, db_factory):
+    other = PayloadDecryptor(session_factory=db_factory, refresh_seconds=1e-9)  # Ingest Worker khác
+    other.load_all()
+    assert decrypts_with(other, settings.AES_KEY)
+
+    assert client.put(f"/devices/{DEVICE}/key", json={"aes_key": NEW_KEY}).status_code == 200
+    assert decrypts_with(payload_decryptor, NEW_KEY.encode())
+    assert other.refresh_if_due()
+    assert decrypts_with(other, NEW_KEY.encode())
+
+    assert client.delete(f"/devices/{DEVICE}/key").status_code == 200
+    assert other.refresh_if_due()
+    assert decrypts_with(other, settings.AES_KEY)
+
+
+def test_rejects_bad_key_and_unknown_device(client):
+    assert client.put(f"/devices/{DEVICE}/key", json={"aes_key": "x" * 20}).status_code == 400
+    assert client.put("/devices/AA:BB:CC:DD:EE:99/key", json={"aes_key": NEW_KEY}).status_code == 404
+    assert client.delete(f"/devices/{DEVICE}/key").status_code == 404
+
+
+def test_decrypt_many_matches_decrypt_and_drops_rotated_ciphers(client, db_factory):
+    other = PayloadDecryptor(session_factory=db_factory)
+    other.load_all()
+    good = encrypt(settings.AES_KEY, DEVICE)
+    plains = other.decrypt_many([(DEVICE, good), (DEVICE, "không phải base64!"), (None, good)])
+    assert plains[0] == plains[2] == other.decrypt(good, DEVICE)
+    assert plains[1] is None
+
+    assert client.put(f"/devices/{DEVICE}/key", json={"aes_key": NEW_KEY}).status_code == 200
+    other.load_all()
+    assert json.loads(other.decrypt_many([(DEVICE, encrypt(NEW_KEY.encode(), DEVICE))])[0])["device_id"] == DEVICE
+    assert NEW_KEY.encode() in other._ciphers
+
+    # Khóa đã xoay đi thì cipher của nó không còn nằm trong bộ nhớ
+    assert client.put(f"/devices/{DEVICE}/key", json={"aes_key": "RotatedKey000002"}).status_code == 200
+    other.load_all()
+    assert NEW_KEY.encode() not in other._ciphers
@@ -0,0 +1,184 @@
+"""
+Nhiều Ingest Worker (ingest_worker.py) chạy song song trên cùng 1 DB: gói tin MQTT đi qua đúng đường thật
+(IngestWorker.handle -> decode_mqtt_message -> IngestWriter), mỗi worker có Registry / Writer / bộ chống trùng riêng
+như các tiến trình riêng biệt. Kiểm tra sensor_data, trạng thái thiết bị và device_latest_reading.
+"""
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+from Crypto.Cipher import AES
+
+from core.config import settings
+from crud import device as crud_device
+from ingest_worker import IngestWorker, partition_of
+from models import models
+from services.device_registry import DeviceRegistry, device_registry
+from services.heartbeat import HeartbeatFlusher
+from services.ingest_writer import IngestWriter
+from services.payload_crypto import payload_decryptor
+from services.timeseries import RelationalStore
+
+WORKERS = 3
+DEVICES = [f"TEST:{i:08X}" for i in range(12)]
+ROUNDS = 5
+
+
+def message(device_id: str, seq: int, temp: float, pump: bool):
+    payload = {"device_id": device_id, "temp": temp, "hum_air": 60.0, "hum_soil": 45.0, "light": 120.0,
+               "pump_state": pump, "seq": seq}
+    return SimpleNamespace(topic=settings.MQTT_TOPIC_SENSOR, payload=json.dumps(payload).encode())
+
+
+def make_workers(db_factory, mode: str):
+    """Mỗi worker = 1 "tiến trình": Registry, Writer, bộ chống trùng riêng; chỉ dùng chung DB"""
+    workers = []
+    for worker_id in range(WORKERS):
+        registry = DeviceRegistry(session_factory=db_factory)
+        registry.load_all()
+        writer = IngestWriter(session_factory=db_factory, registry=registry,
+                              heartbeats=HeartbeatFlusher(session_factory=db_factory), store=RelationalStore())
+        workers.append(IngestWorker(worker_id, WORKERS, mode, writer=writer))
+    return workers
+
+
+def deliver(workers, mode: str, msg, turn: int):
+    """hash: mọi worker nhận mọi gói (subscribe thường). shared: Broker giao mỗi gói cho 1 worker (luân phiên)"""
+    if mode == "hash":
+        for worker in workers:
+            worker.handle(msg)
+    else:
+        workers[turn % len(workers)].handle(msg)
+
+
+def send_round(workers, mode: str, seq: int, pump: bool):
+    for i, device_id in enumerate(DEVICES):
+        deliver(workers, mode, message(device_id, seq, 20.0 + seq + i / 10, pump), seq * len(DEVICES) + i)
+    for worker in workers:
+        worker.writer.flush_pending()
+
+
+@pytest.fixture
+def fleet(db_factory):
+    db = db_factory()
+    db.add_all([models.Device(device_id=d, name=d, status=models.DeviceStatus.OFFLINE) for d in DEVICES])
+    db.commit()
+    db.close()
+    # decode_mqtt_message hỏi Registry dùng chung của tiến trình để loại thiết bị lạ
+    device_registry.load_all()
+    yield db_factory
+    device_registry.invalidate()
+
+
+@pytest.mark.parametrize("mode", ["hash", "shared"])
+def test_workers_store_every_reading_once(fleet, mode):
+    workers = make_workers(fleet, mode)
+    for seq in range(ROUNDS):
+        send_round(workers, mode, seq, pump=seq % 2 == 1)
+
+    db = fleet()
+    try:
+        assert db.query(models.SensorData).count() == ROUNDS * len(DEVICES)
+        for device_id in DEVICES:
+            temps = [t for (t,) in db.query(models.SensorData.temp).filter(models.SensorData.device_id == device_id)]
+            assert sorted(temps) == [20.0 + seq + DEVICES.index(device_id) / 10 for seq in range(ROUNDS)]
+
+        devices = {d.device_id: d for d in db.query(models.Device).all()}
+        assert all(d.status == models.DeviceStatus.ONLINE for d in devices.values())
+        assert all(d.pump_state == ((ROUNDS - 1) % 2 == 1) for d in devices.values())
+
+        latest = crud_device.get_latest_readings(db, DEVICES)
+        assert {d: latest[d].temp for d in DEVICES} == {d: 20.0 + ROUNDS - 1 + i / 10 for i, d in enumerate(DEVICES)}
+        assert crud_device.find_stale_latest_readings(db) == []
+    finally:
+        db.close()
+
+    if mode == "hash":
+        # Mỗi thiết bị chỉ được đúng 1 worker ghi
+        for worker in workers:
+            owned = sum(partition_of(d, WORKERS) == worker.worker_id for d in DEVICES)
+            assert worker.writer.saved_count == owned * ROUNDS
+
+
+def test_redelivery_to_same_worker_is_dropped(fleet):
+    workers = make_workers(fleet, "shared")
+    msg = message(DEVICES[0], 7, 25.0, False)
+    workers[0].handle(msg)
+    workers[0].handle(msg)  # QoS 1 gửi lại cùng seq
+    workers[0].writer.flush_pending()
+
+    db = fleet()
+    try:
+        assert db.query(models.SensorData).count() == 1
+    finally:
+        db.close()
+    assert workers[0].writer.stats()["duplicates"] == 1
+
+
+@pytest.mark.parametrize("mode", ["hash", "shared"])
+def test_workers_pick_up_state_changed_by_other_processes(fleet, mode):
+    workers = make_workers(fleet, mode)
+    send_round(workers, mode, 0, pump=True)
+
+    # API (tiến trình khác): Watchdog đánh dấu OFFLINE, người dùng tắt bơm
+    db = fleet()
+    crud_device.update_devices_bulk(db, [
+        {"device_id": d, "status": models.DeviceStatus.OFFLINE, "pump_state": False} for d in DEVICES
+    ])
+    db.commit()
+    db.close()
+
+    # Vòng lặp Writer tới hạn nạp lại Registry
+    for worker in workers:
+        worker.writer._registry.refresh_seconds = 1e-9
+        assert worker.writer._registry.refresh_if_due()
+    send_round(workers, mode, 1, pump=True)
+
+    db = fleet()
+    try:
+        devices = db.query(models.Device).all()
+        assert all(d.status == models.DeviceStatus.ONLINE for d in devices)
+        assert all(d.pump_state for d in devices)
+    finally:
+        db.close()
+
+
+def test_batch_decrypts_aes_payloads_in_one_call(fleet, monkeypatch):
+    """handle_batch (AsyncioMqttTransport.batch_handler): gói AES của cả loạt giải mã bằng 1 lần decrypt_many"""
+    calls = []
+    decrypt_many = payload_decryptor.decrypt_many
+    monkeypatch.setattr(payload_decryptor, "decrypt_many", lambda envelopes: calls.append(len(envelopes)) or decrypt_many(envelopes))
+    monkeypatch.setattr("ingest_worker.stage_sampler", lambda: False)
+
+    msgs = []
+    for seq, device_id in enumerate(DEVICES):
+        inner = json.dumps({"device_id": device_id, "temp": 25.0, "hum_air": 60.0, "hum_soil": 45.0, "seq": seq}).encode()
+        inner += b"\x00" * (-len(inner) % 16)
+        data = base64.b64encode(AES.new(settings.AES_KEY, AES.MODE_ECB).encrypt(inner)).decode()
+        msgs.append(SimpleNamespace(topic=settings.MQTT_TOPIC_SENSOR, payload=json.dumps({"data": data}).encode()))
+    msgs.append(SimpleNamespace(topic=settings.MQTT_TOPIC_SENSOR, payload=b'{"data": "broken"}'))
+
+    worker = make_workers(fleet, "shared")[0]
+    worker.handle_batch(msgs)
+    worker.writer.flush_pending()
+
+    assert calls == [len(DEVICES) + 1]
+    db = fleet()
+    try:
+        assert db.query(models.SensorData).count() == len(DEVICES)
+    finally:
+        db.close()
+
+
+def test_hash_workers_decode_only_their_devices(fleet, monkeypatch):
+    """hash: mọi worker nhận mọi gói nhưng chỉ worker sở hữu thiết bị mới giải mã gói đó"""
+    from services import mqtt_service
+    decoded = []
+    decode = mqtt_service.decode_sensor_payload
+    monkeypatch.setattr(mqtt_service, "decode_sensor_payload",
+                        lambda payload, **kwargs: decoded.append(payload) or decode(payload, **kwargs))
+
+    workers = make_workers(fleet, "hash")
+    send_round(workers, "hash", 0, pump=False)
+    assert len(decoded) == len(DEVICES)
@@ -0,0 +1,113 @@
+"""
+IngestWriter khi DB lỗi: lô không bị bỏ, khóa chống trùng chỉ ghi nhớ sau COMMIT
+(thiết bị gửi lại gói chưa lưu được theo QoS 1 vẫn được nhận).
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import exc as sa_exc
+
+from models import models
+from services.dedup import DedupWindow
+from services.device_registry import DeviceRegistry
+from services.heartbeat import HeartbeatFlusher
+from services.ingest_writer import IngestWriter, SensorReading
+from services.timeseries import ColumnarStore, RelationalStore
+
+DEVICE = "WRITER:1"
+
+
+def reading(seq: int, temp: float = 25.0) -> SensorReading:
+    return SensorReading(device_id=DEVICE, temp=temp, hum_air=60.0, hum_soil=40.0, light=100.0,
+                         pump_state=None, light_state=None, mist_state=None, is_error=False,
+                         received_at=datetime.now(), dedup_key=seq)
+
+
+class FlakySessions:
+    """session_factory có COMMIT hỏng `failures` lần đầu (mô phỏng DB mất kết nối / bị khóa)"""
+
+    def __init__(self, factory, failures: int):
+        self.factory = factory
+        self.failures = failures
+
+    def __call__(self):
+        db = self.factory()
+        if self.failures > 0:
+            self.failures -= 1
+
+            def commit():
+                raise sa_exc.OperationalError("COMMIT", {}, Exception("database is locked"))
+            db.commit = commit
+        return db
+
+
+@pytest.fixture
+def sessions(db_factory):
+    db = db_factory()
+    db.add(models.Device(device_id=DEVICE, name=DEVICE))
+    db.commit()
+    db.close()
+    return db_factory
+
+
+def make_writer(session_factory, db_factory, store=None, **kwargs):
+    return IngestWriter(session_factory=session_factory, registry=DeviceRegistry(session_factory=db_factory),
+                        heartbeats=HeartbeatFlusher(session_factory=db_factory), store=store or RelationalStore(),
+                        dedup=DedupWindow(per_device=16, ttl_seconds=60), retry_backoff_ms=1, retry_max_ms=1, **kwargs)
+
+
+def stored_count(db_factory) -> int:
+    db = db_factory()
+    try:
+        return db.query(models.SensorData).count()
+    finally:
+        db.close()
+
+
+def test_transient_error_retries_batch(sessions):
+    writer = make_writer(FlakySessions(sessions, failures=2), sessions)
+    writer.put(reading(1))
+    writer.put(reading(2))
+    writer.flush_pending()
+
+    assert stored_count(sessions) == 2
+    assert writer.saved_count == 2
+
+
+def test_retransmit_after_failed_write_is_stored(sessions):
+    """Writer đang dừng hết lượt thử lại -> lô bị bỏ, nhưng gói gửi lại vẫn không bị coi là trùng"""
+    writer = make_writer(FlakySessions(sessions, failures=2), sessions, retry_on_stop=1)
+    writer._stop_event.set()
+    writer.put(reading(1))
+    writer.flush_pending()
+    assert stored_count(sessions) == 0
+
+    assert writer.put(reading(1))
+    writer.flush_pending()
+    assert stored_count(sessions) == 1
+
+    # Đã COMMIT -> lần gửi lại tiếp theo mới là trùng
+    assert not writer.put(reading(1))
+    assert writer.stats()["duplicates"] == 1
+
+
+def test_bad_reading_only_drops_itself(sessions):
+    writer = make_writer(sessions, sessions)
+    writer.put(reading(1))
+    writer.put(reading(2, temp="không phải số"))
+    writer.put(reading(3))
+    writer.flush_pending()
+
+    assert stored_count(sessions) == 2
+
+
+def test_columnar_store_is_not_appended_twice_on_retry(sessions, tmp_path):
+    """Kho columnar ghi file ngay (không rollback được) -> chỉ ghi sau COMMIT, thử lại không nhân bản ghi"""
+    store = ColumnarStore(directory=str(tmp_path))
+    writer = make_writer(FlakySessions(sessions, failures=2), sessions, store=store)
+    writer.put(reading(1))
+    writer.put(reading(2))
+    writer.flush_pending()
+
+    assert len(store.query_range(None, DEVICE)) == 2
+    assert writer.saved_count == 2
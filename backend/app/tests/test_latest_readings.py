@@ -0,0 +1,113 @@
+"""
+Kiểm tra / dựng lại device_latest_reading (crud.find_stale_latest_readings, rebuild_latest_readings,
+tools/latest_readings.py) với cả 2 backend của kho chuỗi thời gian.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from crud import device as crud_device
+from models import models
+from services import timeseries
+from services.device_registry import DeviceRegistry
+from services.heartbeat import HeartbeatFlusher
+from services.ingest_writer import IngestWriter, SensorReading
+
+DEVICES = [f"LATEST:{i}" for i in range(4)]
+READINGS = 6
+
+
+def reading(device_id: str, at: datetime, temp: float) -> SensorReading:
+    return SensorReading(device_id=device_id, temp=temp, hum_air=60.0, hum_soil=40.0, light=100.0,
+                         pump_state=None, light_state=None, mist_state=None, is_error=False, received_at=at)
+
+
+@pytest.fixture(params=["relational", "columnar"])
+def store(request, db_factory, tmp_path, monkeypatch):
+    """Kho chuỗi thời gian đang dùng (TIMESERIES_BACKEND) + dữ liệu do Writer ghi như lúc chạy thật"""
+    if request.param == "columnar":
+        store = timeseries.ColumnarStore(directory=str(tmp_path / "columnar"))
+    else:
+        store = timeseries.RelationalStore()
+    monkeypatch.setattr(timeseries, "timeseries_store", store)
+
+    db = db_factory()
+    db.add_all([models.Device(device_id=d, name=d) for d in DEVICES])
+    db.commit()
+    db.close()
+
+    writer = IngestWriter(session_factory=db_factory, registry=DeviceRegistry(session_factory=db_factory),
+                          heartbeats=HeartbeatFlusher(session_factory=db_factory), store=store)
+    start = datetime.now() - timedelta(hours=1)
+    for i in range(READINGS):
+        for n, device_id in enumerate(DEVICES):
+            writer.put(reading(device_id, start + timedelta(seconds=10 * i + n), 20.0 + i))
+    writer.flush_pending()
+    return store
+
+
+def latest_temps(db):
+    return {d: row.temp for d, row in crud_device.get_latest_readings(db, DEVICES).items()}
+
+
+def test_writer_output_is_not_stale(store, db_factory):
+    db = db_factory()
+    try:
+        assert crud_device.find_stale_latest_readings(db) == []
+    finally:
+        db.close()
+
+
+def test_rebuild_keeps_latest_values(store, db_factory):
+    db = db_factory()
+    try:
+        assert crud_device.rebuild_latest_readings(db) == len(DEVICES)
+        assert latest_temps(db) == {d: 20.0 + READINGS - 1 for d in DEVICES}
+        assert crud_device.find_stale_latest_readings(db) == []
+    finally:
+        db.close()
+
+
+def test_repair_restores_missing_row(store, db_factory):
+    db = db_factory()
+    try:
+        db.query(models.DeviceLatestReading).filter(models.DeviceLatestReading.device_id == DEVICES[1]).delete()
+        db.commit()
+        stale = crud_device.find_stale_latest_readings(db)
+        assert stale == [DEVICES[1]]
+        crud_device.rebuild_latest_readings(db, stale)
+        assert crud_device.find_stale_latest_readings(db) == []
+        assert latest_temps(db)[DEVICES[1]] == 20.0 + READINGS - 1
+    finally:
+        db.close()
+
+
+def test_compressed_devices_are_not_stale(db_factory, monkeypatch):
+    """Sau khi sensor_blocks nén hết bảng nóng, bản mới nhất nằm trong khối"""
+    from services.sensor_blocks import sensor_blocks
+
+    monkeypatch.setattr(timeseries, "timeseries_store", timeseries.RelationalStore())
+    db = db_factory()
+    db.add_all([models.Device(device_id=d, name=d) for d in DEVICES])
+    db.commit()
+    db.close()
+    writer = IngestWriter(session_factory=db_factory, registry=DeviceRegistry(session_factory=db_factory),
+                          heartbeats=HeartbeatFlusher(session_factory=db_factory), store=timeseries.RelationalStore())
+    start = datetime.now() - timedelta(hours=5)
+    for i in range(READINGS):
+        for n, device_id in enumerate(DEVICES[:-1]):  # Thiết bị cuối chưa gửi gì
+            writer.put(reading(device_id, start + timedelta(minutes=20 * i, seconds=n), 20.0 + i))
+    writer.flush_pending()
+
+    monkeypatch.setattr(sensor_blocks, "after_hours", 1)
+    assert sensor_blocks.compress_once(now=datetime.now() + timedelta(hours=2))["rows"] == READINGS * (len(DEVICES) - 1)
+
+    db = db_factory()
+    try:
+        assert db.query(models.SensorData).count() == 0
+        assert crud_device.find_stale_latest_readings(db) == []
+        assert crud_device.rebuild_latest_readings(db) == len(DEVICES) - 1
+        assert latest_temps(db) == {d: 20.0 + READINGS - 1 for d in DEVICES[:-1]}
+        assert crud_device.find_stale_latest_readings(db) == []
+    finally:
+        db.close()
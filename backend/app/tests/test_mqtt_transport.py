@@ -0,0 +1,18 @@
+"""
+MqttTransport: độ trễ publish -> xác nhận của Broker được xuất ra /metrics (smartfarm_mqtt_publish_seconds).
+"""
+from core.metrics import MQTT_PUBLISH_SECONDS, metrics
+from services.mqtt_transport import ThreadMqttTransport
+
+
+def test_publish_latency_is_exported():
+    transport = ThreadMqttTransport(client_id="test-publish-latency")
+    before = MQTT_PUBLISH_SECONDS.count("1")
+
+    transport._publish_now("farm/control", "PUMP_ON", 1)
+    (mid,) = transport._publish_started
+    transport._on_publish(transport.client, None, mid, None, None)  # PUBACK của Broker
+
+    assert MQTT_PUBLISH_SECONDS.count("1") == before + 1
+    assert len(transport.publish_latencies_ms) == 1
+    assert 'smartfarm_mqtt_publish_seconds_count{qos="1"}' in metrics.render()
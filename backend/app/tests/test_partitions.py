@@ -0,0 +1,45 @@
+"""
+SQLite chia partition theo tháng (db/partitions.py): số file tháng phải nằm trong giới hạn ATTACH của SQLite,
+nếu không install() từ chối thay vì lặng lẽ bỏ các tháng cũ khỏi truy vấn.
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+
+from core.config import settings
+from db.base import Base
+from db.partitions import SQLITE_MAX_ATTACHED, SensorPartitions, add_months
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SENSOR_PARTITIONING", True)
+    monkeypatch.setattr(settings, "SENSOR_PARTITION_AHEAD_MONTHS", 2)
+    monkeypatch.setattr(settings, "SENSOR_PARTITION_DIR", str(tmp_path / "parts"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'farm.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("retention", [0, SQLITE_MAX_ATTACHED - 2])
+def test_refuses_retention_beyond_attach_limit(sqlite_engine, monkeypatch, retention):
+    monkeypatch.setattr(settings, "SENSOR_RETENTION_MONTHS", retention)
+    with pytest.raises(ValueError):
+        SensorPartitions().install(sqlite_engine)
+
+
+def test_every_kept_month_is_attached(sqlite_engine, monkeypatch):
+    monkeypatch.setattr(settings, "SENSOR_RETENTION_MONTHS", SQLITE_MAX_ATTACHED - 4)
+    partitions = SensorPartitions()
+    partitions.install(sqlite_engine)
+    Base.metadata.create_all(bind=sqlite_engine)
+    assert partitions.enabled
+
+    # Chạy đủ 1 năm: mỗi tháng maintain() gỡ tháng hết hạn rồi tạo tháng mới, không tháng nào bị bỏ khỏi ATTACH
+    for i in range(12):
+        assert partitions.maintain(add_months(datetime(2026, 1, 1), i))["created"]
+        assert partitions._attachable() == partitions._files
+        assert len(partitions.months()) == min(i, settings.SENSOR_RETENTION_MONTHS) + 3
+        with sqlite_engine.connect() as conn:
+            assert set(conn.info["sensor_partitions"]) == set(partitions.months())
@@ -0,0 +1,56 @@
+"""
+RollupCompactor với số liệu Writer COMMIT muộn (lô tồn đọng khi DB nghẽn): khung đã qua watermark được gộp lại.
+"""
+from datetime import datetime, timedelta
+
+from models import models
+from services.device_registry import DeviceRegistry
+from services.heartbeat import HeartbeatFlusher
+from services.ingest_writer import IngestWriter, SensorReading
+from services.rollup import RollupCompactor, floor_minute
+from services.timeseries import RelationalStore
+
+DEVICE = "ROLLUP:1"
+
+
+def reading(at: datetime, temp: float) -> SensorReading:
+    return SensorReading(device_id=DEVICE, temp=temp, hum_air=60.0, hum_soil=40.0, light=100.0,
+                         pump_state=None, light_state=None, mist_state=None, is_error=False, received_at=at)
+
+
+def samples_1m(db_factory, bucket: datetime):
+    db = db_factory()
+    try:
+        row = db.query(models.SensorRollup1m).filter(models.SensorRollup1m.device_id == DEVICE,
+                                                     models.SensorRollup1m.bucket == bucket).first()
+        return (row.samples, row.temp_max) if row else None
+    finally:
+        db.close()
+
+
+def test_late_batch_is_rolled_up_again(db_factory):
+    db = db_factory()
+    db.add(models.Device(device_id=DEVICE, name=DEVICE))
+    db.commit()
+    db.close()
+    writer = IngestWriter(session_factory=db_factory, registry=DeviceRegistry(session_factory=db_factory),
+                          heartbeats=HeartbeatFlusher(session_factory=db_factory), store=RelationalStore())
+    compactor = RollupCompactor(session_factory=db_factory)
+
+    at = floor_minute(datetime.now() - timedelta(minutes=30)) + timedelta(seconds=10)
+    writer.put(reading(at, 20.0))
+    writer.flush_pending()
+    assert compactor.compact_once()["1m"] >= 1
+    assert samples_1m(db_factory, floor_minute(at)) == (1, 20.0)
+
+    # Bản ghi nhận cùng phút nhưng nằm trong hàng đợi tới khi DB hết nghẽn -> COMMIT sau khi phút đó đã gộp
+    writer.put(reading(at + timedelta(seconds=5), 30.0))
+    writer.flush_pending()
+    compactor.compact_once()
+    assert samples_1m(db_factory, floor_minute(at)) == (2, 30.0)
+
+    db = db_factory()
+    try:
+        assert db.query(models.RollupLateData).count() == 0
+    finally:
+        db.close()
@@ -0,0 +1,71 @@
+"""
+sensor_data.timestamp luôn là giờ địa phương: bản ghi qua HTTP (crud.create_sensor_reading) cùng quy ước với
+Ingest Writer, bản cũ do SQLite CURRENT_TIMESTAMP (giờ UTC) đổi lại 1 lần bằng tools/sensor_timestamps.py.
+"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from crud import device as crud_device
+from db.session import engine
+from models import models
+from schemas import device as schemas
+from tools.sensor_timestamps import MIGRATION, localize_sqlite_sensor_timestamps
+
+DEVICE = "TZ:1"
+
+
+@pytest.fixture
+def local_tz(monkeypatch):
+    """Múi giờ khác UTC để phân biệt được 2 loại mốc thời gian"""
+    monkeypatch.setenv("TZ", "Asia/Ho_Chi_Minh")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def db(db_factory, local_tz):
+    db = db_factory()
+    db.add(models.Device(device_id=DEVICE, name=DEVICE))
+    db.commit()
+    yield db
+    db.close()
+
+
+def close_to_now(ts: datetime) -> bool:
+    return abs(ts - datetime.now()) < timedelta(minutes=1)
+
+
+def test_http_reading_uses_local_time(db):
+    row = crud_device.create_sensor_reading(db, schemas.SensorDataInput(temp=25.0, hum_air=60.0, hum_soil=40.0), DEVICE)
+    assert close_to_now(row.timestamp)
+    assert close_to_now(crud_device.get_latest_readings(db, [DEVICE])[DEVICE].timestamp)
+
+
+def insert_legacy_row():
+    # Như bản cũ: timestamp do server_default (CURRENT_TIMESTAMP) điền
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO sensor_data (device_id, temp, hum_air, hum_soil, light) VALUES (:d, 30.0, 60.0, 40.0, 100.0)"),
+                     {"d": DEVICE})
+
+
+def test_utc_rows_are_localized_once(db):
+    insert_legacy_row()
+    crud_device.rebuild_latest_readings(db, [DEVICE])
+    assert not close_to_now(db.query(models.SensorData.timestamp).scalar())
+
+    assert localize_sqlite_sensor_timestamps(db) == 1
+    assert close_to_now(db.query(models.SensorData.timestamp).scalar())
+    latest = crud_device.get_latest_readings(db, [DEVICE])[DEVICE]
+    assert close_to_now(latest.timestamp) and latest.temp == 30.0
+    assert crud_device.find_stale_latest_readings(db) == []
+
+    # Đã ghi mốc -> chạy lại không đụng tới dữ liệu nào nữa (kể cả dòng bản cũ ghi thêm sau đó)
+    assert db.get(models.DataMigration, MIGRATION).rows == 1
+    insert_legacy_row()
+    assert localize_sqlite_sensor_timestamps(db) == 0
+    assert sum(close_to_now(ts) for (ts,) in db.query(models.SensorData.timestamp)) == 1
@@ -0,0 +1,68 @@
+"""
+SQLite production: engine ghi đồng bộ và engine ghi aiosqlite chung 1 ghế ghi (db/session.py WriteGate).
+"""
+import asyncio
+
+from db.session import AsyncSessionLocal, SessionLocal, WriteGate, async_engine, sqlite_write_gate
+from models import models
+
+
+def test_gate_times_out_and_hands_over():
+    gate = WriteGate(timeout=0.05)
+    assert gate.acquire()
+    assert not gate.acquire()
+    assert not asyncio.run(gate.acquire_async())
+    gate.release()
+    assert gate.acquire()
+    gate.release()
+
+
+def test_cancelled_async_waiter_does_not_keep_gate():
+    gate = WriteGate(timeout=5)
+
+    async def scenario():
+        assert await gate.acquire_async()
+        waiter = asyncio.create_task(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        gate.release()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await asyncio.wait_for(gate.acquire_async(), 1)
+
+    assert asyncio.run(scenario())
+
+
+def test_async_write_waits_for_sync_writer_without_blocking_loop(db_factory):
+    sync_db = SessionLocal()
+    sync_db.add(models.Device(device_id="GATE:SYNC", name="sync"))
+    sync_db.flush()  # Đang giữ kết nối ghi đồng bộ (ghế ghi)
+
+    async def async_write():
+        db = AsyncSessionLocal()
+        try:
+            db.add(models.Device(device_id="GATE:ASYNC", name="async"))
+            await db.commit()
+        finally:
+            await db.close()
+
+    async def scenario():
+        task = asyncio.create_task(async_write())
+        ticks = 0
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        # Chờ ghế chứ không mở kết nối ghi thứ 2 rồi tranh khóa file bằng busy_timeout
+        assert not task.done() and len(sqlite_write_gate._waiters) == 1
+        sync_db.commit()
+        sync_db.close()
+        await asyncio.wait_for(task, 5)
+        await async_engine.dispose()
+        return ticks
+
+    assert asyncio.run(scenario()) == 10
+
+    db = db_factory()
+    try:
+        assert {d for (d,) in db.query(models.Device.device_id)} == {"GATE:SYNC", "GATE:ASYNC"}
+    finally:
+        db.close()
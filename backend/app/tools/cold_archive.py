@@ -0,0 +1,58 @@
+"""
+Kho lạnh của sensor_data (services/cold_archive.py).
+
+    cd backend/app
+    # Số file / bản ghi đã lưu kho, dung lượng, số bản ghi còn trong bảng nóng
+    python -m tools.cold_archive status
+
+    # Chuyển ngay các ngày cũ hơn COLD_ARCHIVE_AFTER_DAYS (hoặc --days) vào kho lạnh
+    python -m tools.cold_archive run --days 30
+
+API tự chạy mỗi COLD_ARCHIVE_INTERVAL_SECONDS khi COLD_ARCHIVE_AFTER_DAYS > 0.
+"""
+import argparse
+import time
+
+from sqlalchemy import func
+
+from db.base import Base
+from db.partitions import sensor_partitions
+from db.session import SessionLocal, engine
+from services.cold_archive import cold_archive
+
+
+def status():
+    db = SessionLocal()
+    try:
+        info = cold_archive.status(db)
+        sd = sensor_partitions.sensor_entity(db)
+        hot_rows, hot_first = db.query(func.count(), func.min(sd.timestamp)).select_from(sd).one()
+    finally:
+        db.close()
+    print(f"   bảng nóng   {hot_rows:>12,} bản ghi   từ {hot_first or '-'}")
+    print(f"   kho lạnh    {info['rows']:>12,} bản ghi   {info['files']:,} file, {info['bytes'] / 2 ** 20:.1f} MB"
+          f"   ({info['first_day'] or '-'} -> {info['last_day'] or '-'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kho lạnh của sensor_data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Thống kê bảng nóng / kho lạnh")
+    p = sub.add_parser("run", help="Chuyển dữ liệu cũ vào kho lạnh ngay")
+    p.add_argument("--days", type=int, default=None, help="Giữ lại N ngày gần nhất (mặc định COLD_ARCHIVE_AFTER_DAYS)")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    if args.command == "run":
+        if args.days is not None:
+            cold_archive.after_days = args.days
+        if cold_archive.after_days <= 0:
+            raise SystemExit("❌ Cần COLD_ARCHIVE_AFTER_DAYS > 0 hoặc --days N")
+        started = time.perf_counter()
+        result = cold_archive.archive_once()
+        print(f"🧊 Đã chuyển {result['rows']:,} bản ghi ({result['days']} ngày) trong {time.perf_counter() - started:.1f}s")
+    status()
+
+
+if __name__ == "__main__":
+    main()
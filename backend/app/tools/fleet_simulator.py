@@ -0,0 +1,391 @@
+"""
+Mô phỏng cả đàn ESP32 ảo (1k - 50k thiết bị) để đo tải Ingest + Watchdog + AI tưới tự động cùng lúc, không cần phần cứng.
+
+    cd backend/app
+    # Trong tiến trình: gói tin đi thẳng vào mqtt_service.on_message, lệnh của AI / API quay về thẳng đàn thiết bị.
+    # Chạy kèm Ingest Writer, auto_irrigation_task và watchdog_task (như main.lifespan). --provision tạo thiết bị + vườn AUTO.
+    python -m tools.fleet_simulator --devices 5000 --target inproc --provision --zones 20 --duration 300
+
+    # Qua Broker thật (MQTT_BROKER), API chạy riêng: uvicorn main:app
+    python -m tools.fleet_simulator --devices 20000 --target broker --format aes --connections 8
+
+Mỗi thiết bị gửi 1 gói / --interval giây (giống taskMQTT của 1_firmware/Simulator), lệch pha đều nhau để tải không dồn cục.
+Số liệu theo chu kỳ ngày đêm (--time-scale: 60 = 1 giây thật là 1 phút mô phỏng):
+- temp cao nhất ~15h, hum_air ngược chiều temp, light theo mặt trời (0 - 100% như firmware map LDR).
+- hum_soil khô dần (nhanh hơn khi nóng + nắng); PUMP ON làm ẩm nhanh, MIST ON làm mát + tăng ẩm không khí.
+Lệnh điều khiển ({"device": "PUMP", "status": "ON"}) trên MQTT_TOPIC_CONTROL không có device_id
+nên MỌI thiết bị đều thực hiện (đúng như firmware hiện tại); lệnh có kèm "device_id" thì chỉ thiết bị đó thực hiện.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import signal
+import time
+from typing import Callable, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+from Crypto.Cipher import AES
+
+from core.config import settings
+from core.logger import get_logger
+from services.mqtt_transport import AsyncioMqttTransport
+
+logger = get_logger("Fleet_Simulator")
+
+TICK_SECONDS = 0.01          # Nhịp lập lịch: mỗi 10ms gửi 1 nhóm thiết bị
+PUMP_SOIL_PER_SECOND = 0.5   # Bơm chạy 1 giây (thật) -> đất ẩm thêm 0.5%
+MIST_SOIL_PER_SECOND = 0.02  # Phun sương cũng làm đất ẩm thêm chút ít
+DRY_PER_SIM_HOUR = 1.5       # Đất khô đi ~1.5%/giờ mô phỏng lúc mát, gấp ~3 lần lúc nắng gắt
+FORMATS = ("json", "aes", "mixed")
+
+
+# =========================================================================
+# 1 THIẾT BỊ ẢO
+# =========================================================================
+class VirtualDevice:
+    __slots__ = ("device_id", "rng", "temp_offset", "soil", "pump", "mist", "light_on", "encrypted", "silent", "seq")
+
+    def __init__(self, device_id: str, seed: int, encrypted: bool):
+        self.device_id = device_id
+        self.rng = random.Random(seed)
+        self.temp_offset = self.rng.uniform(-2.0, 2.0)   # Mỗi nhà màng nóng/lạnh hơn 1 chút
+        self.soil = self.rng.uniform(35.0, 75.0)
+        self.pump = False
+        self.mist = False
+        self.light_on = False
+        self.encrypted = encrypted
+        self.silent = False   # Giả lập rớt mạng (để Watchdog chuyển OFFLINE)
+        self.seq = 0          # Số thứ tự gói như firmware (Server dùng để bỏ gói gửi lại)
+
+    def advance(self, sim_hour: float, sim_dt_hours: float, real_dt: float):
+        """Cập nhật độ ẩm đất sau 1 khoảng thời gian"""
+        sun = max(0.0, math.sin(math.pi * (sim_hour - 6.0) / 12.0))
+        self.soil -= DRY_PER_SIM_HOUR * (1.0 + 2.0 * sun) * sim_dt_hours
+        if self.pump:
+            self.soil += PUMP_SOIL_PER_SECOND * real_dt
+        if self.mist:
+            self.soil += MIST_SOIL_PER_SECOND * real_dt
+        self.soil = min(95.0, max(5.0, self.soil))
+
+    def reading(self, sim_hour: float) -> dict:
+        rng = self.rng
+        day = math.sin(2.0 * math.pi * (sim_hour - 9.0) / 24.0)   # = 1 lúc 15h, -1 lúc 3h sáng
+        sun = max(0.0, math.sin(math.pi * (sim_hour - 6.0) / 12.0))
+        temp = 26.0 + 7.0 * day + self.temp_offset + rng.gauss(0.0, 0.3)
+        hum_air = 68.0 - 18.0 * day + rng.gauss(0.0, 1.5)
+        if self.mist:
+            temp -= 3.0
+            hum_air += 15.0
+        light = 100.0 * sun * rng.uniform(0.7, 1.0)   # Mây che
+        self.seq += 1
+        return {
+            "device_id": self.device_id,
+            "temp": round(temp, 1),
+            "hum_air": round(min(99.0, max(20.0, hum_air)), 1),
+            "hum_soil": int(self.soil),
+            "light": int(light),
+            "pump_state": self.pump,
+            "light_state": self.light_on,
+            "mist_state": self.mist,
+            "seq": self.seq,
+        }
+
+    def apply(self, device: str, state: bool):
+        if device == "PUMP":
+            self.pump = state
+        elif device == "MIST":
+            self.mist = state
+        elif device == "LIGHT":
+            self.light_on = state
+
+
+# =========================================================================
+# CẢ ĐÀN
+# =========================================================================
+class Fleet:
+    def __init__(self, count: int, interval: float = 5.0, fmt: str = "json", time_scale: float = 60.0,
+                 start_hour: float = 6.0, prefix: str = "SIM", seed: int = 1):
+        self.interval = interval
+        self.time_scale = time_scale
+        self.start_hour = start_hour
+        self.devices: List[VirtualDevice] = [
+            VirtualDevice(f"{prefix}-{i:05d}", seed * 1_000_003 + i,
+                          encrypted=fmt == "aes" or (fmt == "mixed" and i % 2 == 1))
+            for i in range(count)
+        ]
+        self.by_id: Dict[str, VirtualDevice] = {d.device_id: d for d in self.devices}
+        self._cipher = AES.new(settings.AES_KEY, AES.MODE_ECB)
+
+        # Chia đều thiết bị vào các khe 10ms trong 1 chu kỳ gửi
+        slots = max(1, int(round(interval / TICK_SECONDS)))
+        self.slots: List[List[VirtualDevice]] = [self.devices[i::slots] for i in range(slots)]
+
+        self.published = 0
+        self.commands = 0
+        self.started_at = time.monotonic()
+
+    # ---------------- Thời gian mô phỏng ----------------
+    def sim_hour(self, now: Optional[float] = None) -> float:
+        elapsed = (now or time.monotonic()) - self.started_at
+        return (self.start_hour + elapsed * self.time_scale / 3600.0) % 24.0
+
+    # ---------------- Gói tin ----------------
+    def encode(self, device: VirtualDevice, sim_hour: float) -> bytes:
+        body = json.dumps(device.reading(sim_hour)).encode()
+        if not device.encrypted:
+            return body
+        # Giống ESP32 thật: AES-128-ECB, đệm 0, Base64 trong {"data": ...}
+        body += b"\x00" * (-len(body) % 16)
+        return json.dumps({"data": base64.b64encode(self._cipher.encrypt(body)).decode()}).encode()
+
+    def on_command(self, payload: bytes):
+        """Lệnh từ MQTT_TOPIC_CONTROL: {"device": "PUMP", "status": "ON"[, "device_id": ...]}"""
+        try:
+            cmd = json.loads(payload)
+            device, state = cmd["device"], cmd["status"] == "ON"
+        except (ValueError, KeyError, TypeError):
+            return
+        self.commands += 1
+        target = cmd.get("device_id")
+        if target:
+            if target in self.by_id:
+                self.by_id[target].apply(device, state)
+            return
+        for d in self.devices:
+            d.apply(device, state)
+
+    # ---------------- Vòng lặp gửi ----------------
+    async def run(self, publish: Callable[[VirtualDevice, bytes], None], duration: float, stop_event: asyncio.Event,
+                  silent_fraction: float = 0.0, silent_after: float = 0.0, duplicate_rate: float = 0.0):
+        self.started_at = time.monotonic()
+        last_hour = self.sim_hour()
+        last_step = self.started_at
+        last_report = self.started_at
+        reported = 0
+        slot = 0
+        next_tick = self.started_at
+        went_silent = silent_fraction <= 0
+
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if duration and now - self.started_at >= duration:
+                break
+
+            # Mỗi giây cập nhật độ ẩm đất của cả đàn 1 lần (không phải mỗi gói)
+            if now - last_step >= 1.0:
+                hour = self.sim_hour(now)
+                sim_dt = (now - last_step) * self.time_scale / 3600.0
+                for d in self.devices:
+                    d.advance(hour, sim_dt, now - last_step)
+                last_step, last_hour = now, hour
+
+            if not went_silent and now - self.started_at >= silent_after:
+                went_silent = True
+                for d in self.devices[:int(len(self.devices) * silent_fraction)]:
+                    d.silent = True
+                logger.warning(f"📴 {int(len(self.devices) * silent_fraction)} thiết bị ngừng gửi (chờ Watchdog báo OFFLINE)")
+
+            for d in self.slots[slot]:
+                if not d.silent:
+                    payload = self.encode(d, last_hour)
+                    publish(d, payload)
+                    self.published += 1
+                    # Giả lập QoS 1 gửi lại khi mất PUBACK: cùng gói (cùng seq) tới lần 2
+                    if duplicate_rate and d.rng.random() < duplicate_rate:
+                        publish(d, payload)
+                        self.published += 1
+            slot = (slot + 1) % len(self.slots)
+
+            if now - last_report >= 5.0:
+                rate = (self.published - reported) / (now - last_report)
+                pumping = sum(1 for d in self.devices if d.pump)
+                avg_soil = sum(d.soil for d in self.devices) / len(self.devices)
+                logger.info(f"📡 {rate:,.0f} msg/s (mục tiêu {len(self.devices) / self.interval:,.0f}) | "
+                            f"giờ mô phỏng {last_hour:05.2f} | đất TB {avg_soil:.1f}% | bơm đang chạy {pumping} | lệnh nhận {self.commands}")
+                last_report, reported = now, self.published
+
+            next_tick += TICK_SECONDS
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)   # Không theo kịp: vẫn nhường event loop (Writer, AI, MQTT)
+                if delay < -1.0:
+                    next_tick = time.monotonic()   # Trễ quá 1 giây thì bỏ qua, không dồn gửi bù
+
+
+# =========================================================================
+# ĐÍCH GỬI: TRONG TIẾN TRÌNH
+# =========================================================================
+class InProcessTransport:
+    """Thay mqtt_service.transport: lệnh publish_command() được giao thẳng cho đàn thiết bị ảo"""
+
+    def __init__(self, fleet: Fleet):
+        self.fleet = fleet
+        self.client = None
+
+    def is_connected(self) -> bool:
+        return True
+
+    def publish(self, topic: str, payload, qos: int = 0) -> bool:
+        if topic == settings.MQTT_TOPIC_CONTROL:
+            data = payload.encode() if isinstance(payload, str) else payload
+            asyncio.get_running_loop().call_soon(self.fleet.on_command, data)
+        return True
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+def provision(fleet: Fleet, zones: int) -> int:
+    """Tạo thiết bị còn thiếu trong DB; zones > 0: tạo thêm N vườn chế độ AUTO, mỗi vườn gắn 1 thiết bị (AI xét thiết bị đầu tiên của vườn)"""
+    from db.session import SessionLocal
+    from models import models
+
+    db = SessionLocal()
+    try:
+        existing = {row[0] for row in db.query(models.Device.device_id).filter(models.Device.device_id.in_(list(fleet.by_id))).all()}
+        new_zones = []
+        for i in range(zones):
+            zone = models.Zone(name=f"Vườn mô phỏng {i + 1}", description="tools/fleet_simulator.py")
+            zone.setting = models.ZoneSetting(mode="AUTO")
+            db.add(zone)
+            new_zones.append(zone)
+        db.flush()
+        created = 0
+        for i, d in enumerate(fleet.devices):
+            if d.device_id in existing:
+                continue
+            zone_id = new_zones[i].zone_id if i < len(new_zones) else None
+            db.add(models.Device(device_id=d.device_id, name=f"Thiết bị ảo {d.device_id}", zone_id=zone_id))
+            created += 1
+        db.commit()
+        return created
+    finally:
+        db.close()
+
+
+async def run_inprocess(fleet: Fleet, args, stop_event: asyncio.Event):
+    """Gói tin -> mqtt_service.on_message -> Ingest Writer, kèm AI tưới + Watchdog như khi chạy main.py"""
+    from db.base import Base
+    from db.session import engine
+    from main import watchdog_task
+    from services import mqtt_service
+    from services.device_registry import device_registry
+    from services.ingest_writer import ingest_writer
+    from services.irrigation_logic import auto_irrigation_task
+    from services.payload_crypto import payload_decryptor
+
+    Base.metadata.create_all(bind=engine)
+    if args.provision:
+        logger.info(f"🆕 Đã tạo {provision(fleet, args.zones)} thiết bị ảo trong DB")
+    device_registry.load_all()
+    payload_decryptor.load_all()
+    mqtt_service.transport = InProcessTransport(fleet)
+    mqtt_service.capture = None
+    ingest_writer.start()
+    tasks = [asyncio.create_task(auto_irrigation_task()), asyncio.create_task(watchdog_task())]
+
+    on_message = mqtt_service.on_message
+    topic = settings.MQTT_TOPIC_SENSOR.encode()
+
+    def publish(device: VirtualDevice, payload: bytes):
+        msg = mqtt.MQTTMessage(topic=topic)
+        msg.payload = payload
+        on_message(None, None, msg)
+
+    try:
+        await fleet.run(publish, args.duration, stop_event, args.silent_fraction, args.silent_after, args.duplicate_rate)
+    finally:
+        for task in tasks:
+            task.cancel()
+        ingest_writer.stop()
+        stats = ingest_writer.stats()
+        logger.info(f"💾 saved={stats['saved']:,} rejected={stats['rejected']:,} duplicates={stats['duplicates']:,} dropped={stats['queue']['dropped_total']:,}")
+
+
+# =========================================================================
+# ĐÍCH GỬI: BROKER THẬT
+# =========================================================================
+async def run_broker(fleet: Fleet, args, stop_event: asyncio.Event):
+    """Chia đàn thiết bị lên --connections kết nối MQTT; chỉ kết nối đầu tiên nghe topic điều khiển"""
+    transports = []
+    for i in range(args.connections):
+        transport = AsyncioMqttTransport(
+            client_id=f"smartfarm-fleet-{int(time.time())}-{i}",
+            handler=(lambda msg: fleet.on_command(msg.payload)) if i == 0 else None,
+        )
+        if i == 0:
+            transport.add_subscription(settings.MQTT_TOPIC_CONTROL)
+        await transport.start()
+        transports.append(transport)
+
+    deadline = time.monotonic() + 10
+    while not all(t.is_connected() for t in transports):
+        if time.monotonic() > deadline:
+            for t in transports:
+                await t.stop()
+            raise SystemExit(f"❌ Không kết nối được Broker {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
+        await asyncio.sleep(0.05)
+
+    topic = settings.MQTT_TOPIC_SENSOR
+    count = len(transports)
+    slot_of = {d.device_id: i % count for i, d in enumerate(fleet.devices)}
+
+    def publish(device: VirtualDevice, payload: bytes):
+        transports[slot_of[device.device_id]].publish(topic, payload)
+
+    try:
+        await fleet.run(publish, args.duration, stop_event, args.silent_fraction, args.silent_after, args.duplicate_rate)
+    finally:
+        for t in transports:
+            await t.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mô phỏng đàn ESP32 ảo")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=5.0, help="Mỗi thiết bị gửi 1 gói / N giây (firmware: 5s)")
+    parser.add_argument("--format", choices=FORMATS, default="json", help="json = như Wokwi, aes = {\"data\": AES Base64}, mixed = 1/2 mỗi loại")
+    parser.add_argument("--target", choices=["inproc", "broker"], default="inproc")
+    parser.add_argument("--duration", type=float, default=0, help="Số giây chạy (0 = tới khi Ctrl+C)")
+    parser.add_argument("--time-scale", type=float, default=60.0, help="Tốc độ đồng hồ mô phỏng so với thật")
+    parser.add_argument("--start-hour", type=float, default=6.0, help="Giờ mô phỏng lúc bắt đầu")
+    parser.add_argument("--prefix", default="SIM", help="Tiền tố device_id")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--connections", type=int, default=1, help="broker: số kết nối MQTT chia nhau gửi")
+    parser.add_argument("--provision", action="store_true", help="inproc: tạo thiết bị ảo còn thiếu trong DB")
+    parser.add_argument("--zones", type=int, default=0, help="inproc + --provision: tạo N vườn AUTO cho AI tưới")
+    parser.add_argument("--silent-fraction", type=float, default=0.0, help="Tỉ lệ thiết bị ngừng gửi giữa chừng (thử Watchdog)")
+    parser.add_argument("--silent-after", type=float, default=60.0, help="... sau N giây")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Tỉ lệ gói bị gửi lại 2 lần (thử chống trùng)")
+    args = parser.parse_args()
+
+    fleet = Fleet(args.devices, args.interval, args.format, args.time_scale, args.start_hour, args.prefix, args.seed)
+    logger.info(f"🚜 {args.devices:,} thiết bị ảo ({args.format}), {args.devices / args.interval:,.0f} msg/s -> {args.target}")
+
+    async def runner():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:  # Windows
+                pass
+        if args.target == "inproc":
+            await run_inprocess(fleet, args, stop_event)
+        else:
+            await run_broker(fleet, args, stop_event)
+        logger.info(f"🏁 Đã gửi {fleet.published:,} gói, nhận {fleet.commands} lệnh")
+
+    asyncio.run(runner())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Bảo trì bảng device_latest_reading (số liệu mới nhất của từng thiết bị).
+
+    cd backend/app
+    # Lần đầu nâng cấp: dựng bảng từ toàn bộ số liệu cảm biến đã có
+    python -m tools.latest_readings backfill
+
+    # Kiểm tra lệch với số liệu cảm biến (exit code 1 nếu có thiết bị lệch)
+    python -m tools.latest_readings check
+
+    # Sửa riêng các thiết bị bị lệch (sau khi xóa / nạp tay dữ liệu cảm biến)
+    python -m tools.latest_readings repair
+
+Số liệu cảm biến đọc qua kho chuỗi thời gian đang dùng (TIMESERIES_BACKEND: sensor_data + kho khối + kho lạnh,
+hoặc file cột). Chạy được khi API / Ingest Worker đang hoạt động: bản ghi mới hơn do Writer ghi song song không bị đè.
+"""
+import argparse
+import time
+
+from crud import device as crud_device
+from db.base import Base
+from db.session import SessionLocal, engine
+
+
+def backfill(chunk_size: int):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        written = crud_device.rebuild_latest_readings(db, chunk_size=chunk_size)
+        print(f"✅ Đã dựng device_latest_reading cho {written:,} thiết bị trong {time.perf_counter() - started:.2f}s")
+    finally:
+        db.close()
+
+
+def check(limit: int) -> bool:
+    db = SessionLocal()
+    try:
+        stale = crud_device.find_stale_latest_readings(db)
+    finally:
+        db.close()
+    if not stale:
+        print("✅ device_latest_reading khớp với số liệu cảm biến")
+        return True
+    print(f"❌ {len(stale):,} thiết bị lệch với số liệu cảm biến:")
+    for device_id in stale[:limit]:
+        print(f"   {device_id}")
+    if len(stale) > limit:
+        print(f"   ... và {len(stale) - limit:,} thiết bị khác")
+    return False
+
+
+def repair(chunk_size: int):
+    db = SessionLocal()
+    try:
+        stale = crud_device.find_stale_latest_readings(db)
+        if not stale:
+            print("✅ Không có thiết bị nào cần sửa")
+            return
+        written = crud_device.rebuild_latest_readings(db, stale, chunk_size=chunk_size)
+        print(f"🔧 Đã sửa {len(stale):,} thiết bị lệch ({written:,} còn số liệu, {len(stale) - written:,} đã xóa dòng thừa)")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bảo trì bảng device_latest_reading")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("backfill", help="Dựng lại toàn bộ bảng từ số liệu cảm biến")
+    p.add_argument("--chunk-size", type=int, default=1000, help="Số thiết bị mỗi lần COMMIT")
+
+    p = sub.add_parser("check", help="Liệt kê thiết bị lệch với số liệu cảm biến")
+    p.add_argument("--limit", type=int, default=20, help="Số thiết bị in ra tối đa")
+
+    p = sub.add_parser("repair", help="Dựng lại riêng các thiết bị bị lệch")
+    p.add_argument("--chunk-size", type=int, default=1000, help="Số thiết bị mỗi lần COMMIT")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    if args.command == "backfill":
+        backfill(args.chunk_size)
+    elif args.command == "check":
+        raise SystemExit(0 if check(args.limit) else 1)
+    else:
+        repair(args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Ghi lại / phát lại gói tin cảm biến MQTT để đo tải Ingest bằng dữ liệu thật.
+
+    cd backend/app
+    # 1. Ghi lại (hoặc đặt MQTT_CAPTURE_FILE=... cho API tự ghi trong lúc chạy)
+    python -m tools.mqtt_replay capture farm.sfcap --seconds 600
+
+    # 2. Xem nhanh nội dung file
+    python -m tools.mqtt_replay info farm.sfcap
+
+    # 3. Phát lại qua on_message -> Ingest Writer -> DB (theo DATABASE_URL), nhanh gấp 10 lần thực tế
+    python -m tools.mqtt_replay replay farm.sfcap --speed 10 --target pipeline --create-devices
+
+    # 4. Phát lại lên Broker (MQTT_BROKER) hết tốc lực, QoS 1
+    python -m tools.mqtt_replay replay farm.sfcap --speed max --target broker
+
+Kết quả in ra: tốc độ duy trì được (msg/s, tính cả thời gian Writer ghi xong xuống DB / Broker xác nhận hết),
+độ trễ xử lý từng gói p50/p99/p99.9/max và độ trễ so với lịch phát (máy không theo kịp tốc độ yêu cầu).
+"""
+import argparse
+import asyncio
+import signal
+import time
+from collections import Counter, deque
+
+import paho.mqtt.client as mqtt
+
+from core.config import settings
+from services.mqtt_capture import CaptureWriter, read_capture
+from services.mqtt_transport import AsyncioMqttTransport
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def parse_speed(value: str) -> float:
+    """1 / 10 / 2.5 ... hoặc "max" (không chờ giữa các gói, trả về 0)"""
+    if value == "max":
+        return 0.0
+    speed = float(value.rstrip("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("--speed phải > 0 hoặc 'max'")
+    return speed
+
+
+def load_messages(path: str, loops: int = 1) -> list:
+    """Đọc file capture vào bộ nhớ (đọc file trong lúc phát sẽ làm sai số đo). Lặp lại loops lần nối đuôi nhau."""
+    messages = list(read_capture(path))
+    if not messages or loops <= 1:
+        return messages
+    span = messages[-1].received_at - messages[0].received_at + 0.001
+    return [msg._replace(received_at=msg.received_at + span * i) for i in range(loops) for msg in messages]
+
+
+def schedule(messages: list, speed: float):
+    """Duyệt (độ trễ so với lịch, gói tin) theo nhịp thời gian gốc chia cho speed"""
+    started = time.perf_counter()
+    origin = messages[0].received_at
+    for msg in messages:
+        lag = 0.0
+        if speed:
+            due = started + (msg.received_at - origin) / speed
+            lag = time.perf_counter() - due
+            if lag < 0:
+                time.sleep(-lag)
+                lag = 0.0
+        yield lag, msg
+
+
+def report(title: str, sent: int, wall: float, latencies: list, lags: list, extra: str = ""):
+    latencies.sort()
+    lags.sort()
+    print(f"📊 {title}: {sent:,} gói trong {wall:.2f}s -> {sent / wall:,.0f} msg/s duy trì")
+    print(f"   ⏱️  Xử lý 1 gói: p50 {percentile(latencies, 0.5) * 1e3:.3f}ms / p99 {percentile(latencies, 0.99) * 1e3:.3f}ms"
+          f" / p99.9 {percentile(latencies, 0.999) * 1e3:.3f}ms / max {(latencies[-1] if latencies else 0) * 1e3:.3f}ms")
+    if lags and lags[-1] > 0:
+        print(f"   🐢 Trễ so với lịch phát: p99 {percentile(lags, 0.99) * 1e3:.1f}ms / max {lags[-1] * 1e3:.1f}ms")
+    if extra:
+        print(f"   {extra}")
+
+
+# =========================================================================
+# GHI LẠI
+# =========================================================================
+async def capture(path: str, seconds: float):
+    from services.mqtt_service import sensor_router
+
+    writer = CaptureWriter(path)
+    transport = AsyncioMqttTransport(
+        client_id=f"smartfarm-capture-{int(time.time())}",
+        handler=lambda msg: writer.write(msg.topic, msg.payload),
+    )
+    topics = sensor_router.subscriptions()
+    for topic in topics:
+        transport.add_subscription(topic)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    await transport.start()
+    print(f"📼 Đang ghi {', '.join(topics)} từ {settings.MQTT_BROKER} -> {path} (Ctrl+C để dừng)")
+    try:
+        await asyncio.wait_for(stop_event.wait(), seconds or None)
+    except asyncio.TimeoutError:
+        pass
+    await transport.stop()
+    writer.close()
+
+
+# =========================================================================
+# PHÁT LẠI
+# =========================================================================
+def register_devices(messages: list) -> int:
+    """Thêm vào DB các thiết bị có trong file capture nhưng chưa đăng ký (để DB trống vẫn phát lại được)"""
+    from db.session import SessionLocal
+    from models import models
+    from services.mqtt_service import sensor_router
+    from services.payload_decoder import PayloadError, decode_sensor_payload
+
+    device_ids = set()
+    for msg in messages:
+        route, params = sensor_router.match(msg.topic)
+        if route is None:
+            continue
+        if "device_id" in params:
+            device_ids.add(params["device_id"])
+            continue
+        try:
+            device_ids.add(decode_sensor_payload(msg.payload).device_id)
+        except PayloadError:
+            pass
+
+    db = SessionLocal()
+    try:
+        existing = {row[0] for row in db.query(models.Device.device_id).all()}
+        missing = sorted(device_ids - existing)
+        db.add_all([models.Device(device_id=d, name=f"Replay {d}") for d in missing])
+        db.commit()
+    finally:
+        db.close()
+    return len(missing)
+
+
+def replay_pipeline(messages: list, speed: float, create_devices: bool):
+    """Gọi thẳng mqtt_service.on_message như lúc nhận từ Broker, Writer ghi thật xuống DB"""
+    from db.base import Base
+    from db.session import engine
+    from services import mqtt_service
+    from services.device_registry import device_registry
+    from services.ingest_writer import ingest_writer
+    from services.payload_crypto import payload_decryptor
+
+    Base.metadata.create_all(bind=engine)
+    if create_devices:
+        print(f"🆕 Đã đăng ký {register_devices(messages)} thiết bị mới từ file capture")
+    mqtt_service.capture = None  # Không ghi lại chính các gói đang phát lại
+    device_registry.load_all()
+    payload_decryptor.load_all()
+    ingest_writer.start()
+
+    on_message = mqtt_service.on_message
+    latencies = []
+    lags = []
+    started = time.perf_counter()
+    for lag, captured in schedule(messages, speed):
+        msg = mqtt.MQTTMessage(topic=captured.topic.encode("utf-8"))
+        msg.payload = captured.payload
+        t0 = time.perf_counter()
+        on_message(None, None, msg)
+        latencies.append(time.perf_counter() - t0)
+        lags.append(lag)
+    # Tốc độ duy trì tính tới lúc Writer ghi xong bản ghi cuối cùng
+    ingest_writer.stop(timeout=60)
+    wall = time.perf_counter() - started
+
+    stats = ingest_writer.stats()
+    report("pipeline", len(messages), wall, latencies, lags,
+           f"💾 saved={stats['saved']:,} rejected={stats['rejected']:,} dropped={stats['queue']['dropped_total']:,} "
+           f"hàng đợi max={stats['queue']['high_water']}/{stats['queue']['capacity']}")
+
+
+async def replay_broker(messages: list, speed: float, qos: int):
+    """Phát lại lên Broker; độ trễ = publish -> Broker xác nhận (PUBACK với QoS 1)"""
+    transport = AsyncioMqttTransport(client_id=f"smartfarm-replay-{int(time.time())}")
+    transport.publish_latencies_ms = deque()  # Giữ toàn bộ để tính p99.9
+    await transport.start()
+    deadline = time.monotonic() + 10
+    while not transport.is_connected():
+        if time.monotonic() > deadline:
+            await transport.stop()
+            raise SystemExit(f"❌ Không kết nối được Broker {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
+        await asyncio.sleep(0.05)
+
+    lags = []
+    started = time.perf_counter()
+    origin = messages[0].received_at
+    for index, captured in enumerate(messages):
+        if speed:
+            delay = started + (captured.received_at - origin) / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, -delay))
+        elif index % 100 == 0:
+            await asyncio.sleep(0)  # Nhường event loop cho paho đọc PUBACK / ghi socket
+        transport.publish(captured.topic, captured.payload, qos)
+
+    # Chờ Broker xác nhận hết (tối đa 30 giây)
+    deadline = time.monotonic() + 30
+    while len(transport.publish_latencies_ms) < len(messages) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - started
+    await transport.stop()
+
+    latencies = [ms / 1000 for ms in transport.publish_latencies_ms]
+    report(f"broker QoS {qos}", len(messages), wall, latencies, lags,
+           f"📨 Broker đã xác nhận {len(latencies):,}/{len(messages):,} gói")
+
+
+def info(path: str):
+    messages = list(read_capture(path))
+    if not messages:
+        print(f"📭 {path}: trống")
+        return
+    span = messages[-1].received_at - messages[0].received_at
+    topics = Counter(msg.topic for msg in messages)
+    size = sum(len(msg.payload) for msg in messages)
+    print(f"📼 {path}: {len(messages):,} gói, {span:.1f}s ({len(messages) / max(span, 0.001):,.0f} msg/s trung bình), "
+          f"payload trung bình {size / len(messages):.0f} byte")
+    for topic, count in topics.most_common(10):
+        print(f"   {count:>10,}  {topic}")
+    if len(topics) > 10:
+        print(f"   ... và {len(topics) - 10} topic khác")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ghi lại / phát lại gói tin cảm biến MQTT")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("capture", help="Subscribe topic cảm biến và ghi gói tin thô ra file")
+    p.add_argument("file")
+    p.add_argument("--seconds", type=float, default=0, help="Tự dừng sau N giây (0 = tới khi Ctrl+C)")
+
+    p = sub.add_parser("info", help="Thống kê nhanh file capture")
+    p.add_argument("file")
+
+    p = sub.add_parser("replay", help="Phát lại file capture")
+    p.add_argument("file")
+    p.add_argument("--speed", type=parse_speed, default=1.0, help="1 = thời gian thực, 10 = nhanh gấp 10, max = hết tốc lực")
+    p.add_argument("--target", choices=["pipeline", "broker"], default="pipeline",
+                   help="pipeline = gọi mqtt_service.on_message trong tiến trình này, broker = publish lên MQTT_BROKER")
+    p.add_argument("--loops", type=int, default=1, help="Phát nối tiếp file N lần")
+    p.add_argument("--qos", type=int, choices=[0, 1], default=1, help="QoS khi --target broker")
+    p.add_argument("--create-devices", action="store_true", help="pipeline: tự đăng ký thiết bị chưa có trong DB")
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        asyncio.run(capture(args.file, args.seconds))
+    elif args.command == "info":
+        info(args.file)
+    else:
+        messages = load_messages(args.file, args.loops)
+        if not messages:
+            raise SystemExit(f"📭 {args.file}: không có gói tin nào")
+        if args.target == "pipeline":
+            replay_pipeline(messages, args.speed, args.create_devices)
+        else:
+            asyncio.run(replay_broker(messages, args.speed, args.qos))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Quản lý partition theo tháng của sensor_data (SENSOR_PARTITIONING=true, xem db/partitions.py).
+
+    cd backend/app
+    # Các partition đang có và số dòng
+    python -m tools.partitions status
+
+    # Tạo trước các tháng tới + áp dụng SENSOR_RETENTION_MONTHS ngay (API tự chạy mỗi SENSOR_PARTITION_CHECK_SECONDS)
+    python -m tools.partitions maintain
+
+    # Nâng cấp DB đang có: chuyển dữ liệu sensor_data hiện tại vào các partition tháng
+    python -m tools.partitions migrate
+
+migrate trên PostgreSQL đổi tên bảng cũ, tạo bảng partition, chép dữ liệu rồi xóa bảng cũ trong 1 transaction
+(khóa sensor_data suốt quá trình: nên dừng API / ingest_worker trước).
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import MetaData, func, insert, select, text
+
+from core.config import settings
+from db.base import Base
+from db.partitions import SQLITE_MAX_ATTACHED, add_months, month_key, month_start, sensor_partitions
+from db.session import SessionLocal, engine
+from models import models
+
+
+def status():
+    if not sensor_partitions.enabled:
+        print("ℹ️ sensor_data không chia partition (SENSOR_PARTITIONING=false hoặc DB không hỗ trợ)")
+    for name, rows in sensor_partitions.stats():
+        print(f"   {name:<28} {rows:>12,} dòng")
+
+
+def maintain():
+    result = sensor_partitions.maintain()
+    print(f"🗂️ Tạo mới: {result.get('created') or '-'}   Hết hạn: {result.get('partitions') or '-'}"
+          f"   DELETE phần mặc định: {result.get('deleted_rows', 0):,} dòng")
+
+
+def _data_months(conn, table) -> List[datetime]:
+    first, last = conn.execute(select(func.min(table.c.timestamp), func.max(table.c.timestamp))).one()
+    if first is None:
+        return []
+    months, month = [], month_start(first)
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def migrate_sqlite():
+    """Chép từng tháng từ main.sensor_data sang file tháng (giữ nguyên id), mỗi tháng 1 transaction"""
+    table = models.SensorData.__table__
+    with engine.connect() as conn:
+        months = _data_months(conn, table)
+    current = month_start(datetime.now())
+    oldest_kept = add_months(current, -settings.SENSOR_RETENTION_MONTHS) if settings.SENSOR_RETENTION_MONTHS > 0 else None
+    # SQLite chỉ ATTACH được SQLITE_MAX_ATTACHED file: chừa chỗ cho tháng hiện tại + các tháng tạo trước
+    slots = SQLITE_MAX_ATTACHED - settings.SENSOR_PARTITION_AHEAD_MONTHS - 1
+    months = [m for m in months if m < current and (oldest_kept is None or m >= oldest_kept)][-slots:] if slots > 0 else []
+    sensor_partitions.ensure()
+    sensor_partitions.create_months(months)
+
+    names = [c.name for c in table.columns]
+    for month in months + [current]:
+        db = SessionLocal()
+        try:
+            key = month_key(month)
+            if key not in sensor_partitions.attached(db, write=True):
+                continue
+            target = sensor_partitions.partition_table(key)
+            window = (table.c.timestamp >= month, table.c.timestamp < add_months(month, 1))
+            moved = db.execute(insert(target).from_select(names, select(*(table.c[n] for n in names)).where(*window))).rowcount
+            db.execute(table.delete().where(*window))
+            db.commit()
+            print(f"   {key}: chuyển {moved:,} dòng")
+        finally:
+            db.close()
+    print("ℹ️ Dữ liệu ngoài các tháng trên vẫn nằm ở main.sensor_data (partition mặc định)")
+
+
+def migrate_postgres():
+    with engine.begin() as conn:
+        if sensor_partitions.pg_is_partitioned(conn):
+            print("ℹ️ sensor_data đã là bảng partition")
+            return
+        conn.execute(text("ALTER TABLE sensor_data RENAME TO sensor_data_legacy"))
+        conn.execute(text("ALTER SEQUENCE IF EXISTS sensor_data_id_seq RENAME TO sensor_data_legacy_id_seq"))
+        for (index,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'sensor_data_legacy'")):
+            conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_legacy"'))
+
+        Base.metadata.create_all(bind=conn, tables=[models.SensorData.__table__])
+        legacy = models.SensorData.__table__.to_metadata(MetaData(), name="sensor_data_legacy")
+        for month in _data_months(conn, legacy):
+            sensor_partitions.create_pg_partition(conn, month)
+
+        names = [c.name for c in legacy.columns]
+        moved = conn.execute(insert(models.SensorData.__table__).from_select(names, select(*(legacy.c[n] for n in names)))).rowcount
+        conn.execute(text("SELECT setval('sensor_data_id_seq', COALESCE((SELECT max(id) FROM sensor_data), 0) + 1, false)"))
+        conn.execute(text("DROP TABLE sensor_data_legacy"))
+    print(f"   Đã chuyển {moved:,} dòng sang bảng partition")
+    sensor_partitions.maintain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quản lý partition theo tháng của sensor_data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Các partition và số dòng")
+    sub.add_parser("maintain", help="Tạo trước các tháng tới + áp dụng hạn lưu trữ")
+    sub.add_parser("migrate", help="Chuyển sensor_data hiện có vào các partition tháng")
+    args = parser.parse_args()
+
+    if args.command != "status" and not sensor_partitions.enabled:
+        raise SystemExit("❌ Cần đặt SENSOR_PARTITIONING=true (PostgreSQL hoặc SQLite)")
+    if args.command != "migrate":
+        Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    if args.command == "maintain":
+        maintain()
+    elif args.command == "migrate":
+        migrate_postgres() if engine.dialect.name == "postgresql" else migrate_sqlite()
+        print(f"✅ Xong trong {time.perf_counter() - started:.1f}s")
+    status()
+
+
+if __name__ == "__main__":
+    main()
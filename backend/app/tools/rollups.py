@@ -0,0 +1,76 @@
+"""
+Quản lý các bảng gộp số liệu sensor_rollup_1m / 1h / 1d.
+
+    cd backend/app
+    # Xem watermark và số dòng từng bảng
+    python -m tools.rollups status
+
+    # Gộp ngay tới hiện tại (lần đầu nâng cấp: gộp toàn bộ sensor_data đã có)
+    python -m tools.rollups compact
+
+    # Dữ liệu cũ được nạp muộn / sửa tay: tính lại từ ngày đó
+    python -m tools.rollups rebuild --since 2026-03-01
+
+API tự gộp nền mỗi ROLLUP_INTERVAL_SECONDS; lệnh ở đây dùng khi API không chạy hoặc cần gộp ngay.
+"""
+import argparse
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+from core.config import settings
+from db.base import Base
+from db.partitions import add_months, month_start
+from db.session import SessionLocal, engine
+from services.rollup import LEVELS, load_watermarks, rollup_compactor
+
+
+def status():
+    db = SessionLocal()
+    try:
+        watermarks = load_watermarks(db)
+        for level in LEVELS:
+            rows = db.query(func.count()).select_from(level.model).scalar()
+            watermark = watermarks.get(level.name)
+            behind = f" (trễ {(datetime.now() - watermark).total_seconds() / 60:,.0f} phút)" if watermark else ""
+            print(f"   {level.name:>3}  {rows:>12,} dòng   watermark {watermark or '-'}{behind}")
+    finally:
+        db.close()
+
+
+def compact():
+    started = time.perf_counter()
+    written = rollup_compactor.compact_once()
+    print(f"🧮 Đã gộp {written} khung trong {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quản lý bảng gộp số liệu cảm biến")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Watermark và số dòng từng bảng")
+    sub.add_parser("compact", help="Gộp tới hiện tại (trừ ROLLUP_LAG_SECONDS)")
+    p = sub.add_parser("rebuild", help="Tính lại các bảng gộp từ 1 ngày trở đi")
+    p.add_argument("--since", type=datetime.fromisoformat, required=True, help="VD: 2026-03-01")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    if args.command == "status":
+        status()
+    elif args.command == "compact":
+        compact()
+        status()
+    else:
+        if settings.SENSOR_RETENTION_MONTHS > 0:
+            # Bản ghi thô cũ hơn hạn lưu trữ đã bị xóa: tính lại từ đó sẽ làm mất luôn số liệu đã gộp
+            cutoff = add_months(month_start(datetime.now()), -settings.SENSOR_RETENTION_MONTHS)
+            if args.since < cutoff:
+                raise SystemExit(f"❌ sensor_data chỉ còn từ {cutoff:%Y-%m-%d} (SENSOR_RETENTION_MONTHS), không rebuild trước mốc này")
+        rollup_compactor.rewind(args.since)
+        print(f"⏪ Đã dời watermark về {args.since:%Y-%m-%d}")
+        compact()
+        status()
+
+
+if __name__ == "__main__":
+    main()
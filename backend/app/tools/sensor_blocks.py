@@ -0,0 +1,59 @@
+"""
+Kho khối nén của sensor_data (services/sensor_blocks.py).
+
+    cd backend/app
+    # Số khối / bản ghi đã nén, dung lượng, số bản ghi còn trong bảng nóng
+    python -m tools.sensor_blocks status
+
+    # Nén ngay các giờ cũ hơn SENSOR_BLOCKS_AFTER_HOURS (hoặc --hours)
+    python -m tools.sensor_blocks run --hours 24
+
+API tự chạy mỗi SENSOR_BLOCKS_INTERVAL_SECONDS khi SENSOR_BLOCKS_AFTER_HOURS > 0.
+"""
+import argparse
+import time
+
+from sqlalchemy import func
+
+from db.base import Base
+from db.partitions import sensor_partitions
+from db.session import SessionLocal, engine
+from services.sensor_blocks import sensor_blocks
+
+
+def status():
+    db = SessionLocal()
+    try:
+        info = sensor_blocks.status(db)
+        sd = sensor_partitions.sensor_entity(db)
+        hot_rows, hot_first = db.query(func.count(), func.min(sd.timestamp)).select_from(sd).one()
+    finally:
+        db.close()
+    per_row = info["bytes"] / info["rows"] if info["rows"] else 0
+    print(f"   bảng nóng   {hot_rows:>12,} bản ghi   từ {hot_first or '-'}")
+    print(f"   kho khối    {info['rows']:>12,} bản ghi   {info['blocks']:,} khối, {info['bytes'] / 2 ** 20:.1f} MB"
+          f" ({per_row:.1f} B/bản ghi)   ({info['first_hour'] or '-'} -> {info['last_hour'] or '-'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kho khối nén của sensor_data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Thống kê bảng nóng / kho khối")
+    p = sub.add_parser("run", help="Nén các giờ cũ ngay")
+    p.add_argument("--hours", type=int, default=None, help="Giữ lại N giờ gần nhất (mặc định SENSOR_BLOCKS_AFTER_HOURS)")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    if args.command == "run":
+        if args.hours is not None:
+            sensor_blocks.after_hours = args.hours
+        if sensor_blocks.after_hours <= 0:
+            raise SystemExit("❌ Cần SENSOR_BLOCKS_AFTER_HOURS > 0 hoặc --hours N")
+        started = time.perf_counter()
+        result = sensor_blocks.compress_once()
+        print(f"🗜️ Đã nén {result['rows']:,} bản ghi ({result['hours']} giờ) trong {time.perf_counter() - started:.1f}s")
+    status()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Đổi sensor_data.timestamp cũ trên SQLite từ giờ UTC sang giờ địa phương (chạy 1 lần khi nâng cấp).
+
+    cd backend/app
+    # Xem còn bao nhiêu bản ghi mang giờ UTC, đã đổi chưa
+    python -m tools.sensor_timestamps check
+
+    # Đổi (dừng hết API / ingest_worker bản cũ trước: bản cũ vẫn ghi giờ UTC)
+    python -m tools.sensor_timestamps localize
+
+Bản cũ để SQLite điền timestamp bằng CURRENT_TIMESTAMP = giờ UTC, không có phần lẻ giây; bản mới luôn ghi
+datetime.now() (giờ địa phương) kèm ".ffffff". Lệnh localize chỉ đổi các dòng không có phần lẻ giây rồi ghi mốc
+"sensor_timestamps_localtime" vào bảng data_migrations: đã có mốc thì từ chối chạy lại (đổi 2 lần = lệch 2 lần
+độ chênh múi giờ). Không hoàn tác được -> sao lưu file DB trước.
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import text, update
+from sqlalchemy.orm import Session
+
+from db.base import Base
+from db.session import SessionLocal, engine
+from models.models import DataMigration, DeviceLatestReading, SensorData
+
+MIGRATION = "sensor_timestamps_localtime"
+UTC_ROWS = "timestamp IS NOT NULL AND timestamp NOT LIKE '%.%'"
+
+
+def applied(db: Session):
+    """Mốc đã đổi (DataMigration) hoặc None"""
+    return db.get(DataMigration, MIGRATION)
+
+
+def count_utc_rows(db: Session) -> int:
+    if engine.dialect.name != "sqlite":
+        return 0
+    return db.execute(text(f"SELECT COUNT(*) FROM sensor_data WHERE {UTC_ROWS}")).scalar()
+
+
+def localize_sqlite_sensor_timestamps(db: Session) -> int:
+    """
+    Đổi các dòng mang giờ UTC sang giờ địa phương, dựng lại device_latest_reading của các thiết bị đó và gộp lại
+    rollup từ mốc cũ nhất bị ảnh hưởng. Đã có mốc trong data_migrations thì không làm gì. Trả về số dòng đã đổi.
+    """
+    if engine.dialect.name != "sqlite" or applied(db) is not None:
+        return 0
+    oldest_utc, oldest_local = db.execute(text(
+        f"SELECT MIN(datetime(timestamp)), MIN(datetime(timestamp, 'localtime')) FROM sensor_data WHERE {UTC_ROWS}"
+    )).one()
+    device_ids = [d for (d,) in db.execute(text(f"SELECT DISTINCT device_id FROM sensor_data WHERE {UTC_ROWS}"))]
+    shifted = db.execute(
+        update(SensorData.__table__).where(text(UTC_ROWS)).values(timestamp=text("datetime(timestamp, 'localtime') || '.000000'"))
+    ).rowcount
+    # Ghi mốc cùng transaction với lệnh đổi -> không có trạng thái "đã đổi mà chưa ghi mốc"
+    db.add(DataMigration(name=MIGRATION, rows=shifted))
+    db.commit()
+    if not device_ids:
+        return 0
+
+    # Import muộn: crud / rollup kéo theo cả tầng service
+    from crud import device as crud_device
+    from services.rollup import rollup_compactor
+
+    # Bản mới nhất đang lưu cũng mang giờ UTC (upsert không ghi đè bản "mới hơn") -> xóa rồi dựng lại
+    db.query(DeviceLatestReading).filter(DeviceLatestReading.device_id.in_(device_ids)).delete(synchronize_session=False)
+    db.commit()
+    crud_device.rebuild_latest_readings(db, device_ids)
+    # Khung gộp cũ nằm ở mốc UTC, khung đúng ở mốc địa phương -> gộp lại từ mốc sớm hơn
+    rollup_compactor.rewind(datetime.fromisoformat(min(oldest_utc, oldest_local)))
+    return shifted
+
+
+def check():
+    db = SessionLocal()
+    try:
+        marker = applied(db)
+        rows = count_utc_rows(db)
+    finally:
+        db.close()
+    if marker is not None:
+        print(f"✅ Đã đổi {marker.rows:,} dòng lúc {marker.applied_at:%Y-%m-%d %H:%M:%S}")
+        if rows:
+            print(f"⚠️ Vẫn còn {rows:,} dòng không có phần lẻ giây (tiến trình bản cũ ghi sau khi đổi?): kiểm tra tay")
+    else:
+        print(f"ℹ️ Chưa đổi: {rows:,} dòng mang giờ UTC")
+
+
+def localize():
+    if engine.dialect.name != "sqlite":
+        raise SystemExit("ℹ️ Chỉ SQLite mới cần đổi (DB khác ghi giờ địa phương từ trước)")
+    db = SessionLocal()
+    try:
+        marker = applied(db)
+        if marker is not None:
+            raise SystemExit(f"❌ Đã đổi lúc {marker.applied_at:%Y-%m-%d %H:%M:%S} ({marker.rows:,} dòng), không chạy lại")
+        shifted = localize_sqlite_sensor_timestamps(db)
+    finally:
+        db.close()
+    print(f"✅ Đã đổi {shifted:,} bản ghi sensor_data từ giờ UTC sang giờ địa phương")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đổi sensor_data.timestamp cũ (SQLite, giờ UTC) sang giờ địa phương")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="Số dòng còn mang giờ UTC, đã đổi chưa")
+    sub.add_parser("localize", help="Đổi 1 lần và ghi mốc vào data_migrations")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    if args.command == "check":
+        check()
+    else:
+        localize()
+
+
+if __name__ == "__main__":
+    main()